@@ -0,0 +1,107 @@
+# analytics/management/commands/analytics_worker.py
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+
+def run_worker(batch_size, loop, interval):
+    """
+    Цикл одного воркера: берет пачки задач, пока очередь не опустеет
+    (в режиме loop — ждет новые). Возвращает итоги воркера
+    """
+    import django
+    from django.apps import apps
+    if not apps.ready:  # процесс запущен через spawn
+        django.setup()
+
+    from analytics.services.analytics_queue import analytics_queue
+
+    totals = {'processed': 0, 'failed': 0, 'max_lag': 0.0}
+    while True:
+        result = analytics_queue.process_batch(batch_size=batch_size)
+        totals['processed'] += result['processed']
+        totals['failed'] += result['failed']
+        if result['max_lag'] is not None:
+            totals['max_lag'] = max(totals['max_lag'], result['max_lag'])
+
+        if result['processed'] == 0:
+            if not loop:
+                return totals
+            time.sleep(interval)
+
+
+class Command(BaseCommand):
+    help = 'Воркер очереди аналитики: применяет проекции к завершённым продажам пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Продаж в одной пачке')
+        parser.add_argument('--processes', type=int, default=1, help='Число процессов-воркеров')
+        parser.add_argument('--loop', action='store_true', help='Работать непрерывно')
+        parser.add_argument('--interval', type=float, default=1.0, help='Пауза между опросами (сек) в режиме --loop')
+        parser.add_argument(
+            '--backfill', action='store_true',
+            help='Поставить в очередь завершённые продажи без задачи '
+                 '(только если их аналитика еще не считалась)'
+        )
+        parser.add_argument('--stats', action='store_true', help='Только показать метрики очереди')
+
+    def handle(self, *args, **options):
+        from analytics.services.analytics_queue import analytics_queue
+
+        if options['stats']:
+            self._report_stats(analytics_queue.stats())
+            return
+
+        if options['backfill']:
+            queued = analytics_queue.backfill()
+            self.stdout.write(self.style.WARNING(f'📥 Поставлено в очередь продаж: {queued}'))
+
+        batch_size = max(options['batch_size'], 1)
+        processes = max(options['processes'], 1)
+        if processes > 1 and connections['default'].vendor == 'sqlite':
+            # SQLite блокирует базу целиком: параллельные пишущие процессы только мешают друг другу
+            self.stdout.write(self.style.WARNING('⚠️ SQLite: воркер запускается в одном процессе'))
+            processes = 1
+        args = (batch_size, options['loop'], options['interval'])
+
+        self._report_stats(analytics_queue.stats())
+        started = time.monotonic()
+
+        try:
+            if processes == 1:
+                results = [run_worker(*args)]
+            else:
+                # Соединения с БД не должны наследоваться дочерними процессами
+                connections.close_all()
+                self.stdout.write(f'🚀 Запуск воркеров: {processes}')
+                with ProcessPoolExecutor(max_workers=processes) as executor:
+                    futures = [executor.submit(run_worker, *args) for _ in range(processes)]
+                    results = [future.result() for future in futures]
+        except KeyboardInterrupt:
+            self.stdout.write('⏹️ Остановлено')
+            return
+
+        elapsed = time.monotonic() - started
+        processed = sum(result['processed'] for result in results)
+        failed = sum(result['failed'] for result in results)
+        max_lag = max(result['max_lag'] for result in results)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ Обработано продаж: {processed} за {elapsed:.1f} с '
+            f'({processed / elapsed if elapsed else 0:.0f}/с), макс. отставание {max_lag:.1f} с'
+        ))
+        if failed:
+            self.stdout.write(self.style.ERROR(f'❌ С ошибкой: {failed}'))
+        self._report_stats(analytics_queue.stats())
+
+    def _report_stats(self, stats):
+        self.stdout.write(
+            f"📊 В очереди: {stats['pending']} | отставание: {stats['oldest_lag']:.1f} с | "
+            f"обработано за час: {stats['processed_last_hour']}"
+        )
+        if stats['stuck']:
+            self.stdout.write(self.style.WARNING(
+                f"⚠️ Задач, исчерпавших попытки: {stats['stuck']} (см. last_error)"
+            ))
@@ -0,0 +1,140 @@
+# analytics/management/commands/benchmark_projection_ledger.py
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+
+from analytics.models import ProjectionLedger
+from analytics.services.analytics_projector import analytics_projector
+from sales.models import Transaction, TransactionItem
+from stores.management.bench import rollback_after, measure, create_bench_store
+
+
+def legacy_inclusion_checks(transaction):
+    """
+    Эталон: прежние проверки «уже учтена ли продажа» из analytics/signals.py
+    (_is_transaction_already_included_in_summary, _is_item_already_included_in_product_analytics,
+    _is_transaction_already_included_in_customer_analytics) — каждая пересчитывает весь день
+    """
+    date = transaction.created_at.date()
+
+    # Сводка продаж: перебор всех продаж дня в Python
+    expected_amount = Decimal('0.00')
+    for tx in Transaction.objects.filter(
+        store=transaction.store, created_at__date=date, status='completed'
+    ).exclude(id=transaction.id):
+        if tx.payment_method == transaction.payment_method:
+            expected_amount += tx.total_amount
+
+    # Аналитика товаров: агрегат по всем позициям дня на каждую позицию чека
+    for item in transaction.items.all():
+        TransactionItem.objects.filter(
+            transaction__store=transaction.store,
+            transaction__created_at__date=date,
+            transaction__status='completed',
+            product=item.product
+        ).exclude(transaction_id=transaction.id).aggregate(total=Sum('quantity'))
+
+    # Аналитика клиента: агрегат по продажам клиента за день
+    if transaction.customer_id:
+        Transaction.objects.filter(
+            store=transaction.store, created_at__date=date,
+            customer=transaction.customer, status='completed'
+        ).exclude(id=transaction.id).aggregate(total=Sum('total_amount'))
+
+    return expected_amount
+
+
+def ledger_inclusion_check(transaction):
+    """Новая проверка: один индексный поиск по журналу проекций"""
+    return set(
+        ProjectionLedger.objects.filter(
+            transaction_id=transaction.pk,
+            projection__in=analytics_projector.PROJECTIONS
+        ).values_list('projection', flat=True)
+    )
+
+
+class Command(BaseCommand):
+    help = 'Замер проверки «продажа уже учтена в аналитике»: пересчет дня против журнала проекций'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--day-sizes', type=str, default='1000,5000,10000',
+            help='Число продаж за день через запятую'
+        )
+        parser.add_argument('--items', type=int, default=3, help='Позиций в чеке')
+
+    def handle(self, *args, **options):
+        day_sizes = sorted(int(size) for size in options['day_sizes'].split(',') if size.strip())
+        items_per_sale = max(options['items'], 1)
+
+        self.stdout.write(self.style.SUCCESS('=== БЕНЧМАРК ЖУРНАЛА ПРОЕКЦИЙ ==='))
+        self.stdout.write(
+            f"{'продаж/день':>11} | {'пересчет: запр.':>15} | {'мс':>8} | "
+            f"{'журнал: запр.':>13} | {'мс':>6} | {'apply: запр.':>12} | {'мс':>6}"
+        )
+
+        with rollback_after():
+            store, user, products = create_bench_store(products=items_per_sale * 4, batches_per_product=0)
+            created = 0
+
+            for day_size in day_sizes:
+                # Продажи дня, уже учтённые в аналитике
+                sales = self._create_sales(store, user, products, day_size - created, items_per_sale)
+                ProjectionLedger.objects.bulk_create(
+                    [
+                        ProjectionLedger(transaction_id=sale.pk, projection=projection)
+                        for sale in sales
+                        for projection in analytics_projector.PROJECTIONS
+                    ],
+                    batch_size=1000
+                )
+                created = day_size
+
+                probe = self._create_sales(store, user, products, 1, items_per_sale)[0]
+                _, legacy_queries, legacy_ms = measure(legacy_inclusion_checks, probe)
+                _, ledger_queries, ledger_ms = measure(ledger_inclusion_check, probe)
+                _, apply_queries, apply_ms = measure(analytics_projector.apply, [probe])
+                created += 1
+
+                self.stdout.write(
+                    f"{day_size:>11} | {legacy_queries:>15} | {legacy_ms:>8.1f} | "
+                    f"{ledger_queries:>13} | {ledger_ms:>6.1f} | {apply_queries:>12} | {apply_ms:>6.1f}"
+                )
+
+        self.stdout.write(self.style.SUCCESS('\n✅ Замер завершен, тестовые данные откатены'))
+
+    def _create_sales(self, store, user, products, count, items_per_sale):
+        """Завершённые продажи одним bulk_create (без сигналов)"""
+        if count <= 0:
+            return []
+
+        sales = Transaction.objects.bulk_create(
+            [
+                Transaction(
+                    store=store,
+                    cashier=user,
+                    total_amount=Decimal('100.00') * items_per_sale,
+                    payment_method='card',
+                    status='completed'
+                )
+                for _ in range(count)
+            ],
+            batch_size=1000
+        )
+        TransactionItem.objects.bulk_create(
+            [
+                TransactionItem(
+                    transaction=sale,
+                    store=store,
+                    product=products[(index + offset) % len(products)],
+                    quantity=Decimal('1'),
+                    price=Decimal('100.00')
+                )
+                for index, sale in enumerate(sales)
+                for offset in range(items_per_sale)
+            ],
+            batch_size=1000
+        )
+        return sales
@@ -0,0 +1,96 @@
+# analytics/management/commands/rebuild_rollups.py
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from stores.business_date import business_date, to_date
+
+
+def rebuild_store(store_id, date_from, date_to, chunk_days):
+    """
+    Пересчет сводок одного магазина (выполняется в процессе пула).
+    Возвращает (store_id, {'chunks', 'transactions'})
+    """
+    import django
+    from django.apps import apps
+    if not apps.ready:  # процесс запущен через spawn
+        django.setup()
+
+    from analytics.services.rollup_rebuilder import rollup_rebuilder
+
+    date_from = date_from or rollup_rebuilder.first_date(store_id)
+    if date_from is None or date_from > date_to:
+        return store_id, {'chunks': 0, 'transactions': 0}
+    return store_id, rollup_rebuilder.rebuild(store_id, date_from, date_to, chunk_days)
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчет сводок (SalesSummary, HourlySalesSummary, ProductAnalytics, UnitAnalytics, '
+        'SizeAnalytics, CategoryAnalytics, CustomerAnalytics, FinancialSummary) из продаж '
+        'за период: по дням, магазины — в пуле процессов'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--store-id', action='append', dest='store_ids', help='ID магазина (можно несколько)')
+        parser.add_argument('--date-from', type=str, help='Начало периода YYYY-MM-DD (по умолчанию — первая продажа)')
+        parser.add_argument('--date-to', type=str, help='Конец периода YYYY-MM-DD (по умолчанию — сегодня)')
+        parser.add_argument('--chunk-days', type=int, default=1, help='Дней в одной транзакции пересчета')
+        parser.add_argument('--processes', type=int, default=4, help='Число процессов пула')
+
+    def handle(self, *args, **options):
+        from stores.models import Store
+
+        try:
+            date_from = to_date(options['date_from'])
+            date_to = to_date(options['date_to']) or business_date()
+        except ValueError as e:
+            raise CommandError(f'❌ {e}')
+        if date_from and date_from > date_to:
+            raise CommandError('❌ Начало периода позже конца')
+
+        stores = Store.objects.order_by('pk')
+        if options['store_ids']:
+            stores = stores.filter(pk__in=options['store_ids'])
+        store_ids = [str(store_id) for store_id in stores.values_list('pk', flat=True)]
+        if not store_ids:
+            raise CommandError('❌ Магазины не найдены')
+
+        processes = max(min(options['processes'], len(store_ids)), 1)
+        if processes > 1 and connections['default'].vendor == 'sqlite':
+            # SQLite блокирует базу целиком: параллельные пишущие процессы только мешают друг другу
+            self.stdout.write(self.style.WARNING('⚠️ SQLite: пересчет выполняется в одном процессе'))
+            processes = 1
+        args = (date_from, date_to, max(options['chunk_days'], 1))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"=== ПЕРЕСЧЕТ СВОДОК: магазинов {len(store_ids)}, "
+            f"период {date_from or 'с первой продажи'} — {date_to}, процессов {processes} ==="
+        ))
+        started = time.monotonic()
+
+        if processes == 1:
+            results = [rebuild_store(store_id, *args) for store_id in store_ids]
+            for store_id, result in results:
+                self._report(store_id, result)
+        else:
+            # Соединения с БД не должны наследоваться дочерними процессами
+            connections.close_all()
+            results = []
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                futures = [executor.submit(rebuild_store, store_id, *args) for store_id in store_ids]
+                for future in as_completed(futures):
+                    results.append(future.result())
+                    self._report(*results[-1])
+
+        elapsed = time.monotonic() - started
+        chunks = sum(result['chunks'] for _, result in results)
+        transactions = sum(result['transactions'] for _, result in results)
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ Пересчитано: {chunks} чанков, {transactions} продаж за {elapsed:.1f} с'
+        ))
+
+    def _report(self, store_id, result):
+        self.stdout.write(f"🔁 {store_id}: чанков {result['chunks']}, продаж {result['transactions']}")
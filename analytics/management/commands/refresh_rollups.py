@@ -0,0 +1,47 @@
+# analytics/management/commands/refresh_rollups.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from analytics.services.rollup_refresher import rollup_refresher
+
+
+class Command(BaseCommand):
+    help = (
+        'Догоняющее обновление сводок: только продажи, новые или измененные после '
+        'отметки магазина (для cron раз в минуту)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--store-id', action='append', dest='store_ids', help='ID магазина (можно несколько)')
+        parser.add_argument('--batch-size', type=int, help='Продаж в одной пачке проекций (ROLLUP_REFRESH_BATCH_SIZE)')
+        parser.add_argument(
+            '--settle-seconds', type=int,
+            help='Продажи моложе стольких секунд ждут следующего запуска (ROLLUP_REFRESH_SETTLE_SECONDS)'
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        results = rollup_refresher.refresh(
+            store_ids=options['store_ids'],
+            batch_size=options['batch_size'],
+            settle_seconds=options['settle_seconds'],
+        )
+
+        for store_id, result in results.items():
+            if result is None:
+                self.stdout.write(self.style.WARNING(f'⏭️ {store_id}: обновляется другим процессом'))
+                continue
+            self.stdout.write(
+                f"🔄 {store_id}: продаж {result['transactions']}, догнано {result['applied']}, "
+                f"пересчитано дней {result['days']}"
+            )
+
+        done = [result for result in results.values() if result]
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Магазинов с новой активностью: {len(results)}, "
+            f"продаж {sum(result['transactions'] for result in done)}, "
+            f"догнано {sum(result['applied'] for result in done)}, "
+            f"дней пересчитано {sum(result['days'] for result in done)} "
+            f"за {time.monotonic() - started:.2f} с"
+        ))
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.1 on 2026-10-16 18:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0006_unitanalytics_product_ids_and_more'),
+        ('sales', '0004_transactionoutbox'),
+        ('stores', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalyticsJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('store', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='%(class)s_set', to='stores.store', verbose_name='Магазин')),
+                ('transaction', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='analytics_job', to='sales.transaction', verbose_name='Продажа')),
+            ],
+            options={
+                'verbose_name': 'Задача аналитики',
+                'verbose_name_plural': 'Очередь аналитики',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['processed_at', 'id'], name='analytics_a_process_ab5ef8_idx')],
+            },
+        ),
+    ]
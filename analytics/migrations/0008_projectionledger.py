@@ -0,0 +1,29 @@
+# Generated by Django 5.2.1 on 2026-10-16 18:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0007_analyticsjob'),
+        ('sales', '0004_transactionoutbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectionLedger',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('projection', models.CharField(max_length=50, verbose_name='Проекция')),
+                ('applied_at', models.DateTimeField(auto_now_add=True)),
+                ('transaction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='projection_ledger', to='sales.transaction', verbose_name='Продажа')),
+            ],
+            options={
+                'verbose_name': 'Применённая проекция',
+                'verbose_name_plural': 'Журнал проекций аналитики',
+                'constraints': [models.UniqueConstraint(fields=('transaction', 'projection'), name='unique_transaction_projection')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-16 19:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0008_projectionledger'),
+        ('inventory', '0007_batch_fifo_stock_indexes'),
+        ('stores', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cashregister',
+            index=models.Index(condition=models.Q(('is_open', True)), fields=['store', 'date_opened'], name='cashregister_open_idx'),
+        ),
+    ]
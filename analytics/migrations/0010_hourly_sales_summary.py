@@ -0,0 +1,95 @@
+# Generated by Django 5.2.1 on 2026-10-16 19:15
+
+from zoneinfo import ZoneInfo
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import ExtractHour
+
+
+def fill_hourly_sales(apps, schema_editor):
+    """
+    Почасовые сводки по уже завершённым продажам — одна группировка в БД;
+    продажи отмечаются в журнале проекций, чтобы повторная обработка их не удвоила
+    """
+    Transaction = apps.get_model('sales', 'Transaction')
+    HourlySalesSummary = apps.get_model('analytics', 'HourlySalesSummary')
+    ProjectionLedger = apps.get_model('analytics', 'ProjectionLedger')
+    db = schema_editor.connection.alias
+    zone = ZoneInfo(getattr(settings, 'BUSINESS_TIME_ZONE', settings.TIME_ZONE))
+
+    completed = Transaction.objects.using(db).filter(status='completed')
+    groups = completed.annotate(
+        hour=ExtractHour('created_at', tzinfo=zone)
+    ).values('store_id', 'business_date', 'hour', 'payment_method').annotate(
+        count=Count('id'),
+        total=Sum('total_amount'),
+        cash=Sum('cash_amount'),
+        transfer=Sum('transfer_amount'),
+        card=Sum('card_amount'),
+    ).order_by()
+
+    HourlySalesSummary.objects.using(db).bulk_create([
+        HourlySalesSummary(
+            store_id=group['store_id'],
+            date=group['business_date'],
+            hour=group['hour'],
+            payment_method=group['payment_method'],
+            total_transactions=group['count'],
+            total_amount=group['total'],
+            cash_amount=group['cash'],
+            transfer_amount=group['transfer'],
+            card_amount=group['card'],
+        )
+        for group in groups
+    ], batch_size=1000)
+
+    ProjectionLedger.objects.using(db).bulk_create(
+        (
+            ProjectionLedger(transaction_id=transaction_id, projection='hourly_sales')
+            for transaction_id in completed.values_list('pk', flat=True).iterator()
+        ),
+        batch_size=1000,
+        ignore_conflicts=True
+    )
+
+
+def clear_hourly_sales(apps, schema_editor):
+    ProjectionLedger = apps.get_model('analytics', 'ProjectionLedger')
+    ProjectionLedger.objects.using(schema_editor.connection.alias).filter(projection='hourly_sales').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0009_cashregister_open_index'),
+        ('sales', '0006_transaction_business_date'),
+        ('stores', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HourlySalesSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('hour', models.PositiveSmallIntegerField(verbose_name='Час')),
+                ('payment_method', models.CharField(choices=[('cash', 'Наличные'), ('transfer', 'Перевод'), ('card', 'Карта'), ('debt', 'В долг'), ('hybrid', 'Гибридная оплата')], max_length=20)),
+                ('total_transactions', models.PositiveIntegerField(default=0)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('cash_amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('transfer_amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('card_amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('store', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='%(class)s_set', to='stores.store', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'Почасовая сводка продаж',
+                'verbose_name_plural': 'Почасовые сводки продаж',
+                'ordering': ['-date', 'hour'],
+                'unique_together': {('store', 'date', 'hour', 'payment_method')},
+            },
+        ),
+        migrations.RunPython(fill_hourly_sales, clear_hourly_sales),
+    ]
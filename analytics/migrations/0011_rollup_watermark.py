@@ -0,0 +1,54 @@
+# Generated by Django 5.2.1 on 2026-10-16 19:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Max
+from django.utils import timezone
+
+
+def init_watermarks(apps, schema_editor):
+    """
+    Отметки магазинов — на текущей последней продаже: refresh_rollups начинает
+    с новой активности, история сверяется через rebuild_rollups
+    """
+    Store = apps.get_model('stores', 'Store')
+    Transaction = apps.get_model('sales', 'Transaction')
+    RollupWatermark = apps.get_model('analytics', 'RollupWatermark')
+    db = schema_editor.connection.alias
+    now = timezone.now()
+
+    last_ids = dict(
+        Transaction.objects.using(db).values('store_id').annotate(last_id=Max('pk')).values_list('store_id', 'last_id')
+    )
+    RollupWatermark.objects.using(db).bulk_create([
+        RollupWatermark(store_id=store_id, last_transaction_id=last_ids.get(store_id, 0), last_updated_at=now)
+        for store_id in Store.objects.using(db).values_list('pk', flat=True)
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0010_hourly_sales_summary'),
+        ('sales', '0007_transaction_updated_at'),
+        ('stores', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_transaction_id', models.BigIntegerField(default=0, verbose_name='Последняя обработанная продажа')),
+                ('last_updated_at', models.DateTimeField(blank=True, null=True, verbose_name='Изменения учтены до')),
+                ('refreshed_at', models.DateTimeField(auto_now=True)),
+                ('store', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='%(class)s_set', to='stores.store', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'Отметка обновления сводок',
+                'verbose_name_plural': 'Отметки обновления сводок',
+                'constraints': [models.UniqueConstraint(fields=('store',), name='unique_rollup_watermark_store')],
+            },
+        ),
+        migrations.RunPython(init_watermarks, migrations.RunPython.noop),
+    ]
@@ -6,7 +6,8 @@ from sales.models import Transaction
 from customers.models import Customer
 import logging
 from django.contrib.auth.models import User
-from stores.mixins import StoreOwnedModel, StoreOwnedManager
+from stores.mixins import StoreOwnedModel, StoreOwnedManager, StoreFilteredQuerySet
+from stores.business_date import business_date, range_lookups
 from django.db import transaction  # Для атомарных операций
 from django.utils import timezone
 from decimal import Decimal
@@ -19,7 +20,7 @@ class SalesSummaryManager(StoreOwnedManager):
     def update_from_transaction(self, transaction):
         summary, created = self.get_or_create(
             store=transaction.store,
-            date=transaction.created_at.date(),
+            date=transaction.business_date,
             payment_method=transaction.payment_method,
             defaults={
                 "cashier": transaction.cashier,
@@ -65,6 +66,46 @@ class SalesSummary(StoreOwnedModel):
         return f"{self.date} - {self.get_payment_method_display()} ({self.total_amount})"
 
 
+class HourlySalesQuerySet(StoreFilteredQuerySet):
+    def pattern(self, store, date_from, date_to=None):
+        """Продажи магазина по часам бизнес-дня за период: [{'hour', 'count', 'total'}, ...]"""
+        queryset = self.filter(store=store, date__gte=date_from)
+        if date_to is not None:
+            queryset = queryset.filter(date__lte=date_to)
+        return queryset.values('hour').annotate(
+            count=models.Sum('total_transactions'),
+            total=models.Sum('total_amount')
+        ).order_by('hour')
+
+
+class HourlySalesSummary(StoreOwnedModel):
+    """
+    Почасовая сводка завершённых продаж: (магазин, бизнес-дата, час, способ оплаты).
+    Час — по часовому поясу бизнес-дня; обновляется проекцией аналитики при продаже
+    """
+    date = models.DateField(verbose_name=_("Дата"))
+    hour = models.PositiveSmallIntegerField(verbose_name=_("Час"))
+    payment_method = models.CharField(
+        max_length=20, choices=Transaction.PAYMENT_METHODS
+    )
+    total_transactions = models.PositiveIntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    cash_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    transfer_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    card_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    objects = StoreOwnedManager.from_queryset(HourlySalesQuerySet)()
+
+    class Meta:
+        verbose_name = _("Почасовая сводка продаж")
+        verbose_name_plural = _("Почасовые сводки продаж")
+        unique_together = ('store', 'date', 'hour', 'payment_method')
+        ordering = ['-date', 'hour']
+
+    def __str__(self):
+        return f"{self.date} {self.hour:02d}:00 - {self.payment_method} ({self.total_amount})"
+
+
 class ProductAnalytics(models.Model):
     """
     ОБНОВЛЕННАЯ статистика по товарам с учетом новой структуры товаров
@@ -202,7 +243,8 @@ class CustomerAnalytics(models.Model):
 def default_product_ids():
     """Возвращает пустой список для поля product_ids"""
     return []
-from django.contrib.postgres.fields import ArrayField
+
+
 class UnitAnalytics(StoreOwnedModel):
     """
     НОВАЯ модель: Аналитика по единицам измерения
@@ -273,6 +315,15 @@ class UnitAnalytics(StoreOwnedModel):
             self.average_unit_price = self.total_revenue / self.total_quantity_sold
 
 
+class CashRegisterQuerySet(StoreFilteredQuerySet):
+    def open_on(self, store, day):
+        """
+        Открытые кассы магазина, открытые в бизнес-день day.
+        Границы дня вместо date_opened__date: условие идет по индексу открытых касс
+        """
+        return self.filter(store=store, is_open=True, **range_lookups('date_opened', day, day))
+
+
 class CashRegister(StoreOwnedModel):
     """
     ✅ МОДЕЛЬ КАССЫ — сколько денег в ящике прямо сейчас
@@ -313,13 +364,19 @@ class CashRegister(StoreOwnedModel):
         'CashHistory', related_name='cash_registers', blank=True
     )
 
-    objects = StoreOwnedManager()
+    objects = StoreOwnedManager.from_queryset(CashRegisterQuerySet)()
 
     class Meta:
         verbose_name = "Касса"
         verbose_name_plural = "Кассы"
         unique_together = ('store', 'date_opened')  # Одна касса на смену в магазине
         ordering = ['-date_opened']
+        indexes = [
+            # Открытые кассы магазина: is_open в запросе — литерал без параметра,
+            # поэтому частичный индекс используется и в SQLite
+            models.Index(fields=['store', 'date_opened'], condition=models.Q(is_open=True),
+                         name='cashregister_open_idx'),
+        ]
 
     def __str__(self):
         return f"Касса {self.store.name} ({self.date_opened.date()}) — {self.current_balance:,} сум"
@@ -398,7 +455,7 @@ class CashRegister(StoreOwnedModel):
                 # Создаём summary, если нет
                 self.financial_summary = FinancialSummary.objects.create(
                     store=self.store,
-                    date=self.date_opened.date(),
+                    date=business_date(self.date_opened),
                     cash_total=actual_balance,
                     grand_total=actual_balance
                 )
@@ -689,4 +746,85 @@ class SupplierAnalytics(StoreOwnedModel):
             self.average_margin_percentage = (self.total_margin / self.total_revenue * 100)
         if self.products_count > 0:  # Примерный turnover; адаптируй под реальный average_stock из Stock
             average_stock = self.products_count  # Замени на реальный расчёт, если есть данные
-            self.turnover_rate = self.total_quantity_sold / average_stock if average_stock else 0
\ No newline at end of file
+            self.turnover_rate = self.total_quantity_sold / average_stock if average_stock else 0
+
+class AnalyticsJob(StoreOwnedModel):
+    """
+    ✅ Очередь пересчета аналитики (в БД).
+    Одна задача на завершённую продажу; задачи разбирает `manage.py analytics_worker`
+    пачками, проекции применяются сгруппированными upsert'ами (AnalyticsProjector)
+    """
+    transaction = models.OneToOneField(
+        Transaction,
+        on_delete=models.CASCADE,
+        related_name='analytics_job',
+        verbose_name="Продажа"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    objects = StoreOwnedManager()
+
+    class Meta:
+        verbose_name = _("Задача аналитики")
+        verbose_name_plural = _("Очередь аналитики")
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['processed_at', 'id']),
+        ]
+
+    def __str__(self):
+        status = 'обработана' if self.processed_at else f'в очереди (попыток: {self.attempts})'
+        return f"Аналитика продажи #{self.transaction_id} — {status}"
+
+
+class ProjectionLedger(models.Model):
+    """
+    ✅ Журнал применённых проекций аналитики: (продажа, проекция) — не более одной строки.
+    Проверка «уже учтена ли продажа» — один индексный поиск вместо пересчета всего дня
+    """
+    transaction = models.ForeignKey(
+        Transaction,
+        on_delete=models.CASCADE,
+        related_name='projection_ledger',
+        verbose_name="Продажа"
+    )
+    projection = models.CharField(max_length=50, verbose_name="Проекция")
+    applied_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = _("Применённая проекция")
+        verbose_name_plural = _("Журнал проекций аналитики")
+        constraints = [
+            models.UniqueConstraint(
+                fields=['transaction', 'projection'],
+                name='unique_transaction_projection'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.projection} ← продажа #{self.transaction_id}"
+
+
+class RollupWatermark(StoreOwnedModel):
+    """
+    ✅ Отметка refresh_rollups для магазина: до какой продажи (id) и до какого
+    момента изменений (updated_at) сводки уже сверены с продажами
+    """
+    last_transaction_id = models.BigIntegerField(default=0, verbose_name="Последняя обработанная продажа")
+    last_updated_at = models.DateTimeField(null=True, blank=True, verbose_name="Изменения учтены до")
+    refreshed_at = models.DateTimeField(auto_now=True)
+
+    objects = StoreOwnedManager()
+
+    class Meta:
+        verbose_name = _("Отметка обновления сводок")
+        verbose_name_plural = _("Отметки обновления сводок")
+        constraints = [
+            models.UniqueConstraint(fields=['store'], name='unique_rollup_watermark_store'),
+        ]
+
+    def __str__(self):
+        return f"{self.store_id}: до продажи #{self.last_transaction_id}, изменения до {self.last_updated_at}"
@@ -0,0 +1,522 @@
+# analytics/services/analytics_projector.py
+import logging
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction as db_transaction
+
+from analytics.models import (
+    SalesSummary, HourlySalesSummary, ProductAnalytics, CustomerAnalytics,
+    UnitAnalytics, SizeAnalytics, CategoryAnalytics,
+    ProjectionLedger
+)
+from inventory.models import FinancialSummary, StockHistory
+from sales.models import TransactionItem
+from stores.business_date import business_hour
+from stores.services.upsert import upsert_increment
+
+logger = logging.getLogger('analytics')
+
+
+def _size_info(size):
+    """Снимок размера товара (как в ProductAnalytics.save)"""
+    return {
+        'size': size.size,
+        'dimension1': float(size.dimension1) if size.dimension1 else None,
+        'dimension2': float(size.dimension2) if size.dimension2 else None,
+        'dimension3': float(size.dimension3) if size.dimension3 else None,
+        'dimension1_label': size.dimension1_label,
+        'dimension2_label': size.dimension2_label,
+        'dimension3_label': size.dimension3_label,
+    }
+
+
+class AnalyticsProjector:
+    """
+    📊 Проекции аналитики для пачки завершённых продаж.
+
+    Позиции всех продаж пачки загружаются одним запросом, и каждая таблица
+    обновляется одним INSERT ... ON CONFLICT DO UPDATE (upsert_increment):
+    счетчики прибавляются на стороне БД. Число запросов не зависит от числа
+    продаж в пачке.
+
+    Повторное применение исключает ProjectionLedger: каждая проекция получает
+    только продажи, которых еще нет в журнале, и записывает их туда в той же
+    транзакции БД (уникальность (продажа, проекция) — на уровне БД).
+    """
+
+    PROJECTIONS = (
+        'sales_summary', 'hourly_sales', 'product_analytics', 'unit_analytics',
+        'size_analytics', 'category_analytics', 'customer_analytics',
+    )
+    # Финансовая сводка применяется сразу в outbox (см. inventory/signals.py),
+    # аналитика — возможно, воркером; журнал у них общий
+    ALL_PROJECTIONS = PROJECTIONS + ('financial_summary',)
+    # Проекции, которым нужны позиции продаж
+    ITEM_PROJECTIONS = (
+        'financial_summary', 'sales_summary', 'product_analytics', 'unit_analytics',
+        'size_analytics', 'category_analytics',
+    )
+
+    def apply(self, transactions, projections=None):
+        """
+        Применяет проекции (по умолчанию — аналитику PROJECTIONS) к пачке
+        продаж в одной транзакции БД. Возвращает число продаж, к которым
+        применена хотя бы одна проекция
+        """
+        projections = tuple(projections or self.PROJECTIONS)
+        transactions = sorted(
+            (t for t in transactions if t.status == 'completed'),
+            key=lambda t: t.pk
+        )
+        if not transactions:
+            return 0
+
+        with db_transaction.atomic(savepoint=False):
+            pending = self._claim(transactions, projections)
+            applied = {t.pk for group in pending.values() for t in group}
+            if not applied:
+                return 0
+
+            # Позиции — только для продаж, которых еще нет в журнале
+            items = defaultdict(list)
+            if any(pending[name] for name in projections if name in self.ITEM_PROJECTIONS):
+                for item in (
+                    TransactionItem.objects
+                    .filter(transaction_id__in=sorted(applied))
+                    .select_related('product__category', 'product__custom_unit', 'product__default_size')
+                    .order_by('id')
+                ):
+                    items[item.transaction_id].append(item)
+
+            self._process_financial_summary(pending.get('financial_summary', []), items)
+            self._process_sales_summary(pending.get('sales_summary', []), items)
+            self._process_hourly_sales(pending.get('hourly_sales', []))
+            self._process_product_analytics(pending.get('product_analytics', []), items)
+            self._process_unit_analytics(pending.get('unit_analytics', []), items)
+            self._process_size_analytics(pending.get('size_analytics', []), items)
+            self._process_category_analytics(pending.get('category_analytics', []), items)
+            self._process_customer_analytics(pending.get('customer_analytics', []))
+
+        logger.info(f"✅ {', '.join(projections)}: processed {len(applied)} of {len(transactions)} transactions")
+        return len(applied)
+
+    def _claim(self, transactions, projections):
+        """
+        Отбирает для каждой проекции еще не учтённые продажи и записывает их
+        в журнал: один SELECT по журналу и один INSERT.
+        Возвращает {проекция: [продажи]}
+        """
+        applied = set(
+            ProjectionLedger.objects.filter(
+                transaction_id__in=[t.pk for t in transactions],
+                projection__in=projections
+            ).values_list('transaction_id', 'projection')
+        )
+
+        pending = {projection: [] for projection in projections}
+        entries = []
+        for projection in projections:
+            for transaction in transactions:
+                if (transaction.pk, projection) in applied:
+                    # Обычное дело для refresh_rollups: продажа уже учтена через outbox
+                    logger.debug(f"Transaction {transaction.pk} already included in {projection}")
+                    continue
+                pending[projection].append(transaction)
+                entries.append(ProjectionLedger(transaction_id=transaction.pk, projection=projection))
+
+        # Без ignore_conflicts: параллельное применение той же продажи
+        # упадет на уникальном ключе и откатит пачку целиком
+        ProjectionLedger.objects.bulk_create(entries)
+        return pending
+
+    # === UPSERT С БЛОКИРОВКОЙ ===
+
+    def _upsert_locked(self, model, key_fields, groups, build, merge, update_fields):
+        """
+        Для строк, которые нельзя обновить выражением в SQL (объединение списков):
+        SELECT ... FOR UPDATE, INSERT недостающих, один bulk UPDATE.
+        groups — {ключ: данные}, ключ — кортеж значений key_fields.
+        build(key, data) — новая строка с нулевыми счетчиками,
+        merge(row, data) — прибавляет данные к заблокированной строке
+        """
+        if not groups:
+            return
+
+        lookup = {
+            f'{field}__in': {key[index] for key in groups}
+            for index, field in enumerate(key_fields)
+        }
+
+        def load():
+            return {
+                tuple(getattr(row, field) for field in key_fields): row
+                for row in model.objects.select_for_update().filter(**lookup)
+            }
+
+        rows = load()
+        missing = [key for key in groups if key not in rows]
+        if missing:
+            model.objects.bulk_create(
+                [build(key, groups[key]) for key in missing],
+                ignore_conflicts=True
+            )
+            rows = load()
+
+        for key, data in groups.items():
+            merge(rows[key], data)
+
+        model.objects.bulk_update([rows[key] for key in groups], update_fields)
+
+    # === ПРОЕКЦИИ ===
+
+    def _process_financial_summary(self, transactions, items):
+        """Дневная финансовая сводка магазина: счетчики прибавляются в БД"""
+        groups = {}
+        costs = self._cost_of_goods(transactions, items)
+
+        for transaction in transactions:
+            # Сверяем части гибридной оплаты (у остальных способов они обнуляются в clean)
+            actual_total = transaction.cash_amount + transaction.transfer_amount + transaction.card_amount
+            if transaction.payment_method == 'hybrid' and abs(actual_total - transaction.total_amount) > Decimal('0.01'):
+                logger.warning(
+                    f"Несоответствие сумм в транзакции {transaction.id}: "
+                    f"total_amount={transaction.total_amount}, actual={actual_total}"
+                )
+
+            group = groups.setdefault((transaction.business_date, transaction.store_id), {
+                'cash_total': Decimal('0'),
+                'transfer_total': Decimal('0'),
+                'card_total': Decimal('0'),
+                'debt_total': Decimal('0'),
+                'total_transactions': 0,
+                'grand_total': Decimal('0'),
+                'total_margin': Decimal('0'),
+            })
+            group['cash_total'] += transaction.cash_amount
+            group['transfer_total'] += transaction.transfer_amount
+            group['card_total'] += transaction.card_amount
+            if transaction.payment_method == 'debt':
+                group['debt_total'] += transaction.total_amount
+            group['total_transactions'] += 1
+            group['grand_total'] += transaction.total_amount
+            group['total_margin'] += transaction.total_amount - costs[transaction.pk]
+
+        rows = [
+            {
+                'date': date,
+                'store': store_id,
+                **data,
+                'total_margin': data['total_margin'].quantize(Decimal('0.01')),
+                # Для новой строки; у существующей средний чек и маржинальность пересчитываются в БД
+                'avg_transaction': (data['grand_total'] / data['total_transactions']).quantize(Decimal('0.01')),
+                'margin_percentage': (
+                    (data['total_margin'] * 100 / data['grand_total']).quantize(Decimal('0.01'))
+                    if data['grand_total'] else Decimal('0')
+                ),
+            }
+            for (date, store_id), data in groups.items()
+        ]
+
+        upsert_increment(
+            FinancialSummary, ('date', 'store'), rows,
+            increment=('cash_total', 'transfer_total', 'card_total', 'debt_total',
+                       'total_transactions', 'grand_total', 'total_margin'),
+            computed={
+                # Пересчитываем средний чек и маржинальность
+                'avg_transaction': lambda new: f"{new('grand_total')} * 1.0 / NULLIF({new('total_transactions')}, 0)",
+                'margin_percentage': lambda new: f"COALESCE({new('total_margin')} * 100.0 / NULLIF({new('grand_total')}, 0), 0)",
+            }
+        )
+
+    def _cost_of_goods(self, transactions, items):
+        """
+        Себестоимость продаж {продажа: сумма} по записям журнала SALE (один запрос):
+        закупка в них — цена списанных по FIFO партий. Позиции без цены закупки
+        в себестоимость не входят
+        """
+        costs = defaultdict(Decimal)
+        references = {
+            f'txn_{transaction.pk}_item_{item.id}': transaction.pk
+            for transaction in transactions
+            for item in items[transaction.pk]
+        }
+        if not references:
+            return costs
+
+        for reference_id, quantity_change, purchase_price in StockHistory.objects.filter(
+            reference_id__in=list(references), operation_type='SALE'
+        ).values_list('reference_id', 'quantity_change', 'purchase_price_at_time'):
+            if purchase_price is not None:
+                costs[references[reference_id]] += abs(quantity_change) * purchase_price
+        return costs
+
+    def _process_sales_summary(self, transactions, items):
+        """Сводка продаж; гибридная оплата раскладывается по способам оплаты"""
+        rows = []
+
+        for transaction in transactions:
+            date = transaction.business_date
+            items_count = sum((item.quantity for item in items[transaction.pk]), Decimal('0'))
+
+            if transaction.payment_method == 'hybrid':
+                payments = [
+                    (method, amount) for method, amount in (
+                        ('cash', transaction.cash_amount),
+                        ('transfer', transaction.transfer_amount),
+                        ('card', transaction.card_amount),
+                    ) if amount > 0
+                ]
+                total_hybrid = sum((amount for _, amount in payments), Decimal('0'))
+                # Пропорционально распределяем количество товаров между способами оплаты
+                # (сначала умножение: так же считает пересчет сводок в SQL)
+                payments = [
+                    (method, amount, int(items_count * amount / total_hybrid) if total_hybrid > 0 else 0)
+                    for method, amount in payments
+                ]
+            else:
+                payments = [(transaction.payment_method, transaction.total_amount, int(items_count))]
+
+            for method, amount, method_items in payments:
+                rows.append({
+                    'store': transaction.store_id,
+                    'date': date,
+                    'payment_method': method,
+                    'total_amount': amount,
+                    'total_transactions': 1,
+                    'total_items_sold': method_items,
+                    'cashier': transaction.cashier_id,  # последний кассир
+                })
+
+        upsert_increment(
+            SalesSummary, ('store', 'date', 'payment_method'), rows,
+            increment=('total_amount', 'total_transactions', 'total_items_sold'),
+            replace=('cashier',)
+        )
+
+    def _process_hourly_sales(self, transactions):
+        """Почасовая сводка: час бизнес-дня продажи и способ оплаты"""
+        upsert_increment(
+            HourlySalesSummary, ('store', 'date', 'hour', 'payment_method'),
+            [
+                {
+                    'store': transaction.store_id,
+                    'date': transaction.business_date,
+                    'hour': business_hour(transaction.created_at),
+                    'payment_method': transaction.payment_method,
+                    'total_transactions': 1,
+                    'total_amount': transaction.total_amount,
+                    'cash_amount': transaction.cash_amount,
+                    'transfer_amount': transaction.transfer_amount,
+                    'card_amount': transaction.card_amount,
+                }
+                for transaction in transactions
+            ],
+            increment=('total_transactions', 'total_amount', 'cash_amount', 'transfer_amount', 'card_amount')
+        )
+
+    def _process_product_analytics(self, transactions, items):
+        """Аналитика по товарам с учетом дробных единиц"""
+        groups = {}
+
+        for transaction in transactions:
+            date = transaction.business_date
+            for item in items[transaction.pk]:
+                group = groups.setdefault((item.product_id, date), {
+                    'product': item.product,
+                    'quantity': Decimal('0'),
+                    'revenue': Decimal('0'),
+                })
+                group['quantity'] += item.quantity
+                group['revenue'] += item.quantity * item.price
+                group['cashier'] = transaction.cashier_id  # последний кассир
+
+        rows = []
+        for (product_id, date), data in groups.items():
+            product = data['product']
+            rows.append({
+                'product': product_id,
+                'date': date,
+                'quantity_sold': data['quantity'],
+                'revenue': data['revenue'],
+                'cashier': data['cashier'],
+                # Только при создании строки
+                'unit_type': product.unit_type or 'custom',
+                'unit_display': product.unit_display,
+                'size_info': _size_info(product.default_size) if product.has_sizes and product.default_size else None,
+                'average_unit_price': (
+                    (data['revenue'] / data['quantity']).quantize(Decimal('0.01')) if data['quantity'] else None
+                ),
+            })
+
+        upsert_increment(
+            ProductAnalytics, ('product', 'date'), rows,
+            increment=('quantity_sold', 'revenue'),
+            replace=('cashier',),
+            computed={
+                # Пересчитываем среднюю цену
+                'average_unit_price': lambda new: f"{new('revenue')} * 1.0 / NULLIF({new('quantity_sold')}, 0)",
+            }
+        )
+
+    def _process_unit_analytics(self, transactions, items):
+        """Аналитика по единицам измерения (список товаров объединяется — с блокировкой)"""
+        groups = {}
+
+        for transaction in transactions:
+            date = transaction.business_date
+            for item in items[transaction.pk]:
+                product = item.product
+                key = (transaction.store_id, date, product.unit_type or 'custom', product.unit_display)
+                group = groups.setdefault(key, {
+                    'is_custom': product.custom_unit_id is not None,
+                    'quantity': Decimal('0'),
+                    'revenue': Decimal('0'),
+                    'products': set(),
+                    'transactions': set(),
+                })
+                group['quantity'] += item.quantity
+                group['revenue'] += item.quantity * item.price
+                group['products'].add(product.id)
+                group['transactions'].add(transaction.pk)
+
+        def build(key, data):
+            store_id, date, unit_type, unit_display = key
+            return UnitAnalytics(
+                store_id=store_id, date=date, unit_type=unit_type,
+                unit_display=unit_display, is_custom=data['is_custom'], product_ids=[]
+            )
+
+        def merge(row, data):
+            row.total_quantity_sold += data['quantity']
+            row.total_revenue += data['revenue']
+            row.product_ids = sorted(set(row.product_ids) | data['products'])
+            row.products_count = len(row.product_ids)
+            row.transactions_count += len(data['transactions'])
+            row.calculate_metrics()
+            if row.average_unit_price is not None:
+                row.average_unit_price = row.average_unit_price.quantize(Decimal('0.01'))
+
+        self._upsert_locked(
+            UnitAnalytics, ('store_id', 'date', 'unit_type', 'unit_display'), groups, build, merge,
+            ['total_quantity_sold', 'total_revenue', 'product_ids', 'products_count',
+             'transactions_count', 'average_unit_price']
+        )
+
+    def _process_size_analytics(self, transactions, items):
+        """Аналитика по размерам (товары без размеров пропускаются)"""
+        groups = {}
+
+        for transaction in transactions:
+            date = transaction.business_date
+            for item in items[transaction.pk]:
+                product = item.product
+                if not product.has_sizes or not product.default_size:
+                    continue
+
+                size = product.default_size
+                group = groups.setdefault((transaction.store_id, date, size.size), {
+                    'size': size,
+                    'quantity': Decimal('0'),
+                    'revenue': Decimal('0'),
+                    'products': set(),
+                    'transactions': set(),
+                })
+                group['quantity'] += item.quantity
+                group['revenue'] += item.quantity * item.price
+                group['products'].add(product.id)
+                group['transactions'].add(transaction.pk)
+
+        upsert_increment(
+            SizeAnalytics, ('store', 'date', 'size_name'),
+            [
+                {
+                    'store': store_id,
+                    'date': date,
+                    'size_name': size_name,
+                    'total_quantity_sold': data['quantity'],
+                    'total_revenue': data['revenue'],
+                    'transactions_count': len(data['transactions']),
+                    # Только при создании строки
+                    'dimension1': data['size'].dimension1,
+                    'dimension2': data['size'].dimension2,
+                    'dimension3': data['size'].dimension3,
+                    'dimension1_label': data['size'].dimension1_label,
+                    'dimension2_label': data['size'].dimension2_label,
+                    'dimension3_label': data['size'].dimension3_label,
+                    'products_count': len(data['products']),
+                }
+                for (store_id, date, size_name), data in groups.items()
+            ],
+            increment=('total_quantity_sold', 'total_revenue', 'transactions_count')
+        )
+
+    def _process_category_analytics(self, transactions, items):
+        """Аналитика по категориям"""
+        groups = {}
+
+        for transaction in transactions:
+            date = transaction.business_date
+            for item in items[transaction.pk]:
+                product = item.product
+                group = groups.setdefault((transaction.store_id, date, product.category_id), {
+                    'quantity': Decimal('0'),
+                    'revenue': Decimal('0'),
+                    'products': set(),
+                    'transactions': set(),
+                })
+                group['quantity'] += item.quantity
+                group['revenue'] += item.quantity * item.price
+                group['products'].add(product.id)
+                group['transactions'].add(transaction.pk)
+
+        upsert_increment(
+            CategoryAnalytics, ('store', 'date', 'category'),
+            [
+                {
+                    'store': store_id,
+                    'date': date,
+                    'category': category_id,
+                    'total_quantity_sold': data['quantity'],
+                    'total_revenue': data['revenue'],
+                    'transactions_count': len(data['transactions']),
+                    'average_transaction_amount': (
+                        data['revenue'] / len(data['transactions'])
+                    ).quantize(Decimal('0.01')),
+                    # Только при создании строки
+                    'products_count': len(data['products']),
+                    'unique_products_sold': len(data['products']),
+                }
+                for (store_id, date, category_id), data in groups.items()
+            ],
+            increment=('total_quantity_sold', 'total_revenue', 'transactions_count'),
+            computed={
+                'average_transaction_amount':
+                    lambda new: f"{new('total_revenue')} * 1.0 / NULLIF({new('transactions_count')}, 0)",
+            }
+        )
+
+    def _process_customer_analytics(self, transactions):
+        """Аналитика по клиентам"""
+        upsert_increment(
+            CustomerAnalytics, ('customer', 'date'),
+            [
+                {
+                    'customer': transaction.customer_id,
+                    'date': transaction.business_date,
+                    'total_purchases': transaction.total_amount,
+                    'transaction_count': 1,
+                    'debt_added': (
+                        transaction.total_amount if transaction.payment_method == 'debt' else Decimal('0')
+                    ),
+                    'cashier': transaction.cashier_id,
+                }
+                for transaction in transactions
+                if transaction.customer_id
+            ],
+            increment=('total_purchases', 'transaction_count', 'debt_added'),
+            replace=('cashier',)
+        )
+
+
+analytics_projector = AnalyticsProjector()
@@ -0,0 +1,156 @@
+# analytics/services/analytics_queue.py
+import logging
+from datetime import timedelta
+
+from django.db import transaction as db_transaction
+from django.db.models import F, Min
+from django.utils import timezone
+
+from analytics.models import AnalyticsJob
+from analytics.services.analytics_projector import analytics_projector
+
+logger = logging.getLogger('analytics')
+
+
+class AnalyticsQueue:
+    """
+    📥 Очередь аналитики в БД (AnalyticsJob).
+
+    Задача ставится проекцией outbox по завершённой продаже, а разбирается
+    воркерами `manage.py analytics_worker`: каждый берет пачку задач через
+    SELECT ... FOR UPDATE SKIP LOCKED, применяет AnalyticsProjector ко всей пачке
+    и отмечает задачи обработанными в той же транзакции БД.
+    """
+
+    MAX_ATTEMPTS = 5
+
+    def enqueue(self, transactions, process_now=False):
+        """
+        Ставит продажи в очередь (один INSERT, повторы игнорируются).
+        process_now=True — применить проекции сразу (без воркера)
+        """
+        transactions = list(transactions)
+        if not transactions:
+            return
+
+        now = None
+        if process_now:
+            analytics_projector.apply(transactions)
+            now = timezone.now()
+
+        AnalyticsJob.objects.bulk_create(
+            [
+                AnalyticsJob(
+                    transaction=transaction,
+                    store_id=transaction.store_id,
+                    processed_at=now,
+                    attempts=1 if process_now else 0
+                )
+                for transaction in transactions
+            ],
+            ignore_conflicts=True
+        )
+
+    def pending(self):
+        """Необработанные задачи, не исчерпавшие попытки"""
+        return AnalyticsJob.objects.filter(
+            processed_at__isnull=True,
+            attempts__lt=self.MAX_ATTEMPTS
+        ).order_by('id')
+
+    def process_batch(self, batch_size=100):
+        """
+        Обрабатывает одну пачку задач.
+        Возвращает {'processed': int, 'failed': int, 'max_lag': секунды | None}
+        """
+        processed = []
+        failed = 0
+
+        with db_transaction.atomic():
+            jobs = list(
+                self.pending()
+                .select_for_update(skip_locked=True, of=('self',))
+                .select_related('transaction')
+                [:batch_size]
+            )
+            if not jobs:
+                return {'processed': 0, 'failed': 0, 'max_lag': None}
+
+            try:
+                with db_transaction.atomic():
+                    analytics_projector.apply([job.transaction for job in jobs])
+                processed = jobs
+            except Exception:
+                # Пачка не прошла — применяем по одной, чтобы изолировать сбойную продажу
+                for job in jobs:
+                    try:
+                        with db_transaction.atomic():
+                            analytics_projector.apply([job.transaction])
+                    except Exception as e:
+                        failed += 1
+                        AnalyticsJob.objects.filter(pk=job.pk).update(
+                            attempts=F('attempts') + 1,
+                            last_error=f"{type(e).__name__}: {e}"
+                        )
+                        logger.error(f"❌ Analytics job for transaction {job.transaction_id} failed: {e}")
+                    else:
+                        processed.append(job)
+
+            now = timezone.now()
+            if processed:
+                AnalyticsJob.objects.filter(pk__in=[job.pk for job in processed]).update(
+                    processed_at=now,
+                    attempts=F('attempts') + 1,
+                    last_error=''
+                )
+
+        max_lag = max(
+            ((now - job.transaction.created_at).total_seconds() for job in processed),
+            default=None
+        )
+        if processed:
+            logger.info(f"✅ Analytics jobs processed: {len(processed)}, max lag {max_lag:.1f}s")
+
+        return {'processed': len(processed), 'failed': failed, 'max_lag': max_lag}
+
+    def stats(self):
+        """
+        Метрики отставания очереди:
+        pending — задач в очереди, stuck — исчерпали попытки,
+        oldest_lag — возраст самой старой задачи в очереди (сек),
+        processed_last_hour — обработано за последний час
+        """
+        now = timezone.now()
+        pending = self.pending()
+        oldest = pending.aggregate(oldest=Min('created_at'))['oldest']
+        return {
+            'pending': pending.count(),
+            'stuck': AnalyticsJob.objects.filter(
+                processed_at__isnull=True, attempts__gte=self.MAX_ATTEMPTS
+            ).count(),
+            'oldest_lag': (now - oldest).total_seconds() if oldest else 0.0,
+            'processed_last_hour': AnalyticsJob.objects.filter(
+                processed_at__gte=now - timedelta(hours=1)
+            ).count(),
+        }
+
+    def backfill(self, batch_size=500):
+        """
+        Ставит в очередь завершённые продажи без задачи.
+        Только для продаж, аналитика которых еще не считалась
+        """
+        from sales.models import Transaction
+
+        queued = 0
+        while True:
+            transactions = list(
+                Transaction.objects.filter(status='completed', analytics_job__isnull=True)
+                .only('id', 'store_id').order_by('id')[:batch_size]
+            )
+            if not transactions:
+                return queued
+            self.enqueue(transactions)
+            queued += len(transactions)
+
+
+analytics_queue = AnalyticsQueue()
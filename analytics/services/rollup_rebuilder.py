@@ -0,0 +1,442 @@
+# analytics/services/rollup_rebuilder.py
+import logging
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import connections, router, transaction as db_transaction
+from django.db.models import (
+    Case, CharField, Count, DecimalField, F, IntegerField, Max, Min, OuterRef, Q, Subquery, Sum, Value, When
+)
+from django.db.models.functions import Abs, Cast, Coalesce, Concat, ExtractHour, Floor, NullIf
+from django.utils import timezone
+
+from analytics.models import (
+    SalesSummary, HourlySalesSummary, ProductAnalytics, CustomerAnalytics,
+    UnitAnalytics, SizeAnalytics, CategoryAnalytics, ProjectionLedger
+)
+from analytics.services.analytics_projector import analytics_projector, _size_info
+from inventory.models import FinancialSummary, Product, StockHistory
+from sales.models import Transaction, TransactionItem
+from stores.business_date import business_tz
+from stores.services.upsert import upsert_increment
+
+logger = logging.getLogger('analytics')
+
+# Счетчики финансовой сводки, которые считаются по продажам (остальные поля не трогаются)
+FINANCIAL_FIELDS = (
+    'cash_total', 'transfer_total', 'card_total', 'debt_total',
+    'total_transactions', 'grand_total', 'avg_transaction',
+    'total_margin', 'margin_percentage',
+)
+
+ZERO = Value(Decimal('0'), output_field=DecimalField(max_digits=15, decimal_places=3))
+MONEY = DecimalField(max_digits=15, decimal_places=2)
+QUANTITY = DecimalField(max_digits=15, decimal_places=3)
+CENT = Decimal('0.01')
+
+
+def _money(value):
+    return (value or Decimal('0')).quantize(CENT)
+
+
+def _ratio(numerator, denominator):
+    """Средняя величина до копеек (None при нулевом знаменателе)"""
+    return (numerator / denominator).quantize(CENT) if denominator else None
+
+
+class RollupRebuilder:
+    """
+    🔁 Пересчет сводок магазина из продаж за период, по дням (чанками).
+
+    Каждый чанк пересчитывается в своей короткой транзакции БД: строки сводок
+    аналитики за эти дни удаляются, продажные счетчики FinancialSummary
+    обнуляются, журнал проекций продаж чанка переписывается одним
+    INSERT ... SELECT, и каждая сводка строится одним агрегатным запросом
+    (GROUP BY) по продажам и позициям и вставляется одним bulk_create.
+    Продажи и позиции в Python не загружаются: число запросов и память
+    не зависят от числа продаж. Результат совпадает с инкрементальными
+    проекциями AnalyticsProjector и не зависит от прежнего состояния сводок.
+
+    Агрегаты берут только продажи, записанные этим пересчетом в журнал
+    проекций: продажа, закоммиченная во время пересчета, применяется
+    диспетчером outbox после него, а не дважды.
+
+    В сводки входят только завершённые продажи (status='completed'). Возврат
+    убирает продажу пересчетом ее дня: сразу — проекцией outbox 'refunded'
+    (analytics/signals.py), при пропуске — refresh_rollups по updated_at.
+    """
+
+    # Сводки аналитики и путь от них к магазину
+    ANALYTICS_ROLLUPS = (
+        (SalesSummary, 'store_id'),
+        (HourlySalesSummary, 'store_id'),
+        (ProductAnalytics, 'product__store_id'),
+        (UnitAnalytics, 'store_id'),
+        (SizeAnalytics, 'store_id'),
+        (CategoryAnalytics, 'store_id'),
+        (CustomerAnalytics, 'customer__store_id'),
+    )
+
+    def first_date(self, store_id):
+        """Бизнес-дата первой продажи магазина или None"""
+        return Transaction.objects.filter(store_id=store_id).aggregate(first=Min('business_date'))['first']
+
+    def chunks(self, date_from, date_to, days=1):
+        """Периоды [начало, конец] по days дней, включительно"""
+        step = timedelta(days=max(days, 1))
+        start = date_from
+        while start <= date_to:
+            end = min(start + step - timedelta(days=1), date_to)
+            yield start, end
+            start = end + timedelta(days=1)
+
+    def rebuild(self, store_id, date_from, date_to, chunk_days=1):
+        """Пересчитывает период по чанкам. Возвращает {'chunks', 'transactions'}"""
+        totals = {'chunks': 0, 'transactions': 0}
+        for start, end in self.chunks(date_from, date_to, chunk_days):
+            totals['transactions'] += self.rebuild_chunk(store_id, start, end)
+            totals['chunks'] += 1
+        return totals
+
+    def rebuild_chunk(self, store_id, date_from, date_to):
+        """Пересчитывает сводки магазина за дни [date_from, date_to] атомарно. Возвращает число продаж"""
+        period = {'date__gte': date_from, 'date__lte': date_to}
+        sales = Transaction.objects.filter(
+            store_id=store_id, business_date__gte=date_from, business_date__lte=date_to
+        )
+
+        with db_transaction.atomic():
+            # Сначала удаление: в PostgreSQL параллельная проекция тех же строк
+            # ждет коммита пересчета и прибавляет к новым значениям
+            for model, store_path in self.ANALYTICS_ROLLUPS:
+                model.objects.filter(**{store_path: store_id}, **period).delete()
+            FinancialSummary.objects.filter(store_id=store_id, **period).update(
+                **{field: 0 for field in FINANCIAL_FIELDS}
+            )
+            ProjectionLedger.objects.filter(
+                transaction__in=sales.values('pk'),
+                projection__in=analytics_projector.ALL_PROJECTIONS
+            ).delete()
+
+            count = self._claim(sales.filter(status='completed'))
+            if count:
+                self._rebuild(store_id, sales)
+
+        logger.debug(f"🔁 Сводки магазина {store_id} за {date_from}..{date_to}: продаж {count}")
+        return count
+
+    def _claim(self, completed):
+        """
+        Записывает в журнал все проекции завершённых продаж чанка одним
+        INSERT ... SELECT. Возвращает число продаж.
+        Без ON CONFLICT: продажа, которую параллельно учла проекция,
+        откатит пересчет чанка целиком
+        """
+        projections = analytics_projector.ALL_PROJECTIONS
+        connection = connections[router.db_for_write(ProjectionLedger)]
+        qn = connection.ops.quote_name
+        meta = ProjectionLedger._meta
+        columns = ', '.join(
+            qn(meta.get_field(name).column) for name in ('transaction', 'projection', 'applied_at')
+        )
+        select_sql, select_params = completed.order_by().values(sale=F('pk')).query.sql_with_params()
+        names = ' UNION ALL '.join(['SELECT %s AS projection'] * len(projections))
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {qn(meta.db_table)} ({columns}) "
+                f"SELECT sales.sale, names.projection, %s "
+                f"FROM ({select_sql}) sales CROSS JOIN ({names}) names",
+                [connection.ops.adapt_datetimefield_value(timezone.now()), *select_params, *projections]
+            )
+            return cursor.rowcount // len(projections)
+
+    def _rebuild(self, store_id, sales):
+        """Сводки по продажам, записанным в журнал этим пересчетом"""
+        def claimed_sales(projection):
+            return sales.filter(projection_ledger__projection=projection).order_by()
+
+        def claimed_items(projection):
+            return TransactionItem.objects.filter(
+                transaction__in=claimed_sales(projection).values('pk')
+            ).order_by()
+
+        # Кассир строки — кассир последней (по id) продажи, как у проекций: [(строка, продажа)]
+        last_sales = []
+        rollups = (
+            self._financial_summary(store_id, claimed_sales('financial_summary'), claimed_items('financial_summary')),
+            self._sales_summary(store_id, claimed_sales('sales_summary'), last_sales),
+            self._hourly_sales(store_id, claimed_sales('hourly_sales')),
+            self._product_analytics(claimed_items('product_analytics'), last_sales),
+            self._unit_analytics(store_id, claimed_items('unit_analytics')),
+            self._size_analytics(store_id, claimed_items('size_analytics')),
+            self._category_analytics(store_id, claimed_items('category_analytics')),
+            self._customer_analytics(claimed_sales('customer_analytics'), last_sales),
+        )
+
+        cashiers = dict(
+            Transaction.objects.filter(pk__in={pk for _, pk in last_sales}).values_list('pk', 'cashier_id')
+        )
+        for row, pk in last_sales:
+            row.cashier_id = cashiers[pk]
+        for rows in rollups:
+            if rows:
+                type(rows[0]).objects.bulk_create(rows)
+
+    # === СВОДКИ ===
+
+    def _financial_summary(self, store_id, sales, items):
+        """Продажные счетчики FinancialSummary: остальные поля строки не трогаются"""
+        # Себестоимость позиции — по ее записи SALE в журнале движений
+        cost = StockHistory.objects.filter(
+            operation_type='SALE',
+            reference_id=Concat(
+                Value('txn_'), Cast(OuterRef('transaction_id'), CharField()),
+                Value('_item_'), Cast(OuterRef('pk'), CharField()),
+                output_field=CharField()
+            ),
+        ).values(cost=Coalesce(Abs(F('quantity_change')) * F('purchase_price_at_time'), ZERO, output_field=MONEY))
+        costs = dict(
+            items.values_list('transaction__business_date')
+            .annotate(cost=Sum(Subquery(cost[:1]), output_field=MONEY))
+        )
+
+        rows = []
+        for data in sales.values('business_date').annotate(
+            cash_total=Sum('cash_amount'),
+            transfer_total=Sum('transfer_amount'),
+            card_total=Sum('card_amount'),
+            debt_total=Coalesce(Sum('total_amount', filter=Q(payment_method='debt')), ZERO, output_field=MONEY),
+            total_transactions=Count('pk'),
+            grand_total=Sum('total_amount'),
+        ):
+            grand_total = _money(data['grand_total'])
+            margin = _money(grand_total - (costs.get(data['business_date']) or Decimal('0')))
+            rows.append({
+                'date': data['business_date'],
+                'store': store_id,
+                'cash_total': _money(data['cash_total']),
+                'transfer_total': _money(data['transfer_total']),
+                'card_total': _money(data['card_total']),
+                'debt_total': _money(data['debt_total']),
+                'total_transactions': data['total_transactions'],
+                'grand_total': grand_total,
+                'avg_transaction': _ratio(grand_total, data['total_transactions']),
+                'total_margin': margin,
+                'margin_percentage': _ratio(margin * 100, grand_total) or Decimal('0'),
+            })
+
+        upsert_increment(FinancialSummary, ('date', 'store'), rows, replace=FINANCIAL_FIELDS)
+
+    def _sales_summary(self, store_id, sales, last_sales):
+        """
+        По способам оплаты; гибридная продажа раскладывается по частям оплаты,
+        товары — пропорционально сумме части, с отбрасыванием дробной части
+        по каждой продаже (как в проекции)
+        """
+        items_count = Coalesce(
+            Subquery(
+                TransactionItem.objects.filter(transaction=OuterRef('pk')).order_by()
+                .values('transaction').annotate(total=Sum('quantity')).values('total')
+            ),
+            ZERO, output_field=QUANTITY
+        )
+        paid = F('cash_amount') + F('transfer_amount') + F('card_amount')
+        groups = {}
+
+        def add(date, method, amount, transactions, items, last_id):
+            group = groups.setdefault((date, method), {
+                'total_amount': Decimal('0'), 'total_transactions': 0, 'total_items_sold': 0, 'last': last_id,
+            })
+            group['total_amount'] += amount or Decimal('0')
+            group['total_transactions'] += transactions
+            group['total_items_sold'] += int(items or 0)
+            group['last'] = max(group['last'], last_id)
+
+        for data in sales.exclude(payment_method='hybrid').values('business_date', 'payment_method').annotate(
+            amount=Sum('total_amount'),
+            transactions=Count('pk'),
+            items=Sum(Floor(items_count), output_field=IntegerField()),
+            last=Max('pk'),
+        ):
+            add(data['business_date'], data['payment_method'], data['amount'],
+                data['transactions'], data['items'], data['last'])
+
+        methods = ('cash', 'transfer', 'card')
+        aggregates = {}
+        for method in methods:
+            part = Q(**{f'{method}_amount__gt': 0})
+            aggregates.update({
+                f'{method}_paid': Sum(f'{method}_amount', filter=part),
+                f'{method}_transactions': Count('pk', filter=part),
+                f'{method}_items': Sum(
+                    Floor(items_count * F(f'{method}_amount') / NullIf(paid, ZERO)),
+                    filter=part, output_field=IntegerField()
+                ),
+                f'{method}_last': Max('pk', filter=part),
+            })
+        for data in sales.filter(payment_method='hybrid').values('business_date').annotate(**aggregates):
+            for method in methods:
+                if data[f'{method}_transactions']:
+                    add(data['business_date'], method, data[f'{method}_paid'],
+                        data[f'{method}_transactions'], data[f'{method}_items'], data[f'{method}_last'])
+
+        rows = []
+        for (date, method), data in groups.items():
+            row = SalesSummary(
+                store_id=store_id, date=date, payment_method=method,
+                total_amount=_money(data['total_amount']),
+                total_transactions=data['total_transactions'],
+                total_items_sold=data['total_items_sold'],
+            )
+            last_sales.append((row, data['last']))
+            rows.append(row)
+        return rows
+
+    def _hourly_sales(self, store_id, sales):
+        """По часу бизнес-дня и способу оплаты"""
+        return [
+            HourlySalesSummary(store_id=store_id, **data)
+            for data in sales.annotate(hour=ExtractHour('created_at', tzinfo=business_tz()))
+            .values('hour', 'payment_method', date=F('business_date')).annotate(
+                total_transactions=Count('pk'),
+                total_amount=Sum('total_amount'),
+                cash_amount=Sum('cash_amount'),
+                transfer_amount=Sum('transfer_amount'),
+                card_amount=Sum('card_amount'),
+            )
+        ]
+
+    def _product_analytics(self, items, last_sales):
+        """По товарам; единицы и размер — снимок товара, как при вставке строки проекцией"""
+        groups = list(
+            items.values('product_id', date=F('transaction__business_date')).annotate(
+                sold=Sum('quantity'),
+                revenue=Sum(F('quantity') * F('price'), output_field=MONEY),
+                last=Max('transaction_id'),
+            )
+        )
+        products = Product.objects.include_deleted().select_related('custom_unit', 'default_size').in_bulk(
+            {data['product_id'] for data in groups}
+        )
+
+        rows = []
+        for data in groups:
+            product = products[data['product_id']]
+            row = ProductAnalytics(
+                product_id=data['product_id'], date=data['date'],
+                quantity_sold=data['sold'], revenue=_money(data['revenue']),
+                unit_type=product.unit_type or 'custom',
+                unit_display=product.unit_display,
+                size_info=_size_info(product.default_size) if product.has_sizes and product.default_size else None,
+                average_unit_price=_ratio(data['revenue'], data['sold']),
+            )
+            last_sales.append((row, data['last']))
+            rows.append(row)
+        return rows
+
+    def _unit_analytics(self, store_id, items):
+        """По единицам измерения: тип и отображение единицы считаются в SQL, как Product.unit_display"""
+        unit = {
+            'unit': Coalesce(NullIf(F('product__unit_type'), Value('')), Value('custom'), output_field=CharField()),
+            'display': Case(
+                When(product__custom_unit__isnull=False, then=F('product__custom_unit__short_name')),
+                *[When(product__unit_type=code, then=Value(label)) for code, label in Product.SYSTEM_UNITS],
+                default=F('product__unit_type'),
+                output_field=CharField(),
+            ),
+            'date': F('transaction__business_date'),
+        }
+        keys = ('date', 'unit', 'display')
+
+        product_ids = {}
+        for data in items.values('product_id', **unit).distinct():
+            product_ids.setdefault(tuple(data[key] for key in keys), set()).add(data['product_id'])
+
+        rows = []
+        for data in items.values(**unit).annotate(
+            sold=Sum('quantity'),
+            revenue=Sum(F('quantity') * F('price'), output_field=MONEY),
+            transactions=Count('transaction_id', distinct=True),
+            is_custom=Max(Case(When(product__custom_unit__isnull=False, then=Value(1)), default=Value(0))),
+        ):
+            products = sorted(product_ids[tuple(data[key] for key in keys)])
+            rows.append(UnitAnalytics(
+                store_id=store_id, date=data['date'], unit_type=data['unit'], unit_display=data['display'],
+                is_custom=bool(data['is_custom']),
+                total_quantity_sold=data['sold'], total_revenue=_money(data['revenue']),
+                product_ids=products, products_count=len(products),
+                transactions_count=data['transactions'],
+                average_unit_price=_ratio(data['revenue'], data['sold']),
+            ))
+        return rows
+
+    def _size_analytics(self, store_id, items):
+        """По размерам товаров; размеры строки — из первой позиции, как при вставке проекцией"""
+        groups = list(
+            items.filter(product__has_sizes=True, product__default_size__isnull=False)
+            .values(date=F('transaction__business_date'), size=F('product__default_size__size')).annotate(
+                sold=Sum('quantity'),
+                revenue=Sum(F('quantity') * F('price'), output_field=MONEY),
+                transactions=Count('transaction_id', distinct=True),
+                products=Count('product_id', distinct=True),
+                first=Min('pk'),
+            )
+        )
+        sizes = {
+            item.pk: item.product.default_size
+            for item in TransactionItem.objects.filter(pk__in=[data['first'] for data in groups])
+            .select_related('product__default_size')
+        }
+
+        rows = []
+        for data in groups:
+            size = sizes[data['first']]
+            rows.append(SizeAnalytics(
+                store_id=store_id, date=data['date'], size_name=data['size'],
+                total_quantity_sold=data['sold'], total_revenue=_money(data['revenue']),
+                transactions_count=data['transactions'], products_count=data['products'],
+                dimension1=size.dimension1, dimension2=size.dimension2, dimension3=size.dimension3,
+                dimension1_label=size.dimension1_label, dimension2_label=size.dimension2_label,
+                dimension3_label=size.dimension3_label,
+            ))
+        return rows
+
+    def _category_analytics(self, store_id, items):
+        """По категориям товаров"""
+        rows = []
+        for data in items.values(date=F('transaction__business_date'), category=F('product__category_id')).annotate(
+            sold=Sum('quantity'),
+            revenue=Sum(F('quantity') * F('price'), output_field=MONEY),
+            transactions=Count('transaction_id', distinct=True),
+            products=Count('product_id', distinct=True),
+        ):
+            rows.append(CategoryAnalytics(
+                store_id=store_id, date=data['date'], category_id=data['category'],
+                total_quantity_sold=data['sold'], total_revenue=_money(data['revenue']),
+                transactions_count=data['transactions'],
+                average_transaction_amount=_ratio(data['revenue'], data['transactions']),
+                products_count=data['products'], unique_products_sold=data['products'],
+            ))
+        return rows
+
+    def _customer_analytics(self, sales, last_sales):
+        """По покупателям"""
+        rows = []
+        for data in sales.filter(customer__isnull=False).values('customer_id', date=F('business_date')).annotate(
+            purchases=Sum('total_amount'),
+            transactions=Count('pk'),
+            debt=Coalesce(Sum('total_amount', filter=Q(payment_method='debt')), ZERO, output_field=MONEY),
+            last=Max('pk'),
+        ):
+            row = CustomerAnalytics(
+                customer_id=data['customer_id'], date=data['date'],
+                total_purchases=_money(data['purchases']), transaction_count=data['transactions'],
+                debt_added=_money(data['debt']),
+            )
+            last_sales.append((row, data['last']))
+            rows.append(row)
+        return rows
+
+
+rollup_rebuilder = RollupRebuilder()
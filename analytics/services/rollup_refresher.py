@@ -0,0 +1,140 @@
+# analytics/services/rollup_refresher.py
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.db.models import Exists, Min, OuterRef, Q
+from django.utils import timezone
+
+from analytics.models import RollupWatermark
+from analytics.services.analytics_projector import analytics_projector
+from analytics.services.rollup_rebuilder import rollup_rebuilder
+from sales.models import Transaction
+from stores.models import Store
+
+logger = logging.getLogger('analytics')
+
+
+class RollupRefresher:
+    """
+    🔄 Догоняющее обновление сводок по отметке магазина (RollupWatermark).
+
+    Новые продажи (id больше отметки) применяются пачками тем же
+    AnalyticsProjector, что и outbox: журнал проекций пропускает уже учтённые,
+    поэтому догоняются только продажи, чьи проекции не дошли. Измененные
+    продажи (updated_at после отметки — возврат, завершение из админки)
+    пересчитываются целым днем через RollupRebuilder, как и возврат в outbox.
+
+    Продажи моложе задержки settle ждут следующего запуска: транзакция с
+    меньшим id могла еще не закоммититься. Стоимость запуска зависит только от
+    новой активности: магазины без нее отсекаются одним запросом по индексам.
+    Параллельный запуск пропускает магазины, отметку которых держит другой.
+    """
+
+    def active_store_ids(self, store_ids=None, cutoff=None):
+        """Магазины с продажами после отметки (отметки недостающих магазинов создаются)"""
+        cutoff = cutoff or timezone.now()
+        stores = Store.objects.all()
+        if store_ids:
+            stores = stores.filter(pk__in=store_ids)
+
+        RollupWatermark.objects.bulk_create(
+            [
+                RollupWatermark(store_id=store_id)
+                for store_id in stores.filter(rollupwatermark_set__isnull=True).values_list('pk', flat=True)
+            ],
+            ignore_conflicts=True
+        )
+
+        settled = Transaction.objects.filter(store=OuterRef('store'))
+        return list(
+            RollupWatermark.objects.filter(store__in=stores).annotate(
+                has_new=Exists(settled.filter(pk__gt=OuterRef('last_transaction_id'), created_at__lte=cutoff)),
+                has_changed=Exists(settled.filter(updated_at__gt=OuterRef('last_updated_at'), updated_at__lte=cutoff)),
+            ).filter(Q(has_new=True) | Q(has_changed=True)).order_by('store_id').values_list('store_id', flat=True)
+        )
+
+    def refresh(self, store_ids=None, batch_size=None, settle_seconds=None):
+        """Обновляет сводки активных магазинов. Возвращает {store_id: результат refresh_store}"""
+        cutoff = self._cutoff(settle_seconds)
+        return {
+            store_id: self.refresh_store(store_id, batch_size=batch_size, cutoff=cutoff)
+            for store_id in self.active_store_ids(store_ids, cutoff)
+        }
+
+    def refresh_store(self, store_id, batch_size=None, cutoff=None):
+        """
+        Догоняет сводки магазина до момента cutoff в одной транзакции БД с
+        отметкой. Возвращает {'transactions', 'applied', 'days'} или None,
+        если магазин сейчас обновляет другой процесс
+        """
+        from sales.services.sales_statistics import sales_statistics
+
+        batch_size = max(batch_size or getattr(settings, 'ROLLUP_REFRESH_BATCH_SIZE', 500), 1)
+        cutoff = cutoff or self._cutoff()
+
+        with db_transaction.atomic():
+            watermark = (
+                RollupWatermark.objects.select_for_update(skip_locked=True)
+                .filter(store_id=store_id).first()
+            )
+            if watermark is None:
+                logger.info(f"⏭️ Сводки магазина {store_id} уже обновляет другой процесс")
+                return None
+
+            result = {'transactions': 0, 'applied': 0, 'days': 0}
+            sales = Transaction.objects.filter(store_id=store_id)
+
+            # Измененные продажи, уже пройденные отметкой: пересчет их дней
+            if watermark.last_updated_at is not None:
+                days = sorted(set(
+                    sales.filter(
+                        pk__lte=watermark.last_transaction_id,
+                        updated_at__gt=watermark.last_updated_at,
+                        updated_at__lte=cutoff,
+                    ).values_list('business_date', flat=True)
+                ))
+                for day in days:
+                    rollup_rebuilder.rebuild_chunk(store_id, day, day)
+                result['days'] = len(days)
+
+            # Новые продажи: префикс по id до первой продажи моложе cutoff
+            new_sales = sales.filter(pk__gt=watermark.last_transaction_id)
+            young = new_sales.filter(created_at__gt=cutoff).aggregate(first=Min('pk'))['first']
+            if young is not None:
+                new_sales = new_sales.filter(pk__lt=young)
+
+            last_id = watermark.last_transaction_id
+            while True:
+                batch = list(new_sales.filter(pk__gt=last_id).order_by('pk')[:batch_size])
+                if not batch:
+                    break
+                result['applied'] += analytics_projector.apply(
+                    batch, projections=analytics_projector.ALL_PROJECTIONS
+                )
+                result['transactions'] += len(batch)
+                last_id = batch[-1].pk
+
+            watermark.last_transaction_id = last_id
+            if watermark.last_updated_at is None or watermark.last_updated_at < cutoff:
+                watermark.last_updated_at = cutoff
+            watermark.save(update_fields=['last_transaction_id', 'last_updated_at', 'refreshed_at'])
+
+            if result['applied'] or result['days']:
+                sales_statistics.invalidate(store_id)
+
+        if result['applied'] or result['days']:
+            logger.info(
+                f"🔄 Сводки магазина {store_id}: догнано продаж {result['applied']} "
+                f"из {result['transactions']}, пересчитано дней {result['days']}"
+            )
+        return result
+
+    def _cutoff(self, settle_seconds=None):
+        if settle_seconds is None:
+            settle_seconds = getattr(settings, 'ROLLUP_REFRESH_SETTLE_SECONDS', 60)
+        return timezone.now() - timedelta(seconds=max(settle_seconds, 0))
+
+
+rollup_refresher = RollupRefresher()
@@ -1,3 +1,436 @@
-from django.test import TestCase
+import threading
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from analytics.models import HourlySalesSummary, RollupWatermark, SalesSummary
+from analytics.services.analytics_projector import analytics_projector
+from analytics.services.rollup_rebuilder import rollup_rebuilder
+from analytics.services.rollup_refresher import rollup_refresher
+from customers.models import Customer
+from inventory.models import CustomUnit, FinancialSummary, Product, ProductBatch, SizeInfo
+from sales.models import Transaction, TransactionOutbox
+from sales.services.checkout_service import checkout_service
+from sales.services.outbox_dispatcher import outbox_dispatcher
+from stores.business_date import business_date, business_hour, day_start
+from stores.management.bench import create_bench_store
+from stores.services.upsert import upsert_increment
+
+
+# Пишутся только при создании строки: инкрементально — по первой пачке продаж дня,
+# при пересчете — точно по всему дню, поэтому в сверке не участвуют
+INSERT_ONLY = {
+    'SizeAnalytics': ('products_count',),
+    'CategoryAnalytics': ('products_count', 'unique_products_sold'),
+}
+
+
+def snapshot(store):
+    """Содержимое всех сводок магазина без служебных полей: {модель: [строки]}"""
+    result = {}
+    for model, store_path in rollup_rebuilder.ANALYTICS_ROLLUPS + ((FinancialSummary, 'store_id'),):
+        fields = [
+            field.attname for field in model._meta.concrete_fields
+            if not field.primary_key and not getattr(field, 'auto_now', False)
+            and not getattr(field, 'auto_now_add', False)
+            and field.attname not in INSERT_ONLY.get(model.__name__, ())
+        ]
+        rows = model.objects.filter(**{store_path: store.pk}).values(*fields)
+        result[model.__name__] = sorted((tuple(sorted(row.items(), key=lambda kv: kv[0])) for row in rows), key=repr)
+    return result
+
+
+class FinancialSummaryMarginTests(TestCase):
+    """Маржа дневной сводки — по себестоимости списанных по FIFO партий"""
+
+    def setUp(self):
+        self.store, self.user, products = create_bench_store(
+            products=1, batches_per_product=2, batch_quantity=Decimal('2')
+        )
+        self.product = products[0]
+
+    def _sell(self, quantity):
+        total = self.product.sale_price * quantity
+        transaction = Transaction.objects.create(
+            store=self.store, cashier=self.user, total_amount=total,
+            payment_method='cash', cash_amount=total
+        )
+        checkout_service.checkout(transaction, [
+            {'product': self.product, 'quantity': quantity, 'price': self.product.sale_price}
+        ])
+        outbox_dispatcher.dispatch_all()
+        return transaction
+
+    def test_margin_uses_cost_of_written_off_batches(self):
+        # Партии по 2 шт.: 50.00 и 51.00 — продажа 3 шт. списывает 2 × 50 + 1 × 51,
+        # в журнале цена единицы 151 / 3 = 50.33 (до копеек)
+        self._sell(Decimal('3'))
+
+        summary = FinancialSummary.objects.get(store=self.store)
+        self.assertEqual(summary.grand_total, Decimal('300.00'))
+        self.assertEqual(summary.total_margin, Decimal('149.01'))
+        self.assertEqual(summary.margin_percentage, Decimal('49.67'))
+
+    def test_margin_accumulates_across_sales(self):
+        self._sell(Decimal('3'))
+        self._sell(Decimal('1'))  # последняя единица партии по 51.00
+
+        summary = FinancialSummary.objects.get(store=self.store)
+        self.assertEqual(summary.total_margin, Decimal('198.01'))
+        self.assertEqual(summary.margin_percentage, Decimal('49.50'))
+
+    def test_sale_without_purchase_price_counts_full_revenue(self):
+        ProductBatch.objects.filter(product=self.product).update(purchase_price=None)
+
+        self._sell(Decimal('1'))
+
+        summary = FinancialSummary.objects.get(store=self.store)
+        self.assertEqual(summary.total_margin, Decimal('100.00'))
+
+
+class RefundRollupTests(TestCase):
+    """Возврат убирает продажу из сводок так же, как пересчет дня"""
+
+    def setUp(self):
+        self.store, self.user, self.products = create_bench_store(
+            products=2, batches_per_product=1, batch_quantity=Decimal('20')
+        )
+        self.customer = Customer.objects.create(store=self.store, full_name='Refund customer')
+
+    def _sell(self, method, customer=None):
+        total = sum((product.sale_price for product in self.products), Decimal('0'))
+        transaction = Transaction.objects.create(
+            store=self.store, cashier=self.user, total_amount=total, payment_method=method,
+            cash_amount=total if method == 'cash' else total / 4 if method == 'hybrid' else 0,
+            card_amount=total if method == 'card' else total * 3 / 4 if method == 'hybrid' else 0,
+            customer=customer,
+        )
+        checkout_service.checkout(transaction, [
+            {'product': product, 'quantity': Decimal('1'), 'price': product.sale_price} for product in self.products
+        ])
+        outbox_dispatcher.dispatch_all()
+        return transaction
+
+    def _refund(self, transaction):
+        transaction.status = 'refunded'
+        transaction.save()
+        outbox_dispatcher.dispatch_all()
+
+    def test_refund_matches_rebuild(self):
+        self._sell('cash')
+        refunded = self._sell('hybrid', customer=self.customer)
+        self._sell('card', customer=self.customer)
+
+        self._refund(refunded)
+        live = snapshot(self.store)
+        rollup_rebuilder.rebuild_chunk(self.store.pk, business_date(), business_date())
+
+        self.assertEqual(snapshot(self.store), live)
+        summary = FinancialSummary.objects.get(store=self.store)
+        self.assertEqual(summary.total_transactions, 2)
+        self.assertEqual(summary.grand_total, Decimal('400.00'))
+
+    def test_refunded_sale_leaves_no_trace(self):
+        self._sell('cash', customer=self.customer)
+        before = snapshot(self.store)
+
+        self._refund(self._sell('hybrid', customer=self.customer))
+
+        self.assertEqual(snapshot(self.store), before)
+
+
+class UpsertConcurrencyTests(TransactionTestCase):
+    """Одновременные продажи: атомарный upsert сводок не теряет обновлений"""
+
+    THREADS = 8
+    ITERATIONS = 25
+    AMOUNT = Decimal('10.00')
+
+    def setUp(self):
+        self.store, _, _ = create_bench_store(products=0)
+        self.day = date(2000, 1, 1)
+
+    def _increment(self):
+        upsert_increment(
+            SalesSummary, ('store', 'date', 'payment_method'),
+            [{'store': self.store.pk, 'date': self.day, 'payment_method': 'cash',
+              'total_amount': self.AMOUNT, 'total_transactions': 1}],
+            increment=('total_amount', 'total_transactions')
+        )
+        upsert_increment(
+            FinancialSummary, ('date', 'store'),
+            [{'date': self.day, 'store': self.store.pk, 'cash_total': self.AMOUNT, 'grand_total': self.AMOUNT,
+              'total_transactions': 1, 'avg_transaction': self.AMOUNT}],
+            increment=('cash_total', 'grand_total', 'total_transactions'),
+            computed={
+                'avg_transaction': lambda new: f"{new('grand_total')} * 1.0 / NULLIF({new('total_transactions')}, 0)",
+            }
+        )
+
+    def test_parallel_upserts_lose_no_updates(self):
+        errors = []
+        barrier = threading.Barrier(self.THREADS)
+
+        def worker():
+            try:
+                barrier.wait()
+                for _ in range(self.ITERATIONS):
+                    self._increment()
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+            finally:
+                connection.close()
+
+        pool = [threading.Thread(target=worker) for _ in range(self.THREADS)]
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+
+        expected = self.THREADS * self.ITERATIONS
+        self.assertEqual(errors, [])
+        summary = SalesSummary.objects.get(store=self.store, date=self.day, payment_method='cash')
+        self.assertEqual(summary.total_transactions, expected)
+        self.assertEqual(summary.total_amount, self.AMOUNT * expected)
+        financial = FinancialSummary.objects.get(store=self.store, date=self.day)
+        self.assertEqual(financial.total_transactions, expected)
+        self.assertEqual(financial.cash_total, self.AMOUNT * expected)
+        self.assertEqual(financial.avg_transaction, self.AMOUNT)
+
+
+class HourlySalesSummaryTests(TestCase):
+    """Почасовая сводка продаж совпадает с продажами и читается одним запросом"""
+
+    SALES = 60
+
+    def setUp(self):
+        self.store, self.user, products = create_bench_store(
+            products=1, batches_per_product=1, batch_quantity=Decimal(self.SALES + 1)
+        )
+        product = products[0]
+        self.today = business_date()
+        methods = ('cash', 'card', 'transfer')
+        for index in range(self.SALES):
+            transaction = Transaction.objects.create(
+                store=self.store, cashier=self.user, total_amount=product.sale_price,
+                payment_method=methods[index % len(methods)]
+            )
+            checkout_service.checkout(
+                transaction, [{'product': product, 'quantity': Decimal('1'), 'price': product.sale_price}]
+            )
+            # Разносим продажи по часам бизнес-дня и по дням недели
+            day = self.today - timedelta(days=index % 7)
+            Transaction.objects.filter(pk=transaction.pk).update(
+                business_date=day, created_at=day_start(day) + timedelta(hours=index % 24, minutes=30)
+            )
+        outbox_dispatcher.dispatch_all()
+        self.date_from = self.today - timedelta(days=6)
+
+    def _expected_pattern(self):
+        """Эталон: продажи по часам бизнес-дня, посчитанные по строкам продаж в Python"""
+        hours = defaultdict(lambda: {'count': 0, 'total': Decimal('0')})
+        for transaction in Transaction.objects.filter(
+            store=self.store, status='completed', business_date__gte=self.date_from
+        ):
+            row = hours[business_hour(transaction.created_at)]
+            row['count'] += 1
+            row['total'] += transaction.total_amount
+        return [{'hour': hour, **hours[hour]} for hour in sorted(hours)]
+
+    def test_pattern_matches_sales(self):
+        with self.assertNumQueries(1):
+            pattern = list(HourlySalesSummary.objects.pattern(self.store, self.date_from))
+        self.assertEqual(pattern, self._expected_pattern())
+
+    def test_reapplying_projections_does_not_double(self):
+        analytics_projector.apply(Transaction.objects.filter(store=self.store))
+
+        self.assertEqual(
+            list(HourlySalesSummary.objects.pattern(self.store, self.date_from)), self._expected_pattern()
+        )
+
+
+class RollupRefreshTests(TestCase):
+    """refresh_rollups догоняет потерянные проекции и завершение в обход сигналов, не трогая учтённое"""
+
+    SALES = 30
+    DAYS = 5
+
+    def setUp(self):
+        self.store, self.user, self.products = create_bench_store(
+            products=3, batches_per_product=1, batch_quantity=Decimal('1000')
+        )
+        self.customer = Customer.objects.create(store=self.store, full_name='Refresh customer')
+        self.today = business_date()
+        for index in range(self.SALES):
+            self._sell(index)
+        outbox_dispatcher.dispatch_all()
+
+    def _sell(self, index, complete=True, backdate=True):
+        basket = self.products[:index % len(self.products) + 1]
+        transaction = Transaction.objects.create(
+            store=self.store, cashier=self.user, payment_method='cash',
+            total_amount=sum((product.sale_price for product in basket), Decimal('0')),
+            customer=self.customer if index % 3 == 0 else None,
+        )
+        if complete:
+            checkout_service.checkout(transaction, [
+                {'product': product, 'quantity': Decimal('1'), 'price': product.sale_price} for product in basket
+            ])
+        if backdate:
+            # Прошлые дни: продажа «из будущего» ждала бы задержки settle;
+            # update() не трогает updated_at — перенос дат не изменение продажи
+            day = self.today - timedelta(days=index % self.DAYS + 1)
+            Transaction.objects.filter(pk=transaction.pk).update(
+                business_date=day, created_at=day_start(day) + timedelta(hours=index % 24)
+            )
+        return transaction
+
+    def _refresh(self):
+        result = rollup_refresher.refresh(store_ids=[self.store.pk], settle_seconds=0).get(self.store.pk)
+        self.assertIsNotNone(result)
+        last = Transaction.objects.filter(store=self.store).order_by('-pk').first()
+        self.assertEqual(RollupWatermark.objects.get(store=self.store).last_transaction_id, last.pk)
+        return result
+
+    def test_applied_history_is_not_reapplied(self):
+        before = snapshot(self.store)
+
+        result = self._refresh()
+
+        self.assertEqual(result['transactions'], self.SALES)
+        self.assertEqual(result['applied'], 0)
+        self.assertEqual(snapshot(self.store), before)
+
+    def test_lost_projections_are_caught_up(self):
+        self._refresh()
+        lost = [self._sell(self.SALES + index) for index in range(10)]
+        TransactionOutbox.objects.filter(transaction__in=lost).update(processed_at=timezone.now())
+        bypassed = self._sell(self.SALES + len(lost), complete=False)
+        Transaction.objects.filter(pk=bypassed.pk).update(status='completed', updated_at=timezone.now())
+        refunded = Transaction.objects.filter(store=self.store, status='completed').order_by('pk').first()
+        refunded.status = 'refunded'
+        refunded.save()
+        outbox_dispatcher.dispatch_all()
+        drifted = snapshot(self.store)
+
+        result = self._refresh()
+
+        # Дни измененных продаж пересчитываются целиком, остальные продажи догоняются проекциями
+        self.assertGreater(result['days'], 0)
+        self.assertGreater(result['applied'], 0)
+        completed = Transaction.objects.filter(store=self.store, status='completed')
+        for projection in analytics_projector.ALL_PROJECTIONS:
+            self.assertFalse(completed.exclude(projection_ledger__projection=projection).exists(), projection)
+        refreshed = snapshot(self.store)
+        self.assertNotEqual(refreshed, drifted)
+        rollup_rebuilder.rebuild(self.store.pk, self.today - timedelta(days=self.DAYS), self.today)
+        self.assertEqual(snapshot(self.store), refreshed)
+
+    def test_idle_run_does_not_depend_on_history(self):
+        self._refresh()
+
+        with self.assertNumQueries(2):
+            active = rollup_refresher.refresh(settle_seconds=0)
+
+        self.assertNotIn(self.store.pk, active)
+
+    def test_young_sales_wait_for_settle(self):
+        self._refresh()
+        self._sell(0, backdate=False)
+
+        self.assertNotIn(self.store.pk, rollup_refresher.refresh(store_ids=[self.store.pk], settle_seconds=60))
+
+
+class RollupRebuildTests(TestCase):
+    """Пересчет сводок из продаж совпадает с инкрементальными проекциями"""
+
+    SALES = 40
+    DAYS = 5
+    METHODS = ('cash', 'card', 'transfer', 'hybrid')
+
+    def setUp(self):
+        self.store, self.user, products = create_bench_store(
+            products=4, batches_per_product=1, batch_quantity=Decimal('1000')
+        )
+        # Товар с размером и товар с собственной единицей измерения
+        size = SizeInfo.objects.create(store=self.store, size='DN15', dimension1=Decimal('15'))
+        unit = CustomUnit.objects.create(store=self.store, name='Рулон', short_name='рул')
+        Product.objects.filter(pk=products[0].pk).update(has_sizes=True, default_size=size)
+        Product.objects.filter(pk=products[1].pk).update(custom_unit=unit, unit_type=None)
+        self.products = list(Product.objects.filter(pk__in=[product.pk for product in products]).order_by('pk'))
+        customer = Customer.objects.create(store=self.store, full_name='Rebuild customer')
+
+        self.today = business_date()
+        for index in range(self.SALES):
+            self._sell(index, customer if index % 3 == 0 else None)
+        outbox_dispatcher.dispatch_all()
+        self.date_from = self.today - timedelta(days=self.DAYS - 1)
+
+    def _sell(self, index, customer=None):
+        basket = self.products[:index % len(self.products) + 1]
+        quantity = Decimal(index % 3 + 1)
+        total = sum((product.sale_price * quantity for product in basket), Decimal('0'))
+        method = self.METHODS[index % len(self.METHODS)]
+        # Гибридная оплата делится неровно: товары раскладываются по частям с округлением
+        cash = (total / 3).quantize(Decimal('0.01')) if method == 'hybrid' else total if method == 'cash' else 0
+        transaction = Transaction.objects.create(
+            store=self.store, cashier=self.user, total_amount=total, payment_method=method,
+            cash_amount=cash,
+            card_amount=total - cash if method == 'hybrid' else total if method == 'card' else 0,
+            transfer_amount=total if method == 'transfer' else 0,
+            customer=customer,
+        )
+        checkout_service.checkout(transaction, [
+            {'product': product, 'quantity': quantity, 'price': product.sale_price} for product in basket
+        ])
+        day = self.today - timedelta(days=index % self.DAYS)
+        Transaction.objects.filter(pk=transaction.pk).update(
+            business_date=day, created_at=day_start(day) + timedelta(hours=index % 24)
+        )
+
+    def test_rebuild_matches_incremental_rollups(self):
+        incremental = snapshot(self.store)
+        # Порча сводок: пересчет не должен зависеть от прежнего состояния
+        tomorrow = self.today + timedelta(days=1)
+        SalesSummary.objects.filter(store=self.store).update(total_amount=0)
+        FinancialSummary.objects.filter(store=self.store, date=self.today).delete()
+        FinancialSummary.objects.create(store=self.store, date=tomorrow, grand_total=1, total_transactions=1)
+
+        result = rollup_rebuilder.rebuild(self.store.pk, self.date_from, tomorrow)
+
+        self.assertEqual(result, {'chunks': self.DAYS + 1, 'transactions': self.SALES})
+        stray = FinancialSummary.objects.get(store=self.store, date=tomorrow)
+        self.assertEqual((stray.total_transactions, stray.grand_total), (0, 0))
+        stray.delete()
+        rebuilt = snapshot(self.store)
+        for name, rows in incremental.items():
+            with self.subTest(rollup=name):
+                self.assertTrue(rows)
+                self.assertEqual(rebuilt[name], rows)
+
+    def test_rebuild_is_repeatable(self):
+        rollup_rebuilder.rebuild(self.store.pk, self.date_from, self.today)
+        rebuilt = snapshot(self.store)
+
+        rollup_rebuilder.rebuild(self.store.pk, self.date_from, self.today)
+
+        self.assertEqual(snapshot(self.store), rebuilt)
+
+    def test_chunk_queries_do_not_depend_on_sales(self):
+        def chunk_queries():
+            with CaptureQueriesContext(connection) as queries:
+                rollup_rebuilder.rebuild_chunk(self.store.pk, self.today, self.today)
+            return len(queries)
+
+        before = chunk_queries()
+        for index in range(0, self.SALES, self.DAYS):
+            self._sell(index)
+        outbox_dispatcher.dispatch_all()
+
+        self.assertEqual(chunk_queries(), before)
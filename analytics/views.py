@@ -23,6 +23,7 @@ from .pagination import OptionalPagination
 
 from inventory.models import ProductBatch
 from stores.mixins import StoreViewSetMixin  # ← ДОБАВЛЯЕМ МИКСИН
+from stores.business_date import business_date, range_lookups
 import logging
 
 logger = logging.getLogger(__name__)
@@ -168,7 +169,7 @@ class SupplierAnalyticsViewSet(StoreViewSetMixin, viewsets.ReadOnlyModelViewSet)
 
         limit = int(request.query_params.get('limit', 10))
         start_date = request.query_params.get('start_date')
-        end_date = request.query_params.get('end_date', timezone.now().date())
+        end_date = request.query_params.get('end_date', business_date())
         metric = request.query_params.get('metric', 'revenue')  # Сортировка по revenue/margin/turnover
 
         # Если модель не persistent, агрегируем из StockHistory
@@ -293,7 +294,7 @@ class SalesAnalyticsViewSet(StoreViewSetMixin, viewsets.ReadOnlyModelViewSet):
             }, status=400)
 
         start_date = request.query_params.get('start_date')
-        end_date = request.query_params.get('end_date', timezone.now().date())
+        end_date = request.query_params.get('end_date', business_date())
         cashier_id = request.query_params.get('cashier')
 
         # Парсинг дат
@@ -301,7 +302,7 @@ class SalesAnalyticsViewSet(StoreViewSetMixin, viewsets.ReadOnlyModelViewSet):
             try:
                 end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
             except ValueError:
-                end_date = timezone.now().date()
+                end_date = business_date()
 
         if start_date:
             try:
@@ -352,10 +353,7 @@ class SalesAnalyticsViewSet(StoreViewSetMixin, viewsets.ReadOnlyModelViewSet):
             purchase_price__isnull=False
         )
 
-        if start_date:
-            purchase_qs = purchase_qs.filter(created_at__date__gte=start_date)
-        if end_date:
-            purchase_qs = purchase_qs.filter(created_at__date__lte=end_date)
+        purchase_qs = purchase_qs.filter(**range_lookups('created_at', start_date, end_date))
 
         # Правильный расчет суммы закупок
         total_purchase_cost = Decimal('0.00')
@@ -429,7 +427,7 @@ class SalesAnalyticsViewSet(StoreViewSetMixin, viewsets.ReadOnlyModelViewSet):
             return Response({'error': 'Магазин не определен'}, status=400)
 
         start_date = request.query_params.get('start_date')
-        end_date = request.query_params.get('end_date', timezone.now().date())
+        end_date = request.query_params.get('end_date', business_date())
         product_id = request.query_params.get('product_id')
 
         # Парсинг дат
@@ -437,7 +435,7 @@ class SalesAnalyticsViewSet(StoreViewSetMixin, viewsets.ReadOnlyModelViewSet):
             try:
                 end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
             except ValueError:
-                end_date = timezone.now().date()
+                end_date = business_date()
 
         if start_date:
             try:
@@ -452,10 +450,7 @@ class SalesAnalyticsViewSet(StoreViewSetMixin, viewsets.ReadOnlyModelViewSet):
         )
 
         # Остальные фильтры
-        if start_date:
-            batches_qs = batches_qs.filter(created_at__date__gte=start_date)
-        if end_date:
-            batches_qs = batches_qs.filter(created_at__date__lte=end_date)
+        batches_qs = batches_qs.filter(**range_lookups('created_at', start_date, end_date))
         if product_id:
             try:
                 batches_qs = batches_qs.filter(product_id=int(product_id))
@@ -514,7 +509,7 @@ class SalesAnalyticsViewSet(StoreViewSetMixin, viewsets.ReadOnlyModelViewSet):
             return Response({'error': 'Магазин не определен'}, status=400)
 
         start_date = request.query_params.get('start_date')
-        end_date = request.query_params.get('end_date', timezone.now().date())
+        end_date = request.query_params.get('end_date', business_date())
         cashier_id = request.query_params.get('cashier')
 
         # ФИЛЬТРУЕМ ПО МАГАЗИНУ
@@ -590,7 +585,7 @@ class ProductAnalyticsViewSet(StoreViewSetMixin, viewsets.ReadOnlyModelViewSet):
 
         limit = int(request.query_params.get('limit', 10))
         start_date = request.query_params.get('start_date')
-        end_date = request.query_params.get('end_date', datetime.today().date())
+        end_date = request.query_params.get('end_date', business_date())
 
         # ФИЛЬТРУЕМ ПО ТОВАРАМ ТЕКУЩЕГО МАГАЗИНА
         queryset = ProductAnalytics.objects.filter(
@@ -646,7 +641,7 @@ class CustomerAnalyticsViewSet(StoreViewSetMixin, viewsets.ReadOnlyModelViewSet)
 
         limit = int(request.query_params.get('limit', 10))
         start_date = request.query_params.get('start_date')
-        end_date = request.query_params.get('end_date', datetime.today().date())
+        end_date = request.query_params.get('end_date', business_date())
 
         # ФИЛЬТРУЕМ ПО КЛИЕНТАМ ТЕКУЩЕГО МАГАЗИНА
         queryset = CustomerAnalytics.objects.filter(
@@ -695,7 +690,7 @@ class TransactionsHistoryByDayView(StoreViewSetMixin, APIView):  # ← ДОБА
                 # ФИЛЬТРУЕМ ПО МАГАЗИНУ
                 transactions = TransactionHistory.objects.filter(
                     store=current_store,  # ← ФИЛЬТР ПО МАГАЗИНУ
-                    created_at__date=date
+                    **range_lookups('created_at', date, date)
                 ).all()
 
                 transactions = FilteredTransactionHistorySerializer(transactions, many=True).data
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-16 19:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0001_initial'),
+        ('stores', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['store', 'debt'], name='customers_c_store_i_2a95bc_idx'),
+        ),
+    ]
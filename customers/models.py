@@ -22,6 +22,10 @@ class Customer(StoreOwnedModel):
         verbose_name = "Покупатель"
         verbose_name_plural = "Покупатели"
         unique_together = ['store', 'phone']
+        indexes = [
+            models.Index(fields=['store', 'debt']),  # Должники магазина по сумме долга
+            models.Index(fields=['store', 'created_at', 'id']),  # Keyset-пагинация клиентов магазина
+        ]
 
     def __str__(self):
         return self.full_name or self.phone or self.email or "Анонимный покупатель"
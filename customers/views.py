@@ -10,6 +10,8 @@ from drf_yasg import openapi
 from .serializers import CustomerSerializer
 from .models import Customer
 from stores.mixins import StoreViewSetMixin
+from stores.business_date import business_date, range_lookups
+from stores.pagination import KeysetPagination, KEYSET_QUERY_PARAMETERS
 
 class FlexiblePagination(pagination.PageNumberPagination):
     page_size_query_param = "page_size"
@@ -79,7 +81,7 @@ class FlexiblePagination(pagination.PageNumberPagination):
 
 class CustomerViewSet(StoreViewSetMixin, viewsets.ModelViewSet):
     serializer_class = CustomerSerializer
-    pagination_class = FlexiblePagination
+    pagination_class = KeysetPagination  # новые клиенты сверху, страница не больше max_page_size
     queryset = Customer.objects.all()  # ← ДОБАВЛЯЕМ базовый queryset
 
     def get_queryset(self):
@@ -126,10 +128,8 @@ class CustomerViewSet(StoreViewSetMixin, viewsets.ModelViewSet):
             queryset = queryset.filter(filters)
 
         # Фильтр по дате последней покупки
-        if date_from:
-            queryset = queryset.filter(annotated_last_purchase_date__date__gte=date_from)
-        if date_to:
-            queryset = queryset.filter(annotated_last_purchase_date__date__lte=date_to)
+        if date_from or date_to:
+            queryset = queryset.filter(**range_lookups('annotated_last_purchase_date', date_from, date_to))
 
         # Фильтр по наличию долга
         if has_debt == 'true':
@@ -178,22 +178,7 @@ class CustomerViewSet(StoreViewSetMixin, viewsets.ModelViewSet):
                 type=openapi.TYPE_STRING,
                 format='date'
             ),
-            openapi.Parameter(
-                'page', openapi.IN_QUERY,
-                description="Номер страницы или 'all' для всех записей",
-                type=openapi.TYPE_STRING
-            ),
-            openapi.Parameter(
-                'limit', openapi.IN_QUERY,
-                description="Количество записей (для offset/limit пагинации)",
-                type=openapi.TYPE_INTEGER
-            ),
-            openapi.Parameter(
-                'offset', openapi.IN_QUERY,
-                description="Смещение записей (для offset/limit пагинации)",
-                type=openapi.TYPE_INTEGER
-            )
-        ],
+        ] + KEYSET_QUERY_PARAMETERS,
         responses={200: CustomerSerializer(many=True)}
     )
     def list(self, request, *args, **kwargs):
@@ -354,15 +339,15 @@ class CustomerViewSet(StoreViewSetMixin, viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def recent_active(self, request):
         """Получить недавно активных клиентов"""
-        from datetime import datetime, timedelta
+        from datetime import timedelta
 
         days = int(request.query_params.get('days', 30))
         limit = int(request.query_params.get('limit', 20))
 
-        since_date = datetime.now().date() - timedelta(days=days)
+        since_date = business_date() - timedelta(days=days)
 
         queryset = self.get_queryset().filter(
-            purchases__created_at__date__gte=since_date,
+            purchases__business_date__gte=since_date,
             purchases__status='completed'
         ).distinct().order_by('-purchases__created_at')[:limit]
 
@@ -141,8 +141,11 @@ class ProductBatchAdmin(admin.ModelAdmin):
 
     def delete_expired_batches(self, request, queryset):
         expired = queryset.filter(expiration_date__lt=timezone.now().date())
+        from inventory.services.price_stats import price_stats
+
         count = expired.count()
-        expired.delete()
+        with price_stats.deferred():
+            expired.delete()
         self.message_user(request, f'Удалено {count} истёкших партий.')
     delete_expired_batches.short_description = 'Удалить истёкшие партии'
 
@@ -0,0 +1,68 @@
+# inventory/management/commands/benchmark_barcode_allocator.py
+import random
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory.models import Product
+from inventory.services.barcode_allocator import barcode_allocator, ean13_checksum
+from stores.management.bench import rollback_after, measure, create_bench_store
+
+
+def legacy_generate_unique_barcode():
+    """Эталон: прежний Product.generate_unique_barcode — случайный код и exists() на каждую попытку"""
+    for _ in range(100):
+        code = str(int(time.time()))[-6:] + str(random.randint(100000, 999999))
+        full_ean = code + ean13_checksum(code)
+        if not Product.objects.filter(barcode=full_ean).exists():
+            return full_ean
+    data12 = str(uuid.uuid4().int)[:12]
+    return data12 + ean13_checksum(data12)
+
+
+class Command(BaseCommand):
+    help = 'Замер выдачи штрих-кодов: случайный код с проверкой против блочного счетчика магазина'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000, help='Сколько товаров создать')
+
+    def handle(self, *args, **options):
+        count = max(options['products'], 1)
+
+        self.stdout.write(self.style.SUCCESS('=== БЕНЧМАРК ВЫДАЧИ ШТРИХ-КОДОВ ==='))
+
+        with rollback_after():
+            store, _, _ = create_bench_store(products=0)
+            category = store.productcategory_set.first()
+
+            def new_products():
+                return [
+                    Product(store=store, category=category, name=f'Bench {index}',
+                            unit_type='piece', sale_price=Decimal('10.00'))
+                    for index in range(count)
+                ]
+
+            legacy, legacy_queries, legacy_ms = measure(
+                lambda: [legacy_generate_unique_barcode() for _ in range(count)]
+            )
+            allocated, single_queries, single_ms = measure(
+                lambda: [barcode_allocator.allocate(store)[0] for _ in range(count)]
+            )
+            products, bulk_queries, bulk_ms = measure(lambda: barcode_allocator.assign(new_products()))
+            Product.objects.bulk_create(products, batch_size=1000)
+
+            codes = allocated + [product.barcode for product in products]
+            if len(set(codes)) != len(codes):
+                raise CommandError('❌ Выданы повторяющиеся штрих-коды')
+            if any(code[-1] != ean13_checksum(code[:12]) for code in codes):
+                raise CommandError('❌ Неверная контрольная цифра EAN-13')
+
+        self.stdout.write(f"{'способ':<28} | {'запросов':>8} | {'мс':>8}")
+        self.stdout.write(f"{'случайный код + exists()':<28} | {legacy_queries:>8} | {legacy_ms:>8.1f}")
+        self.stdout.write(f"{'счетчик, по одному коду':<28} | {single_queries:>8} | {single_ms:>8.1f}")
+        self.stdout.write(f"{'счетчик, assign() для bulk':<28} | {bulk_queries:>8} | {bulk_ms:>8.1f}")
+        self.stdout.write(self.style.SUCCESS(
+            f'\n✅ {len(codes)} кодов уникальны, контрольные цифры верны; тестовые данные откатены'
+        ))
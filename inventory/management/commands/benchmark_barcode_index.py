@@ -0,0 +1,79 @@
+# inventory/management/commands/benchmark_barcode_index.py
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory.models import Product
+from inventory.serializers import ProductSerializer
+from inventory.services.barcode_index import barcode_index
+from stores.management.bench import rollback_after, measure, create_bench_store
+
+
+def legacy_scan(store, barcode):
+    """Эталон: прежний scan_barcode — запрос товара, полный ProductSerializer, count() при промахе"""
+    product = Product.objects.filter(store=store, barcode=barcode).select_related('category', 'stock').first()
+    if not product:
+        Product.objects.filter(barcode=barcode).exclude(store=store).count()
+        Product.objects.filter(barcode=barcode).count()
+        return None
+    return ProductSerializer(product).data
+
+
+class Command(BaseCommand):
+    help = 'Микробенчмарк сканирования штрих-кода: запрос + сериализатор против индекса в памяти'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=500, help='Товаров в магазине')
+        parser.add_argument('--lookups', type=int, default=2000, help='Сканирований в замере')
+        parser.add_argument('--miss-ratio', type=float, default=0.1, help='Доля неизвестных кодов')
+
+    def handle(self, *args, **options):
+        lookups = max(options['lookups'], 1)
+        rng = random.Random(42)
+
+        self.stdout.write(self.style.SUCCESS('=== БЕНЧМАРК ИНДЕКСА ШТРИХ-КОДОВ ==='))
+
+        with rollback_after():
+            store, _, products = create_bench_store(products=options['products'], batches_per_product=1)
+            for index, product in enumerate(products):
+                product.barcode = f'bench{index:08d}'
+            Product.objects.bulk_update(products, ['barcode'])
+
+            codes = [
+                f'unknown{index}' if rng.random() < options['miss_ratio']
+                else products[rng.randrange(len(products))].barcode
+                for index in range(lookups)
+            ]
+
+            barcode_index.clear()
+            legacy_sample = codes[:min(lookups, 200)]
+            _, legacy_queries, legacy_ms = measure(lambda: [legacy_scan(store, code) for code in legacy_sample])
+
+            _, cold_queries, cold_ms = measure(lambda: [barcode_index.lookup(store, code) for code in codes])
+            started = time.perf_counter()
+            _, warm_queries, _ = measure(lambda: [barcode_index.lookup(store, code) for code in codes])
+            warm_ms = (time.perf_counter() - started) * 1000
+
+            # Карточка должна сбрасываться при изменении товара
+            product = products[0]
+            product.sale_price = Decimal('777.00')
+            product.save()
+            if barcode_index.lookup(store, product.barcode)['sale_price'] != 777.0:
+                raise CommandError('❌ Индекс не сброшен после изменения товара')
+            stats = barcode_index.stats()
+            barcode_index.clear()
+
+        self.stdout.write(
+            f"прежний путь:     {legacy_ms / len(legacy_sample) * 1000:>9.1f} мкс/скан, "
+            f"запросов {legacy_queries / len(legacy_sample):.2f}/скан"
+        )
+        self.stdout.write(
+            f"индекс (холодный): {cold_ms / lookups * 1000:>8.1f} мкс/скан, запросов {cold_queries}"
+        )
+        self.stdout.write(
+            f"индекс (прогретый): {warm_ms / lookups * 1000:>7.1f} мкс/скан, запросов {warm_queries}"
+        )
+        self.stdout.write(f"📊 Записей: {stats['entries']}, попаданий: {stats['hits']}, промахов: {stats['misses']}")
+        self.stdout.write(self.style.SUCCESS('\n✅ Замер завершен, тестовые данные откатены'))
@@ -0,0 +1,58 @@
+# inventory/management/commands/benchmark_label_sheet.py
+import shutil
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from inventory.services.barcode_allocator import ean13
+from inventory.services.label_renderer import LabelRenderer
+
+
+class Command(BaseCommand):
+    help = 'Замер печати листа этикеток: холодный кэш (последовательно и в пуле) и прогретый'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--labels', type=int, default=2000, help='Этикеток в тираже')
+        parser.add_argument('--template', default='shelf', help='Шаблон этикетки')
+
+    def handle(self, *args, **options):
+        count = max(options['labels'], 1)
+        template_name = options['template']
+        items = [
+            {'name': f'Товар {index}', 'barcode': ean13(99999, index), 'price': 12500 + index, 'unit': 'шт'}
+            for index in range(count)
+        ]
+
+        self.stdout.write(self.style.SUCCESS(f'=== БЕНЧМАРК ЛИСТА ЭТИКЕТОК ({count} шт.) ==='))
+
+        results = []
+        cache_dir = tempfile.mkdtemp(prefix='label_bench_')
+        try:
+            for title, processes in (('холодный кэш, 1 процесс', 1), ('холодный кэш, пул', None)):
+                shutil.rmtree(cache_dir, ignore_errors=True)
+                settings_override = {'LABEL_CACHE_DIR': cache_dir}
+                if processes:
+                    settings_override['LABEL_RENDER_PROCESSES'] = processes
+                with override_settings(**settings_override):
+                    results.append((title, self._render(LabelRenderer(), items, template_name)))
+
+            with override_settings(LABEL_CACHE_DIR=cache_dir):
+                results.append(('кэш на диске', self._render(LabelRenderer(), items, template_name)))
+                renderer = LabelRenderer()
+                renderer.barcode_images([item['barcode'] for item in items], template_name)
+                results.append(('кэш в памяти', self._render(renderer, items, template_name)))
+        finally:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+        self.stdout.write(f"{'режим':<26} | {'страниц':>7} | {'размер, КБ':>10} | {'сек':>6}")
+        for title, (pages, size, seconds) in results:
+            self.stdout.write(f"{title:<26} | {pages:>7} | {size / 1024:>10.0f} | {seconds:>6.2f}")
+        self.stdout.write(self.style.SUCCESS('\n✅ Замер завершен'))
+
+    def _render(self, renderer, items, template_name):
+        started = time.perf_counter()
+        output, pages = renderer.render_pdf(items, template_name)
+        size = len(output.read())
+        return pages, size, time.perf_counter() - started
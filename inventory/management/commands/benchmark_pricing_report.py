@@ -0,0 +1,125 @@
+# inventory/management/commands/benchmark_pricing_report.py
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db.models import F, Min
+
+from inventory.models import Product, ProductBatch
+from inventory.services.price_stats import price_stats
+from stores.management.bench import rollback_after, measure, create_bench_store
+
+
+def legacy_pricing_report(store):
+    """
+    Эталон: прежний отчет StoreViewSet.pricing_report — цикл по товарам
+    с запросами к партиям на каждый товар и сортировкой в Python
+    """
+    analysis = []
+    for product in Product.objects.filter(store=store).select_related('store'):
+        batches = product.batches.filter(quantity__gt=0, purchase_price__isnull=False)
+        if not batches.exists():
+            continue
+        cost = sum((batch.purchase_price * batch.quantity for batch in batches), Decimal('0'))
+        quantity = sum((batch.quantity for batch in batches), Decimal('0'))
+        avg_purchase = cost / quantity
+
+        base_price = batches.aggregate(min_price=Min('purchase_price'))['min_price']
+        if not base_price:
+            last_batch = product.batches.filter(purchase_price__isnull=False).order_by('-created_at').first()
+            base_price = last_batch.purchase_price if last_batch else Decimal('0')
+
+        margin = ((product.sale_price - avg_purchase) / avg_purchase) * 100
+        analysis.append({
+            'product_id': product.id,
+            'min_sale_price': base_price * (1 + store.min_markup_percent / 100),
+            'current_margin': round(margin, 2),
+            'meets_min_markup': margin >= store.min_markup_percent,
+        })
+    analysis.sort(key=lambda row: row['current_margin'])
+    return analysis
+
+
+def annotated_pricing_report(store):
+    """Новый отчет: аннотации with_price_stats() + оконная сводка, один запрос"""
+    return list(
+        Product.objects.filter(store=store)
+        .with_price_stats()
+        .with_price_summary()
+        .order_by(F('margin_percent').asc(nulls_last=True), 'pk')[:20]
+    )
+
+
+class Command(BaseCommand):
+    help = 'Замер отчета по ценообразованию: цикл по товарам против аннотаций with_price_stats()'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--skus', type=str, default='1000,5000,20000', help='Число товаров через запятую')
+        parser.add_argument(
+            '--legacy-max', type=int, default=5000,
+            help='Прежний отчет замеряется только до этого числа товаров'
+        )
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['skus'].split(',') if size.strip())
+
+        self.stdout.write(self.style.SUCCESS('=== БЕНЧМАРК ОТЧЕТА ПО ЦЕНООБРАЗОВАНИЮ ==='))
+        self.stdout.write(
+            f"{'товаров':>8} | {'цикл: запр.':>11} | {'мс':>9} | {'SQL: запр.':>10} | {'мс':>7}"
+        )
+
+        with rollback_after():
+            store, user, _ = create_bench_store(products=0)
+            store.min_markup_percent = Decimal('20')
+            store.save(update_fields=['min_markup_percent'])
+            category = store.productcategory_set.first()
+            created = 0
+
+            for size in sizes:
+                self._create_products(store, category, created, size - created)
+                created = size
+
+                if size <= options['legacy_max']:
+                    _, legacy_queries, legacy_ms = measure(legacy_pricing_report, store)
+                    legacy = f"{legacy_queries:>11} | {legacy_ms:>9.1f}"
+                else:
+                    legacy = f"{'—':>11} | {'—':>9}"
+                _, queries, ms = measure(annotated_pricing_report, store)
+
+                self.stdout.write(f"{size:>8} | {legacy} | {queries:>10} | {ms:>7.1f}")
+
+        self.stdout.write(self.style.SUCCESS('\n✅ Замер завершен, тестовые данные откатены'))
+
+    def _create_products(self, store, category, start, count):
+        """Товары и по две партии на каждый — bulk_create, кэш цен одним пересчетом"""
+        if count <= 0:
+            return
+        suffix = uuid.uuid4().hex[:6]
+        products = Product.objects.bulk_create(
+            [
+                Product(
+                    store=store,
+                    category=category,
+                    name=f'Bench product {start + index}',
+                    barcode=f'bench-{suffix}-{index}',
+                    unit_type='piece',
+                    sale_price=Decimal('55.00') + (start + index) % 20
+                )
+                for index in range(count)
+            ],
+            batch_size=1000
+        )
+        ProductBatch.objects.bulk_create(
+            [
+                ProductBatch(
+                    store=store,
+                    product=product,
+                    quantity=Decimal('10'),
+                    purchase_price=Decimal('50.00') + offset
+                )
+                for product in products
+                for offset in range(2)
+            ],
+            batch_size=1000
+        )
+        price_stats.rebuild(Product.all_objects.filter(pk__in=[product.pk for product in products]))
@@ -0,0 +1,31 @@
+# inventory/management/commands/rebuild_price_stats.py
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from inventory.models import Product
+from inventory.services.price_stats import price_stats
+from stores.models import Store
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает кэш закупочных цен товаров (средняя/мин./последняя цена, число партий)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--store-id', type=str, help='ID магазина (по умолчанию — все)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Товаров в одном пересчете')
+
+    def handle(self, *args, **options):
+        queryset = Product.all_objects.all()
+        if options.get('store_id'):
+            try:
+                store = Store.objects.get(id=options['store_id'])
+            except (Store.DoesNotExist, ValueError):
+                raise CommandError(f"Магазин {options['store_id']} не найден")
+            queryset = queryset.filter(store=store)
+
+        with transaction.atomic():
+            total, changed = price_stats.rebuild(queryset, batch_size=max(options['batch_size'], 1))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ Кэш цен пересчитан: товаров {total}, исправлено {changed}'
+        ))
@@ -0,0 +1,52 @@
+# inventory/management/commands/reconcile_stock.py
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from inventory.services.stock_ledger import stock_ledger
+from stores.models import Store
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает остатки (Stock.quantity) из журнала движений StockHistory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--store-id', type=str, help='ID магазина (по умолчанию — все)')
+        parser.add_argument('--execute', action='store_true', help='Записать изменения')
+        parser.add_argument(
+            '--opening-balance', action='store_true',
+            help='Не менять остатки, а записать в журнал входящие корректировки '
+                 '(однократно, при переходе на журнал)'
+        )
+        parser.add_argument('--verbose', action='store_true', help='Подробный вывод')
+
+    def handle(self, *args, **options):
+        execute = options['execute']
+        store = None
+        if options.get('store_id'):
+            try:
+                store = Store.objects.get(id=options['store_id'])
+            except (Store.DoesNotExist, ValueError):
+                raise CommandError(f"Магазин {options['store_id']} не найден")
+
+        if not execute:
+            self.stdout.write(self.style.WARNING('🔍 РЕЖИМ ПРОСМОТРА. Добавьте --execute для выполнения'))
+
+        with transaction.atomic():
+            if options['opening_balance']:
+                mismatched = stock_ledger.open_balances(store=store, execute=execute)
+            else:
+                mismatched = stock_ledger.reconcile(store=store, execute=execute)
+
+        if options['verbose']:
+            for stock, expected in mismatched:
+                self.stdout.write(
+                    f"   📦 товар {stock.product_id}: остаток {stock.quantity}, по журналу {expected}"
+                )
+
+        if not mismatched:
+            self.stdout.write(self.style.SUCCESS('✅ Остатки совпадают с журналом'))
+        elif execute:
+            action = 'Записано входящих остатков' if options['opening_balance'] else 'Пересчитано остатков'
+            self.stdout.write(self.style.SUCCESS(f'✅ {action}: {len(mismatched)}'))
+        else:
+            self.stdout.write(self.style.WARNING(f'👀 Найдено расхождений: {len(mismatched)}'))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-16 18:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0003_financialsummary_stockhistory'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stockhistory',
+            name='attributes_snapshot',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 5.2.1 on 2026-10-16 18:34
+
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+def fill_price_stats(apps, schema_editor):
+    """Заполняет кэш закупочных цен по текущим партиям"""
+    Product = apps.get_model('inventory', 'Product')
+    ProductBatch = apps.get_model('inventory', 'ProductBatch')
+
+    stats = {}
+    batches = ProductBatch.objects.order_by('product_id', 'created_at', 'pk').values_list(
+        'product_id', 'quantity', 'purchase_price'
+    )
+    for product_id, quantity, price in batches.iterator():
+        row = stats.setdefault(product_id, {'cost': Decimal('0'), 'quantity': Decimal('0'),
+                                            'min': None, 'last': None, 'count': 0})
+        if price is not None:
+            row['last'] = price
+        if quantity <= 0:
+            continue
+        row['count'] += 1
+        if price is not None:
+            row['cost'] += price * quantity
+            row['quantity'] += quantity
+            row['min'] = price if row['min'] is None else min(row['min'], price)
+
+    products = [
+        Product(
+            pk=product_id,
+            cached_average_purchase_price=(
+                (row['cost'] / row['quantity']).quantize(Decimal('0.01')) if row['quantity'] else None
+            ),
+            cached_min_purchase_price=row['min'],
+            cached_last_purchase_price=row['last'],
+            cached_batches_count=row['count'],
+        )
+        for product_id, row in stats.items()
+    ]
+    Product.objects.bulk_update(
+        products,
+        ['cached_average_purchase_price', 'cached_min_purchase_price',
+         'cached_last_purchase_price', 'cached_batches_count'],
+        batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0004_stockhistory_attributes_snapshot_json'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='cached_average_purchase_price',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=12, null=True, verbose_name='Средняя закупочная цена (кэш)'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='cached_batches_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Активных партий (кэш)'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='cached_last_purchase_price',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=12, null=True, verbose_name='Последняя закупочная цена (кэш)'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='cached_min_purchase_price',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=12, null=True, verbose_name='Минимальная закупочная цена (кэш)'),
+        ),
+        migrations.RunPython(fill_price_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.1 on 2026-10-16 18:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0005_product_price_stats_cache'),
+        ('stores', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BarcodeSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('next_value', models.PositiveBigIntegerField(default=0, verbose_name='Следующий номер')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('store', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='%(class)s_set', to='stores.store', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'Счетчик штрих-кодов',
+                'verbose_name_plural': 'Счетчики штрих-кодов',
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.1 on 2026-10-16 19:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0006_barcodesequence'),
+        ('stores', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productbatch',
+            index=models.Index(fields=['product', 'expiration_date', 'created_at'], name='inventory_p_product_369c09_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stock',
+            index=models.Index(fields=['store', 'quantity'], name='inventory_s_store_i_9b5229_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-16 19:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0007_batch_fifo_stock_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stockhistory',
+            index=models.Index(fields=['store', 'timestamp', 'id'], name='inventory_s_store_i_ec52fd_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-16 19:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0008_stockhistory_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productbatch',
+            index=models.Index(fields=['store', 'created_at', 'id'], name='inventory_p_store_i_6910ae_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-16 20:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0009_productbatch_export_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stockhistory',
+            index=models.Index(fields=['reference_id'], name='inventory_s_referen_58f095_idx'),
+        ),
+    ]
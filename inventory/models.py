@@ -1,37 +1,28 @@
 # inventory/models.py - ИСПРАВЛЕННАЯ ВЕРСИЯ
 import logging
-from django.db import models
+from django.db import models, transaction
 from django.core.validators import MinValueValidator
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from django.db.models import Sum, F, Min, Avg
+from django.db.models import (
+    Sum, F, Min, Max, Avg, Count, Q, Case, When, Value, Window,
+    ExpressionWrapper, FloatField, DecimalField, BooleanField
+)
+from django.db.models.functions import Cast, Coalesce, NullIf
 from django.conf import settings
 from django.utils.text import format_lazy
 from django.core.files.base import ContentFile
 from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
-import barcode
-from io import BytesIO
-from barcode.writer import ImageWriter
-from PIL import Image as PILImage
-from io import BytesIO
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.lib.fonts import addMapping
-from stores.mixins import StoreOwnedModel, StoreOwnedManager
+from stores.mixins import StoreOwnedModel, StoreOwnedManager, StoreFilteredQuerySet
 from django.utils import timezone
 from decimal import Decimal
 from datetime import timedelta
-from django.contrib.postgres.fields import ArrayField  # Для PostgreSQL (опционально)
 import uuid
 from users.models import Employee  # Импортируем модель Employee
 
-
-pdfmetrics.registerFont(
-    TTFont("DejaVuSans", "/usr/share/fonts/dejavu-sans-fonts/DejaVuSans.ttf")
-)
-addMapping('DejaVuSans', 0, 0, 'DejaVuSans')
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# barcode, PIL и reportlab (со шрифтами) загружаются при первой печати этикеток —
+# см. inventory/services/label_renderer.py
 logger = logging.getLogger('inventory')
 
 class SoftDeleteManager(models.Manager):
@@ -134,9 +125,7 @@ class StockHistory(models.Model):
         null=True, 
         blank=True
     )
-    attributes_snapshot = ArrayField(  # PostgreSQL: моментальный снимок атрибутов
-        models.JSONField(),
-        size=10,
+    attributes_snapshot = models.JSONField(  # Моментальный снимок атрибутов (список)
         blank=True,
         null=True
     )  # [{'attribute_value_id': 1, 'quantity': 5}, ...]
@@ -155,8 +144,10 @@ class StockHistory(models.Model):
         indexes = [
             models.Index(fields=['product', 'date_only']),  # Тренды по продукту
             models.Index(fields=['store', 'date_only']),    # Тренды по магазину
+            models.Index(fields=['store', 'timestamp', 'id']),  # Keyset-пагинация истории магазина
             models.Index(fields=['timestamp']),             # Временные ряды
             models.Index(fields=['operation_type', 'date_only']),  # Анализ операций
+            models.Index(fields=['reference_id']),          # Движения по документу (маржа, возврат)
         ]
         ordering = ['-timestamp']
     
@@ -466,6 +457,77 @@ class AttributeValue(models.Model):
         return f"{self.attribute_type.name}: {self.value} ({self.slug})"
 
 
+class ProductQuerySet(StoreFilteredQuerySet):
+    """QuerySet товаров с ценовой аналитикой, считаемой в SQL"""
+
+    def with_price_stats(self, live=False):
+        """
+        Аннотирует товары ценовой статистикой одним запросом:
+        purchase_price_avg / purchase_price_min / purchase_price_last, active_batches,
+        margin_percent   — наценка к средней закупочной цене, %,
+        min_allowed_price — минимальная цена продажи с учетом наценки магазина,
+        below_min_markup — наценка ниже минимальной для магазина.
+        По умолчанию берет кэш цен товара, live=True — считает подзапросами по партиям
+        """
+        if live:
+            from inventory.services.price_stats import price_stats
+
+            queryset = self.annotate(**price_stats.annotations()).annotate(
+                purchase_price_avg=Cast(
+                    Cast('_batches_cost', FloatField()) / NullIf(Cast('_batches_quantity', FloatField()), 0.0),
+                    DecimalField(max_digits=12, decimal_places=2)
+                ),
+                purchase_price_min=F('_batches_min_price'),
+                purchase_price_last=F('_batches_last_price'),
+                active_batches=F('_batches_count'),
+            )
+        else:
+            queryset = self.annotate(
+                purchase_price_avg=F('cached_average_purchase_price'),
+                purchase_price_min=F('cached_min_purchase_price'),
+                purchase_price_last=F('cached_last_purchase_price'),
+                active_batches=F('cached_batches_count'),
+            )
+
+        average = Cast('purchase_price_avg', FloatField())
+        base_price = Coalesce(
+            NullIf('purchase_price_min', Value(Decimal('0'))), 'purchase_price_last', Value(Decimal('0'))
+        )
+        return queryset.annotate(
+            margin_percent=ExpressionWrapper(
+                (Cast('sale_price', FloatField()) - average) * 100.0 / NullIf(average, 0.0),
+                output_field=FloatField()
+            ),
+            min_allowed_price=ExpressionWrapper(
+                Cast(base_price, FloatField()) *
+                (1.0 + Cast('store__min_markup_percent', FloatField()) / 100.0),
+                output_field=FloatField()
+            ),
+        ).annotate(
+            below_min_markup=Case(
+                When(margin_percent__lt=F('store__min_markup_percent'), then=Value(True)),
+                default=Value(False),
+                output_field=BooleanField()
+            ),
+        )
+
+    def with_price_summary(self):
+        """
+        Добавляет к каждой строке итоги по всей выборке (оконные агрегаты),
+        чтобы список и сводка отчета приходили одним запросом.
+        Вызывается после with_price_stats() и фильтров
+        """
+        analyzed = Q(purchase_price_avg__gt=0)
+        return self.annotate(
+            summary_total=Window(Count('pk')),
+            summary_analyzed=Window(Count('pk', filter=analyzed)),
+            summary_below_markup=Window(Count('pk', filter=analyzed & Q(below_min_markup=True))),
+            summary_avg_margin=Window(Avg('margin_percent')),
+            summary_min_margin=Window(Min('margin_percent')),
+            summary_max_margin=Window(Max('margin_percent')),
+        )
+
+
 class Product(StoreOwnedModel):
     # Системные единицы измерения
     SYSTEM_UNITS = [
@@ -590,6 +652,37 @@ class Product(StoreOwnedModel):
         verbose_name="Изображение этикетки"
     )
     
+    # Кэш закупочных цен по партиям (обновляет inventory.services.price_stats)
+    cached_average_purchase_price = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name="Средняя закупочная цена (кэш)"
+    )
+    cached_min_purchase_price = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name="Минимальная закупочная цена (кэш)"
+    )
+    cached_last_purchase_price = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name="Последняя закупочная цена (кэш)"
+    )
+    cached_batches_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name="Активных партий (кэш)"
+    )
+
     # Мягкое удаление
     is_deleted = models.BooleanField(
         default=False,
@@ -602,7 +695,7 @@ class Product(StoreOwnedModel):
         verbose_name="Дата удаления"
     )
 
-    objects = StoreOwnedManager()
+    objects = StoreOwnedManager.from_queryset(ProductQuerySet)()
     all_objects = models.Manager()
 
     class Meta:
@@ -662,40 +755,18 @@ class Product(StoreOwnedModel):
     # === СВОЙСТВА ДЛЯ ЦЕН И НАЦЕНОК ===
     @property
     def average_purchase_price(self):
-        """Средневзвешенная закупочная цена"""
-        batches = self.batches.filter(
-            quantity__gt=0,
-            purchase_price__isnull=False
-        )
-        if not batches.exists():
-            return None
-            
-        total_cost = Decimal('0')
-        total_quantity = Decimal('0')
-        for batch in batches:
-            total_cost += batch.purchase_price * batch.quantity
-            total_quantity += batch.quantity
-        
-        return total_cost / total_quantity if total_quantity > 0 else None
+        """Средневзвешенная закупочная цена активных партий (из кэша)"""
+        return self.cached_average_purchase_price
     
     @property
     def last_purchase_price(self):
-        """Последняя закупочная цена"""
-        last_batch = self.batches.filter(
-            purchase_price__isnull=False
-        ).order_by('-created_at').first()
-        
-        return last_batch.purchase_price if last_batch else None
+        """Последняя закупочная цена (из кэша)"""
+        return self.cached_last_purchase_price
     
     @property
     def min_purchase_price(self):
-        """Минимальная закупочная цена из активных партий"""
-        min_price = self.batches.filter(
-            quantity__gt=0,
-            purchase_price__isnull=False
-        ).aggregate(min_price=Min('purchase_price'))['min_price']
-        
-        return min_price
+        """Минимальная закупочная цена из активных партий (из кэша)"""
+        return self.cached_min_purchase_price
     
     @property
     def min_sale_price(self):
@@ -731,7 +802,7 @@ class Product(StoreOwnedModel):
             'min_sale_price': float(self.min_sale_price),
             'min_markup_percent': float(self.store.min_markup_percent) if hasattr(self.store, 'min_markup_percent') else 0,
             'current_margin': self._calculate_margin(self.sale_price, avg_purchase),
-            'batches_count': self.batches.filter(quantity__gt=0).count()
+            'batches_count': self.cached_batches_count
         }
     
     def complete_movement_history(self, days=30):
@@ -854,8 +925,8 @@ class Product(StoreOwnedModel):
         self.save(update_fields=['is_deleted', 'deleted_at'])
         
         if hasattr(self, 'stock'):
-            self.stock.quantity = 0
-            self.stock.save()
+            from inventory.services.stock_ledger import stock_ledger
+            stock_ledger.set_balance(self.stock, 0, notes='Удаление товара')
 
     def restore(self):
         """Восстановление товара"""
@@ -864,47 +935,47 @@ class Product(StoreOwnedModel):
         self.save(update_fields=['is_deleted', 'deleted_at'])
 
     @classmethod
-    def generate_unique_barcode(cls):
-        """Генерация уникального штрих-кода"""
-        import uuid
-        import random
-        import time
-        
-        max_attempts = 100
-        attempts = 0
-        
-        while attempts < max_attempts:
-            timestamp = str(int(time.time()))[-6:]
-            random_part = str(random.randint(100000, 999999))
-            barcode_code = timestamp + random_part
-            checksum = cls()._calculate_ean13_checksum(barcode_code)
-            full_ean = barcode_code + checksum
-            
-            if not cls.objects.filter(barcode=full_ean).exists():
-                return full_ean
-            attempts += 1
-        
-        data12 = str(uuid.uuid4().int)[:12]
-        return data12 + cls()._calculate_ean13_checksum(data12)
+    def generate_unique_barcode(cls, store):
+        """Внутренний штрих-код EAN-13 из счетчика магазина (без проверок в цикле)"""
+        from inventory.services.barcode_allocator import barcode_allocator
+
+        return barcode_allocator.allocate(store)[0]
     
     def _calculate_ean13_checksum(self, digits):
         """Вычисляет контрольную цифру EAN-13"""
-        weights = [1, 3] * 6
-        total = sum(int(d) * w for d, w in zip(digits, weights))
-        return str((10 - (total % 10)) % 10)
+        from inventory.services.barcode_allocator import ean13_checksum
+
+        return ean13_checksum(digits)
 
     def save(self, *args, **kwargs):
         """Сохранение с автогенерацией штрих-кода"""
         is_new = self._state.adding
         
         if is_new and not self.barcode:
-            self.barcode = self.generate_unique_barcode()
+            self.barcode = self.generate_unique_barcode(self.store_id)
         
         super().save(*args, **kwargs)
 
 
 
 
+class BarcodeSequence(StoreOwnedModel):
+    """
+    Счетчик внутренних штрих-кодов EAN-13 магазина.
+    Номер строки — префикс кодов, next_value — следующий свободный номер.
+    Коды выдает inventory.services.barcode_allocator блоками
+    """
+    next_value = models.PositiveBigIntegerField(default=0, verbose_name="Следующий номер")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Счетчик штрих-кодов"
+        verbose_name_plural = "Счетчики штрих-кодов"
+
+    def __str__(self):
+        return f"{self.store_id}: {self.pk} → {self.next_value}"
+
+
 class ProductAttribute(models.Model):
     product = models.ForeignKey(
         Product,
@@ -995,11 +1066,22 @@ class ProductBatch(StoreOwnedModel):
         verbose_name = "Партия товара"
         verbose_name_plural = "Партии товаров"
         ordering = ['expiration_date', 'created_at']
+        indexes = [
+            models.Index(fields=['product', 'expiration_date', 'created_at']),  # FIFO-списание без сортировки
+            models.Index(fields=['store', 'created_at', 'id']),  # Выгрузка закупок за период без сортировки
+        ]
 
     def __str__(self):
         size_info = f" ({self.size.size})" if self.size else ""
         return f"{self.product.name}{size_info} × {self.quantity} {self.product.unit_display}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Запоминаем загруженное количество — по нему считается движение при save()"""
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_quantity = instance.__dict__.get('quantity')
+        return instance
+
     @property
     def total_cost(self):
         """Общая стоимость партии"""
@@ -1034,7 +1116,9 @@ class ProductBatch(StoreOwnedModel):
                 raise ValidationError(f"Размер {self.size} не доступен для товара {self.product.name}")
 
     def sell(self, quantity):
-        """Продажа из партии"""
+        """Продажа из партии (через FIFO-аллокатор)"""
+        from inventory.services.batch_allocator import batch_allocator
+
         quantity = Decimal(str(quantity))
         
         if quantity > self.quantity:
@@ -1042,12 +1126,22 @@ class ProductBatch(StoreOwnedModel):
                 f"Недостаточно товара в партии. Доступно: {self.quantity}, запрошено: {quantity}"
             )
         
-        self.quantity = F('quantity') - quantity
-        self.save(update_fields=['quantity'])
-        self.refresh_from_db()
+        from inventory.services.stock_ledger import stock_ledger
+
+        plan = batch_allocator.build_plan([self], {self.product_id: quantity})
+        with transaction.atomic():
+            batch_allocator.apply(plan)
+            stock_ledger.post([{
+                'product': self.product,
+                'quantity_change': -quantity,
+                'operation_type': 'SALE',
+                'batch_id': self.pk,
+                'purchase_price': self.purchase_price,
+            }])
+        self.quantity -= quantity
+        self._loaded_quantity = self.quantity
 
         if self.quantity <= 0:
-            self.delete()
             logger.info(f"Партия {self.id} удалена (товар {self.product.name})")
 
         return quantity
@@ -1073,45 +1167,64 @@ class Stock(StoreOwnedModel):
     class Meta:
         verbose_name = "Остаток на складе"
         verbose_name_plural = "Остатки на складе"
+        indexes = [
+            models.Index(fields=['store', 'quantity']),  # Заканчивающиеся товары магазина
+        ]
 
     def __str__(self):
         return f"{self.product.name}: {self.quantity} {self.product.unit_display}"
 
     def update_quantity(self):
-        """Обновляет общее количество товара на основе партий"""
+        """
+        Сверяет остаток с суммой партий. Разница проводится
+        корректирующим движением через журнал (StockLedger)
+        """
+        from inventory.services.stock_ledger import stock_ledger
+
         total = self.product.batches.aggregate(
             total=Sum('quantity')
         )['total'] or Decimal('0')
-        self.quantity = total
-        self.save(update_fields=['quantity', 'updated_at'])
+        stock_ledger.set_balance(self, total, notes='Сверка с партиями')
 
     def sell(self, quantity):
-        """Списывает товар по FIFO"""
+        """
+        Списывает товар по FIFO: один запрос на партии, один UPDATE партий,
+        одна запись в журнал и один UPDATE остатка. Возвращает план распределения
+        """
+        from inventory.services.batch_allocator import batch_allocator
+        from inventory.services.stock_ledger import stock_ledger
+
         quantity = Decimal(str(quantity))
         
         if quantity <= 0:
             raise ValueError("Количество должно быть положительным")
 
-        if self.quantity < quantity:
-            raise ValueError(
-                f"Недостаточно товара '{self.product.name}'. "
-                f"Доступно: {self.quantity} {self.product.unit_display}, "
-                f"запрошено: {quantity}"
-            )
-
-        remaining = quantity
-        batches = self.product.batches.order_by('expiration_date', 'created_at')
-
-        for batch in batches:
-            if remaining <= 0:
-                break
-
-            sell_amount = min(remaining, batch.quantity)
-            batch.sell(sell_amount)
-            remaining -= sell_amount
+        with transaction.atomic():
+            balances = stock_ledger.lock_balances([self.product])
+            available = balances[self.product_id].quantity
+            if available < quantity:
+                raise ValueError(
+                    f"Недостаточно товара '{self.product.name}'. "
+                    f"Доступно: {available} {self.product.unit_display}, "
+                    f"запрошено: {quantity}"
+                )
 
-        self.update_quantity()
-        logger.info(f"Продано {quantity} {self.product.unit_display} {self.product.name}")
+            plan = batch_allocator.allocate({self.product_id: quantity})
+            stock_ledger.post([{
+                'product': self.product,
+                'quantity_change': -quantity,
+                'operation_type': 'SALE',
+                'purchase_price': plan['cost_prices'].get(
+                    self.product_id, plan['average_prices'].get(self.product_id)
+                ),
+            }], balances=balances)
+
+        self.quantity = balances[self.product_id].quantity
+        logger.info(
+            f"Продано {quantity} {self.product.unit_display} {self.product.name}, "
+            f"партий затронуто: {len(plan['allocations'])}"
+        )
+        return plan
 
     def stockout_rate(self, period_days=30):
         from_date = timezone.now() - timedelta(days=period_days)
@@ -1162,32 +1275,49 @@ def create_product_stock(sender, instance, created, **kwargs):
 
 
 @receiver(post_save, sender=ProductBatch)
-def update_stock_on_batch_change(sender, instance, **kwargs):
+def update_stock_on_batch_change(sender, instance, created, **kwargs):
     """
-    Обновляем остатки при изменении партии
+    Изменение партии проводится через журнал движений:
+    новая партия — INCOMING, изменение количества — CORRECTION на разницу
     """
-    try:
-        # Получаем или создаем Stock для продукта
-        stock, created = Stock.objects.get_or_create(
-            product=instance.product,
-            defaults={
-                'store': instance.store,  # ← Берем store из ProductBatch
-                'quantity': 0
-            }
-        )
+    from inventory.services.stock_ledger import stock_ledger
 
-        # Обновляем количество
-        stock.update_quantity()
-
-        if created:
-            logger.info(f"✅ Stock created during batch update for: {instance.product.name}")
-        else:
-            logger.debug(f"✅ Stock updated for: {instance.product.name}")
+    try:
+        loaded = getattr(instance, '_loaded_quantity', None)
+        if not created and (loaded is None or not isinstance(instance.quantity, Decimal)):
+            # Неизвестно исходное значение — сверяем остаток с партиями целиком
+            instance.product.stock.update_quantity()
+            return
+
+        change = instance.quantity if created else instance.quantity - loaded
+        stock_ledger.post([{
+            'product': instance.product,
+            'store_id': instance.store_id,
+            'batch_id': instance.pk,
+            'quantity_change': change,
+            'operation_type': 'INCOMING' if created else 'CORRECTION',
+            'size_id': instance.size_id,
+            'purchase_price': instance.purchase_price,
+            'reference_id': instance.invoice_number,
+            'notes': f'Партия {instance.pk} поставщик {instance.supplier}' if instance.supplier else None,
+        }])
+        instance._loaded_quantity = instance.quantity
+
+        logger.debug(f"✅ Stock updated for: {instance.product.name} ({change:+})")
 
     except Exception as e:
         logger.error(f"❌ Error updating stock for batch {instance.id}: {str(e)}")
 
 
+@receiver([post_save, post_delete], sender=ProductBatch)
+def update_price_stats_on_batch_change(sender, instance, **kwargs):
+    """Пересчет кэша закупочных цен товара при изменении или удалении партии"""
+    from inventory.services.price_stats import price_stats
+
+    product = instance.product if kwargs['signal'] is post_save else instance.product_id
+    price_stats.touch([product])
+
+
 class FinancialSummary(models.Model):
     """
     Дневная финансовая сводка по магазину
@@ -2,6 +2,8 @@ from rest_framework.pagination import LimitOffsetPagination, PageNumberPaginatio
 from rest_framework.response import Response
 from collections import OrderedDict
 
+from stores.pagination import KeysetPagination
+
 
 class CustomLimitOffsetPagination(LimitOffsetPagination):
     """
@@ -112,4 +114,12 @@ class ProductPagination(CustomLimitOffsetPagination):
                 'previous': self.get_previous_link(),
             },
             'data': data
-        })
\ No newline at end of file
+        })
+
+
+class StockHistoryPagination(KeysetPagination):
+    """
+    Keyset-пагинация истории стока: по времени операции, новые сверху
+    """
+    ordering_field = 'timestamp'
+    page_size = 50
@@ -16,6 +16,7 @@ from .models import (Product, ProductCategory, Stock,
 from users.serializers import UserSerializer
 import logging
 from stores.mixins import StoreSerializerMixin
+from .services.barcode_allocator import barcode_allocator
 
 
 logger = logging.getLogger('inventory')
@@ -221,36 +222,9 @@ class ProductCategorySerializer(serializers.ModelSerializer):
                 )
             return value
 
-        # Получаем текущий магазин
-        current_store = None
-
-        if hasattr(request.user, 'current_store') and request.user.current_store:
-            current_store = request.user.current_store
-
-        if not current_store:
-            auth_header = request.META.get('HTTP_AUTHORIZATION', '')
-            if auth_header.startswith('Bearer '):
-                try:
-                    from rest_framework_simplejwt.tokens import AccessToken
-                    token = auth_header.split(' ')[1]
-                    decoded_token = AccessToken(token)
-                    store_id = decoded_token.get('store_id')
-
-                    if store_id:
-                        from stores.models import Store
-                        current_store = Store.objects.filter(id=store_id).first()
-                except Exception:
-                    pass
-
-            if not current_store:
-                from stores.models import StoreEmployee
-                store_membership = StoreEmployee.objects.filter(
-                    user=request.user,
-                    is_active=True
-                ).select_related('store').first()
-
-                if store_membership:
-                    current_store = store_membership.store
+        # Текущий магазин из контекста запроса (токен уже проверен при аутентификации)
+        from stores.services.store_context import store_context
+        current_store = store_context.resolve(request)['store']
 
         if not current_store:
             raise serializers.ValidationError(
@@ -357,36 +331,9 @@ class SizeInfoSerializer(StoreSerializerMixin, serializers.ModelSerializer):
         if not request:
             return attrs
 
-        # Получаем текущий магазин
-        current_store = None
-
-        if hasattr(request.user, 'current_store') and request.user.current_store:
-            current_store = request.user.current_store
-
-        if not current_store:
-            auth_header = request.META.get('HTTP_AUTHORIZATION', '')
-            if auth_header.startswith('Bearer '):
-                try:
-                    from rest_framework_simplejwt.tokens import AccessToken
-                    token = auth_header.split(' ')[1]
-                    decoded_token = AccessToken(token)
-                    store_id = decoded_token.get('store_id')
-
-                    if store_id:
-                        from stores.models import Store
-                        current_store = Store.objects.filter(id=store_id).first()
-                except Exception:
-                    pass
-
-            if not current_store:
-                from stores.models import StoreEmployee
-                store_membership = StoreEmployee.objects.filter(
-                    user=request.user,
-                    is_active=True
-                ).select_related('store').first()
-
-                if store_membership:
-                    current_store = store_membership.store
+        # Текущий магазин из контекста запроса (токен уже проверен при аутентификации)
+        from stores.services.store_context import store_context
+        current_store = store_context.resolve(request)['store']
 
         if not current_store:
             raise serializers.ValidationError("Не удалось определить текущий магазин")
@@ -986,12 +933,15 @@ class ProductMultiSizeCreateSerializer(serializers.Serializer):
         batch_info = validated_data.get('batch_info', [])
         created_products = []
 
+        # Штрих-коды на все размеры — одним резервом из счетчика магазина (до транзакции)
+        barcodes = iter(barcode_allocator.allocate(store, len(batch_info)))
+
         try:
             with transaction.atomic():
                 for batch_data in batch_info:
                     size_instance = SizeInfo.objects.get(id=batch_data['size_id'])
                     product_name = f"{validated_data['name']} - {size_instance.size}"
-                    unique_barcode = self.generate_unique_barcode(store)
+                    unique_barcode = next(barcodes)
 
                     # Создание продукта
                     product_data = {
@@ -1061,23 +1011,3 @@ class ProductMultiSizeCreateSerializer(serializers.Serializer):
             raise
 
         return created_products
-
-    def generate_unique_barcode(self, store):
-        import random, time, uuid
-        max_attempts = 100
-        attempts = 0
-        while attempts < max_attempts:
-            timestamp = str(int(time.time()))[-6:]
-            random_part = str(random.randint(100000, 999999))
-            code = timestamp + random_part
-            checksum = self._calculate_ean13_checksum(code)
-            full_barcode = code + checksum
-            if not Product.objects.filter(store=store, barcode=full_barcode).exists():
-                return full_barcode
-            attempts += 1
-        return str(uuid.uuid4().int)[:12]
-
-    def _calculate_ean13_checksum(self, digits):
-        weights = [1, 3] * 6
-        total = sum(int(d) * w for d, w in zip(digits, weights))
-        return str((10 - (total % 10)) % 10)
\ No newline at end of file
@@ -0,0 +1,211 @@
+# inventory/services/barcode_allocator.py
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connections, router, transaction as db_transaction
+from django.db.models import F
+
+from inventory.models import BarcodeSequence, Product
+
+logger = logging.getLogger('inventory')
+
+# Внутренние коды EAN-13: «2» (диапазон для внутренней нумерации магазина) +
+# номер счетчика (5 цифр) + порядковый номер (6 цифр) + контрольная цифра
+INTERNAL_PREFIX = '2'
+SEQUENCE_DIGITS = 5
+NUMBER_DIGITS = 6
+MAX_SEQUENCE = 10 ** SEQUENCE_DIGITS - 1
+MAX_NUMBER = 10 ** NUMBER_DIGITS - 1
+RETURNING_VENDORS = ('sqlite', 'postgresql')
+
+
+def ean13_checksum(digits):
+    """Контрольная цифра EAN-13 для 12 цифр"""
+    weights = [1, 3] * 6
+    total = sum(int(d) * w for d, w in zip(digits, weights))
+    return str((10 - (total % 10)) % 10)
+
+
+def ean13(sequence_id, number):
+    code = f"{INTERNAL_PREFIX}{sequence_id:0{SEQUENCE_DIGITS}d}{number:0{NUMBER_DIGITS}d}"
+    return code + ean13_checksum(code)
+
+
+class BarcodeAllocator:
+    """
+    🏷️ Выдача внутренних штрих-кодов EAN-13 по счетчику магазина.
+
+    Коды резервируются блоком: одно атомарное увеличение BarcodeSequence.next_value
+    на размер блока (UPDATE ... RETURNING) и одна проверка диапазона на коды,
+    занятые товарами со старыми штрих-кодами. Остаток блока выдается из памяти.
+
+    Остаток резерва, сделанного в транзакции, до ее коммита выдается только
+    в этой же транзакции, а в общий пул попадает после коммита: при откате
+    счетчик возвращается назад, и эти коды может получить другой процесс.
+    """
+
+    def __init__(self):
+        self._pools = {}       # store_id -> [код, ...]
+        self._sequences = {}   # store_id -> id активного счетчика
+        self._lock = threading.Lock()
+        self._local = threading.local()  # остатки резервов открытой транзакции
+
+    @property
+    def block_size(self):
+        return getattr(settings, 'BARCODE_BLOCK_SIZE', 100)
+
+    def allocate(self, store, count=1):
+        """Возвращает count новых уникальных штрих-кодов магазина (store — объект или id)"""
+        store_id = getattr(store, 'pk', store)
+        using = router.db_for_write(BarcodeSequence)
+
+        # Сначала остаток резерва этой же транзакции, затем общий пул
+        # (в нем только коды из закоммиченных резервов — их можно выдавать где угодно)
+        pending = self._pending(store_id, using)
+        codes = pending.take(count) if pending else []
+        with self._lock:
+            pool = self._pools.get(store_id, [])
+            taken, self._pools[store_id] = pool[:count - len(codes)], pool[count - len(codes):]
+        codes.extend(taken)
+
+        need = count - len(codes)
+        if need > 0:
+            block = self._reserve(store_id, max(need, self.block_size))
+            codes.extend(block[:need])
+            if len(block) > need:
+                reservation = _Reservation(self, store_id, block[need:])
+                db_transaction.on_commit(reservation, using=using)
+                if connections[using].in_atomic_block:
+                    self._local.__dict__.setdefault('pending', {})[store_id] = reservation
+
+        return codes
+
+    def _pending(self, store_id, using):
+        """Остаток резерва открытой транзакции, если его on_commit еще не отменен откатом"""
+        reservation = getattr(self._local, 'pending', {}).get(store_id)
+        if reservation is None:
+            return None
+        connection = connections[using]
+        if connection.in_atomic_block and any(entry[1] is reservation for entry in connection.run_on_commit):
+            return reservation
+        self._local.pending.pop(store_id, None)
+        return None
+
+    def _release(self, store_id, codes):
+        with self._lock:
+            self._pools.setdefault(store_id, []).extend(codes)
+
+    def assign(self, products):
+        """Проставляет штрих-коды товарам без них (перед bulk_create). Один резерв на магазин"""
+        missing = {}
+        for product in products:
+            if not product.barcode:
+                missing.setdefault(product.store_id, []).append(product)
+
+        for store_id, store_products in missing.items():
+            for product, code in zip(store_products, self.allocate(store_id, len(store_products))):
+                product.barcode = code
+        return products
+
+    def _reserve(self, store_id, count):
+        """Резервирует count свободных кодов: увеличение счетчика + проверка занятых"""
+        codes = []
+        while len(codes) < count:
+            sequence_id = self._active_sequence(store_id)
+            end = self._bump(sequence_id, count - len(codes))
+            if end is None:
+                # Счетчик, созданный в откатившейся транзакции
+                with self._lock:
+                    self._sequences.pop(store_id, None)
+                continue
+            start = end - (count - len(codes))
+            if end - 1 > MAX_NUMBER:
+                # Счетчик исчерпан — следующий резерв пойдет в новый
+                with self._lock:
+                    self._sequences.pop(store_id, None)
+                BarcodeSequence.objects.filter(pk=sequence_id).update(next_value=MAX_NUMBER + 1)
+                end = MAX_NUMBER + 1
+                if start > MAX_NUMBER:
+                    continue
+
+            block = [ean13(sequence_id, number) for number in range(start, end)]
+            taken = set(
+                Product.all_objects.filter(barcode__gte=block[0], barcode__lte=block[-1])
+                .values_list('barcode', flat=True)
+            )
+            if taken:
+                logger.warning(f"🏷️ Пропущено занятых штрих-кодов: {len(taken)} (счетчик {sequence_id})")
+            codes.extend(code for code in block if code not in taken)
+        return codes
+
+    def _active_sequence(self, store_id):
+        with self._lock:
+            sequence_id = self._sequences.get(store_id)
+        if sequence_id is not None:
+            return sequence_id
+
+        sequence = BarcodeSequence.objects.filter(
+            store_id=store_id, next_value__lte=MAX_NUMBER
+        ).order_by('pk').first()
+        if sequence is None:
+            sequence = BarcodeSequence.objects.create(store_id=store_id)
+        if sequence.pk > MAX_SEQUENCE:
+            raise ValueError("Исчерпан диапазон внутренних штрих-кодов")
+
+        with self._lock:
+            self._sequences[store_id] = sequence.pk
+        return sequence.pk
+
+    def _bump(self, sequence_id, count):
+        """Атомарно увеличивает счетчик на count. Возвращает новое next_value (None — счетчика нет)"""
+        using = router.db_for_write(BarcodeSequence)
+        connection = connections[using]
+
+        if connection.vendor in RETURNING_VENDORS:
+            qn = connection.ops.quote_name
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"UPDATE {qn(BarcodeSequence._meta.db_table)} "
+                    f"SET {qn('next_value')} = {qn('next_value')} + %s "
+                    f"WHERE {qn('id')} = %s RETURNING {qn('next_value')}",
+                    [count, sequence_id]
+                )
+                row = cursor.fetchone()
+                return row[0] if row else None
+
+        with db_transaction.atomic(using=using):
+            BarcodeSequence.objects.using(using).filter(pk=sequence_id).update(next_value=F('next_value') + count)
+            return BarcodeSequence.objects.using(using).filter(pk=sequence_id).values_list(
+                'next_value', flat=True
+            ).first()
+
+    def clear(self):
+        """Сбрасывает кэш блоков (неиспользованные коды пропадают)"""
+        with self._lock:
+            self._pools.clear()
+            self._sequences.clear()
+        self._local.__dict__.pop('pending', None)
+
+
+class _Reservation:
+    """Остаток резерва: выдается внутри транзакции, после коммита уходит в общий пул"""
+
+    def __init__(self, allocator, store_id, codes):
+        self.allocator = allocator
+        self.store_id = store_id
+        self.codes = codes
+
+    def take(self, count):
+        taken, self.codes = self.codes[:count], self.codes[count:]
+        return taken
+
+    def __call__(self):
+        pending = getattr(self.allocator._local, 'pending', {})
+        if pending.get(self.store_id) is self:
+            del pending[self.store_id]
+        self.allocator._release(self.store_id, self.codes)
+        self.codes = []
+
+
+barcode_allocator = BarcodeAllocator()
@@ -0,0 +1,144 @@
+# inventory/services/barcode_index.py
+import logging
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+
+from inventory.models import Product
+
+logger = logging.getLogger('inventory')
+
+NOT_FOUND = None
+
+
+class BarcodeIndex:
+    """
+    🔎 Индекс штрих-кодов в памяти процесса: (магазин, штрих-код) → краткая
+    карточка товара для кассы. Неизвестные коды тоже запоминаются (отрицательный кэш).
+
+    Размер ограничен (LRU, BARCODE_INDEX_MAX_ENTRIES), записи живут не дольше
+    BARCODE_INDEX_TTL секунд — это предел расхождения между процессами.
+    Внутри процесса записи сбрасываются сигналами Product/Stock, журналом
+    остатков и пересчетом кэша цен (сразу и после коммита).
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()   # (store_id, barcode) -> (expires_at, карточка | None)
+        self._keys_by_product = {}      # product_id -> (store_id, barcode)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def max_entries(self):
+        return getattr(settings, 'BARCODE_INDEX_MAX_ENTRIES', 50000)
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'BARCODE_INDEX_TTL', 60)
+
+    def _queryset(self, store_id):
+        return Product.objects.filter(store_id=store_id).select_related('category', 'stock', 'custom_unit')
+
+    def _summary(self, product):
+        """Краткая карточка товара (без партий и истории)"""
+        stock = getattr(product, 'stock', None)
+        return {
+            'id': product.id,
+            'name': product.name,
+            'barcode': product.barcode,
+            'category': product.category_id,
+            'category_name': product.category.name,
+            'sale_price': float(product.sale_price),
+            'unit_display': product.unit_display,
+            'allow_decimal': product.allow_decimal,
+            'min_sale_quantity': float(product.min_sale_quantity),
+            'quantity_step': float(product.quantity_step),
+            'current_stock': float(stock.quantity) if stock else 0.0,
+            'has_sizes': product.has_sizes,
+            'default_size_id': product.default_size_id,
+            'purchase_price': product.min_purchase_price or product.last_purchase_price,
+        }
+
+    def _payload(self, summary, store):
+        """Карточка для ответа: минимальная цена считается по текущей наценке магазина"""
+        payload = dict(summary)
+        base_price = payload.pop('purchase_price')
+        min_sale_price = base_price * (1 + store.min_markup_percent / 100) if base_price else Decimal('0')
+        payload['min_sale_price'] = float(min_sale_price)
+        return payload
+
+    def _put(self, key, summary, product_id=None):
+        """Кладет запись и вытесняет самые давние сверх лимита (вызывать под _lock)"""
+        self._entries[key] = (time.monotonic() + self.ttl, summary)
+        self._entries.move_to_end(key)
+        if product_id is not None:
+            self._keys_by_product[product_id] = key
+
+        while len(self._entries) > self.max_entries:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            if evicted is not NOT_FOUND:
+                self._keys_by_product.pop(evicted['id'], None)
+
+    def lookup(self, store, barcode):
+        """Карточка товара по штрих-коду в магазине или None. Без запросов к БД при попадании"""
+        key = (store.pk, barcode)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                summary = entry[1]
+                return self._payload(summary, store) if summary is not NOT_FOUND else NOT_FOUND
+            self.misses += 1
+
+        product = self._queryset(store.pk).filter(barcode=barcode).first()
+        summary = self._summary(product) if product else NOT_FOUND
+        with self._lock:
+            self._put(key, summary, product.pk if product else None)
+        return self._payload(summary, store) if summary is not NOT_FOUND else NOT_FOUND
+
+    def warm(self, store):
+        """Загружает все товары магазина со штрих-кодом одним запросом. Возвращает число записей"""
+        products = self._queryset(store.pk).exclude(barcode__isnull=True).exclude(barcode='')
+        summaries = [(product.pk, product.barcode, self._summary(product)) for product in products.iterator()]
+        with self._lock:
+            for product_id, barcode, summary in summaries:
+                self._put((store.pk, barcode), summary, product_id)
+        logger.info(f"🔎 Индекс штрих-кодов магазина {store.pk}: загружено {len(summaries)}")
+        return len(summaries)
+
+    def _drop(self, keys=(), product_ids=()):
+        with self._lock:
+            for product_id in product_ids:
+                key = self._keys_by_product.pop(product_id, None)
+                if key is not None:
+                    self._entries.pop(key, None)
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def invalidate(self, keys=(), product_ids=()):
+        """
+        Сбрасывает записи по ключам (store_id, barcode) и по товарам.
+        Повторно — после коммита, чтобы не осталась карточка, прочитанная до него
+        """
+        keys, product_ids = list(keys), list(product_ids)
+        self._drop(keys, product_ids)
+        db_transaction.on_commit(lambda: self._drop(keys, product_ids))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_product.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+barcode_index = BarcodeIndex()
@@ -0,0 +1,195 @@
+# inventory/services/batch_allocator.py
+import logging
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction as db_transaction
+from django.db.models import Case, When, Value, DecimalField, F
+
+from inventory.models import ProductBatch
+from inventory.services.price_stats import price_stats, PRICE_QUANT
+
+logger = logging.getLogger('inventory')
+
+
+class FifoBatchAllocator:
+    """
+    📦 FIFO-распределение списания по партиям.
+    План строится за один проход по партиям (expiration_date, created_at)
+    и применяется одним UPDATE ... CASE; опустевшие партии удаляются.
+
+    План — словарь:
+    {
+        'allocations': [{'batch_id', 'product_id', 'quantity',
+                         'quantity_before', 'quantity_after', 'purchase_price'}, ...],
+        'unallocated': {product_id: Decimal},   # не хватило партий
+        'average_prices': {product_id: Decimal}, # средневзвешенная закупка до списания
+        'cost_prices': {product_id: Decimal},    # себестоимость единицы по списанным партиям
+        'price_stats': {product_id: {поле кэша: значение} или None},  # кэш цен после списания
+        'cached_price_stats': {product_id: {поле кэша: значение}},    # кэш цен до списания
+    }
+    price_stats есть только у плана по всем активным партиям товара (plan()):
+    новый кэш цен считается из тех же партий, без пересчета запросом.
+    None — списание опустошает самую новую партию с ценой, и последнюю цену
+    закупки нужно искать среди остальных партий запросом.
+    """
+
+    ORDERING = ('expiration_date', 'created_at')
+
+    # Текущий кэш цен товара, читается вместе с партиями (JOIN)
+    CACHED_PRICE_STATS = {
+        '_cached_average_purchase_price': 'cached_average_purchase_price',
+        '_cached_min_purchase_price': 'cached_min_purchase_price',
+        '_cached_batches_count': 'cached_batches_count',
+    }
+
+    def build_plan(self, batches, quantities, complete=False):
+        """
+        Чистый расчет без обращения к БД.
+        batches — партии, уже упорядоченные по FIFO внутри каждого товара
+        quantities — {product_id: количество к списанию}
+        complete — batches содержат все активные партии товаров: в план
+        добавляется кэш цен после списания
+        """
+        remaining = {product_id: Decimal(str(qty)) for product_id, qty in quantities.items()}
+        cost = defaultdict(Decimal)
+        priced_quantity = defaultdict(Decimal)
+        sold_cost = defaultdict(Decimal)
+        sold_priced_quantity = defaultdict(Decimal)
+        allocations = []
+        left_batches = defaultdict(list)
+        cached = {}
+
+        for batch in batches:
+            if batch.product_id not in remaining:
+                continue
+
+            if batch.purchase_price is not None and batch.quantity > 0:
+                cost[batch.product_id] += batch.purchase_price * batch.quantity
+                priced_quantity[batch.product_id] += batch.quantity
+
+            if complete and batch.product_id not in cached:
+                cached[batch.product_id] = {
+                    field: getattr(batch, attribute) for attribute, field in self.CACHED_PRICE_STATS.items()
+                }
+
+            need = remaining[batch.product_id]
+            take = min(need, batch.quantity) if need > 0 and batch.quantity > 0 else Decimal('0')
+            left_batches[batch.product_id].append((batch, batch.quantity - take))
+            if take <= 0:
+                continue
+
+            remaining[batch.product_id] = need - take
+            if batch.purchase_price is not None:
+                sold_cost[batch.product_id] += batch.purchase_price * take
+                sold_priced_quantity[batch.product_id] += take
+            allocations.append({
+                'batch_id': batch.pk,
+                'product_id': batch.product_id,
+                'quantity': take,
+                'quantity_before': batch.quantity,
+                'quantity_after': batch.quantity - take,
+                'purchase_price': batch.purchase_price,
+            })
+
+        plan = {
+            'allocations': allocations,
+            'unallocated': {
+                product_id: left for product_id, left in remaining.items() if left > 0
+            },
+            'average_prices': {
+                product_id: (cost[product_id] / priced_quantity[product_id]).quantize(PRICE_QUANT)
+                for product_id in priced_quantity
+                if priced_quantity[product_id] > 0
+            },
+            'cost_prices': {
+                product_id: (sold_cost[product_id] / sold_priced_quantity[product_id]).quantize(PRICE_QUANT)
+                for product_id in sold_priced_quantity
+            },
+        }
+        if complete:
+            touched = {allocation['product_id'] for allocation in allocations}
+            plan['price_stats'] = {
+                product_id: self._price_stats_after(left_batches[product_id]) for product_id in touched
+            }
+            plan['cached_price_stats'] = {product_id: cached[product_id] for product_id in touched}
+        return plan
+
+    def _price_stats_after(self, left_batches):
+        """
+        Кэш цен товара по его активным партиям после списания [(партия, остаток)].
+        None — опустела самая новая партия с ценой (последняя цена закупки
+        может быть у партии с нулевым остатком, которой нет среди активных)
+        """
+        priced = [(batch, left) for batch, left in left_batches if batch.purchase_price is not None]
+        if priced and max(priced, key=lambda item: (item[0].created_at, item[0].pk))[1] <= 0:
+            return None
+
+        priced = [(batch.purchase_price, left) for batch, left in priced if left > 0]
+        quantity = sum((left for _, left in priced), Decimal('0'))
+        return {
+            'cached_average_purchase_price': (
+                (sum((price * left for price, left in priced), Decimal('0')) / quantity).quantize(PRICE_QUANT)
+                if quantity else None
+            ),
+            'cached_min_purchase_price': min((price for price, _ in priced), default=None),
+            'cached_batches_count': sum(1 for _, left in left_batches if left > 0),
+        }
+
+    def plan(self, quantities, lock=True):
+        """Загружает все активные партии товаров (и их кэш цен) одним запросом и строит план"""
+        batches = ProductBatch.objects.filter(
+            product_id__in=list(quantities),
+            quantity__gt=0
+        ).annotate(**{
+            attribute: F(f'product__{field}') for attribute, field in self.CACHED_PRICE_STATS.items()
+        }).order_by('product_id', *self.ORDERING)
+        if lock:
+            # Блокируются только партии: строки товаров держит lock_balances через Stock
+            batches = batches.select_for_update(of=('self',))
+        return self.build_plan(batches, quantities, complete=True)
+
+    def apply(self, plan):
+        """
+        Применяет план: частично списанные партии — одним UPDATE ... CASE,
+        опустевшие партии удаляются. Кэш цен пишется готовым из плана (одним
+        UPDATE и только если изменился); без готового — пересчет запросом
+        один раз на все товары.
+
+        Удаление — отдельные запросы (выборка для каскада, атрибуты партий,
+        ссылки в истории стока, сами партии): партия опустевает один раз за
+        жизнь, а у обычной продажи из партии остается UPDATE партий, UPDATE
+        кэша цен, запись в журнал и UPDATE остатка
+        """
+        partial = [a for a in plan['allocations'] if a['quantity_after'] > 0]
+        emptied = [a['batch_id'] for a in plan['allocations'] if a['quantity_after'] <= 0]
+        known = {
+            product_id: stats for product_id, stats in plan.get('price_stats', {}).items() if stats is not None
+        }
+
+        with db_transaction.atomic(savepoint=False), price_stats.deferred():
+            if partial:
+                ProductBatch.objects.filter(pk__in=[a['batch_id'] for a in partial]).update(
+                    quantity=Case(
+                        *[When(pk=a['batch_id'], then=Value(a['quantity_after'])) for a in partial],
+                        output_field=DecimalField(max_digits=12, decimal_places=3)
+                    )
+                )
+            if emptied:
+                ProductBatch.objects.filter(pk__in=emptied).delete()
+                logger.info(f"Удалено пустых партий: {len(emptied)}")
+            price_stats.store(known, plan.get('cached_price_stats'))
+            price_stats.touch({a['product_id'] for a in plan['allocations']} - set(known))
+
+        for product_id, left in plan['unallocated'].items():
+            logger.warning(f"Партий товара {product_id} не хватило для списания, не распределено: {left}")
+
+        return plan
+
+    def allocate(self, quantities):
+        """Строит и применяет план списания. Возвращает план"""
+        with db_transaction.atomic(savepoint=False):
+            return self.apply(self.plan(quantities))
+
+
+batch_allocator = FifoBatchAllocator()
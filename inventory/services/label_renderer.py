@@ -0,0 +1,318 @@
+# inventory/services/label_renderer.py
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+
+logger = logging.getLogger('inventory')
+
+FONT_NAME = 'DejaVuSans'
+FONT_PATH = '/usr/share/fonts/dejavu-sans-fonts/DejaVuSans.ttf'
+MM_PER_INCH = 25.4
+PAGE_SIZE_MM = (210, 297)  # A4
+
+# Шаблоны этикеток: размер, сетка на листе A4 и параметры штрих-кода.
+# Изменение параметров штрих-кода меняет ключ кэша — старые картинки не используются
+LABEL_TEMPLATES = {
+    'shelf': {
+        'width_mm': 58, 'height_mm': 40, 'columns': 3, 'rows': 7,
+        'name_size': 8, 'price_size': 14,
+        'barcode': {'module_width': 0.25, 'module_height': 10.0, 'font_size': 8,
+                    'text_distance': 3.0, 'quiet_zone': 2.0, 'dpi': 300},
+    },
+    'small': {
+        'width_mm': 40, 'height_mm': 25, 'columns': 5, 'rows': 11,
+        'name_size': 6, 'price_size': 10,
+        'barcode': {'module_width': 0.18, 'module_height': 6.0, 'font_size': 6,
+                    'text_distance': 2.0, 'quiet_zone': 1.5, 'dpi': 300},
+    },
+}
+
+
+def is_ean13(code):
+    if not (code and len(code) == 13 and code.isdigit()):
+        return False
+    total = sum(int(d) * w for d, w in zip(code[:12], [1, 3] * 6))
+    return str((10 - total % 10) % 10) == code[12]
+
+
+def render_barcode_png(code, options):
+    """
+    Картинка штрих-кода (PNG, 1 бит). Чистая функция без Django —
+    выполняется и в дочерних процессах пула
+    """
+    import barcode
+    from barcode.writer import ImageWriter
+
+    symbology = 'ean13' if is_ean13(code) else 'code128'
+    buffer = BytesIO()
+    barcode.get(symbology, code, writer=ImageWriter(mode='1')).write(buffer, options=dict(options))
+    return buffer.getvalue()
+
+
+def _render_chunk(jobs):
+    return [render_barcode_png(code, options) for code, options in jobs]
+
+
+class LabelRenderer:
+    """
+    🏷️ Печать этикеток листами: PDF (все страницы) или PNG (одна страница).
+
+    Картинки штрих-кодов кэшируются по хэшу содержимого (код + параметры шаблона):
+    в памяти процесса (LRU) и на диске (LABEL_CACHE_DIR), общем для всех процессов.
+    Недостающие картинки большого тиража рисуются в пуле процессов.
+    """
+
+    def __init__(self):
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._reportlab_ready = False
+
+    @property
+    def cache_dir(self):
+        return getattr(settings, 'LABEL_CACHE_DIR', os.path.join(settings.MEDIA_ROOT, 'label_cache'))
+
+    @property
+    def memory_entries(self):
+        return getattr(settings, 'LABEL_CACHE_MEMORY_ENTRIES', 5000)
+
+    @property
+    def pool_threshold(self):
+        return getattr(settings, 'LABEL_RENDER_POOL_THRESHOLD', 200)
+
+    @property
+    def processes(self):
+        return getattr(settings, 'LABEL_RENDER_PROCESSES', os.cpu_count() or 1)
+
+    def template(self, name):
+        if name not in LABEL_TEMPLATES:
+            raise ValueError(f"Неизвестный шаблон этикетки: {name}. Доступны: {', '.join(LABEL_TEMPLATES)}")
+        return LABEL_TEMPLATES[name]
+
+    # === Данные ===
+
+    def items_for(self, store, product_ids, copies=1):
+        """Этикетки товаров магазина в порядке product_ids (copies экземпляров каждой)"""
+        from inventory.models import Product
+
+        products = Product.objects.filter(store=store, pk__in=product_ids).select_related('custom_unit')
+        by_id = {product.pk: product for product in products}
+        items = []
+        for product_id in product_ids:
+            product = by_id.get(product_id)
+            if product is None or not product.barcode:
+                continue
+            items.extend([{
+                'name': product.name,
+                'barcode': product.barcode,
+                'price': product.sale_price,
+                'unit': product.unit_display,
+            }] * copies)
+        return items
+
+    # === Кэш картинок штрих-кодов ===
+
+    def cache_key(self, code, template_name):
+        options = self.template(template_name)['barcode']
+        content = json.dumps([code, 'ean13' if is_ean13(code) else 'code128', options], sort_keys=True)
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f'{key}.png')
+
+    def _remember(self, key, png):
+        with self._lock:
+            self._memory[key] = png
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _store(self, key, png):
+        """Запись на диск атомарно (через временный файл)"""
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(png)
+        os.replace(temp_path, path)
+
+    def barcode_images(self, codes, template_name):
+        """{код: PNG} для всех кодов: память → диск → отрисовка (в пуле процессов для больших тиражей)"""
+        options = self.template(template_name)['barcode']
+        images, missing = {}, {}
+
+        for code in dict.fromkeys(codes):
+            key = self.cache_key(code, template_name)
+            with self._lock:
+                png = self._memory.get(key)
+                if png is not None:
+                    self._memory.move_to_end(key)
+            if png is None:
+                try:
+                    with open(self._disk_path(key), 'rb') as file:
+                        png = file.read()
+                    self._remember(key, png)
+                except FileNotFoundError:
+                    missing[code] = key
+                    continue
+            images[code] = png
+
+        if missing:
+            rendered = self._render_many(list(missing), options)
+            for code, png in zip(missing, rendered):
+                self._store(missing[code], png)
+                self._remember(missing[code], png)
+                images[code] = png
+            logger.info(f"🏷️ Нарисовано штрих-кодов: {len(missing)}, из кэша: {len(images) - len(missing)}")
+
+        return images
+
+    def _render_many(self, codes, options):
+        processes = min(self.processes, max(len(codes) // 50, 1))
+        if len(codes) < self.pool_threshold or processes <= 1:
+            return [render_barcode_png(code, options) for code in codes]
+
+        size = -(-len(codes) // processes)
+        chunks = [[(code, options) for code in codes[start:start + size]] for start in range(0, len(codes), size)]
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            return [png for chunk in executor.map(_render_chunk, chunks) for png in chunk]
+
+    # === Листы ===
+
+    def _pages(self, items, template):
+        per_page = template['columns'] * template['rows']
+        return [items[start:start + per_page] for start in range(0, len(items), per_page)]
+
+    def _cells(self, template):
+        """Левые нижние углы ячеек листа (мм), построчно сверху вниз"""
+        page_width, page_height = PAGE_SIZE_MM
+        margin_x = (page_width - template['columns'] * template['width_mm']) / 2
+        margin_y = (page_height - template['rows'] * template['height_mm']) / 2
+        return [
+            (margin_x + column * template['width_mm'],
+             page_height - margin_y - (row + 1) * template['height_mm'])
+            for row in range(template['rows'])
+            for column in range(template['columns'])
+        ]
+
+    def _setup_reportlab(self):
+        """
+        Однократная настройка ReportLab в процессе: шрифт с кириллицей и
+        двоичные потоки вместо ASCII85. ReportLab импортируется лениво (не
+        замедляет запуск), поэтому настройка — при первом PDF, а не при импорте
+        """
+        if self._reportlab_ready:
+            return
+        from reportlab import rl_config
+        from reportlab.lib.fonts import addMapping
+        from reportlab.pdfbase import pdfmetrics
+        from reportlab.pdfbase.ttfonts import TTFont
+
+        if FONT_NAME not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(TTFont(FONT_NAME, FONT_PATH))
+            addMapping(FONT_NAME, 0, 0, FONT_NAME)
+
+        # ASCII85 для картинок кодируется на чистом Python и занимает большую часть времени —
+        # двоичные потоки PDF его не требуют. Настройка глобальная: у Canvas такого параметра нет
+        rl_config.useA85 = 0
+        self._reportlab_ready = True
+
+    def render_pdf(self, items, template_name='shelf'):
+        """PDF со всеми страницами во временном файле (большие тиражи уходят на диск)"""
+        from PIL import Image
+        from reportlab.lib.units import mm
+        from reportlab.lib.utils import ImageReader
+        from reportlab.pdfgen import canvas
+
+        template = self.template(template_name)
+        images = self.barcode_images([item['barcode'] for item in items], template_name)
+        readers = {}
+        self._setup_reportlab()
+
+        output = tempfile.SpooledTemporaryFile(max_size=10 * 1024 * 1024)
+        pdf = canvas.Canvas(output, pagesize=(PAGE_SIZE_MM[0] * mm, PAGE_SIZE_MM[1] * mm))
+        pages = self._pages(items, template)
+        cells = self._cells(template)
+        width, height = template['width_mm'], template['height_mm']
+        dpi = template['barcode']['dpi']
+
+        for page in pages:
+            for item, (x, y) in zip(page, cells):
+                reader = readers.get(item['barcode'])
+                if reader is None:
+                    # Оттенки серого вместо RGB: втрое меньше данных на сжатие
+                    bitmap = Image.open(BytesIO(images[item['barcode']])).convert('L')
+                    reader = readers[item['barcode']] = ImageReader(bitmap)
+                image_width, image_height = reader.getSize()
+                draw_width = min(image_width / dpi * MM_PER_INCH, width - 4)
+                draw_height = draw_width * image_height / image_width
+
+                pdf.setFont(FONT_NAME, template['name_size'])
+                pdf.drawString((x + 2) * mm, (y + height - 2) * mm - template['name_size'], item['name'][:40])
+                pdf.setFont(FONT_NAME, template['price_size'])
+                pdf.drawString(
+                    (x + 2) * mm, (y + height - 4) * mm - template['name_size'] - template['price_size'],
+                    f"{item['price']:.2f} / {item['unit']}"
+                )
+                pdf.drawImage(
+                    reader, (x + (width - draw_width) / 2) * mm, (y + 1) * mm,
+                    width=draw_width * mm, height=draw_height * mm
+                )
+            pdf.showPage()
+
+        pdf.save()
+        output.seek(0)
+        return output, len(pages)
+
+    def render_png(self, items, template_name='shelf', page=1):
+        """Одна страница листа в PNG. Возвращает (файл, число страниц)"""
+        from PIL import Image, ImageDraw, ImageFont
+
+        template = self.template(template_name)
+        pages = self._pages(items, template)
+        if not 1 <= page <= max(len(pages), 1):
+            raise ValueError(f"Нет страницы {page}: всего {len(pages)}")
+        page_items = pages[page - 1] if pages else []
+        images = self.barcode_images([item['barcode'] for item in page_items], template_name)
+
+        dpi = template['barcode']['dpi']
+        px = dpi / MM_PER_INCH
+        sheet = Image.new('L', (round(PAGE_SIZE_MM[0] * px), round(PAGE_SIZE_MM[1] * px)), 255)
+        draw = ImageDraw.Draw(sheet)
+        name_font = ImageFont.truetype(FONT_PATH, round(template['name_size'] * dpi / 72))
+        price_font = ImageFont.truetype(FONT_PATH, round(template['price_size'] * dpi / 72))
+
+        for item, (x, y) in zip(page_items, self._cells(template)):
+            left = round((x + 2) * px)
+            top = round((PAGE_SIZE_MM[1] - y - template['height_mm'] + 2) * px)
+            draw.text((left, top), item['name'][:40], font=name_font, fill=0)
+            draw.text((left, top + name_font.size + 4), f"{item['price']:.2f} / {item['unit']}", font=price_font, fill=0)
+
+            bitmap = Image.open(BytesIO(images[item['barcode']]))
+            max_width = round((template['width_mm'] - 4) * px)
+            if bitmap.width > max_width:
+                bitmap = bitmap.resize((max_width, round(bitmap.height * max_width / bitmap.width)))
+            sheet.paste(
+                bitmap.convert('L'),
+                (round((x + (template['width_mm'] - bitmap.width / px) / 2) * px),
+                 round((PAGE_SIZE_MM[1] - y - 1) * px) - bitmap.height)
+            )
+
+        output = BytesIO()
+        sheet.save(output, format='PNG', dpi=(dpi, dpi))
+        output.seek(0)
+        return output, len(pages)
+
+    def product_image(self, barcode, template_name='shelf'):
+        """PNG штрих-кода одного товара и ключ кэша (для ETag)"""
+        return self.barcode_images([barcode], template_name)[barcode], self.cache_key(barcode, template_name)
+
+
+label_renderer = LabelRenderer()
@@ -0,0 +1,184 @@
+# inventory/services/price_stats.py
+import logging
+import threading
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db.models import OuterRef, Subquery, Sum, Min, Count, F, DecimalField, IntegerField
+from django.db.models.functions import Coalesce
+
+from inventory.models import Product, ProductBatch
+from inventory.services.barcode_index import barcode_index
+
+logger = logging.getLogger('inventory')
+
+PRICE_QUANT = Decimal('0.01')
+
+
+class ProductPriceStats:
+    """
+    💰 Кэш закупочных цен товара (денормализованные колонки Product):
+    средневзвешенная и минимальная цена активных партий, последняя цена
+    закупки и число активных партий.
+
+    Пересчитывается по партиям только затронутых товаров: один SELECT
+    с подзапросами на все товары и один UPDATE изменившихся строк.
+    Внутри deferred() пересчет откладывается до выхода из блока — так
+    массовое списание по партиям дает один пересчет на все товары.
+    """
+
+    FIELDS = (
+        'cached_average_purchase_price',
+        'cached_min_purchase_price',
+        'cached_last_purchase_price',
+        'cached_batches_count',
+    )
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _active_batches(self):
+        return ProductBatch.objects.filter(product=OuterRef('pk'), quantity__gt=0).values('product')
+
+    def _priced_batches(self):
+        return self._active_batches().filter(purchase_price__isnull=False)
+
+    def annotations(self):
+        """Подзапросы статистики цен по партиям (для annotate() по Product)"""
+        decimal = DecimalField(max_digits=24, decimal_places=5)
+        return {
+            '_batches_cost': Subquery(
+                self._priced_batches().annotate(
+                    value=Sum(F('purchase_price') * F('quantity'), output_field=decimal)
+                ).values('value'),
+                output_field=decimal
+            ),
+            '_batches_quantity': Subquery(
+                self._priced_batches().annotate(value=Sum('quantity')).values('value'),
+                output_field=decimal
+            ),
+            '_batches_min_price': Subquery(
+                self._priced_batches().annotate(value=Min('purchase_price')).values('value'),
+                output_field=DecimalField(max_digits=12, decimal_places=2)
+            ),
+            '_batches_count': Coalesce(
+                Subquery(
+                    self._active_batches().annotate(value=Count('pk')).values('value'),
+                    output_field=IntegerField()
+                ),
+                0
+            ),
+            '_batches_last_price': Subquery(
+                ProductBatch.objects.filter(
+                    product=OuterRef('pk'),
+                    purchase_price__isnull=False
+                ).order_by('-created_at', '-pk').values('purchase_price')[:1],
+                output_field=DecimalField(max_digits=12, decimal_places=2)
+            ),
+        }
+
+    def refresh(self, products):
+        """
+        Пересчитывает кэш цен товаров (объекты Product или их id).
+        Переданные объекты обновляются и в памяти. Возвращает число измененных строк
+        """
+        instances = {}
+        for product in products:
+            if isinstance(product, Product):
+                instances.setdefault(product.pk, []).append(product)
+            else:
+                instances.setdefault(product, [])
+        product_ids = [pk for pk in instances if pk is not None]
+        if not product_ids:
+            return 0
+
+        changed = []
+        rows = Product.all_objects.filter(pk__in=product_ids).annotate(
+            **self.annotations()
+        ).values('pk', *self.FIELDS, *self.annotations())
+
+        for row in rows:
+            cost, quantity = row['_batches_cost'], row['_batches_quantity']
+            stats = {
+                'cached_average_purchase_price': (
+                    (Decimal(cost) / Decimal(quantity)).quantize(PRICE_QUANT) if quantity else None
+                ),
+                'cached_min_purchase_price': row['_batches_min_price'],
+                'cached_last_purchase_price': row['_batches_last_price'],
+                'cached_batches_count': row['_batches_count'],
+            }
+            for instance in instances[row['pk']]:
+                for field, value in stats.items():
+                    setattr(instance, field, value)
+            if any(row[field] != value for field, value in stats.items()):
+                changed.append(Product(pk=row['pk'], **stats))
+
+        if changed:
+            Product.all_objects.bulk_update(changed, self.FIELDS)
+            barcode_index.invalidate(product_ids=[product.pk for product in changed])
+        return len(changed)
+
+    def store(self, stats, current=None):
+        """
+        Записывает уже посчитанный кэш цен {product_id: {поле: значение}}
+        (например, из плана FIFO-списания) без пересчета по партиям.
+        current — кэш до изменения: неизменившиеся товары не пишутся.
+        Товары снимаются с отложенного пересчета deferred(). Возвращает число измененных строк
+        """
+        if not stats:
+            return 0
+        pending = getattr(self._local, 'pending', None)
+        if pending is not None:
+            pending[:] = [
+                product for product in pending
+                if (product.pk if isinstance(product, Product) else product) not in stats
+            ]
+
+        current = current or {}
+        changed = [
+            Product(pk=product_id, **values)
+            for product_id, values in stats.items()
+            if any(current.get(product_id, {}).get(field, ...) != value for field, value in values.items())
+        ]
+        if changed:
+            fields = sorted({field for values in stats.values() for field in values})
+            Product.all_objects.bulk_update(changed, fields)
+            barcode_index.invalidate(product_ids=[product.pk for product in changed])
+        return len(changed)
+
+    def touch(self, products):
+        """Партии товаров изменились: пересчет сразу или по выходу из deferred()"""
+        pending = getattr(self._local, 'pending', None)
+        if pending is None:
+            return self.refresh(products)
+        pending.extend(products)
+        return 0
+
+    @contextmanager
+    def deferred(self):
+        """Копит затронутые товары и пересчитывает их одним вызовом на выходе"""
+        if getattr(self._local, 'pending', None) is not None:
+            yield
+            return
+
+        self._local.pending = []
+        try:
+            yield
+            pending = self._local.pending
+        finally:
+            self._local.pending = None
+        if pending:
+            self.refresh(pending)
+
+    def rebuild(self, queryset=None, batch_size=500):
+        """Полный пересчет кэша цен (по умолчанию — всех товаров). Возвращает (всего, изменено)"""
+        queryset = Product.all_objects.all() if queryset is None else queryset
+        product_ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+        changed = 0
+        for start in range(0, len(product_ids), batch_size):
+            changed += self.refresh(product_ids[start:start + batch_size])
+        logger.info(f"💰 Кэш цен пересчитан: товаров {len(product_ids)}, изменено {changed}")
+        return len(product_ids), changed
+
+
+price_stats = ProductPriceStats()
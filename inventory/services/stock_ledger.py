@@ -0,0 +1,206 @@
+# inventory/services/stock_ledger.py
+import logging
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction as db_transaction
+from django.db.models import Case, When, F, Value, DecimalField, Sum
+from django.utils import timezone
+
+from inventory.models import Stock, StockHistory
+from inventory.services.barcode_index import barcode_index
+
+logger = logging.getLogger('inventory')
+
+
+class StockLedger:
+    """
+    📒 Единственный путь изменения остатков.
+    StockHistory — журнал движений (только добавление),
+    Stock.quantity — материализованный баланс по журналу.
+
+    Любое движение = запись в журнал + изменение баланса. За один вызов post()
+    все движения пишутся одним INSERT, а балансы — одним UPDATE ... CASE.
+
+    Движение — словарь:
+    {
+        'product': Product,            # обязателен
+        'quantity_change': Decimal,    # со знаком: + приход, - расход
+        'operation_type': 'SALE' | 'INCOMING' | 'RETURN' | 'CORRECTION' | ...,
+        'store_id', 'reference_id', 'user_id', 'size_id', 'batch_id',
+        'purchase_price', 'sale_price', 'notes', 'is_automatic'  # необязательные
+    }
+    """
+
+    def lock_balances(self, products):
+        """
+        Блокирует строки остатков товаров одним SELECT ... FOR UPDATE.
+        Недостающие Stock создаются с нулевым балансом.
+        Возвращает {product_id: Stock}
+        """
+        products = {product.pk: product for product in products}
+        balances = {
+            stock.product_id: stock
+            for stock in Stock.objects.select_for_update().filter(product_id__in=list(products))
+        }
+
+        missing = [product for product_id, product in products.items() if product_id not in balances]
+        if missing:
+            Stock.objects.bulk_create(
+                [Stock(product=product, store_id=product.store_id, quantity=0) for product in missing],
+                ignore_conflicts=True
+            )
+            for stock in Stock.objects.select_for_update().filter(product__in=missing):
+                balances[stock.product_id] = stock
+
+        return balances
+
+    def post(self, movements, balances=None):
+        """
+        Проводит движения: один INSERT в журнал, один UPDATE балансов.
+        balances — уже заблокированные остатки (из lock_balances), если есть.
+        Возвращает созданные записи журнала
+        """
+        movements = [m for m in movements if m['quantity_change']]
+        if not movements:
+            return []
+
+        with db_transaction.atomic(savepoint=False):
+            if balances is None:
+                products = {m['product'].pk: m['product'] for m in movements}
+                balances = self.lock_balances(products.values())
+
+            now = timezone.now()
+            running = {product_id: stock.quantity for product_id, stock in balances.items()}
+            deltas = defaultdict(Decimal)
+            entries = []
+
+            for movement in movements:
+                product = movement['product']
+                change = Decimal(str(movement['quantity_change']))
+                quantity_before = running[product.pk]
+                quantity_after = quantity_before + change
+                running[product.pk] = quantity_after
+                deltas[product.pk] += change
+
+                notes = movement.get('notes')
+                entries.append(StockHistory(
+                    product=product,
+                    store_id=movement.get('store_id') or product.store_id,
+                    batch_id=movement.get('batch_id'),
+                    quantity_before=quantity_before,
+                    quantity_after=quantity_after,
+                    quantity_change=change,
+                    operation_type=movement['operation_type'],
+                    reference_id=movement.get('reference_id'),
+                    user_id=movement.get('user_id'),
+                    size_id=movement.get('size_id'),
+                    purchase_price_at_time=movement.get('purchase_price'),
+                    sale_price_at_time=movement.get('sale_price'),
+                    notes=notes.replace(":", "-") if notes else notes,
+                    is_automatic=movement.get('is_automatic', True),
+                    timestamp=now
+                ))
+
+            StockHistory.objects.bulk_create(entries)
+
+            Stock.objects.filter(pk__in=[balances[product_id].pk for product_id in deltas]).update(
+                quantity=Case(
+                    *[
+                        When(pk=balances[product_id].pk, then=F('quantity') + Value(delta))
+                        for product_id, delta in deltas.items()
+                    ],
+                    output_field=DecimalField(max_digits=12, decimal_places=3)
+                ),
+                updated_at=now
+            )
+
+        for product_id in deltas:
+            balances[product_id].quantity = running[product_id]
+        barcode_index.invalidate(product_ids=list(deltas))
+
+        return entries
+
+    def set_balance(self, stock, quantity, operation_type='CORRECTION', **extra):
+        """
+        Приводит баланс к заданному значению корректирующим движением
+        """
+        with db_transaction.atomic(savepoint=False):
+            balances = self.lock_balances([stock.product])
+            current = balances[stock.product_id].quantity
+            delta = Decimal(str(quantity)) - current
+            entries = self.post([{
+                'product': stock.product,
+                'quantity_change': delta,
+                'operation_type': operation_type,
+                **extra
+            }], balances=balances)
+        stock.quantity = balances[stock.product_id].quantity
+        return entries
+
+    def ledger_balances(self, store=None):
+        """Балансы по журналу: {product_id: сумма quantity_change} одним GROUP BY"""
+        entries = StockHistory.objects.all()
+        if store is not None:
+            entries = entries.filter(store=store)
+        return dict(
+            entries.values('product_id')
+            .annotate(total=Sum('quantity_change'))
+            .values_list('product_id', 'total')
+        )
+
+    def reconcile(self, store=None, execute=False):
+        """
+        Пересчитывает Stock.quantity из журнала.
+        Возвращает список расхождений [(stock, баланс_по_журналу), ...]
+        """
+        ledger = self.ledger_balances(store)
+        stocks = Stock.objects.all()
+        if store is not None:
+            stocks = stocks.filter(store=store)
+
+        mismatched = []
+        for stock in stocks.only('id', 'product_id', 'store_id', 'quantity'):
+            expected = ledger.get(stock.product_id, Decimal('0'))
+            if stock.quantity != expected:
+                mismatched.append((stock, expected))
+
+        if execute and mismatched:
+            Stock.objects.bulk_update(
+                [Stock(pk=stock.pk, quantity=expected) for stock, expected in mismatched],
+                ['quantity'],
+                batch_size=500
+            )
+            logger.info(f"✅ Пересчитано остатков по журналу: {len(mismatched)}")
+
+        return mismatched
+
+    def open_balances(self, store=None, execute=False):
+        """
+        Перевод исторических данных на журнал: для остатков, не совпадающих
+        с журналом, пишутся входящие корректировки (баланс не меняется).
+        Возвращает список расхождений [(stock, баланс_по_журналу), ...]
+        """
+        mismatched = self.reconcile(store=store, execute=False)
+
+        if execute and mismatched:
+            now = timezone.now()
+            StockHistory.objects.bulk_create([
+                StockHistory(
+                    product_id=stock.product_id,
+                    store_id=stock.store_id,
+                    quantity_before=expected,
+                    quantity_after=stock.quantity,
+                    quantity_change=stock.quantity - expected,
+                    operation_type='CORRECTION',
+                    notes='Входящий остаток журнала',
+                    timestamp=now
+                )
+                for stock, expected in mismatched
+            ], batch_size=500)
+            logger.info(f"✅ Входящих остатков записано в журнал: {len(mismatched)}")
+
+        return mismatched
+
+
+stock_ledger = StockLedger()
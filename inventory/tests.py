@@ -1,3 +1,131 @@
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+
 from django.test import TestCase
 
-# Create your tests here.
+from inventory.models import ProductBatch, Stock
+from inventory.services.batch_allocator import batch_allocator
+from inventory.services.price_stats import price_stats
+from stores.management.bench import create_bench_store
+
+
+def legacy_fifo(batches, quantity):
+    """
+    Эталон: прежняя логика Stock.sell / ProductBatch.sell по одной партии.
+    Возвращает {batch_id: остаток} (None — партия удалена)
+    """
+    result = {}
+    remaining = quantity
+    for batch_id, batch_quantity in batches:
+        if remaining <= 0:
+            result[batch_id] = batch_quantity
+            continue
+        sell_amount = min(remaining, batch_quantity)
+        left = batch_quantity - sell_amount
+        remaining -= sell_amount
+        result[batch_id] = left if left > 0 else None
+    return result
+
+
+class FifoBatchAllocatorTests(TestCase):
+    """FIFO-аллокатор партий против прежнего пошагового списания"""
+
+    def setUp(self):
+        self.rng = random.Random(42)
+        self.store, self.user, products = create_bench_store(products=1, batches_per_product=0)
+        self.product = products[0]
+
+    def _create_batches(self, count):
+        today = date.today()
+        for _ in range(count):
+            ProductBatch.objects.create(
+                store=self.store,
+                product=self.product,
+                quantity=Decimal(self.rng.randint(1, 20)),
+                purchase_price=Decimal(self.rng.randint(1000, 5000)) / 100,
+                expiration_date=today + timedelta(days=self.rng.randint(1, 10))
+            )
+
+    def _active_batches(self):
+        return list(
+            ProductBatch.objects.filter(product=self.product, quantity__gt=0)
+            .order_by(*batch_allocator.ORDERING)
+            .values_list('id', 'quantity')
+        )
+
+    def _assert_price_cache_fresh(self):
+        """Кэш цен после списания совпадает с пересчетом по партиям"""
+        self.assertEqual(price_stats.refresh([self.product.pk]), 0)
+
+    def test_plan_matches_legacy_loop(self):
+        for _ in range(500):
+            batches = [
+                ProductBatch(
+                    id=index + 1,
+                    product_id=1,
+                    quantity=Decimal(self.rng.randint(1, 5000)) / 1000 * self.rng.choice([1, 10, 100]),
+                    purchase_price=Decimal(self.rng.randint(100, 10000)) / 100
+                )
+                for index in range(self.rng.randint(1, 30))
+            ]
+            available = sum(batch.quantity for batch in batches)
+            quantity = (available * Decimal(self.rng.randint(1, 1000)) / 1000).quantize(Decimal('0.001'))
+            if quantity <= 0:
+                continue
+
+            plan = batch_allocator.build_plan(batches, {1: quantity})
+            actual = {batch.id: batch.quantity for batch in batches}
+            for allocation in plan['allocations']:
+                left = allocation['quantity_after']
+                actual[allocation['batch_id']] = left if left > 0 else None
+
+            self.assertEqual(actual, legacy_fifo([(b.id, b.quantity) for b in batches], quantity))
+            self.assertEqual(plan['unallocated'], {})
+
+    def test_stock_sell_matches_legacy_loop(self):
+        self._create_batches(25)
+        stock = Stock.objects.select_related('product').get(product=self.product)
+
+        while True:
+            batches = self._active_batches()
+            if not batches:
+                break
+            quantity = min(Decimal(self.rng.randint(1, 15)), sum(q for _, q in batches))
+            expected = {k: v for k, v in legacy_fifo(batches, quantity).items() if v is not None}
+
+            stock.sell(quantity)
+
+            self.assertEqual(
+                dict(ProductBatch.objects.filter(product=self.product).values_list('id', 'quantity')),
+                expected
+            )
+            self._assert_price_cache_fresh()
+
+        self.assertEqual(Stock.objects.get(pk=stock.pk).quantity, 0)
+
+    def test_partial_sale_round_trips(self):
+        """
+        Продажа без опустевших партий: блокировка остатка, выборка партий с
+        кэшем цен, UPDATE партий, UPDATE кэша цен, запись в журнал, UPDATE остатка
+        (плюс SAVEPOINT/RELEASE: в тесте продажа идет внутри транзакции)
+        """
+        self._create_batches(3)
+        stock = Stock.objects.select_related('product').get(product=self.product)
+        first = self._active_batches()[0][1]
+
+        with self.assertNumQueries(8):
+            stock.sell(first / 2)
+        self._assert_price_cache_fresh()
+
+    def test_emptying_newest_priced_batch_recomputes_price_cache(self):
+        self._create_batches(3)
+        ProductBatch.objects.filter(product=self.product).update(expiration_date=None)
+        stock = Stock.objects.select_related('product').get(product=self.product)
+
+        stock.sell(sum(quantity for _, quantity in self._active_batches()))
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.cached_batches_count, 0)
+        self.assertIsNone(self.product.cached_average_purchase_price)
+        self._assert_price_cache_fresh()
@@ -97,6 +97,7 @@ urlpatterns = [
 - PATCH  batches/{id}/                  - Частично обновить партию
 - DELETE batches/{id}/                  - Удалить партию
 - GET    batches/expiring_soon/         - Партии с истекающим сроком
+- GET    batches/export/                - Выгрузка закупок за период (CSV/XLSX)
 
 ОСТАТКИ НА СКЛАДЕ:
 - GET    stock/                         - Список остатков
@@ -130,7 +131,8 @@ urlpatterns = [
 
 МЕДИА:
 - GET    media/<path>                   - Получить медиа файл
-- GET    products/{id}/label/           - Получить этикетку товара
+- GET    products/{id}/label/           - Получить этикетку товара (ETag, без картинки — штрих-код)
+- POST   products/labels/               - Лист этикеток для печати (PDF или страница PNG)
 
 НОВЫЕ ВОЗМОЖНОСТИ:
 ✅ Пользовательские единицы измерения
@@ -18,6 +18,7 @@ from django.core.exceptions import ValidationError
 from rest_framework import pagination
 from .pagination import OptionalPagination
 from stores.mixins import StoreViewSetMixin, StoreSerializerMixin, StorePermissionMixin, StorePermissionWrapper
+from stores.business_date import business_date, range_lookups
 from decimal import Decimal
 from django.utils import timezone
 from rest_framework.permissions import IsAuthenticated
@@ -46,9 +47,14 @@ from .serializers import (
 )
 
 from .filters import ProductFilter, ProductBatchFilter, StockFilter, SizeInfoFilter
-from .pagination import CustomLimitOffsetPagination
+from .services.stock_ledger import stock_ledger
+from .services.barcode_index import barcode_index
+from .pagination import CustomLimitOffsetPagination, StockHistoryPagination
+from stores.pagination import KEYSET_QUERY_PARAMETERS
+from stores.renderers import EXPORT_RENDERERS, EXPORT_QUERY_PARAMETERS
+from stores.services.tabular_export import tabular_export
 # в одном из ваших приложений views.py
-from django.http import HttpResponse, Http404
+from django.http import HttpResponse, Http404, FileResponse
 from django.conf import settings
 import os
 
@@ -63,17 +69,68 @@ def serve_media(request, path):
         raise Http404
 
 
-class StockHistoryViewSet(viewsets.ReadOnlyModelViewSet):
-    """Просмотр истории изменений запасов"""
+class StockHistoryViewSet(StoreViewSetMixin, viewsets.ReadOnlyModelViewSet):
+    """Просмотр истории изменений запасов (keyset-пагинация по времени операции)"""
     serializer_class = StockHistorySerializer
-    permission_classes = [StorePermissionMixin]
-    
+    permission_classes = [IsAuthenticated, StorePermissionWrapper]
+    pagination_class = StockHistoryPagination
+    queryset = StockHistory.objects.all()
+
     def get_queryset(self):
-        store = self.get_current_store()
-        return StockHistory.objects.filter(store=store).select_related(
+        return super().get_queryset().select_related(
             'product', 'store', 'size', 'batch', 'user'
-        ).order_by('-timestamp')
-    
+        )
+
+    @swagger_auto_schema(
+        operation_description="История изменений запасов текущего магазина, новые сверху",
+        manual_parameters=KEYSET_QUERY_PARAMETERS,
+        responses={200: StockHistorySerializer(many=True)}
+    )
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    export_columns = [
+        ('Время', 'timestamp'),
+        ('Товар', 'product__name'),
+        ('Штрих-код', 'product__barcode'),
+        ('Операция', 'operation_type'),
+        ('Было', 'quantity_before'),
+        ('Изменение', 'quantity_change'),
+        ('Стало', 'quantity_after'),
+        ('Партия', 'batch_id'),
+        ('Размер', 'size__size'),
+        ('Документ', 'reference_id'),
+        ('Сотрудник', 'user__username'),
+        ('Цена закупки', 'purchase_price_at_time'),
+        ('Цена продажи', 'sale_price_at_time'),
+        ('Примечание', 'notes'),
+    ]
+
+    @swagger_auto_schema(
+        operation_description="Выгрузка истории запасов за период (CSV/XLSX потоком)",
+        manual_parameters=EXPORT_QUERY_PARAMETERS,
+        responses={200: 'Файл CSV или XLSX'}
+    )
+    @action(detail=False, methods=['get'], renderer_classes=EXPORT_RENDERERS)
+    def export(self, request):
+        store = self.get_current_store()
+        if not store:
+            return Response({'error': 'Магазин не определен'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            date_from, date_to = tabular_export.period(request.query_params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Индекс (store, timestamp, id): диапазон и порядок без сортировки
+        history = StockHistory.objects.filter(
+            store=store, **range_lookups('timestamp', date_from, date_to)
+        ).order_by('timestamp', 'id')
+        return tabular_export.response(
+            history, self.export_columns,
+            tabular_export.filename('stock_history', date_from, date_to),
+            request.accepted_renderer.format,
+        )
+
     @action(detail=False, methods=['get'])
     def trends(self, request):
         """Тренды стока по продуктам"""
@@ -675,6 +732,7 @@ class ProductViewSet(
     ordering = ['-created_at']
 
     queryset = Product.objects.select_related(
+        "store",
         "category", 
         "stock", 
         "default_size",
@@ -806,54 +864,48 @@ class ProductViewSet(
         if not current_store:
             return Response({'error': 'Магазин не определен'}, status=400)
 
-        from django.db.models import Avg, Min, Max, Count
-
-        # Анализ по всем товарам
-        products = Product.objects.filter(store=current_store)
-        
-        pricing_stats = []
-        
-        for product in products:
-            avg_purchase = product.average_purchase_price
-            last_purchase = product.last_purchase_price
-            min_purchase = product.min_purchase_price
-            
-            if avg_purchase and avg_purchase > 0:
-                margin = ((product.sale_price - avg_purchase) / avg_purchase) * 100
-                
-                pricing_stats.append({
-                    'product_id': product.id,
-                    'product_name': product.name,
-                    'sale_price': float(product.sale_price),
-                    'purchase_prices': {
-                        'average': float(avg_purchase) if avg_purchase else None,
-                        'last': float(last_purchase) if last_purchase else None,
-                        'minimum': float(min_purchase) if min_purchase else None,
-                    },
-                    'margin_percent': round(margin, 2),
-                    'below_min_markup': margin < float(current_store.min_markup_percent),
-                    'batches_count': product.batches.filter(quantity__gt=0).count(),
-                    'unit_display': product.unit_display
-                })
+        # Фильтрация, сортировка по марже и сводка — одним запросом в SQL
+        products = list(
+            Product.objects.filter(store=current_store)
+            .select_related('custom_unit')
+            .with_price_stats()
+            .filter(purchase_price_avg__gt=0)
+            .with_price_summary()
+            .order_by('margin_percent', 'pk')[:50]  # Первые 50 для производительности
+        )
 
-        # Сортируем по марже
-        pricing_stats.sort(key=lambda x: x['margin_percent'])
+        pricing_stats = [
+            {
+                'product_id': product.id,
+                'product_name': product.name,
+                'sale_price': float(product.sale_price),
+                'purchase_prices': {
+                    'average': float(product.purchase_price_avg),
+                    'last': float(product.purchase_price_last) if product.purchase_price_last else None,
+                    'minimum': float(product.purchase_price_min) if product.purchase_price_min else None,
+                },
+                'margin_percent': round(product.margin_percent, 2),
+                'below_min_markup': product.below_min_markup,
+                'batches_count': product.active_batches,
+                'unit_display': product.unit_display
+            }
+            for product in products
+        ]
 
-        # Статистика
-        margins = [p['margin_percent'] for p in pricing_stats if p['margin_percent'] is not None]
-        
+        # Статистика (оконные агрегаты по всей выборке)
+        totals = products[0] if products else None
         summary = {
-            'total_products': len(pricing_stats),
-            'products_below_min_markup': len([p for p in pricing_stats if p['below_min_markup']]),
-            'average_margin': round(sum(margins) / len(margins), 2) if margins else 0,
-            'min_margin': min(margins) if margins else 0,
-            'max_margin': max(margins) if margins else 0,
+            'total_products': totals.summary_total if totals else 0,
+            'products_below_min_markup': totals.summary_below_markup if totals else 0,
+            'average_margin': round(totals.summary_avg_margin, 2) if totals else 0,
+            'min_margin': round(totals.summary_min_margin, 2) if totals else 0,
+            'max_margin': round(totals.summary_max_margin, 2) if totals else 0,
             'store_min_markup': float(current_store.min_markup_percent)
         }
 
         return Response({
             'summary': summary,
-            'products': pricing_stats[:50],  # Первые 50 для производительности
+            'products': pricing_stats,
             'store': {
                 'id': str(current_store.id),
                 'name': current_store.name,
@@ -1191,7 +1243,7 @@ class ProductViewSet(
    
     @action(detail=False, methods=['get'])
     def scan_barcode(self, request):
-        """Сканирование штрих-кода - ищет только в текущем магазине"""
+        """Сканирование штрих-кода - ищет только в текущем магазине, отдает краткую карточку товара"""
         barcode = request.query_params.get('barcode')
         if not barcode:
             return Response(
@@ -1212,35 +1264,19 @@ class ProductViewSet(
                 }
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        # ✅ ИСПРАВЛЕНИЕ: Добавляем логирование для отладки
-        logger.info(f"🔍 Scanning barcode: '{barcode}' in store: {current_store.name} (ID: {current_store.id})")
-
-        # Ищем товар в текущем магазине
-        product = Product.objects.filter(
-            store=current_store,
-            barcode=barcode
-        ).select_related('category', 'stock').first()
-
-        # ✅ ИСПРАВЛЕНИЕ: Дополнительная отладочная информация
-        if not product:
-            # Проверяем, есть ли товар с таким штрих-кодом в других магазинах
-            other_stores_count = Product.objects.filter(barcode=barcode).exclude(store=current_store).count()
-            all_products_count = Product.objects.filter(barcode=barcode).count()
-
-            logger.warning(f"❌ Product not found. Barcode: '{barcode}', Current store: {current_store.id}, "
-                          f"Products with this barcode in other stores: {other_stores_count}, "
-                          f"Total products with this barcode: {all_products_count}")
+        # Краткая карточка из индекса в памяти (без запросов при попадании)
+        product = barcode_index.lookup(current_store, barcode)
 
         if product:
-            logger.info(f"✅ Product found: {product.name} (ID: {product.id})")
-            serializer = self.get_serializer(product)
+            logger.debug(f"✅ Product found: {product['name']} (ID: {product['id']})")
             return Response({
                 'found': True,
-                'product': serializer.data,
+                'product': product,
                 'message': _('Товар найден')
             })
         else:
             # Товар не найден, возвращаем категории текущего магазина
+            logger.info(f"❌ Product not found. Barcode: '{barcode}', store: {current_store.id}")
             categories = ProductCategory.objects.filter(store=current_store)
 
             return Response({
@@ -1255,6 +1291,56 @@ class ProductViewSet(
                 }
             })
 
+    @action(detail=False, methods=['post'])
+    def labels(self, request):
+        """
+        Лист этикеток для печати.
+        Тело: product_ids (список), template (shelf | small), format (pdf | png), copies, page (для png)
+        """
+        from .services.label_renderer import label_renderer
+
+        current_store = self.get_current_store()
+        if not current_store:
+            return Response({'error': 'Магазин не определен'}, status=status.HTTP_400_BAD_REQUEST)
+
+        product_ids = request.data.get('product_ids') or []
+        template_name = request.data.get('template', 'shelf')
+        output_format = request.data.get('format', 'pdf')
+        try:
+            product_ids = [int(product_id) for product_id in product_ids]
+            copies = max(int(request.data.get('copies', 1)), 1)
+            page = int(request.data.get('page', 1))
+            label_renderer.template(template_name)
+        except (TypeError, ValueError) as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if output_format not in ('pdf', 'png'):
+            return Response({'error': 'format: pdf или png'}, status=status.HTTP_400_BAD_REQUEST)
+
+        items = label_renderer.items_for(current_store, product_ids, copies=copies)
+        if not items:
+            return Response(
+                {'error': _('Нет товаров со штрих-кодом для печати')},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            if output_format == 'png':
+                output, pages = label_renderer.render_png(items, template_name, page=page)
+            else:
+                output, pages = label_renderer.render_pdf(items, template_name)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        logger.info(f"🏷️ Лист этикеток: {len(items)} шт., страниц {pages}, магазин {current_store.id}")
+        response = FileResponse(
+            output,
+            content_type='application/pdf' if output_format == 'pdf' else 'image/png',
+            filename=f'labels.{output_format}'
+        )
+        response['X-Total-Pages'] = str(pages)
+        return response
+
     @action(detail=True, methods=['post'])
     def sell(self, request, pk=None):
         """
@@ -1785,6 +1871,48 @@ class ProductBatchViewSet(StoreViewSetMixin, ModelViewSet):
             'expiring_within_days': days
         })
 
+    export_columns = [
+        ('Дата', 'created_at'),
+        ('Товар', 'product__name'),
+        ('Штрих-код', 'product__barcode'),
+        ('Размер', 'size__size'),
+        ('Количество', 'quantity'),
+        ('Цена закупки', 'purchase_price'),
+        ('Сумма', 'total_cost'),
+        ('Поставщик', 'supplier'),
+        ('Накладная', 'invoice_number'),
+        ('Срок годности', 'expiration_date'),
+    ]
+
+    @swagger_auto_schema(
+        operation_description="Выгрузка закупок (партий) за период (CSV/XLSX потоком)",
+        manual_parameters=EXPORT_QUERY_PARAMETERS,
+        responses={200: 'Файл CSV или XLSX'}
+    )
+    @action(detail=False, methods=['get'], renderer_classes=EXPORT_RENDERERS)
+    def export(self, request):
+        store = self.get_current_store()
+        if not store:
+            return Response({'error': 'Магазин не определен'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            date_from, date_to = tabular_export.period(request.query_params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        batches = ProductBatch.objects.filter(
+            store=store, **range_lookups('created_at', date_from, date_to)
+        ).annotate(
+            total_cost=models.ExpressionWrapper(
+                F('quantity') * F('purchase_price'),
+                output_field=models.DecimalField(max_digits=24, decimal_places=5)
+            )
+        ).order_by('created_at', 'id')
+        return tabular_export.response(
+            batches, self.export_columns,
+            tabular_export.filename('purchases', date_from, date_to),
+            request.accepted_renderer.format,
+        )
+
 
 class StockViewSet(StoreViewSetMixin, ModelViewSet):
     """
@@ -1837,8 +1965,13 @@ class StockViewSet(StoreViewSetMixin, ModelViewSet):
             )
 
         old_quantity = stock.quantity
-        stock.quantity = new_quantity
-        stock.save()
+        stock_ledger.set_balance(
+            stock,
+            new_quantity,
+            user_id=request.user.id,
+            notes=reason,
+            is_automatic=False
+        )
 
         logger.info(
             f"Корректировка остатков {stock.product.name}: "
@@ -2563,7 +2696,7 @@ class InventoryStatsView(StoreViewSetMixin, generics.GenericAPIView):
         return Response(stats)
 
 
-from django.http import FileResponse, HttpResponseNotFound
+from django.http import FileResponse, HttpResponseNotFound, HttpResponseNotModified
 from django.views.decorators.csrf import csrf_exempt
 import os
 
@@ -2573,32 +2706,50 @@ from django.conf import settings
 @csrf_exempt
 def product_label_proxy(request, pk):
     """
-    Отдаёт картинку товара через прокси с CORS-заголовками
+    Отдаёт картинку товара через прокси с CORS-заголовками.
+    Без загруженной этикетки отдает штрих-код из кэша картинок.
+    ETag позволяет клиенту не скачивать картинку повторно (304)
     """
     try:
-        product = Product.objects.get(pk=pk)
+        product = Product.objects.only('pk', 'barcode', 'image_label').get(pk=pk)
     except Product.DoesNotExist:
         return HttpResponseNotFound("Product not found")
 
-    if not product.image_label:
+    if product.image_label:
+        file_path = os.path.join(settings.MEDIA_ROOT, str(product.image_label))
+        try:
+            file_stat = os.stat(file_path)
+        except FileNotFoundError:
+            return HttpResponseNotFound("File not found")
+        etag = f'"{file_stat.st_mtime_ns:x}-{file_stat.st_size:x}"'
+        if request.headers.get('If-None-Match') == etag:
+            response = HttpResponseNotModified()
+        else:
+            response = FileResponse(open(file_path, "rb"), content_type="image/png")
+    elif product.barcode:
+        from .services.label_renderer import label_renderer
+
+        png, cache_key = label_renderer.product_image(product.barcode)
+        etag = f'"{cache_key}"'
+        if request.headers.get('If-None-Match') == etag:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(png, content_type="image/png")
+    else:
         return HttpResponseNotFound("Image not found")
 
-    file_path = os.path.join(settings.MEDIA_ROOT, str(product.image_label))
-
-    if not os.path.exists(file_path):
-        return HttpResponseNotFound("File not found")
-
-    response = FileResponse(open(file_path, "rb"), content_type="image/png")
+    response["ETag"] = etag
+    response["Cache-Control"] = "public, max-age=300"
     response["Access-Control-Allow-Origin"] = "*"   # 🔑 главное!
     return response
 
 
 class PaymentAnalyticsViewSet(viewsets.ViewSet):
-    permission_classes = [IsAuthenticated, StorePermissionMixin]
+    permission_classes = [IsAuthenticated, StorePermissionWrapper]
     
     def list(self, request):
         """Аналитика по методам оплаты за период"""
-        store = self.get_current_store()
+        store = store_access_service.get_current_store(request.user, request)
         days = int(request.query_params.get('days', 30))
         from_date = timezone.now() - timedelta(days=days)
         
@@ -2608,24 +2759,18 @@ class PaymentAnalyticsViewSet(viewsets.ViewSet):
             created_at__gte=from_date,
             status='completed'
         ).values('payment_method').annotate(
+            # Средний чек — до одноименной суммы, иначе Avg ссылается на агрегат
+            avg_amount=Avg('total_amount'),
             count=Count('id'),
             total_amount=Sum('total_amount'),
             cash_amount=Sum('cash_amount'),
             transfer_amount=Sum('transfer_amount'),
-            card_amount=Sum('card_amount'),
-            avg_amount=Avg('total_amount')
+            card_amount=Sum('card_amount')
         ).order_by('-total_amount')
         
-        # Дополнительно: по времени суток
-        hourly = Transaction.objects.filter(
-            store=store,
-            created_at__gte=from_date
-        ).extra(
-            select={'hour': 'EXTRACT(hour FROM created_at)'}
-        ).values('hour').annotate(
-            count=Count('id'),
-            total=Sum('total_amount')
-        ).order_by('hour')
+        # Дополнительно: по времени суток (из почасовой сводки — O(часов), а не O(продаж))
+        from analytics.models import HourlySalesSummary
+        hourly = HourlySalesSummary.objects.pattern(store, business_date(from_date))
         
         return Response({
             'store': store.name,
@@ -2807,12 +2952,13 @@ class FinancialSummaryViewSet(viewsets.ReadOnlyModelViewSet):
             created_at__gte=from_date,
             status='completed'
         ).values('payment_method').annotate(
+            # Средний чек — до одноименной суммы, иначе Avg ссылается на агрегат
+            avg_amount=Avg('total_amount'),
             count=Count('id'),
             total_amount=Sum('total_amount'),
             cash_amount=Sum('cash_amount'),
             card_amount=Sum('card_amount'),
-            transfer_amount=Sum('transfer_amount'),
-            avg_amount=Avg('total_amount')
+            transfer_amount=Sum('transfer_amount')
         ).order_by('-total_amount')
         
         # Процентное соотношение
@@ -2820,16 +2966,12 @@ class FinancialSummaryViewSet(viewsets.ReadOnlyModelViewSet):
         for payment in payment_data:
             payment['percentage'] = round((payment['total_amount'] / total_revenue * 100), 1) if total_revenue else 0
         
-        # Пиковые часы
-        hourly_data = Transaction.objects.filter(
-            store=store,
-            created_at__gte=from_date
-        ).extra(
-            select={'hour': 'EXTRACT(hour FROM created_at)'}
-        ).values('hour').annotate(
-            count=Count('id'),
-            revenue=Sum('total_amount')
-        ).order_by('hour')
+        # Пиковые часы (из почасовой сводки)
+        from analytics.models import HourlySalesSummary
+        hourly_data = [
+            {'hour': row['hour'], 'count': row['count'], 'revenue': row['total']}
+            for row in HourlySalesSummary.objects.pattern(store, business_date(from_date))
+        ]
         
         return Response({
             'store': store.name,
@@ -3012,7 +3154,8 @@ class FinancialSummaryViewSet(viewsets.ReadOnlyModelViewSet):
             })
         
         card_payment = next((p for p in payment_data if p['payment_method'] == 'card'), None)
-        if card_payment and card_payment['count'] < total * 0.1:  # Меньше 10% транзакций картой
+        total_count = sum(p['count'] for p in payment_data)
+        if card_payment and card_payment['count'] < total_count * 0.1:  # Меньше 10% транзакций картой
             insights.append({
                 'type': 'low_card_adoption',
                 'title': 'Низкое использование карт',
@@ -3159,19 +3302,18 @@ class FinancialSummaryViewSet(viewsets.ReadOnlyModelViewSet):
     def _get_detailed_day_metrics(self, date, store):
         """Детальные метрики за день"""
         from sales.models import Transaction
+        from analytics.models import HourlySalesSummary
         
         transactions = Transaction.objects.filter(
             store=store,
-            created_at__date=date,
+            business_date=date,
             status='completed'
         )
         
         return {
             'total_transactions': transactions.count(),
             'unique_customers': transactions.values('customer').distinct().count(),
-            'peak_hour': transactions.extra(
-                select={'hour': 'EXTRACT(hour FROM created_at)'}
-            ).values('hour').annotate(count=Count('id')).order_by('-count').first(),
+            'peak_hour': HourlySalesSummary.objects.pattern(store, date, date).order_by('-count', 'hour').first(),
             'avg_transaction_time': transactions.aggregate(avg_duration=Avg('duration')) if hasattr(Transaction, 'duration') else None,
             'payment_mix': {
                 'cash': float(transactions.aggregate(Sum('cash_amount'))['cash_amount__sum'] or 0),
@@ -1,7 +1,8 @@
 from django.contrib import admin
+from django.utils import timezone
 from .models import (
     Transaction, TransactionItem, TransactionHistory, 
-    TransactionRefund, TransactionRefundItem
+    TransactionRefund, TransactionRefundItem, TransactionOutbox
 )
 
 
@@ -45,7 +46,8 @@ class TransactionAdmin(admin.ModelAdmin):
     customer_display.short_description = 'Клиент'
 
     def mark_as_completed(self, request, queryset):
-        updated = queryset.update(status='completed')
+        # update() минует auto_now: refresh_rollups найдет продажи по updated_at
+        updated = queryset.update(status='completed', updated_at=timezone.now())
         self.message_user(request, f'Обновлено {updated} транзакций на "завершено".')
     mark_as_completed.short_description = 'Отметить как завершенные'
 
@@ -131,4 +133,17 @@ class TransactionRefundAdmin(admin.ModelAdmin):
     raw_id_fields = ['original_transaction', 'processed_by', 'store']
     inlines = [TransactionRefundItemInline]
     readonly_fields = ['created_at', 'refunded_amount']  # Сумма – рассчитывается
-    ordering = ['-created_at']
\ No newline at end of file
+    ordering = ['-created_at']
+
+
+@admin.register(TransactionOutbox)
+class TransactionOutboxAdmin(admin.ModelAdmin):
+    """
+    Outbox событий продаж: просмотр очереди и ошибок обработки.
+    """
+    list_display = ['id', 'transaction', 'event', 'created_at', 'processed_at', 'attempts', 'store']
+    list_filter = ['event', 'processed_at', 'store']
+    search_fields = ['transaction__id', 'last_error']
+    raw_id_fields = ['transaction']
+    readonly_fields = ['created_at', 'processed_at', 'last_error']
+    ordering = ['-id']
@@ -0,0 +1,108 @@
+# sales/management/commands/benchmark_checkout.py
+import io
+from contextlib import redirect_stdout
+from decimal import Decimal
+
+from django.contrib.auth.models import Group
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIClient
+
+from sales.models import Transaction
+from sales.services.checkout_service import checkout_service
+from stores.management.bench import rollback_after, measure, create_bench_store
+from stores.models import StoreEmployee
+from stores.tokens import get_tokens_for_user_and_store
+
+CHECKOUT_URL = '/sales/transactions/'
+
+
+class Command(BaseCommand):
+    help = (
+        'Замер числа SQL-запросов и времени проведения чека в зависимости от размера корзины: '
+        'CheckoutService отдельно и весь POST /sales/transactions/'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=str, default='1,5,10,25,50',
+            help='Размеры корзины через запятую'
+        )
+        parser.add_argument('--repeat', type=int, default=3, help='Повторов на каждый размер')
+        parser.add_argument(
+            '--payment-method', type=str, default='card',
+            help='Метод оплаты (cash включает обновление кассы)'
+        )
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',') if size.strip()]
+        repeat = max(options['repeat'], 1)
+        payment_method = options['payment_method']
+
+        self.stdout.write(self.style.SUCCESS('=== БЕНЧМАРК ПРОВЕДЕНИЯ ЧЕКА ==='))
+        self.stdout.write(
+            f"{'':>8} | {'CheckoutService':^32} | {'POST ' + CHECKOUT_URL:^32}\n"
+            f"{'позиций':>8} | {'запросов':>8} | {'мс (мин)':>9} | {'мс (сред)':>9} "
+            f"| {'запросов':>8} | {'мс (мин)':>9} | {'мс (сред)':>9}"
+        )
+
+        with rollback_after():
+            store, user, products = create_bench_store(products=max(sizes))
+            client = self._api_client(store, user)
+
+            for size in sizes:
+                service_timings, api_timings = [], []
+                service_queries = api_queries = 0
+                for _ in range(repeat):
+                    service_queries, elapsed_ms = self._run_checkout(store, user, products[:size], payment_method)
+                    service_timings.append(elapsed_ms)
+                    api_queries, elapsed_ms = self._run_endpoint(client, products[:size], payment_method)
+                    api_timings.append(elapsed_ms)
+
+                self.stdout.write(
+                    f"{size:>8} | {service_queries:>8} | {min(service_timings):>9.1f} "
+                    f"| {sum(service_timings) / len(service_timings):>9.1f} "
+                    f"| {api_queries:>8} | {min(api_timings):>9.1f} | {sum(api_timings) / len(api_timings):>9.1f}"
+                )
+
+        self.stdout.write(self.style.SUCCESS('\n✅ Замер завершен, тестовые данные откатены'))
+
+    def _run_checkout(self, store, user, products, payment_method):
+        validated_items = [
+            {'product': product, 'quantity': Decimal('1'), 'price': product.sale_price}
+            for product in products
+        ]
+        total = sum(item['price'] * item['quantity'] for item in validated_items)
+
+        transaction = Transaction.objects.create(
+            store=store,
+            cashier=user,
+            total_amount=total,
+            payment_method=payment_method,
+            cash_amount=total if payment_method == 'cash' else Decimal('0')
+        )
+        _, queries, elapsed_ms = measure(checkout_service.checkout, transaction, validated_items)
+        return queries, elapsed_ms
+
+    def _api_client(self, store, user):
+        """Клиент API владельца тестового магазина (JWT с магазином)"""
+        StoreEmployee.objects.update_or_create(store=store, user=user, defaults={'role': 'owner'})
+        user.groups.add(Group.objects.get_or_create(name='owner')[0])
+
+        client = APIClient(SERVER_NAME='127.0.0.1')
+        client.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {get_tokens_for_user_and_store(user, store.pk)['access']}"
+        )
+        return client
+
+    def _run_endpoint(self, client, products, payment_method):
+        """Полный путь чека: аутентификация, валидация корзины, проведение и ответ"""
+        payload = {
+            'payment_method': payment_method,
+            'items': [{'product_id': product.pk, 'quantity': 1} for product in products],
+        }
+        # TransactionViewSet.create печатает отладку запроса — в таблицу замера она не попадает
+        with redirect_stdout(io.StringIO()):
+            response, queries, elapsed_ms = measure(client.post, CHECKOUT_URL, payload, format='json')
+        if response.status_code != 201:
+            raise RuntimeError(f"POST {CHECKOUT_URL}: {response.status_code} {response.content[:200]!r}")
+        return queries, elapsed_ms
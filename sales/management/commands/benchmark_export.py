@@ -0,0 +1,126 @@
+# sales/management/commands/benchmark_export.py
+import time
+import tracemalloc
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import reset_queries
+
+from sales.models import Transaction, TransactionItem
+from sales.views import TransactionViewSet
+from stores.management.bench import rollback_after, create_bench_store
+from stores.services.tabular_export import tabular_export
+
+
+class Command(BaseCommand):
+    help = (
+        'Бенчмарк потоковой выгрузки продаж с позициями (CSV/XLSX): пик памяти '
+        'не растет с числом строк и укладывается в бюджет'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=200000, help='Позиций продаж (1000000 — месячная выгрузка)')
+        parser.add_argument('--items-per-sale', type=int, default=5, help='Позиций в одной продаже')
+        parser.add_argument('--budget-mb', type=float, default=16, help='Бюджет пика памяти выгрузки, МБ')
+        parser.add_argument('--format', choices=['csv', 'xlsx', 'all'], default='all', dest='file_format')
+
+    def handle(self, *args, **options):
+        total_items = max(options['items'], 10)
+        per_sale = max(options['items_per_sale'], 1)
+        budget = options['budget_mb'] * 1024 * 1024
+        formats = ['csv', 'xlsx'] if options['file_format'] == 'all' else [options['file_format']]
+
+        self.stdout.write(self.style.SUCCESS('=== БЕНЧМАРК ПОТОКОВОЙ ВЫГРУЗКИ ==='))
+
+        with rollback_after():
+            store, user, products = create_bench_store(products=50, batches_per_product=0)
+            started = time.perf_counter()
+            self._fill(store, user, products, total_items, per_sale)
+            self.stdout.write(f"Создано позиций: {total_items} за {time.perf_counter() - started:.1f} с")
+
+            items = TransactionItem.objects.filter(transaction__store=store).order_by('transaction_id', 'id')
+            columns = TransactionViewSet.export_columns
+            sample = max(total_items // 10, 1)
+            last_sale = Transaction.objects.filter(store=store).order_by('pk')[sample // per_sale].pk
+
+            results = []
+            for file_format in formats:
+                # Пик на десятой части и на всей выгрузке: при потоковой записи они одного порядка
+                small = self._export(items.filter(transaction_id__lt=last_sale), columns, file_format)
+                full = self._export(items, columns, file_format)
+                if full['rows'] != total_items:
+                    raise CommandError(f"❌ {file_format}: выгружено {full['rows']} строк из {total_items}")
+                results.append((file_format, small, full))
+
+            # Для сравнения: та же десятая часть моделями в памяти, как list() для JSON
+            reset_queries()
+            tracemalloc.start()
+            list(items.filter(transaction_id__lt=last_sale).select_related(
+                'transaction', 'transaction__cashier', 'transaction__customer', 'product'
+            ))
+            models_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        mb = 1024 * 1024
+        self.stdout.write(f"\nпозиций: {total_items}, бюджет памяти: {budget / mb:.0f} МБ")
+        self.stdout.write(f"{'формат':<6} {'строк':>9} {'размер, МБ':>11} {'пик, МБ':>8} {'строк/с':>9}")
+        failed = []
+        for file_format, small, full in results:
+            for run in (small, full):
+                self.stdout.write(
+                    f"{file_format:<6} {run['rows']:>9} {run['bytes'] / mb:>11.1f} "
+                    f"{run['peak'] / mb:>8.2f} {run['rows'] / run['seconds']:>9.0f}"
+                )
+            if full['peak'] > budget:
+                failed.append(f"{file_format}: пик {full['peak'] / mb:.1f} МБ больше бюджета")
+            # Рост пика в 10 раз больше строк — не больше пары кусков ответа
+            if full['peak'] > small['peak'] * 2 + mb:
+                failed.append(f"{file_format}: пик растет с числом строк")
+        self.stdout.write(f"модели в памяти, {sample} позиций: пик {models_peak / mb:.1f} МБ")
+
+        if failed:
+            raise CommandError('❌ ' + '; '.join(failed))
+        self.stdout.write(self.style.SUCCESS('\n✅ Память выгрузки не зависит от числа строк, тестовые данные откатены'))
+
+    def _fill(self, store, user, products, total_items, per_sale, batch_size=5000):
+        """Продажи и позиции пачками: объекты не копятся в памяти"""
+        created = 0
+        while created < total_items:
+            count = min(batch_size, total_items - created)
+            sales = Transaction.objects.bulk_create([
+                Transaction(
+                    store=store, cashier=user, payment_method='cash', status='completed',
+                    total_amount=Decimal('0')
+                )
+                for _ in range((count + per_sale - 1) // per_sale)
+            ])
+            TransactionItem.objects.bulk_create([
+                TransactionItem(
+                    store=store, transaction=sales[index // per_sale],
+                    product=products[(created + index) % len(products)],
+                    quantity=Decimal('1.500'), price=Decimal('12500.00'), unit_display='шт',
+                )
+                for index in range(count)
+            ])
+            created += count
+            reset_queries()
+
+    def _export(self, queryset, columns, file_format):
+        """Выгрузка в никуда под tracemalloc: {'rows', 'bytes', 'peak', 'seconds'}"""
+        reset_queries()
+        rows = [0]
+
+        def counted():
+            for row in tabular_export.rows(queryset, [field for _, field in columns]):
+                rows[0] += 1
+                yield row
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        size = 0
+        for chunk in tabular_export.write(file_format, [title for title, _ in columns], counted()):
+            size += len(chunk)
+        seconds = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return {'rows': rows[0], 'bytes': size, 'peak': peak, 'seconds': max(seconds, 1e-6)}
@@ -0,0 +1,131 @@
+# sales/management/commands/benchmark_sales_statistics.py
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Avg, Count, F, Sum
+
+from sales.models import Transaction, TransactionItem
+from sales.services.checkout_service import checkout_service
+from sales.services.outbox_dispatcher import outbox_dispatcher
+from sales.services.sales_statistics import sales_statistics
+from stores.business_date import business_date, day_start
+from stores.management.bench import rollback_after, measure, create_bench_store
+
+
+def legacy_statistics(store):
+    """Эталон: прежний statistics — три агрегации по продажам и топ товаров за месяц по позициям"""
+    queryset = Transaction.objects.filter(store=store, status='completed')
+    today = business_date()
+    result = {}
+    for period, since in (('today', today), ('week', today - timedelta(days=7)), ('month', today - timedelta(days=30))):
+        stats = queryset.filter(business_date__gte=since).aggregate(
+            total=Sum('total_amount'), count=Count('id'), avg=Avg('total_amount')
+        )
+        result[period] = {
+            'total': float(stats['total'] or 0),
+            'count': stats['count'] or 0,
+            'avg': float(stats['avg'] or 0),
+        }
+    result['top_products'] = list(
+        TransactionItem.objects.filter(
+            transaction__store=store, transaction__status='completed',
+            transaction__business_date__gte=today - timedelta(days=30)
+        ).values('product__name').annotate(
+            total_quantity=Sum('quantity'), total_revenue=Sum(F('quantity') * F('price'))
+        ).order_by('-total_quantity', 'product__name')[:10]
+    )
+    return result
+
+
+class Command(BaseCommand):
+    help = 'Бенчмарк статистики продаж: прежние агрегации по продажам против дневных сводок и кэша'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sales', type=int, default=300, help='Продаж в истории')
+        parser.add_argument('--days', type=int, default=31, help='Дней истории')
+        parser.add_argument('--repeat', type=int, default=20, help='Обновлений дашборда в замере')
+
+    def handle(self, *args, **options):
+        total_sales = max(options['sales'], 1)
+        days = max(options['days'], 1)
+        repeat = max(options['repeat'], 1)
+
+        self.stdout.write(self.style.SUCCESS('=== БЕНЧМАРК СТАТИСТИКИ ПРОДАЖ ==='))
+
+        with rollback_after():
+            store, user, products = create_bench_store(
+                products=5, batches_per_product=1, batch_quantity=Decimal(total_sales + 1)
+            )
+            self._create_history(store, user, products, total_sales, days)
+
+            legacy, legacy_queries, legacy_ms = measure(lambda: [legacy_statistics(store) for _ in range(repeat)])
+
+            sales_statistics.clear()
+            try:
+                _, cold_queries, cold_ms = measure(sales_statistics.get, store)
+                warm, warm_queries, warm_ms = measure(lambda: [sales_statistics.get(store) for _ in range(repeat)])
+                self._compare(legacy[0], warm[0])
+                self._check_invalidation(store, user, products, warm[0])
+            finally:
+                sales_statistics.clear()
+
+        self.stdout.write(f"продаж в истории: {total_sales}, дней: {days}")
+        self.stdout.write(
+            f"прежний путь:        {legacy_ms / repeat:>8.2f} мс, запросов {legacy_queries / repeat:.0f} на обновление"
+        )
+        self.stdout.write(f"сводки (без кэша):   {cold_ms:>8.2f} мс, запросов {cold_queries}")
+        self.stdout.write(
+            f"сводки (кэш):        {warm_ms / repeat:>8.3f} мс, запросов {warm_queries / repeat:.0f} на обновление"
+        )
+        self.stdout.write(self.style.SUCCESS('\n✅ Замер завершен, тестовые данные откатены'))
+
+    def _sell(self, store, user, products):
+        validated_items = [
+            {'product': product, 'quantity': Decimal('1'), 'price': product.sale_price}
+            for product in products
+        ]
+        transaction = Transaction.objects.create(
+            store=store,
+            cashier=user,
+            total_amount=sum(item['price'] for item in validated_items),
+            payment_method='card'
+        )
+        checkout_service.checkout(transaction, validated_items)
+        return transaction
+
+    def _create_history(self, store, user, products, total_sales, days):
+        """
+        Продажи с разными корзинами, разнесенные по дням истории;
+        сводки строятся проекциями outbox уже по перенесенным датам
+        """
+        today = business_date()
+        for index in range(total_sales):
+            transaction = self._sell(store, user, products[:index % len(products) + 1])
+            day = today - timedelta(days=index % days)
+            Transaction.objects.filter(pk=transaction.pk).update(
+                business_date=day, created_at=day_start(day) + timedelta(hours=12)
+            )
+        outbox_dispatcher.dispatch_all()
+
+    def _compare(self, legacy, statistics):
+        for period in ('today', 'week', 'month'):
+            for field in ('total', 'count', 'avg'):
+                if abs(legacy[period][field] - statistics[period][field]) > 0.01:
+                    raise CommandError(
+                        f"❌ {period}.{field}: прежний путь {legacy[period][field]}, "
+                        f"сводки {statistics[period][field]}"
+                    )
+        legacy_top = [(row['product__name'], row['total_quantity'], row['total_revenue']) for row in legacy['top_products']]
+        top = [(row['product__name'], row['total_quantity'], row['total_revenue']) for row in statistics['top_products']]
+        if legacy_top != top:
+            raise CommandError(f'❌ Топ товаров не совпал: {legacy_top} != {top}')
+        self.stdout.write('✅ Результаты совпадают с прежней логикой')
+
+    def _check_invalidation(self, store, user, products, before):
+        """Новая продажа сбрасывает кэш магазина"""
+        self._sell(store, user, products[:1])
+        after = sales_statistics.get(store)
+        if after['today']['count'] != before['today']['count'] + 1:
+            raise CommandError('❌ Кэш статистики не сброшен после продажи')
+        self.stdout.write('🔄 Кэш статистики сброшен новой продажей')
@@ -0,0 +1,60 @@
+# sales/management/commands/dispatch_outbox.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from sales.models import TransactionOutbox
+from sales.services.outbox_dispatcher import outbox_dispatcher
+
+
+class Command(BaseCommand):
+    help = 'Обрабатывает события продаж из outbox (касса, финансовая сводка, аналитика)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Событий в одной пачке')
+        parser.add_argument('--loop', action='store_true', help='Работать непрерывно')
+        parser.add_argument('--interval', type=float, default=1.0, help='Пауза между опросами (сек) в режиме --loop')
+        parser.add_argument(
+            '--retry-failed', action='store_true',
+            help='Сбросить счетчик попыток у событий, исчерпавших попытки'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = max(options['batch_size'], 1)
+
+        if options['retry_failed']:
+            reset = TransactionOutbox.objects.filter(
+                processed_at__isnull=True,
+                attempts__gte=outbox_dispatcher.MAX_ATTEMPTS
+            ).update(attempts=0)
+            self.stdout.write(self.style.WARNING(f'🔁 Возвращено в очередь событий: {reset}'))
+
+        if not options['loop']:
+            totals = outbox_dispatcher.dispatch_all(batch_size=batch_size)
+            self._report(totals)
+            return
+
+        self.stdout.write(self.style.SUCCESS('📮 Обработка outbox запущена (Ctrl+C для остановки)'))
+        try:
+            while True:
+                totals = outbox_dispatcher.dispatch_all(batch_size=batch_size)
+                if totals['processed'] or totals['failed']:
+                    self._report(totals)
+                else:
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write('⏹️ Остановлено')
+
+    def _report(self, totals):
+        self.stdout.write(self.style.SUCCESS(f"✅ Обработано: {totals['processed']}"))
+        if totals['failed']:
+            self.stdout.write(self.style.ERROR(f"❌ С ошибкой: {totals['failed']}"))
+
+        stuck = TransactionOutbox.objects.filter(
+            processed_at__isnull=True,
+            attempts__gte=outbox_dispatcher.MAX_ATTEMPTS
+        ).count()
+        if stuck:
+            self.stdout.write(self.style.WARNING(
+                f'⚠️ Событий, исчерпавших попытки: {stuck} (см. last_error, --retry-failed)'
+            ))
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.1 on 2026-10-16 18:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0003_transaction_cash_register_and_more'),
+        ('stores', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event', models.CharField(choices=[('completed', 'Продажа завершена'), ('refunded', 'Продажа возвращена')], max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('store', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='%(class)s_set', to='stores.store', verbose_name='Магазин')),
+                ('transaction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='outbox_events', to='sales.transaction')),
+            ],
+            options={
+                'verbose_name': 'Событие продажи',
+                'verbose_name_plural': 'События продаж (outbox)',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['processed_at', 'id'], name='sales_trans_process_7b2cf0_idx')],
+                'unique_together': {('transaction', 'event')},
+            },
+        ),
+    ]
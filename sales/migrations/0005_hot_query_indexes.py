@@ -0,0 +1,25 @@
+# Generated by Django 5.2.1 on 2026-10-16 19:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0004_transactionoutbox'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='transactionitem',
+            name='sales_trans_product_7b9058_idx',
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['store', 'status', 'created_at'], name='sales_trans_store_i_35a6d3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactionitem',
+            index=models.Index(fields=['product', 'transaction', 'quantity', 'price'], name='sales_trans_product_d4524a_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.1 on 2026-10-16 19:08
+
+from zoneinfo import ZoneInfo
+
+import stores.business_date
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import TruncDate
+
+
+def fill_business_date(apps, schema_editor):
+    """Бизнес-дата существующих продаж — один UPDATE с переводом created_at в часовой пояс магазинов"""
+    Transaction = apps.get_model('sales', 'Transaction')
+    zone = ZoneInfo(getattr(settings, 'BUSINESS_TIME_ZONE', settings.TIME_ZONE))
+    Transaction.objects.using(schema_editor.connection.alias).filter(business_date__isnull=True).update(
+        business_date=TruncDate('created_at', tzinfo=zone)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0005_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='business_date',
+            field=stores.business_date.BusinessDateField(blank=True, editable=False, null=True, verbose_name='Бизнес-дата'),
+        ),
+        migrations.RunPython(fill_business_date, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['store', 'business_date', 'status', 'created_at'], name='sales_trans_store_i_47e46d_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.1 on 2026-10-16 19:24
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_updated_at(apps, schema_editor):
+    """Существующие продажи считаются неизмененными с момента создания"""
+    Transaction = apps.get_model('sales', 'Transaction')
+    Transaction.objects.using(schema_editor.connection.alias).update(updated_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0006_transaction_business_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(fill_updated_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['store', 'updated_at'], name='sales_trans_store_i_373270_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.1 on 2026-10-16 19:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0007_transaction_updated_at'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='transaction',
+            name='sales_trans_store_i_19142a_idx',
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['store', 'created_at', 'id'], name='sales_trans_store_i_42ee09_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactionhistory',
+            index=models.Index(fields=['store', 'created_at', 'id'], name='sales_trans_store_i_3b0fd0_idx'),
+        ),
+    ]
@@ -4,6 +4,7 @@ from django.core.validators import MinValueValidator
 from django.contrib.auth.models import User
 import logging
 from stores.mixins import StoreOwnedModel, StoreOwnedManager
+from stores.business_date import BusinessDateField, business_date
 from decimal import Decimal
 from django.utils import timezone
 
@@ -86,7 +87,10 @@ class Transaction(StoreOwnedModel):
         default='pending'
     )
     created_at = models.DateTimeField(auto_now_add=True)
-    
+    # День продажи по часовому поясу магазина (из created_at при вставке): фильтры по датам идут по индексу
+    business_date = BusinessDateField(verbose_name="Бизнес-дата")
+    # Последнее изменение продажи (статус, возврат): по нему refresh_rollups находит измененные продажи
+    updated_at = models.DateTimeField(auto_now=True)
 
     objects = StoreOwnedManager()
 
@@ -95,7 +99,10 @@ class Transaction(StoreOwnedModel):
         verbose_name_plural = "Продажи"
         ordering = ['-created_at']
         indexes = [
-            models.Index(fields=['store', 'created_at']),
+            models.Index(fields=['store', 'created_at', 'id']),  # Лента продаж, keyset-пагинация
+            models.Index(fields=['store', 'status', 'created_at']),  # Отчеты по завершённым продажам
+            models.Index(fields=['store', 'business_date', 'status', 'created_at']),  # Продажи за день / период
+            models.Index(fields=['store', 'updated_at']),  # Измененные продажи для refresh_rollups
         ]
 
     def __str__(self):
@@ -178,59 +185,22 @@ class Transaction(StoreOwnedModel):
 
     def process_sale(self):
         """
-        ОБНОВЛЕННАЯ обработка продажи с поддержкой гибридной оплаты
+        ОБНОВЛЕННАЯ обработка продажи с поддержкой гибридной оплаты.
+        Списание выполняется пакетно через CheckoutService
         """
-        if self.status != 'pending':
-            raise ValueError("Продажа уже обработана или отменена")
+        from sales.services.checkout_service import checkout_service
 
-        # Списываем товары со склада
-        for item in self.items.all():
-            stock = item.product.stock
-            
-            # Проверяем минимальное количество для продажи
-            min_quantity = item.product.min_sale_quantity
-            if item.quantity < min_quantity:
-                raise ValueError(
-                    f"Количество {item.quantity} {item.product.unit_display} "
-                    f"меньше минимального для продажи: {min_quantity} {item.product.unit_display}"
-                )
-            
-            # Проверяем шаг изменения количества
-            quantity_step = item.product.quantity_step
-            if not item.product.allow_decimal and item.quantity % 1 != 0:
-                raise ValueError(
-                    f"Товар {item.product.name} не поддерживает дробные количества"
-                )
-            
-            # Проверяем соответствие шагу
-            if quantity_step and quantity_step > 0:
-                remainder = (item.quantity % quantity_step)
-                if remainder > Decimal('0.001'):  # Допуск на погрешность
-                    raise ValueError(
-                        f"Количество {item.quantity} не соответствует шагу {quantity_step} "
-                        f"для товара {item.product.name}"
-                    )
-            
-            # Списываем со склада
-            stock.sell(float(item.quantity))
-
-        # Обрабатываем долг только если есть долг в оплате
-        if self.payment_method == 'debt':
-            if not self.customer:
-                raise ValueError("Для продажи в долг нужен покупатель")
-            self.customer.add_debt(self.total_amount)
-
-        # Обновляем total_spent и loyalty_points
-        if self.customer:
-            self.customer.total_spent += self.total_amount
-            self.customer.loyalty_points += int(self.total_amount // 10)  # 1 балл за 10 рублей
-            self.customer.save(update_fields=['total_spent', 'loyalty_points'])
-
-        self.status = 'completed'
-        self.save(update_fields=['status'])
-        
-        payment_info = "гибридная" if self.payment_method == 'hybrid' else self.get_payment_method_display()
-        logger.info(f"Продажа #{self.id} завершена: {self.total_amount} ({payment_info})")
+        items = list(self.items.select_related('product', 'product__custom_unit'))
+        checkout_service.complete_sale(self, items)
+
+    def items_with_products(self):
+        """
+        Позиции чека с товарами: из prefetch, если он уже сделан,
+        иначе одним запросом с JOIN товара, единицы и размера
+        """
+        if 'items' in getattr(self, '_prefetched_objects_cache', {}):
+            return self.items.all()
+        return self.items.select_related('product', 'product__custom_unit', 'product__default_size')
 
     def get_total_items_with_units(self):
         """
@@ -238,7 +208,7 @@ class Transaction(StoreOwnedModel):
         """
         items_info = []
         
-        for item in self.items.all():
+        for item in self.items_with_products():
             items_info.append({
                 'product_name': item.product.name,
                 'quantity': float(item.quantity),
@@ -277,14 +247,8 @@ class Transaction(StoreOwnedModel):
             logger.warning(f"Транзакция {self.id} не подходит для обновления кассы")
             return False
         
-        from django.utils import timezone
-        
-        today = timezone.now().date()
-        cash_register = CashRegister.objects.filter(
-            store=self.store,
-            date_opened__date=today,
-            is_open=True
-        ).first()
+        today = business_date()
+        cash_register = CashRegister.objects.open_on(self.store, today).first()
         
         # Создаём кассу если нет
         if not cash_register:
@@ -344,14 +308,8 @@ class Transaction(StoreOwnedModel):
             logger.warning(f"Транзакция {self.id} без наличных для отмены")
             return False
         
-        from django.utils import timezone
-        
-        today = timezone.now().date()
-        cash_register = CashRegister.objects.filter(
-            store=self.store,
-            date_opened__date=today,
-            is_open=True
-        ).first()
+        today = business_date()
+        cash_register = CashRegister.objects.open_on(self.store, today).first()
         
         if not cash_register:
             logger.error(f"Нет открытой кассы для отмены транзакции {self.id}")
@@ -469,7 +427,8 @@ class TransactionItem(StoreOwnedModel):
         verbose_name = "Элемент продажи"
         verbose_name_plural = "Элементы продаж"
         indexes = [
-            models.Index(fields=['product', 'transaction']),
+            # Покрывающий: продажи товара (количество и цена) без чтения строк таблицы
+            models.Index(fields=['product', 'transaction', 'quantity', 'price']),
             models.Index(fields=['unit_type']),
         ]
 
@@ -486,30 +445,38 @@ class TransactionItem(StoreOwnedModel):
         """Цена за единицу"""
         return self.price
 
+    def apply_product_snapshot(self):
+        """
+        Снимок единиц измерения и размера товара на момент продажи.
+        Вызывается из save() и при пакетном создании (bulk_create не вызывает save)
+        """
+        if not self.product:
+            return
+
+        # Сохраняем информацию о единицах измерения
+        self.unit_type = self.product.unit_type or 'custom'
+        self.unit_display = self.product.unit_display
+
+        # Сохраняем снимок размерной информации
+        if self.product.has_sizes and self.product.default_size:
+            size = self.product.default_size
+            self.size_snapshot = {
+                'size': size.size,
+                'dimension1': float(size.dimension1) if size.dimension1 else None,
+                'dimension2': float(size.dimension2) if size.dimension2 else None,
+                'dimension3': float(size.dimension3) if size.dimension3 else None,
+                'dimension1_label': size.dimension1_label,
+                'dimension2_label': size.dimension2_label,
+                'dimension3_label': size.dimension3_label,
+                'description': size.description,
+                'saved_at': str(timezone.now())
+            }
+
     def save(self, *args, **kwargs):
         """
         Автоматически сохраняем информацию о единицах измерения и размерах
         """
-        if self.product:
-            # Сохраняем информацию о единицах измерения
-            self.unit_type = self.product.unit_type or 'custom'
-            self.unit_display = self.product.unit_display
-            
-            # Сохраняем снимок размерной информации
-            if self.product.has_sizes and self.product.default_size:
-                size = self.product.default_size
-                self.size_snapshot = {
-                    'size': size.size,
-                    'dimension1': float(size.dimension1) if size.dimension1 else None,
-                    'dimension2': float(size.dimension2) if size.dimension2 else None,
-                    'dimension3': float(size.dimension3) if size.dimension3 else None,
-                    'dimension1_label': size.dimension1_label,
-                    'dimension2_label': size.dimension2_label,
-                    'dimension3_label': size.dimension3_label,
-                    'description': size.description,
-                    'saved_at': str(timezone.now())
-                }
-
+        self.apply_product_snapshot()
         super().save(*args, **kwargs)
 
     def validate_quantity(self):
@@ -567,6 +534,9 @@ class TransactionHistory(StoreOwnedModel):
         verbose_name = "История продажи"
         verbose_name_plural = "История продаж"
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['store', 'created_at', 'id']),  # Keyset-пагинация истории магазина
+        ]
 
     def save(self, *args, **kwargs):
         # если магазин не указан → берём из транзакции
@@ -687,4 +657,42 @@ class TransactionRefundItem(StoreOwnedModel):
             total=models.Sum('refunded_quantity')
         )['total'] or Decimal('0')
         
-        return self.original_item.quantity - already_refunded
\ No newline at end of file
+        return self.original_item.quantity - already_refunded
+
+class TransactionOutbox(StoreOwnedModel):
+    """
+    📮 Исходящие события продажи (transactional outbox).
+    Событие пишется в той же транзакции БД, что и продажа, а побочные эффекты
+    (касса, финансовая сводка, аналитика) выполняет OutboxDispatcher после коммита —
+    каждое событие ровно один раз
+    """
+    EVENTS = [
+        ('completed', 'Продажа завершена'),
+        ('refunded', 'Продажа возвращена'),
+    ]
+
+    transaction = models.ForeignKey(
+        Transaction,
+        on_delete=models.CASCADE,
+        related_name='outbox_events'
+    )
+    event = models.CharField(max_length=20, choices=EVENTS)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    objects = StoreOwnedManager()
+
+    class Meta:
+        verbose_name = "Событие продажи"
+        verbose_name_plural = "События продаж (outbox)"
+        ordering = ['id']
+        unique_together = ('transaction', 'event')
+        indexes = [
+            models.Index(fields=['processed_at', 'id']),
+        ]
+
+    def __str__(self):
+        status = 'обработано' if self.processed_at else f'в очереди (попыток: {self.attempts})'
+        return f"{self.get_event_display()} #{self.transaction_id} — {status}"
@@ -3,11 +3,13 @@ from rest_framework import serializers
 from .models import Transaction, TransactionItem, TransactionHistory, TransactionRefund, TransactionRefundItem
 from inventory.models import Product
 from customers.models import Customer
+from sales.services.checkout_service import checkout_service
 from django.utils.translation import gettext_lazy as _
 import logging
 import json
 from django.contrib.auth import get_user_model
 from django.db import models
+from django.db.models import Prefetch, prefetch_related_objects
 from decimal import Decimal, ROUND_HALF_UP
 
 
@@ -16,11 +18,32 @@ User = get_user_model()
 logger = logging.getLogger('sales')
 
 
+class BasketProductField(serializers.PrimaryKeyRelatedField):
+    """
+    ID товара позиции чека. Товары всей корзины загружает одним запросом
+    TransactionSerializer.to_internal_value — поле берет товар из этой карты
+    """
+
+    def to_internal_value(self, data):
+        basket_products = getattr(self.root, 'basket_products', None)
+        if basket_products is None:
+            return super().to_internal_value(data)
+
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return basket_products[int(data)]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
 class TransactionItemSerializer(serializers.ModelSerializer):
     """
     ОБНОВЛЕННЫЙ сериализатор для элементов транзакции с поддержкой дробных единиц
     """
-    product_id = serializers.PrimaryKeyRelatedField(
+    product_id = BasketProductField(
         queryset=Product.objects.all(),
         source='product',
         help_text="ID товара"
@@ -685,6 +708,38 @@ class TransactionSerializer(serializers.ModelSerializer):
         except:
             return "0 ед."
 
+    def to_internal_value(self, data):
+        """
+        Загружает товары корзины одним запросом вместе с магазином, остатком,
+        единицей и размером — проверки цены и остатка ниже идут без запросов на позицию
+        """
+        self.basket_products = self._load_basket_products(data)
+        return super().to_internal_value(data)
+
+    def _load_basket_products(self, data):
+        """Карта {id: товар} для всех позиций корзины"""
+        items = data.get('items') if hasattr(data, 'get') else None
+        if not isinstance(items, list):
+            return {}
+
+        product_ids = set()
+        for item in items:
+            product_id = item.get('product_id') if isinstance(item, dict) else None
+            if isinstance(product_id, bool):
+                continue
+            try:
+                product_ids.add(int(product_id))
+            except (TypeError, ValueError):
+                continue
+
+        if not product_ids:
+            return {}
+
+        product_field = self.fields['items'].child.fields['product_id']
+        return product_field.get_queryset().select_related(
+            'store', 'stock', 'custom_unit', 'default_size'
+        ).in_bulk(product_ids)
+
     def validate(self, data):
         """
         ОБНОВЛЕННАЯ валидация с поддержкой гибридной оплаты
@@ -912,36 +967,23 @@ class TransactionSerializer(serializers.ModelSerializer):
         payment_info = "гибридная" if transaction.payment_method == 'hybrid' else transaction.get_payment_method_display()
         logger.info(f"Transaction #{transaction.id} created in store {transaction.store.name} with {payment_info} payment")
 
-        # Создаем элементы транзакции
+        # Дополнительная проверка цен
         for item_data in validated_items:
             product = item_data['product']
-            quantity = item_data['quantity']
             price_from_db = item_data['price']
-
-            # Дополнительная проверка
             if price_from_db <= 0:
                 logger.error(f"Invalid price in DB for product {product.name}: {price_from_db}")
                 raise serializers.ValidationError({
                     "error": f"Некорректная цена товара {product.name} в базе данных"
                 })
 
-            transaction_item = TransactionItem.objects.create(
-                transaction=transaction,
-                product=product,
-                quantity=quantity,
-                price=price_from_db,
-                store=transaction.store
-            )
-            
+        # Создаем элементы транзакции и обрабатываем продажу пакетно
+        try:
+            checkout_service.checkout(transaction, validated_items)
             logger.info(
-                f"Transaction item created: {product.name} x{quantity} {product.unit_display} "
-                f"@ {price_from_db}"
+                f"Transaction #{transaction.id} processed. Total: {transaction.total_amount}, "
+                f"items: {len(validated_items)}"
             )
-
-        # Обрабатываем продажу
-        try:
-            transaction.process_sale()
-            logger.info(f"Transaction #{transaction.id} processed. Total: {transaction.total_amount}")
         except Exception as e:
             logger.error(f"Error processing transaction #{transaction.id}: {str(e)}")
             transaction.status = 'failed'
@@ -950,6 +992,13 @@ class TransactionSerializer(serializers.ModelSerializer):
                 "error": f"Ошибка обработки продажи: {str(e)}"
             })
 
+        # Ответ читает позиции трижды (items, items_detail, items_with_units) — один запрос на все
+        prefetch_related_objects([transaction], Prefetch(
+            'items',
+            queryset=TransactionItem.objects.select_related(
+                'product', 'product__custom_unit', 'product__default_size'
+            )
+        ))
         return transaction
 
     def to_representation(self, instance):
@@ -965,9 +1014,12 @@ class TransactionSerializer(serializers.ModelSerializer):
                 'name': instance.store.name
             }
 
+        # Позиции с товарами одним запросом (или из prefetch списка продаж)
+        items = list(instance.items_with_products())
+
         # Добавляем детали товаров с единицами измерения
         items_detail = []
-        for item in instance.items.all():
+        for item in items:
             item_detail = {
                 'product_id': item.product.id,
                 'product_name': item.product.name,
@@ -990,7 +1042,7 @@ class TransactionSerializer(serializers.ModelSerializer):
 
         # Добавляем сводную информацию о единицах измерения
         units_summary = {}
-        for item in instance.items.all():
+        for item in items:
             unit_key = item.unit_display or 'шт'
             if unit_key not in units_summary:
                 units_summary[unit_key] = {
@@ -0,0 +1,171 @@
+# sales/services/checkout_service.py
+import logging
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction as db_transaction
+from django.db.models import F
+
+from inventory.services.batch_allocator import batch_allocator
+from inventory.services.stock_ledger import stock_ledger
+from customers.models import Customer
+from sales.models import TransactionItem
+
+logger = logging.getLogger('sales')
+
+
+class CheckoutService:
+    """
+    🛒 Пакетное проведение продажи.
+    Число запросов не зависит от размера корзины:
+    - позиции чека создаются одним bulk_create
+    - остатки блокируются одним SELECT ... FOR UPDATE
+    - партии списываются по FIFO одним UPDATE ... CASE (FifoBatchAllocator)
+    - движения пишутся в журнал одним INSERT, остатки — одним UPDATE (StockLedger)
+    """
+
+    def checkout(self, transaction, validated_items):
+        """
+        Создает позиции чека и проводит продажу в одной транзакции БД.
+        validated_items — результат TransactionSerializer.validate()
+        """
+        with db_transaction.atomic():
+            items = self.build_items(transaction, validated_items)
+            TransactionItem.objects.bulk_create(items)
+            self.complete_sale(transaction, items)
+        return items
+
+    def build_items(self, transaction, validated_items):
+        """Готовит позиции чека в памяти (со снимком единиц и размеров)"""
+        items = []
+        for item_data in validated_items:
+            item = TransactionItem(
+                transaction=transaction,
+                product=item_data['product'],
+                quantity=item_data['quantity'],
+                price=item_data['price'],
+                store=transaction.store
+            )
+            item.apply_product_snapshot()
+            items.append(item)
+        return items
+
+    def complete_sale(self, transaction, items):
+        """
+        Списывает товары, обновляет покупателя и завершает продажу
+        """
+        if transaction.status != 'pending':
+            raise ValueError("Продажа уже обработана или отменена")
+
+        for item in items:
+            self._validate_item_quantity(item)
+
+        with db_transaction.atomic():
+            self._write_off_stock(transaction, items)
+            self._update_customer(transaction)
+
+            transaction.status = 'completed'
+            transaction.save(update_fields=['status', 'updated_at'])
+
+        payment_info = "гибридная" if transaction.payment_method == 'hybrid' else transaction.get_payment_method_display()
+        logger.info(
+            f"Продажа #{transaction.id} завершена: {transaction.total_amount} ({payment_info}), "
+            f"позиций: {len(items)}"
+        )
+
+    def _validate_item_quantity(self, item):
+        """Проверка минимального количества, дробности и шага"""
+        product = item.product
+
+        min_quantity = product.min_sale_quantity
+        if item.quantity < min_quantity:
+            raise ValueError(
+                f"Количество {item.quantity} {product.unit_display} "
+                f"меньше минимального для продажи: {min_quantity} {product.unit_display}"
+            )
+
+        if not product.allow_decimal and item.quantity % 1 != 0:
+            raise ValueError(
+                f"Товар {product.name} не поддерживает дробные количества"
+            )
+
+        quantity_step = product.quantity_step
+        if quantity_step and quantity_step > 0:
+            remainder = (item.quantity % quantity_step)
+            if remainder > Decimal('0.001'):  # Допуск на погрешность
+                raise ValueError(
+                    f"Количество {item.quantity} не соответствует шагу {quantity_step} "
+                    f"для товара {product.name}"
+                )
+
+    def _write_off_stock(self, transaction, items):
+        """
+        Списание со склада для всех позиций сразу
+        """
+        # Суммарное количество по товару (один товар может встречаться в чеке дважды)
+        totals = defaultdict(Decimal)
+        products = {}
+        for item in items:
+            totals[item.product_id] += Decimal(str(item.quantity))
+            products[item.product_id] = item.product
+
+        # 1. Блокируем строки остатков (одним запросом)
+        balances = stock_ledger.lock_balances(products.values())
+
+        for product_id, quantity in totals.items():
+            product = products[product_id]
+            available = balances[product_id].quantity
+            if available < quantity:
+                raise ValueError(
+                    f"Недостаточно товара '{product.name}'. "
+                    f"Доступно: {available} {product.unit_display}, "
+                    f"запрошено: {quantity}"
+                )
+
+        # 2. Списываем партии по FIFO (один SELECT, один UPDATE ... CASE)
+        plan = batch_allocator.allocate(totals)
+        # Закупка в журнале — себестоимость списанных партий: по ней считается
+        # маржа (financial_summary) и цена партии при возврате
+        cost_prices = {**plan['average_prices'], **plan['cost_prices']}
+
+        # 3. Журнал движений: одна запись на позицию (один INSERT),
+        #    остатки — один UPDATE ... CASE
+        stock_ledger.post([
+            {
+                'product': item.product,
+                'store_id': transaction.store_id,
+                'quantity_change': -Decimal(str(item.quantity)),
+                'operation_type': 'SALE',
+                'reference_id': f'txn_{transaction.id}_item_{item.id}',
+                'user_id': transaction.cashier_id,
+                'size_id': item.product.default_size_id if item.product.has_sizes else None,
+                'sale_price': item.price,
+                'purchase_price': cost_prices.get(item.product_id),
+                'notes': f'Продажа номер {transaction.id} количество {float(item.quantity)} товар {item.product.name}',
+            }
+            for item in items
+        ], balances=balances)
+
+    def _update_customer(self, transaction):
+        """Долг, сумма покупок и бонусы покупателя — одним UPDATE"""
+        if transaction.payment_method == 'debt' and not transaction.customer:
+            raise ValueError("Для продажи в долг нужен покупатель")
+
+        customer = transaction.customer
+        if not customer:
+            return
+
+        debt = transaction.total_amount if transaction.payment_method == 'debt' else Decimal('0')
+        points = int(transaction.total_amount // 10)  # 1 балл за 10 рублей
+
+        Customer.objects.filter(pk=customer.pk).update(
+            debt=F('debt') + debt,
+            total_spent=F('total_spent') + transaction.total_amount,
+            loyalty_points=F('loyalty_points') + points
+        )
+        customer.debt += debt
+        customer.total_spent += transaction.total_amount
+        customer.loyalty_points += points
+
+
+checkout_service = CheckoutService()
@@ -0,0 +1,129 @@
+# sales/services/outbox_dispatcher.py
+import logging
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.db.models import F
+from django.utils import timezone
+
+from sales.models import TransactionOutbox
+
+logger = logging.getLogger('sales')
+
+
+class OutboxDispatcher:
+    """
+    📮 Диспетчер исходящих событий продажи.
+
+    Вместо цепочки post_save-обработчиков на Transaction продажа пишет
+    одну строку TransactionOutbox в своей транзакции БД. Проекции
+    (касса, финансовая сводка, аналитика) регистрируются декоратором
+    @outbox_dispatcher.projection(event, name) и выполняются пачками
+    воркером dispatch_outbox, вне запроса кассы: все проекции события — в
+    одной транзакции, поэтому событие применяется ровно один раз, а при
+    ошибке целиком уходит на повтор.
+    """
+
+    MAX_ATTEMPTS = 5
+
+    def __init__(self):
+        self._projections = defaultdict(list)
+
+    def projection(self, event, name):
+        """Декоратор регистрации проекции для события"""
+        def decorator(func):
+            registered = [projection_name for projection_name, _ in self._projections[event]]
+            if name not in registered:
+                self._projections[event].append((name, func))
+            return func
+        return decorator
+
+    def projections(self, event):
+        """Зарегистрированные проекции события: [(name, func), ...]"""
+        return list(self._projections[event])
+
+    def enqueue(self, transaction, event):
+        """
+        Пишет событие в outbox (один INSERT, повторная запись игнорируется).
+        Вызывается внутри транзакции продажи; обработка — воркером
+        (или сразу после коммита при OUTBOX_DISPATCH_ON_COMMIT)
+        """
+        TransactionOutbox.objects.bulk_create(
+            [TransactionOutbox(transaction=transaction, store_id=transaction.store_id, event=event)],
+            ignore_conflicts=True
+        )
+
+        if getattr(settings, 'OUTBOX_DISPATCH_ON_COMMIT', False):
+            transaction_id = transaction.pk
+            db_transaction.on_commit(lambda: self.dispatch(transaction_ids=[transaction_id]))
+
+    def pending(self, transaction_ids=None):
+        """Необработанные события, не исчерпавшие попытки"""
+        events = TransactionOutbox.objects.filter(
+            processed_at__isnull=True,
+            attempts__lt=self.MAX_ATTEMPTS
+        )
+        if transaction_ids is not None:
+            events = events.filter(transaction_id__in=transaction_ids)
+        return events.order_by('id')
+
+    def dispatch(self, batch_size=100, transaction_ids=None):
+        """
+        Обрабатывает одну пачку событий.
+        Возвращает {'processed': int, 'failed': int}
+        """
+        processed = []
+        failed = 0
+
+        with db_transaction.atomic():
+            events = list(
+                self.pending(transaction_ids)
+                .select_for_update(skip_locked=True, of=('self',))
+                .select_related('transaction', 'transaction__store',
+                                'transaction__cashier', 'transaction__customer')
+                [:batch_size]
+            )
+
+            for event in events:
+                try:
+                    with db_transaction.atomic():
+                        for name, func in self._projections[event.event]:
+                            func(event.transaction)
+                except Exception as e:
+                    failed += 1
+                    TransactionOutbox.objects.filter(pk=event.pk).update(
+                        attempts=F('attempts') + 1,
+                        last_error=f"{type(e).__name__}: {e}"
+                    )
+                    logger.error(
+                        f"❌ Событие {event.event} продажи #{event.transaction_id} не обработано "
+                        f"(попытка {event.attempts + 1}/{self.MAX_ATTEMPTS}): {e}"
+                    )
+                else:
+                    processed.append(event.pk)
+
+            if processed:
+                TransactionOutbox.objects.filter(pk__in=processed).update(
+                    processed_at=timezone.now(),
+                    attempts=F('attempts') + 1,
+                    last_error=''
+                )
+
+        if processed:
+            logger.info(f"✅ Обработано событий продаж: {len(processed)}")
+
+        return {'processed': len(processed), 'failed': failed}
+
+    def dispatch_all(self, batch_size=100):
+        """Разбирает очередь пачками, пока есть что обрабатывать"""
+        totals = {'processed': 0, 'failed': 0}
+        while True:
+            result = self.dispatch(batch_size=batch_size)
+            totals['processed'] += result['processed']
+            totals['failed'] += result['failed']
+            if result['processed'] + result['failed'] < batch_size or result['processed'] == 0:
+                return totals
+
+
+outbox_dispatcher = OutboxDispatcher()
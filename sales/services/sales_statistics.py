@@ -0,0 +1,187 @@
+# sales/services/sales_statistics.py
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.db.models import Count, DecimalField, F, Q, Sum
+
+from stores.business_date import business_date
+
+WEEK_DAYS = 7
+MONTH_DAYS = 30
+TOP_PRODUCTS = 10
+
+
+class SalesStatistics:
+    """
+    📈 Статистика продаж магазина для дашборда (TransactionViewSet.statistics).
+
+    Прошедшие дни берутся из дневных сводок: неделя и месяц — из
+    FinancialSummary одним запросом с условной агрегацией, топ товаров — из
+    ProductAnalytics (строка на товар и день). Текущий бизнес-день считается
+    по продажам и их позициям, поэтому в итогах и в топе есть и продажи,
+    которые проекции еще не обработали.
+
+    Топ товаров — за месяц (MONTH_DAYS) вместе с сегодняшним днем, как и
+    итоги месяца; прежний топ за все время перечитывал всю историю на каждом
+    промахе кэша. Объем чтения ограничен окном месяца, а не глубиной истории.
+
+    Результат кэшируется в памяти процесса по (магазин, бизнес-день):
+    запись сбрасывается при проведении и возврате продажи магазина (после
+    коммита) и живет не дольше SALES_STATISTICS_CACHE_TTL секунд — это предел
+    расхождения между процессами.
+
+    Как и живой агрегат за сегодня, сводки учитывают только завершённые
+    продажи: возврат пересчитывает день продажи (проекция outbox 'refunded')
+    и после пересчета сбрасывает статистику магазина.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()   # (store_id, день) -> (expires_at, статистика)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def max_entries(self):
+        return getattr(settings, 'SALES_STATISTICS_CACHE_MAX_ENTRIES', 1000)
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'SALES_STATISTICS_CACHE_TTL', 60)
+
+    def get(self, store):
+        """Статистика магазина за сегодня, неделю и месяц с топом товаров (копия записи кэша)"""
+        today = business_date()
+        key = (str(store.pk), today)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._copy(entry[1])
+            self.misses += 1
+
+        statistics = self.compute(store, today)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, statistics)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return self._copy(statistics)
+
+    def compute(self, store, today=None):
+        """Статистика без кэша: четыре запроса, чтение ограничено окном месяца"""
+        from analytics.models import ProductAnalytics
+        from inventory.models import FinancialSummary
+        from sales.models import Transaction, TransactionItem
+
+        today = today or business_date()
+        week_ago = today - timedelta(days=WEEK_DAYS)
+        month_ago = today - timedelta(days=MONTH_DAYS)
+
+        # Сегодня — по продажам (индекс store, business_date, status)
+        live = Transaction.objects.filter(
+            store=store, business_date=today, status='completed'
+        ).aggregate(total=Sum('total_amount'), count=Count('id'))
+
+        # Прошедшие дни недели и месяца — по дневным сводкам (индекс store, date)
+        week_filter = Q(date__gte=week_ago)
+        rollup = FinancialSummary.objects.filter(
+            store=store, date__gte=month_ago, date__lt=today
+        ).aggregate(
+            week_total=Sum('grand_total', filter=week_filter),
+            week_count=Sum('total_transactions', filter=week_filter),
+            month_total=Sum('grand_total'),
+            month_count=Sum('total_transactions'),
+        )
+
+        # Топ за месяц: прошедшие дни — по сводкам товаров (индекс date, product),
+        # сегодня — по позициям завершённых продаж
+        rollup_top = ProductAnalytics.objects.filter(
+            product__store=store, date__gte=month_ago, date__lt=today
+        ).values(
+            'product__name'
+        ).annotate(
+            total_quantity=Sum('quantity_sold'),
+            total_revenue=Sum('revenue')
+        )
+        live_top = TransactionItem.objects.filter(
+            transaction__store=store, transaction__business_date=today, transaction__status='completed'
+        ).values(
+            'product__name'
+        ).annotate(
+            total_quantity=Sum('quantity'),
+            total_revenue=Sum(F('quantity') * F('price'), output_field=DecimalField(max_digits=15, decimal_places=2))
+        )
+        top_products = self._merge_top(rollup_top, live_top)
+
+        today_total = live['total'] or 0
+        today_count = live['count'] or 0
+        return {
+            'today': self._period(today_total, today_count),
+            'week': self._period(
+                (rollup['week_total'] or 0) + today_total, (rollup['week_count'] or 0) + today_count
+            ),
+            'month': self._period(
+                (rollup['month_total'] or 0) + today_total, (rollup['month_count'] or 0) + today_count
+            ),
+            'top_products': top_products,
+        }
+
+    def _merge_top(self, *sources):
+        """Складывает строки топа по товару и оставляет TOP_PRODUCTS лучших по количеству"""
+        merged = {}
+        for rows in sources:
+            for row in rows:
+                name = row['product__name']
+                if name in merged:
+                    merged[name]['total_quantity'] += row['total_quantity']
+                    merged[name]['total_revenue'] += row['total_revenue']
+                else:
+                    merged[name] = dict(row)
+        top = sorted(merged.values(), key=lambda row: (-row['total_quantity'], row['product__name']))
+        return top[:TOP_PRODUCTS]
+
+    def _period(self, total, count):
+        return {
+            'total': float(total),
+            'count': count,
+            'avg': float(total) / count if count else 0.0,
+        }
+
+    def _copy(self, statistics):
+        """Запись кэша не отдается наружу"""
+        return {
+            key: [dict(row) for row in value] if key == 'top_products' else dict(value)
+            for key, value in statistics.items()
+        }
+
+    def _drop(self, store_id):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == store_id]:
+                del self._entries[key]
+
+    def invalidate(self, store_id):
+        """
+        Сбрасывает статистику магазина.
+        Повторно — после коммита, чтобы не осталась статистика, прочитанная до него
+        """
+        store_id = str(store_id)
+        self._drop(store_id)
+        db_transaction.on_commit(lambda: self._drop(store_id))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+sales_statistics = SalesStatistics()
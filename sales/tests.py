@@ -1,3 +1,174 @@
+import json
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import Group
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from sales.models import Transaction, TransactionHistory
+from sales.services.checkout_service import checkout_service
+from sales.services.outbox_dispatcher import outbox_dispatcher
+from sales.services.sales_statistics import sales_statistics
+from stores.business_date import business_date, day_start
+from stores.management.bench import create_bench_store
+from stores.models import StoreEmployee
+from stores.tokens import get_tokens_for_user_and_store
+
+
+class SalesStatisticsTests(TestCase):
+    """Статистика дашборда из сводок: возвраты прошедших дней и топ за месяц с сегодняшними продажами"""
+
+    def setUp(self):
+        self.store, self.user, self.products = create_bench_store(
+            products=2, batches_per_product=1, batch_quantity=Decimal('20')
+        )
+        self.today = business_date()
+        sales_statistics.clear()
+        self.addCleanup(sales_statistics.clear)
+
+    def _sell(self, product, days_ago=0, dispatch=True):
+        transaction = Transaction.objects.create(
+            store=self.store, cashier=self.user, total_amount=product.sale_price,
+            payment_method='card', card_amount=product.sale_price
+        )
+        checkout_service.checkout(transaction, [
+            {'product': product, 'quantity': Decimal('1'), 'price': product.sale_price}
+        ])
+        day = self.today - timedelta(days=days_ago)
+        Transaction.objects.filter(pk=transaction.pk).update(
+            business_date=day, created_at=day_start(day) + timedelta(hours=12)
+        )
+        if dispatch:
+            outbox_dispatcher.dispatch_all()
+        return Transaction.objects.get(pk=transaction.pk)
+
+    def test_refund_of_past_day_leaves_week_and_month(self):
+        self._sell(self.products[0], days_ago=2)
+        refunded = self._sell(self.products[1], days_ago=2)
+        self.assertEqual(sales_statistics.get(self.store)['week']['count'], 2)
+
+        refunded.status = 'refunded'
+        refunded.save()
+        outbox_dispatcher.dispatch_all()
+
+        statistics = sales_statistics.get(self.store)
+        for period in ('week', 'month'):
+            self.assertEqual(statistics[period]['count'], 1)
+            self.assertEqual(statistics[period]['total'], float(self.products[0].sale_price))
+        self.assertEqual(
+            [row['product__name'] for row in statistics['top_products']], [self.products[0].name]
+        )
+
+    def _top(self):
+        return [
+            (row['product__name'], row['total_quantity'])
+            for row in sales_statistics.get(self.store)['top_products']
+        ]
+
+    def test_top_products_cover_month_window(self):
+        self._sell(self.products[0], days_ago=90)
+        self._sell(self.products[0], days_ago=90)
+        self._sell(self.products[1], days_ago=5)
+
+        self.assertEqual(sales_statistics.get(self.store)['month']['count'], 1)
+        self.assertEqual(self._top(), [(self.products[1].name, Decimal('1'))])
+
+    def test_top_products_include_unprocessed_sales_of_today(self):
+        self._sell(self.products[0], days_ago=5)
+        self._sell(self.products[0], days_ago=5)
+        self._sell(self.products[1])
+        self._sell(self.products[1])
+        self._sell(self.products[1], dispatch=False)
+
+        # Сегодняшние продажи считаются по позициям один раз, обработаны они проекциями или нет
+        self.assertEqual(self._top(), [
+            (self.products[1].name, Decimal('3')), (self.products[0].name, Decimal('2'))
+        ])
+
+
+class CheckoutEndpointTests(TestCase):
+    """POST /sales/transactions/: число запросов не зависит от размера корзины"""
+
+    URL = '/sales/transactions/'
+
+    def setUp(self):
+        self.store, user, self.products = create_bench_store(products=10, batches_per_product=1)
+        StoreEmployee.objects.update_or_create(store=self.store, user=user, defaults={'role': 'owner'})
+        user.groups.add(Group.objects.get_or_create(name='owner')[0])
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {get_tokens_for_user_and_store(user, self.store.pk)['access']}"
+        )
+
+    def _checkout(self, products):
+        payload = {
+            'payment_method': 'card',
+            'items': [{'product_id': product.pk, 'quantity': 1} for product in products],
+        }
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.URL, payload, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json(), len(queries.captured_queries)
+
+    def test_query_count_does_not_depend_on_basket_size(self):
+        _, single = self._checkout(self.products[:1])
+        data, basket = self._checkout(self.products)
+
+        self.assertEqual(basket, single)
+        self.assertEqual(len(data['items_detail']), len(self.products))
+        self.assertEqual(len(data['items_with_units']), len(self.products))
+        self.assertEqual(
+            Transaction.objects.get(pk=data['id']).items.count(), len(self.products)
+        )
+
+    def test_unknown_product_is_rejected(self):
+        response = self.client.post(self.URL, {
+            'payment_method': 'card',
+            'items': [{'product_id': self.products[0].pk, 'quantity': 1}, {'product_id': 0, 'quantity': 1}],
+        }, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('items', response.json())
+
+
+class TransactionHistoryListTests(TestCase):
+    """История продаж: keyset-страницы с has_more, прежний offset отклоняется"""
+
+    URL = '/sales/transaction-history/'
+
+    def setUp(self):
+        store, user, products = create_bench_store(products=1, batches_per_product=1)
+        StoreEmployee.objects.update_or_create(store=store, user=user, defaults={'role': 'owner'})
+        user.groups.add(Group.objects.get_or_create(name='owner')[0])
+        product = products[0]
+        for _ in range(3):
+            transaction = Transaction.objects.create(
+                store=store, cashier=user, total_amount=product.sale_price,
+                payment_method='cash', cash_amount=product.sale_price
+            )
+            TransactionHistory.objects.create(
+                transaction=transaction, action='completed',
+                details=json.dumps({'total_amount': str(product.sale_price), 'items': [{'product': product.name}]})
+            )
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {get_tokens_for_user_and_store(user, store.pk)['access']}"
+        )
+
+    def test_has_more_follows_next_link(self):
+        first = self.client.get(self.URL, {'page_size': 2}).json()
+        self.assertTrue(first['has_more'])
+        self.assertEqual(len(first['results']), 2)
+
+        last = self.client.get(first['next']).json()
+        self.assertFalse(last['has_more'])
+        self.assertEqual(len(last['results']), 1)
+
+    def test_offset_is_rejected(self):
+        response = self.client.get(self.URL, {'limit': 2, 'offset': 2})
 
-# Create your tests here.
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('offset', response.json())
@@ -1,6 +1,6 @@
 from rest_framework import viewsets, permissions, serializers
 from rest_framework.views import APIView
-from django.db.models import Sum, F, FloatField, DecimalField, Value, Q  # ← ДОБАВИТЬ Q
+from django.db.models import Sum, F, FloatField, DecimalField, Value, Q, Prefetch  # ← ДОБАВИТЬ Q
 from rest_framework import pagination
 from rest_framework.decorators import action
 from rest_framework.response import Response
@@ -17,8 +17,13 @@ from rest_framework.permissions import IsAuthenticated
 from django.utils.translation import gettext_lazy as _
 from customers.views import FlexiblePagination
 from .pagination import OptionalPagination
+from .services.sales_statistics import sales_statistics
 import logging
 from stores.mixins import StoreViewSetMixin
+from stores.business_date import business_date, range_lookups
+from stores.pagination import KeysetPagination, KEYSET_QUERY_PARAMETERS
+from stores.renderers import EXPORT_RENDERERS, EXPORT_QUERY_PARAMETERS
+from stores.services.tabular_export import tabular_export
 from decimal import Decimal
 
 logger = logging.getLogger(__name__)
@@ -35,7 +40,9 @@ class TransactionViewSet(StoreViewSetMixin, viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated, IsCashierOrManagerOrAdmin]
     filter_backends = [DjangoFilterBackend, OrderingFilter]
     queryset = Transaction.objects.all()
-    ordering_fields = ['created_at', 'total_amount', 'status']
+    pagination_class = KeysetPagination
+    # Keyset-пагинация держит порядок (created_at, id): ?ordering=created_at — старые сверху
+    ordering_fields = ['created_at']
     ordering = ['-created_at']
 
     def get_queryset(self):
@@ -58,12 +65,11 @@ class TransactionViewSet(StoreViewSetMixin, viewsets.ModelViewSet):
                     'cashier',
                     'store'
                 ).prefetch_related(
-                    'items',
-                    'items__product'
+                    Prefetch('items', queryset=TransactionItem.objects.select_related(
+                        'product', 'product__custom_unit', 'product__default_size'
+                    ))
                 )
 
-                count = queryset.count()
-                logger.info(f"   ✅ Найдено {count} транзакций для магазина {current_store.name}")
                 return queryset
             else:
                 logger.warning(f"   ❌ Магазин не найден для пользователя {self.request.user.username}")
@@ -108,7 +114,7 @@ class TransactionViewSet(StoreViewSetMixin, viewsets.ModelViewSet):
                 type=openapi.TYPE_STRING,
                 format=openapi.FORMAT_DATE
             ),
-        ],
+        ] + KEYSET_QUERY_PARAMETERS,
         responses={200: TransactionSerializer(many=True)}
     )
     def list(self, request, *args, **kwargs):
@@ -129,11 +135,11 @@ class TransactionViewSet(StoreViewSetMixin, viewsets.ModelViewSet):
 
         date_from = request.query_params.get('date_from')
         if date_from:
-            queryset = queryset.filter(created_at__date__gte=date_from)
+            queryset = queryset.filter(business_date__gte=date_from)
 
         date_to = request.query_params.get('date_to')
         if date_to:
-            queryset = queryset.filter(created_at__date__lte=date_to)
+            queryset = queryset.filter(business_date__lte=date_to)
 
         # Пагинация
         page = self.paginate_queryset(queryset)
@@ -247,24 +253,7 @@ class TransactionViewSet(StoreViewSetMixin, viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Возвращаем товары на склад
-        for item in transaction.items.all():
-            # Находим или создаем партию для возврата
-            from inventory.models import ProductBatch
-            batch, created = ProductBatch.objects.get_or_create(
-                product=item.product,
-                store=transaction.store,
-                defaults={
-                    'quantity': 0,
-                    'purchase_price': item.price,
-                    'supplier': 'Возврат'
-                }
-            )
-            batch.quantity += item.quantity
-            batch.save()
-
-            # Обновляем stock
-            item.product.stock.update_quantity()
+        # Товары возвращаются на склад сигналом смены статуса (журнал движений RETURN)
 
         # Обновляем долг покупателя если была оплата в долг
         if transaction.payment_method == 'debt' and transaction.customer:
@@ -295,81 +284,63 @@ class TransactionViewSet(StoreViewSetMixin, viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
 
-        from django.db.models import Sum, Count, Avg
-        from django.utils import timezone
-        from datetime import timedelta
-
-        # Базовый queryset для текущего магазина
-        queryset = Transaction.objects.filter(
-            store=current_store,
-            status='completed'
-        )
-
-        # Статистика за сегодня
-        today = timezone.now().date()
-        today_stats = queryset.filter(
-            created_at__date=today
-        ).aggregate(
-            total=Sum('total_amount'),
-            count=Count('id'),
-            avg=Avg('total_amount')
-        )
-
-        # Статистика за неделю
-        week_ago = today - timedelta(days=7)
-        week_stats = queryset.filter(
-            created_at__date__gte=week_ago
-        ).aggregate(
-            total=Sum('total_amount'),
-            count=Count('id'),
-            avg=Avg('total_amount')
-        )
-
-        # Статистика за месяц
-        month_ago = today - timedelta(days=30)
-        month_stats = queryset.filter(
-            created_at__date__gte=month_ago
-        ).aggregate(
-            total=Sum('total_amount'),
-            count=Count('id'),
-            avg=Avg('total_amount')
-        )
-
-        # Топ товары
-        from django.db.models import F
-        top_products = TransactionItem.objects.filter(
-            transaction__store=current_store,
-            transaction__status='completed'
-        ).values(
-            'product__name'
-        ).annotate(
-            total_quantity=Sum('quantity'),
-            total_revenue=Sum(F('quantity') * F('price'))
-        ).order_by('-total_quantity')[:10]
+        # Прошедшие дни — из дневных сводок, сегодня — по продажам, с кэшем на магазин
+        statistics = sales_statistics.get(current_store)
 
         return Response({
             'store': {
                 'id': str(current_store.id),
                 'name': current_store.name
             },
-            'today': {
-                'total': float(today_stats['total'] or 0),
-                'count': today_stats['count'] or 0,
-                'avg': float(today_stats['avg'] or 0)
-            },
-            'week': {
-                'total': float(week_stats['total'] or 0),
-                'count': week_stats['count'] or 0,
-                'avg': float(week_stats['avg'] or 0)
-            },
-            'month': {
-                'total': float(month_stats['total'] or 0),
-                'count': month_stats['count'] or 0,
-                'avg': float(month_stats['avg'] or 0)
-            },
-            'top_products': list(top_products)
+            **statistics
         })
 
+    # Колонки выгрузки: строка на позицию продажи
+    export_columns = [
+        ('ID продажи', 'transaction_id'),
+        ('Дата и время', 'transaction__created_at'),
+        ('Бизнес-дата', 'transaction__business_date'),
+        ('Статус', 'transaction__status'),
+        ('Способ оплаты', 'transaction__payment_method'),
+        ('Кассир', 'transaction__cashier__username'),
+        ('Покупатель', 'transaction__customer__full_name'),
+        ('Сумма продажи', 'transaction__total_amount'),
+        ('Товар', 'product__name'),
+        ('Штрих-код', 'product__barcode'),
+        ('Количество', 'quantity'),
+        ('Ед. изм.', 'unit_display'),
+        ('Цена', 'price'),
+    ]
+
+    @swagger_auto_schema(
+        operation_description="Выгрузка продаж с позициями за период (CSV/XLSX потоком, строка на позицию)",
+        manual_parameters=EXPORT_QUERY_PARAMETERS,
+        responses={200: 'Файл CSV или XLSX'}
+    )
+    @action(detail=False, methods=['get'], renderer_classes=EXPORT_RENDERERS)
+    def export(self, request):
+        store = self.get_current_store()
+        if not store:
+            return Response({'error': 'Магазин не определен'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            date_from, date_to = tabular_export.period(request.query_params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Период — по business_date продажи: индекс (store, business_date, ...)
+        items = TransactionItem.objects.filter(transaction__store=store)
+        if date_from:
+            items = items.filter(transaction__business_date__gte=date_from)
+        if date_to:
+            items = items.filter(transaction__business_date__lte=date_to)
+
+        return tabular_export.response(
+            items.order_by('transaction_id', 'id'),
+            self.export_columns,
+            tabular_export.filename('sales', date_from, date_to),
+            request.accepted_renderer.format,
+        )
+
     @action(detail=False, methods=['get'])
     def today_sales(self, request):
         """
@@ -382,12 +353,9 @@ class TransactionViewSet(StoreViewSetMixin, viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
 
-        from django.utils import timezone
-
-        today = timezone.now().date()
         transactions = Transaction.objects.filter(
             store=current_store,
-            created_at__date=today
+            business_date=business_date()
         ).select_related('customer', 'cashier').prefetch_related('items__product')
 
         serializer = self.get_serializer(transactions, many=True)
@@ -411,13 +379,13 @@ class TransactionViewSet(StoreViewSetMixin, viewsets.ModelViewSet):
 
 class TransactionHistoryListView(StoreViewSetMixin, viewsets.ReadOnlyModelViewSet):
     """
-    ViewSet для просмотра истории транзакций без автоматического пагинатора
-    Ручная обработка limit/offset с правильным подсчетом записей
+    ViewSet для просмотра истории транзакций.
+    Keyset-пагинация по (created_at, id): глубокие страницы не дороже первой
     """
     # ✅ ДОБАВЛЯЕМ БАЗОВЫЙ QUERYSET - это обязательно для ViewSet
     queryset = TransactionHistory.objects.all()
 
-    # БЕЗ pagination_class - убираем пагинатор!
+    pagination_class = KeysetPagination
     lookup_field = 'id'
     filter_backends = [DjangoFilterBackend, OrderingFilter]
     ordering_fields = ['created_at', 'id']
@@ -481,7 +449,7 @@ class TransactionHistoryListView(StoreViewSetMixin, viewsets.ReadOnlyModelViewSe
             try:
                 from datetime import datetime
                 datetime.strptime(date_from, '%Y-%m-%d')
-                queryset = queryset.filter(created_at__date__gte=date_from)
+                queryset = queryset.filter(**range_lookups('created_at', date_from=date_from))
             except ValueError:
                 pass
 
@@ -489,7 +457,7 @@ class TransactionHistoryListView(StoreViewSetMixin, viewsets.ReadOnlyModelViewSe
             try:
                 from datetime import datetime
                 datetime.strptime(date_to, '%Y-%m-%d')
-                queryset = queryset.filter(created_at__date__lte=date_to)
+                queryset = queryset.filter(**range_lookups('created_at', date_to=date_to))
             except ValueError:
                 pass
 
@@ -499,22 +467,8 @@ class TransactionHistoryListView(StoreViewSetMixin, viewsets.ReadOnlyModelViewSe
         return FilteredTransactionHistorySerializer
 
     @swagger_auto_schema(
-        operation_description="Получить историю транзакций с ручной обработкой пагинации",
+        operation_description="Получить историю транзакций текущего магазина, новые сверху",
         manual_parameters=[
-            openapi.Parameter(
-                'limit',
-                openapi.IN_QUERY,
-                description="Количество записей для показа (по умолчанию все)",
-                type=openapi.TYPE_INTEGER,
-                required=False
-            ),
-            openapi.Parameter(
-                'offset',
-                openapi.IN_QUERY,
-                description="Смещение от начала списка (по умолчанию 0)",
-                type=openapi.TYPE_INTEGER,
-                required=False
-            ),
             openapi.Parameter(
                 'transaction_id',
                 openapi.IN_QUERY,
@@ -556,52 +510,22 @@ class TransactionHistoryListView(StoreViewSetMixin, viewsets.ReadOnlyModelViewSe
             openapi.Parameter(
                 'ordering',
                 openapi.IN_QUERY,
-                description="Сортировка: 'created_at', '-created_at', 'id', '-id'",
+                description="Сортировка: '-created_at' (по умолчанию) или 'created_at'",
                 type=openapi.TYPE_STRING
             ),
-        ]
+        ] + KEYSET_QUERY_PARAMETERS
     )
     def list(self, request, *args, **kwargs):
         """
-        Ручная обработка пагинации без пагинатора
+        Страница истории и информация о текущем магазине.
+        Вместо count/limit/offset прежнего ответа — page_size, next/previous и has_more;
+        ?offset= отклоняется с 400 (KeysetPagination)
         """
-        # Получаем параметры limit и offset
-        limit = request.query_params.get('limit')
-        offset = request.query_params.get('offset', 0)
-
-        # Валидация параметров
-        try:
-            limit = int(limit) if limit else None
-            offset = int(offset)
-        except (ValueError, TypeError):
-            limit = None
-            offset = 0
-
-        # Убеждаемся что offset не отрицательный
-        if offset < 0:
-            offset = 0
-
-        # Ограничиваем максимальный limit
-        if limit and limit > 1000:
-            limit = 1000
-
-        # Получаем базовый queryset
         queryset = self.filter_queryset(self.get_queryset())
-
-        # ВАЖНО: Считаем общее количество записей ДО применения limit/offset
-        total_count = queryset.count()
-
-        # Применяем offset и limit
-        if limit:
-            paginated_queryset = queryset[offset:offset + limit]
-        else:
-            paginated_queryset = queryset[offset:]
-
-        # Сериализуем
-        serializer = self.get_serializer(paginated_queryset, many=True)
+        page = self.paginate_queryset(queryset)
 
         # Фильтруем None значения (если они есть)
-        original_data = serializer.data
+        original_data = self.get_serializer(page, many=True).data
         valid_data = [item for item in original_data if item is not None]
 
         # ✅ ДОБАВЛЯЕМ ИНФОРМАЦИЮ О ТЕКУЩЕМ МАГАЗИНЕ
@@ -613,28 +537,14 @@ class TransactionHistoryListView(StoreViewSetMixin, viewsets.ReadOnlyModelViewSe
                 'name': current_store.name
             }
 
-        # Логирование
         logger.info(f"TransactionHistory list: store={store_info['name'] if store_info else 'None'}, "
-                   f"total_count={total_count}, limit={limit}, offset={offset}, "
-                   f"returned={len(valid_data)}, filtered_out={len(original_data) - len(valid_data)}")
+                    f"page_size={self.paginator.page_size}, returned={len(valid_data)}, "
+                    f"filtered_out={len(original_data) - len(valid_data)}")
 
-        # Формируем ответ
-        response_data = {
+        return Response({
             'store': store_info,  # ✅ Информация о текущем магазине
-            'count': total_count,  # Общее количество записей в БД (с учетом фильтров)
-            'results': valid_data  # Записи для текущей страницы
-        }
-
-        # Добавляем информацию о пагинации если параметры были переданы
-        if limit or offset > 0:
-            response_data.update({
-                'limit': limit,
-                'offset': offset,
-                'returned_count': len(valid_data),  # Фактически возвращено записей
-                'has_more': (offset + len(valid_data)) < total_count  # Есть ли ещё записи
-            })
-
-        return Response(response_data)
+            **self.get_paginated_response(valid_data).data
+        })
 
     @swagger_auto_schema(
         operation_description="Получить конкретную запись истории транзакции",
@@ -858,7 +768,7 @@ class CashierSalesSummaryView(StoreViewSetMixin, APIView):
                 start_date_parsed = parse_date(start_date)
                 if not start_date_parsed:
                     raise ValueError
-                queryset = queryset.filter(transaction__created_at__date__gte=start_date_parsed)
+                queryset = queryset.filter(transaction__business_date__gte=start_date_parsed)
             except ValueError:
                 return Response({
                     'error': 'Некорректный формат start_date. Используйте YYYY-MM-DD'
@@ -869,7 +779,7 @@ class CashierSalesSummaryView(StoreViewSetMixin, APIView):
                 end_date_parsed = parse_date(end_date)
                 if not end_date_parsed:
                     raise ValueError
-                queryset = queryset.filter(transaction__created_at__date__lte=end_date_parsed)
+                queryset = queryset.filter(transaction__business_date__lte=end_date_parsed)
             except ValueError:
                 return Response({
                     'error': 'Некорректный формат end_date. Используйте YYYY-MM-DD'
@@ -944,7 +854,6 @@ class CashierSalesSummaryView(StoreViewSetMixin, APIView):
         """Получить детальную статистику для кассира"""
         from sales.models import Transaction
         from django.db.models import Count, Avg
-        from django.db.models.functions import TruncDate
 
         # Базовый queryset для транзакций кассира
         transactions_qs = Transaction.objects.filter(
@@ -955,13 +864,13 @@ class CashierSalesSummaryView(StoreViewSetMixin, APIView):
 
         # Применяем фильтры по дате
         if start_date:
-            transactions_qs = transactions_qs.filter(created_at__date__gte=parse_date(start_date))
+            transactions_qs = transactions_qs.filter(business_date__gte=parse_date(start_date))
         if end_date:
-            transactions_qs = transactions_qs.filter(created_at__date__lte=parse_date(end_date))
+            transactions_qs = transactions_qs.filter(business_date__lte=parse_date(end_date))
 
         # Статистика по дням
         daily_stats = transactions_qs.annotate(
-            date=TruncDate('created_at')
+            date=F('business_date')
         ).values('date').annotate(
             transactions_count=Count('id'),
             daily_total=Sum('total_amount')
@@ -975,9 +884,9 @@ class CashierSalesSummaryView(StoreViewSetMixin, APIView):
         )
 
         if start_date:
-            top_products = top_products.filter(transaction__created_at__date__gte=parse_date(start_date))
+            top_products = top_products.filter(transaction__business_date__gte=parse_date(start_date))
         if end_date:
-            top_products = top_products.filter(transaction__created_at__date__lte=parse_date(end_date))
+            top_products = top_products.filter(transaction__business_date__lte=parse_date(end_date))
 
         top_products = top_products.values(
             'product__name'
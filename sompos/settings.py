@@ -28,7 +28,7 @@ ALLOWED_HOSTS = ['sompos.pythonanywhere.com', '127.0.0.1']
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'stores.mixins.StoreJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -194,6 +194,54 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Outbox продаж: события обрабатывает `manage.py dispatch_outbox --loop`, в ответ кассе
+# входит только INSERT в outbox. True — обрабатывать сразу после коммита в потоке запроса
+# (удобно при разработке без воркера, но проекции снова задерживают ответ)
+OUTBOX_DISPATCH_ON_COMMIT = False
+
+# Аналитика: False — считается сразу диспетчером outbox,
+# True — ставится в очередь для `manage.py analytics_worker`
+ANALYTICS_WORKER_ENABLED = False
+
+# Индекс штрих-кодов для кассы (в памяти каждого процесса):
+# число карточек и срок жизни записи — предел расхождения между процессами
+BARCODE_INDEX_MAX_ENTRIES = 50000
+BARCODE_INDEX_TTL = 60
+
+# Внутренние штрих-коды EAN-13: сколько кодов резервировать из счетчика магазина за раз
+BARCODE_BLOCK_SIZE = 100
+
+# Печать этикеток: кэш картинок штрих-кодов (диск + память процесса)
+# и пул процессов для отрисовки больших тиражей
+LABEL_CACHE_DIR = os.path.join(MEDIA_ROOT, 'label_cache')
+LABEL_CACHE_MEMORY_ENTRIES = 5000
+LABEL_RENDER_POOL_THRESHOLD = 200
+LABEL_RENDER_PROCESSES = min(os.cpu_count() or 1, 4)
+
+# Кэш членств в магазинах (StoreEmployee) в памяти процесса: размер и время жизни записи (сек)
+STORE_MEMBERSHIP_CACHE_MAX_ENTRIES = 10000
+STORE_MEMBERSHIP_CACHE_TTL = 300
+
+# Бюджет холодного django.setup() в мс (проверяется тестом stores.tests.StartupTests)
+STARTUP_TIME_BUDGET_MS = 1000
+
+# Часовой пояс бизнес-дня магазинов: Transaction.business_date и фильтры по датам (stores/business_date.py)
+BUSINESS_TIME_ZONE = 'Asia/Tashkent'
+
+# Кэш статистики продаж для дашборда в памяти процесса: число магазинов и время жизни записи (сек)
+SALES_STATISTICS_CACHE_MAX_ENTRIES = 1000
+SALES_STATISTICS_CACHE_TTL = 60
+
+# refresh_rollups (cron раз в минуту): продажи моложе задержки (сек) ждут следующего запуска,
+# чтобы не обогнать транзакции, которые еще не закоммичены; размер пачки продаж
+ROLLUP_REFRESH_SETTLE_SECONDS = 60
+ROLLUP_REFRESH_BATCH_SIZE = 500
+
+# Потоковые выгрузки CSV/XLSX (stores/services/tabular_export.py): строк из БД за одну
+# выборку iterator() и размер куска ответа в байтах — вместе задают потолок памяти выгрузки
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FLUSH_BYTES = 64 * 1024
+
 
 
 LOGGING = {
@@ -232,6 +280,11 @@ LOGGING = {
             'level': 'DEBUG',
             'propagate': True,
         },
+        # Логгеры приложений (раньше выводились через logging.basicConfig в inventory/models.py)
+        **{
+            app: {'handlers': ['console', 'file'], 'level': 'INFO', 'propagate': False}
+            for app in ('inventory', 'sales', 'analytics', 'customers', 'users', 'sms_sender', 'sompos')
+        },
     },
 }
 
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class StoresConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "stores"
+
+    def ready(self):
+        import stores.signals  # Сброс кэша членств в магазинах
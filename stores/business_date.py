@@ -0,0 +1,105 @@
+# stores/business_date.py
+"""
+📅 Бизнес-дни магазина (часовой пояс BUSINESS_TIME_ZONE, по умолчанию Asia/Tashkent).
+
+Фильтры вида created_at__date=... оборачивают колонку в функцию перевода
+часового пояса, и индекс (store, created_at) не используется. Здесь дни и
+периоды превращаются в полуоткрытые диапазоны [начало, конец) в UTC, а у продаж
+есть колонка business_date, заполняемая при вставке.
+"""
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+
+@lru_cache(maxsize=None)
+def _zone(name):
+    return ZoneInfo(name)
+
+
+def business_tz():
+    return _zone(getattr(settings, 'BUSINESS_TIME_ZONE', settings.TIME_ZONE))
+
+
+def business_date(moment=None):
+    """Бизнес-дата момента (aware datetime; по умолчанию — сейчас)"""
+    return timezone.localtime(moment or timezone.now(), business_tz()).date()
+
+
+def business_hour(moment):
+    """Час бизнес-дня (0–23) для aware datetime"""
+    return timezone.localtime(moment, business_tz()).hour
+
+
+def to_date(value):
+    """date или строка YYYY-MM-DD -> date. Некорректная строка — ValueError"""
+    if value is None or isinstance(value, date):
+        return value
+    try:
+        parsed = parse_date(str(value))
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValueError(f'Некорректная дата: {value}')
+    return parsed
+
+
+def day_start(day):
+    """Начало бизнес-дня в UTC"""
+    start = datetime.combine(to_date(day), time.min, tzinfo=business_tz())
+    return start.astimezone(dt_timezone.utc)
+
+
+def day_range(day):
+    """Бизнес-день -> (начало, конец) в UTC, конец не входит в диапазон"""
+    day = to_date(day)
+    return day_start(day), day_start(day + timedelta(days=1))
+
+
+def range_lookups(field, date_from=None, date_to=None):
+    """
+    Фильтр по периоду бизнес-дней [date_from, date_to] (границы включительно, любая может
+    отсутствовать) для поля-момента: {'field__gte': начало, 'field__lt': конец следующего дня}.
+    Сравнение с самой колонкой — условие идет по индексу
+    """
+    lookups = {}
+    if date_from is not None:
+        lookups[f'{field}__gte'] = day_start(date_from)
+    if date_to is not None:
+        lookups[f'{field}__lt'] = day_start(to_date(date_to) + timedelta(days=1))
+    return lookups
+
+
+class BusinessDateField(models.DateField):
+    """
+    Бизнес-дата записи, вычисляется из поля-момента (source) при вставке.
+    Объявляется после source: pre_save полей вызывается в порядке объявления,
+    поэтому auto_now_add у source уже заполнен
+    """
+
+    def __init__(self, *args, source='created_at', **kwargs):
+        self.source = source
+        kwargs.setdefault('editable', False)
+        kwargs.setdefault('null', True)
+        kwargs.setdefault('blank', True)
+        super().__init__(*args, **kwargs)
+
+    def pre_save(self, model_instance, add):
+        value = getattr(model_instance, self.attname)
+        if value is None:
+            moment = getattr(model_instance, self.source)
+            if moment is not None:
+                value = business_date(moment)
+                setattr(model_instance, self.attname, value)
+        return value
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.source != 'created_at':
+            kwargs['source'] = self.source
+        return name, path, args, kwargs
@@ -0,0 +1,85 @@
+# stores/management/bench.py
+"""
+Общие помощники для management-команд бенчмарков.
+Все данные создаются внутри транзакции и откатываются в конце замера.
+"""
+import time
+import uuid
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+
+from stores.models import Store
+
+
+class BenchmarkRollback(Exception):
+    """Используется для отката тестовых данных после замера"""
+
+
+@contextmanager
+def rollback_after():
+    """Выполняет блок в транзакции и всегда откатывает её"""
+    try:
+        with transaction.atomic():
+            yield
+            raise BenchmarkRollback()
+    except BenchmarkRollback:
+        pass
+
+
+def measure(func, *args, **kwargs):
+    """
+    Выполняет func и возвращает (результат, число SQL-запросов, миллисекунды)
+    """
+    queries = [0]
+
+    def count_queries(execute, sql, params, many, context):
+        queries[0] += 1
+        return execute(sql, params, many, context)
+
+    # Счетчик через execute_wrapper: журнал запросов Django ограничен 9000 записями
+    with connection.execute_wrapper(count_queries):
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+    return result, queries[0], elapsed_ms
+
+
+def create_bench_store(products=10, batches_per_product=2, batch_quantity=Decimal('1000')):
+    """
+    Создает магазин, владельца, категорию и товары с партиями.
+    Возвращает (store, user, [product, ...])
+    """
+    from inventory.models import Product, ProductBatch, ProductCategory
+
+    suffix = uuid.uuid4().hex[:8]
+    user = User.objects.create_user(username=f'bench_{suffix}', password=uuid.uuid4().hex)
+    store = Store.objects.create(
+        name=f'Bench store {suffix}',
+        address='bench',
+        owner=user,
+        min_markup_percent=Decimal('0')
+    )
+    category = ProductCategory.objects.create(store=store, name=f'Bench {suffix}')
+
+    created = []
+    for index in range(products):
+        product = Product.objects.create(
+            store=store,
+            name=f'Bench product {index}',
+            category=category,
+            unit_type='piece',
+            sale_price=Decimal('100.00')
+        )
+        for batch_index in range(batches_per_product):
+            ProductBatch.objects.create(
+                store=store,
+                product=product,
+                quantity=batch_quantity,
+                purchase_price=Decimal('50.00') + batch_index
+            )
+        created.append(product)
+
+    return store, user, created
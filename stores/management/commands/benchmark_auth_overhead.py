@@ -0,0 +1,90 @@
+# stores/management/commands/benchmark_auth_overhead.py
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from rest_framework.request import Request
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+from stores.management.bench import rollback_after, measure, create_bench_store
+from stores.mixins import StoreJWTAuthentication
+from stores.models import Store, StoreEmployee
+from stores.services.membership_cache import membership_cache
+from stores.services.store_context import store_context
+from stores.tokens import get_tokens_for_user_and_store
+
+
+def legacy_auth(http_request):
+    """
+    Эталон: прежний путь — проверка токена в DRF, повторное декодирование
+    в middleware и во view/сериализаторе, магазин и членство запросами
+    """
+    user, _ = JWTAuthentication().authenticate(Request(http_request))
+    raw_token = http_request.META['HTTP_AUTHORIZATION'].split(' ')[1]
+    store_id = AccessToken(raw_token).get('store_id')
+    store = Store.objects.get(id=store_id)
+    StoreEmployee.objects.filter(user=user, store=store, is_active=True).first()
+    AccessToken(raw_token).get('store_role')
+    return store
+
+
+def store_auth(http_request):
+    """Новый путь: токен проверяется один раз, магазин из claims и кэша членств"""
+    request = Request(http_request, authenticators=[StoreJWTAuthentication()])
+    request.user  # аутентификация
+    return store_context.resolve(request)['store']
+
+
+class Command(BaseCommand):
+    help = 'Микробенчмарк аутентификации: накладные расходы JWT и определения магазина на запрос'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Запросов в замере')
+
+    def handle(self, *args, **options):
+        total = max(options['requests'], 1)
+        factory = RequestFactory()
+
+        self.stdout.write(self.style.SUCCESS('=== БЕНЧМАРК АУТЕНТИФИКАЦИИ ==='))
+
+        with rollback_after():
+            store, user, _ = create_bench_store(products=1, batches_per_product=1)
+            StoreEmployee.objects.update_or_create(store=store, user=user, defaults={'role': 'owner'})
+            header = f"Bearer {get_tokens_for_user_and_store(user, store.pk)['access']}"
+
+            def requests():
+                return [factory.get('/inventory/products/', HTTP_AUTHORIZATION=header) for _ in range(total)]
+
+            membership_cache.clear()
+            legacy_requests, new_requests = requests(), requests()
+            _, legacy_queries, legacy_ms = measure(lambda: [legacy_auth(r) for r in legacy_requests])
+            token = store_context.activate()
+            try:
+                resolved, new_queries, new_ms = measure(lambda: [store_auth(r) for r in new_requests])
+                if any(result != store for result in resolved):
+                    raise CommandError('❌ Магазин из claims не совпал с магазином токена')
+
+                # claims доступны на request.auth без повторного декодирования
+                request = Request(factory.get('/', HTTP_AUTHORIZATION=header), authenticators=[StoreJWTAuthentication()])
+                request.user
+                if request.auth.store_id != str(store.pk) or request.auth.store_role != 'owner':
+                    raise CommandError('❌ store_id/store_role не выставлены на request.auth')
+
+                # Смена роли: токен помечается устаревшим, права — по актуальному членству
+                StoreEmployee.objects.filter(store=store, user=user).update(role='cashier')
+                membership_cache.invalidate(user_ids=[user.pk])
+                context = store_context.resolve(Request(
+                    factory.get('/', HTTP_AUTHORIZATION=header), authenticators=[StoreJWTAuthentication()]
+                ), user=user)
+                if not context['token_stale'] or context['role'] != 'cashier':
+                    raise CommandError('❌ Устаревшая роль в токене не обнаружена')
+            finally:
+                store_context.reset(token)
+                membership_cache.clear()
+
+        self.stdout.write(
+            f"прежний путь: {legacy_ms / total * 1000:>8.1f} мкс/запрос, запросов {legacy_queries / total:.2f}/запрос"
+        )
+        self.stdout.write(
+            f"claims токена: {new_ms / total * 1000:>7.1f} мкс/запрос, запросов {new_queries / total:.2f}/запрос"
+        )
+        self.stdout.write(self.style.SUCCESS('\n✅ Замер завершен, тестовые данные откатены'))
@@ -0,0 +1,120 @@
+# stores/management/commands/benchmark_keyset_pagination.py
+from datetime import timedelta
+from decimal import Decimal
+from urllib.parse import parse_qsl, urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from sales.models import Transaction
+from stores.management.bench import rollback_after, measure, create_bench_store
+from stores.pagination import KeysetPagination
+
+
+class Command(BaseCommand):
+    help = 'Бенчмарк keyset-пагинации продаж против OFFSET: полный обход вперед и назад, глубокие страницы'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000, help='Продаж в магазине')
+        parser.add_argument('--page-size', type=int, default=50, help='Записей на странице')
+
+    def handle(self, *args, **options):
+        rows = max(options['rows'], 2)
+        page_size = max(options['page_size'], 1)
+        factory = APIRequestFactory(SERVER_NAME='127.0.0.1')
+
+        self.stdout.write(self.style.SUCCESS('=== БЕНЧМАРК KEYSET-ПАГИНАЦИИ ==='))
+
+        with rollback_after():
+            store, user, _ = create_bench_store(products=1, batches_per_product=0)
+            Transaction.objects.bulk_create(
+                [Transaction(store=store, cashier=user, total_amount=Decimal('10')) for _ in range(rows)],
+                batch_size=1000
+            )
+            # Одинаковое время у соседних продаж: порядок и курсор держатся на id
+            moment = timezone.now()
+            ids = list(Transaction.objects.filter(store=store).order_by('pk').values_list('pk', flat=True))
+            for index in range(0, len(ids), 3):
+                Transaction.objects.filter(pk__in=ids[index:index + 3]).update(
+                    created_at=moment - timedelta(seconds=len(ids) - index)
+                )
+            queryset = Transaction.objects.filter(store=store)
+            expected = list(queryset.order_by('-created_at', '-pk').values_list('pk', flat=True))
+
+            def page(params):
+                paginator = KeysetPagination()
+                request = Request(factory.get('/sales/transactions/', params))
+                result = paginator.paginate_queryset(queryset, request)
+                data = paginator.get_paginated_response([row.pk for row in result]).data
+                return data
+
+            def query_of(link):
+                return dict(parse_qsl(urlsplit(link).query))
+
+            # Полный обход вперед
+            walked, link, pages = [], None, 0
+            while True:
+                data = page(query_of(link) if link else {'page_size': page_size})
+                walked += data['results']
+                pages += 1
+                link = data['next']
+                if not link:
+                    break
+            if walked != expected:
+                raise CommandError('❌ Обход вперед: пропуски, повторы или нарушен порядок')
+            self.stdout.write(f"✅ Вперед: {pages} страниц, {len(walked)} продаж без пропусков и повторов")
+
+            # Обратно по ссылкам previous с последней страницы
+            back = data['results']
+            link = data['previous']
+            while link:
+                data = page(query_of(link))
+                back = data['results'] + back
+                link = data['previous']
+            if back != expected:
+                raise CommandError('❌ Обход назад: пропуски, повторы или нарушен порядок')
+            self.stdout.write('✅ Назад по previous: тот же список')
+
+            # Глубокая страница: OFFSET против курсора
+            deep = (rows // page_size - 1) * page_size
+            cursor_row = Transaction.objects.get(pk=expected[deep - 1])
+            cursor = KeysetPagination()
+            cursor.request = Request(factory.get('/sales/transactions/'))
+            cursor.page_size = page_size
+            deep_link = cursor.encode_cursor(cursor_row, reverse=False)
+
+            offset_rows, offset_queries, offset_ms = measure(
+                lambda: list(queryset.order_by('-created_at', '-pk')[deep:deep + page_size])
+            )
+            # Тот же запрос, что строит пагинатор, без разбора запроса и ссылок
+            position = (cursor_row.created_at, cursor_row.pk)
+            keyset_rows, keyset_queries, keyset_ms = measure(
+                lambda: list(cursor.after(queryset, position)[:page_size])
+            )
+            first_rows, _, first_ms = measure(lambda: list(cursor.after(queryset)[:page_size]))
+            keyset = page({**query_of(deep_link), 'page_size': page_size})
+            offset_ids = [row.pk for row in offset_rows]
+            if offset_ids != keyset['results'] or offset_ids != [row.pk for row in keyset_rows]:
+                raise CommandError('❌ Глубокая страница по курсору не совпала с OFFSET')
+
+            counted, count_queries, count_ms = measure(page, {'page_size': page_size, 'count': '1'})
+            # До count_limit — точно, дальше — не меньше count_limit и с пометкой «примерно»
+            exact = rows <= KeysetPagination.count_limit
+            if counted['count_is_exact'] != exact or (counted['count'] != rows if exact else counted['count'] <= KeysetPagination.count_limit):
+                raise CommandError(f"❌ Число записей: {counted['count']} при {rows}")
+            capped = page({'page_size': 10 ** 6})
+            if len(capped['results']) != KeysetPagination.max_page_size:
+                raise CommandError('❌ Размер страницы не ограничен')
+
+        self.stdout.write(f"продаж: {rows}, страница: {page_size}, глубокая страница с позиции {deep}")
+        self.stdout.write(f"OFFSET, глубокая страница:  {offset_ms:>8.2f} мс, запросов {offset_queries}")
+        self.stdout.write(f"курсор, глубокая страница:  {keyset_ms:>8.2f} мс, запросов {keyset_queries}")
+        self.stdout.write(f"курсор, первая страница:    {first_ms:>8.2f} мс")
+        self.stdout.write(
+            f"курсор + count=1:           {count_ms:>8.2f} мс, запросов {count_queries} "
+            f"(count={counted['count']}, точно: {counted['count_is_exact']})"
+        )
+        self.stdout.write(f"✅ page_size=1000000 ограничен до {KeysetPagination.max_page_size}")
+        self.stdout.write(self.style.SUCCESS('\n✅ Замер завершен, тестовые данные откатены'))
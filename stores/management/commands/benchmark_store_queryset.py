@@ -0,0 +1,66 @@
+# stores/management/commands/benchmark_store_queryset.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from inventory.models import Product
+from sales.models import Transaction
+from stores.management.bench import rollback_after, create_bench_store
+from stores.mixins import StoreFilteredQuerySet, store_scope
+
+
+def legacy_metadata(model):
+    """Эталон: прежняя проверка полей на каждом вызове"""
+    return 'is_deleted' in [field.name for field in model._meta.get_fields()], hasattr(model, 'store')
+
+
+def legacy_queryset(model, store):
+    """Эталон: прежний get_queryset менеджера и фильтр StoreViewSetMixin"""
+    queryset = StoreFilteredQuerySet(model)
+    field_names = [field.name for field in model._meta.get_fields()]
+    if 'is_deleted' in field_names:
+        queryset = queryset.filter(is_deleted=False)
+    if hasattr(queryset.model, 'store'):
+        queryset = queryset.filter(store=store)
+    return queryset
+
+
+def scoped_queryset(model, store):
+    """Новый путь: метаданные модели посчитаны заранее, фильтр через for_store()"""
+    queryset = model.objects.all()
+    if store_scope(model)['store_field']:
+        queryset = queryset.for_store(store)
+    return queryset
+
+
+class Command(BaseCommand):
+    help = 'Микробенчмарк построения QuerySet моделей магазина: метаданные модели и фильтр по магазину'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20000, help='Построений QuerySet на модель')
+
+    def handle(self, *args, **options):
+        iterations = max(options['iterations'], 1)
+
+        self.stdout.write(self.style.SUCCESS('=== БЕНЧМАРК QUERYSET МАГАЗИНА ==='))
+
+        with rollback_after():
+            store, _, _ = create_bench_store(products=3, batches_per_product=1)
+
+            for model in (Product, Transaction):
+                legacy_meta_us = self._time(lambda: legacy_metadata(model), iterations)
+                scope_meta_us = self._time(lambda: store_scope(model), iterations)
+                legacy_us = self._time(lambda: legacy_queryset(model, store), iterations)
+                scoped_us = self._time(lambda: scoped_queryset(model, store), iterations)
+                self.stdout.write(
+                    f"{model.__name__:<12} проверка полей: {legacy_meta_us:>6.2f} → {scope_meta_us:>5.2f} мкс, "
+                    f"QuerySet: {legacy_us:>6.1f} → {scoped_us:>6.1f} мкс"
+                )
+
+        self.stdout.write(self.style.SUCCESS('\n✅ Замер завершен, тестовые данные откатены'))
+
+    def _time(self, build, iterations):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            build()
+        return (time.perf_counter() - started) / iterations * 1e6
@@ -0,0 +1,84 @@
+# stores/management/commands/profile_startup.py
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Замер в отдельном процессе: в текущем все модули уже импортированы
+SETUP_SCRIPT = (
+    "import time; started = time.perf_counter(); import django; django.setup(); "
+    "print('SETUP_MS', (time.perf_counter() - started) * 1000)"
+)
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)$')
+
+
+def parse_importtime(lines):
+    """Строки -X importtime -> [(модуль, собственное мкс, суммарное мкс, пакет родителя)]"""
+    entries, stack = [], []
+    # Дочерние модули печатаются раньше родителя: разбор с конца
+    for line in reversed(lines):
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, module = match.groups()
+        depth = len(indent) // 2
+        del stack[depth:]
+        parent = stack[-1] if stack else None
+        entries.append((module, int(self_us), int(cumulative_us), parent and parent.split('.')[0]))
+        stack.append(module)
+    return entries
+
+
+class Command(BaseCommand):
+    help = 'Профиль импорта при холодном django.setup(): стоимость по приложениям и сторонним пакетам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=3, help='Число холодных запусков (берется лучший)')
+        parser.add_argument('--top', type=int, default=10, help='Сколько сторонних пакетов показать')
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'sompos.settings'))
+
+        timings, lines = [], []
+        for _ in range(max(options['runs'], 1)):
+            result = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', SETUP_SCRIPT],
+                cwd=settings.BASE_DIR, env=env, capture_output=True, text=True
+            )
+            if result.returncode != 0:
+                raise CommandError(f'❌ django.setup() завершился ошибкой:\n{result.stderr[-2000:]}')
+            timings.append(float(result.stdout.split('SETUP_MS')[-1]))
+            lines = result.stderr.splitlines()
+
+        own, inclusive = defaultdict(int), defaultdict(int)
+        for module, self_us, cumulative_us, parent_package in parse_importtime(lines):
+            package = module.split('.')[0]
+            own[package] += self_us
+            if parent_package != package:
+                inclusive[package] += cumulative_us
+
+        project_apps = {
+            config.name.split('.')[0] for config in apps.get_app_configs()
+            if str(config.path).startswith(str(settings.BASE_DIR))
+        } | {settings.ROOT_URLCONF.split('.')[0]}
+
+        self.stdout.write(self.style.SUCCESS('=== ПРОФИЛЬ ЗАПУСКА DJANGO ==='))
+        self.stdout.write(f"{'приложение':<22} | {'свои, мс':>9} | {'с зависимостями, мс':>20}")
+        for package in sorted(project_apps, key=lambda name: -inclusive[name]):
+            self.stdout.write(f"{package:<22} | {own[package] / 1000:>9.1f} | {inclusive[package] / 1000:>20.1f}")
+
+        self.stdout.write(f"\n{'сторонний пакет':<22} | {'свои, мс':>9}")
+        external = sorted((name for name in own if name not in project_apps), key=lambda name: -own[name])
+        for package in external[:options['top']]:
+            self.stdout.write(f"{package:<22} | {own[package] / 1000:>9.1f}")
+
+        best = min(timings)
+        self.stdout.write(f"\n📊 django.setup(): лучший {best:.0f} мс, запуски: {', '.join(f'{t:.0f}' for t in timings)}")
+        budget = getattr(settings, 'STARTUP_TIME_BUDGET_MS', None)
+        if budget:
+            self.stdout.write(f"бюджет: {budget:.0f} мс (проверяется тестом stores.tests.StartupTests)")
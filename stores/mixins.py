@@ -1,13 +1,15 @@
 # stores/mixins.py (ИСПРАВЛЕННАЯ ВЕРСИЯ)
 from django.db import models
+from django.db.models.signals import class_prepared
+from django.dispatch import receiver
 from django.core.exceptions import PermissionDenied, ValidationError
 from rest_framework import serializers
 from .models import Store
 import logging
 from rest_framework.permissions import BasePermission
-import jwt
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from stores.services.store_access_service import store_access_service
+from stores.services.store_context import store_context
 
 
 
@@ -17,98 +19,43 @@ logger = logging.getLogger(__name__)
 
 class StoreJWTPermission(BasePermission):
     """
-    Permission для JWT-аутентификации с информацией о магазине в токене
+    Permission для JWT-аутентификации с информацией о магазине в токене.
+    Токен уже проверен StoreJWTAuthentication — магазин и роль берутся из контекста запроса
     """
-    
+
     def has_permission(self, request, view):
-        # Получаем токен из заголовка
-        auth_header = request.META.get('HTTP_AUTHORIZATION')
-        if not auth_header or not auth_header.startswith('Bearer '):
+        if not getattr(request, 'auth', None) or not getattr(request.auth, 'store_id', None):
             return False
-        
-        token = auth_header.split(' ')[1]
-        
-        try:
-            # Декодируем токен (без проверки подписи для получения данных)
-            decoded_token = jwt.decode(token, options={"verify_signature": False})
-            
-            # Получаем данные из токена
-            user_id = decoded_token.get('user_id')
-            store_id = decoded_token.get('store_id')
-            store_name = decoded_token.get('store_name')
-            
-            if not user_id or not store_id:
-                return False
-            
-            # Получаем пользователя
-            from django.contrib.auth import get_user_model
-            User = get_user_model()
-            
-            try:
-                user = User.objects.get(id=user_id)
-                request.user = user
-            except User.DoesNotExist:
-                return False
-            
-            # Получаем магазин
-            from stores.models import Store
-            try:
-                store = Store.objects.get(id=store_id)
-                request.current_store = store
-                
-                # Устанавливаем current_store для user (для совместимости)
-                user.current_store = store
-                
-            except Store.DoesNotExist:
-                return False
-            
-            # Проверяем права пользователя в магазине
-            from stores.models import StoreEmployee
-            membership = StoreEmployee.objects.filter(
-                user=user,
-                store=store,
-                is_active=True
-            ).first()
-            
-            if not membership:
-                return False
-            
-            # Сохраняем роль для дальнейшего использования
-            request.user_store_role = membership.role
-            
-            return True
-            
-        except (jwt.DecodeError, KeyError, ValueError) as e:
-            print(f"DEBUG: JWT decode error: {e}")
+
+        context = store_context.resolve(request)
+        # Магазин из токена, а не запасной вариант
+        if context['source'] != 'token':
             return False
-    
+
+        request.current_store = context['store']
+        request.user_store_role = context['role']
+        return True
+
     def has_object_permission(self, request, view, obj):
         # Проверяем, что объект принадлежит магазину из токена
         if hasattr(obj, 'store') and hasattr(request, 'current_store'):
             return obj.store == request.current_store
         return True
-    
 
 
 class StoreJWTAuthentication(JWTAuthentication):
     """
-    Кастомная JWT-аутентификация с установкой текущего магазина
+    JWT-аутентификация с магазинными claims: токен проверяется один раз за запрос,
+    store_id, store_role и membership_version доступны как атрибуты request.auth.
+    Магазин и права определяет store_context (по кэшу членств) — здесь запросов к Store нет
     """
-    
-    def get_user(self, validated_token):
-        user = super().get_user(validated_token)
-        
-        # Получаем store_id из токена
-        store_id = validated_token.get('store_id')
-        if store_id:
-            from stores.models import Store
-            try:
-                store = Store.objects.get(id=store_id)
-                user.current_store = store
-            except Store.DoesNotExist:
-                pass
-        
-        return user
+
+    def get_validated_token(self, raw_token):
+        validated_token = super().get_validated_token(raw_token)
+        for claim, value in store_context.claims_of(validated_token).items():
+            setattr(validated_token, claim, value)
+        return validated_token
+
 
 class SimpleStorePermission(BasePermission):
     """
@@ -145,62 +92,119 @@ class StoreOwnedModel(models.Model):
         abstract = True
 
 
+def _build_store_scope(model):
+    """Метаданные модели для фильтрации: поле магазина и мягкое удаление (is_deleted)"""
+    fields = {field.name: field for field in model._meta.fields}
+    store_field = fields.get('store')
+    return {
+        'store_field': 'store' if store_field is not None and store_field.is_relation else None,
+        'soft_delete': 'is_deleted' in fields,
+    }
+
+
+def store_scope(model):
+    """Метаданные модели (считаются один раз на модель, при ее подготовке)"""
+    scope = model.__dict__.get('_store_scope')
+    if scope is None:
+        scope = model._store_scope = _build_store_scope(model)
+    return scope
+
+
+@receiver(class_prepared)
+def prepare_store_scope(sender, **kwargs):
+    if issubclass(sender, StoreOwnedModel):
+        sender._store_scope = _build_store_scope(sender)
+
+
 class StoreFilteredQuerySet(models.QuerySet):
     """
-    QuerySet, который автоматически фильтрует по магазину
+    QuerySet, который фильтрует по магазину.
+    После for_store() выборка привязана к магазину: for_store() с другим магазином
+    вызывает PermissionDenied, а не возвращает чужие данные
     """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._store_id = None
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._store_id = self._store_id
+        return clone
+
     def for_store(self, store):
-        """Фильтрация по конкретному магазину"""
-        if store:
-            return self.filter(store=store)
-        return self.none()
+        """Фильтрация по конкретному магазину (объект или id)"""
+        if store is None:
+            return self.none()
+        store_id = getattr(store, 'pk', store)
+        if self._store_id is not None:
+            if str(self._store_id) != str(store_id):
+                raise PermissionDenied("Выборка уже ограничена другим магазином")
+            return self._chain()
+
+        field = store_scope(self.model)['store_field'] or 'store'
+        queryset = self.filter(**{f'{field}_id': store_id})
+        queryset._store_id = store_id
+        return queryset
 
     def for_user(self, user):
         """Фильтрация по магазину пользователя"""
-        if hasattr(user, 'current_store') and user.current_store:
-            return self.filter(store=user.current_store)
-        return self.none()
+        return self.for_store(getattr(user, 'current_store', None))
 
 
 class StoreOwnedManager(models.Manager):
     """
-    ✅ ИСПРАВЛЕННЫЙ менеджер для моделей, принадлежащих магазину
+    Менеджер для моделей, принадлежащих магазину.
+    Скрывает удаленные записи (если есть поле is_deleted) и внутри запроса
+    с определенным магазином (store_context) автоматически фильтрует по нему.
+
+    Без фильтра по магазину запроса:
+    - across_stores() — все магазины (фоновые задачи, отчеты по магазинам);
+    - for_store(store) / for_user(user) — явно выбранный магазин;
+    - обратные связи (store.product_set, product.batches, ...) — выборку
+      ограничивает объект-владелец.
+    Свой QuerySet модели подключается через StoreOwnedManager.from_queryset()
     """
-    def get_queryset(self):
-        """
-        Возвращает queryset с фильтрацией удаленных записей (если поле есть)
-        """
-        queryset = StoreFilteredQuerySet(self.model, using=self._db)
+    _queryset_class = StoreFilteredQuerySet
 
-        # ✅ ИСПРАВЛЕНИЕ: Проверяем есть ли поле is_deleted перед фильтрацией
-        if hasattr(self.model, '_meta'):
-            field_names = [field.name for field in self.model._meta.get_fields()]
-            if 'is_deleted' in field_names:
-                queryset = queryset.filter(is_deleted=False)
+    def _base_queryset(self, deleted=False):
+        queryset = self._queryset_class(self.model, using=self._db)
+        if store_scope(self.model)['soft_delete']:
+            queryset = queryset.filter(is_deleted=deleted)
+        elif deleted:
+            queryset = queryset.none()
+        return queryset
 
+    def _scoped(self, queryset):
+        """Фильтр по магазину текущего запроса, если он определен"""
+        if hasattr(self, 'core_filters'):
+            # Менеджер обратной связи: фильтр по объекту-владельцу уже задан
+            return queryset
+        context = store_context.get()
+        if context is not None and context['store_id'] is not None and store_scope(self.model)['store_field']:
+            return queryset.for_store(context['store_id'])
         return queryset
 
+    def get_queryset(self):
+        return self._scoped(self._base_queryset())
+
+    def across_stores(self):
+        """Все магазины без фильтра запроса (фоновые задачи, явно выбранный магазин)"""
+        return self._base_queryset()
+
     def for_store(self, store):
-        return self.get_queryset().for_store(store)
+        """Выборка явно выбранного магазина (дальше привязана к нему)"""
+        return self.across_stores().for_store(store)
 
     def for_user(self, user):
-        return self.get_queryset().for_user(user)
+        return self.across_stores().for_user(user)
 
     def include_deleted(self):
         """Получить все записи включая удаленные"""
-        return StoreFilteredQuerySet(self.model, using=self._db)
+        return self._scoped(self._queryset_class(self.model, using=self._db))
 
     def only_deleted(self):
         """Получить только удаленные записи"""
-        queryset = StoreFilteredQuerySet(self.model, using=self._db)
-
-        # Проверяем есть ли поле is_deleted
-        if hasattr(self.model, '_meta'):
-            field_names = [field.name for field in self.model._meta.get_fields()]
-            if 'is_deleted' in field_names:
-                return queryset.filter(is_deleted=True)
-
-        return queryset.none()
+        return self._scoped(self._base_queryset(deleted=True))
 
 
 class StoreViewSetMixin:
@@ -208,70 +212,16 @@ class StoreViewSetMixin:
     Миксин для ViewSet'ов с автоматической фильтрацией по магазину
     """
     def get_current_store(self):
-        """Получить текущий магазин с резервными способами"""
-        user = self.request.user
-
-        # Способ 1: Из атрибутов пользователя (установлено middleware)
-        if hasattr(user, 'current_store') and user.current_store:
-            # ✅ ДОПОЛНИТЕЛЬНАЯ ПРОВЕРКА: есть ли у пользователя доступ к этому магазину
-            if self._user_has_access_to_store(user, user.current_store):
-                logger.debug(f"✅ Store from user attribute: {user.current_store.name}")
-                return user.current_store
-            else:
-                logger.warning(f"⚠️ User {user.username} has no access to store {user.current_store.name}")
+        """Текущий магазин запроса (определяется один раз на запрос, см. store_context)"""
+        return store_context.resolve(self.request)['store']
 
-        # Способ 2: Через Employee модель
-        if hasattr(user, 'employee') and user.employee and user.employee.store:
-            store = user.employee.store
-            if self._user_has_access_to_store(user, store):
-                logger.debug(f"✅ Store from Employee model: {store.name}")
-                user.current_store = store
-                return store
-
-        # Способ 3: Из JWT токена напрямую
-        try:
-            auth_header = self.request.META.get('HTTP_AUTHORIZATION', '')
-            if auth_header.startswith('Bearer '):
-                token = auth_header.split(' ')[1]
-                from rest_framework_simplejwt.tokens import AccessToken
-                decoded_token = AccessToken(token)
-                store_id = decoded_token.get('store_id')
-
-                if store_id:
-                    from stores.models import Store
-                    store = Store.objects.get(id=store_id, is_active=True)
-
-                    # ✅ ПРОВЕРЯЕМ ДОСТУП К МАГАЗИНУ ИЗ ТОКЕНА
-                    if self._user_has_access_to_store(user, store):
-                        logger.debug(f"✅ Store from JWT token: {store.name}")
-                        user.current_store = store
-                        return store
-                    else:
-                        logger.warning(f"⚠️ User {user.username} has no access to store from JWT: {store.name}")
-
-        except Exception as e:
-            logger.debug(f"Failed to get store from JWT: {e}")
-
-        # ✅ ИСПРАВЛЕНО: Способ 4 - Берем ПЕРВЫЙ ДОСТУПНЫЙ магазин пользователя
-        accessible_stores = self._get_user_accessible_stores(user)
-        if accessible_stores:
-            first_store = accessible_stores.first()
-            logger.debug(f"✅ Using first accessible store: {first_store.name}")
-            user.current_store = first_store
-            return first_store
-
-        logger.warning(f"❌ No accessible stores found for user {user.username}")
-        return None
+    def get_store_context(self):
+        """Магазин, роль и разрешения пользователя в нем"""
+        return store_context.resolve(self.request)
 
     def _user_has_access_to_store(self, user, store):
         """Проверяет, есть ли у пользователя доступ к конкретному магазину"""
-        from stores.models import StoreEmployee
-
-        return StoreEmployee.objects.filter(
-            user=user,
-            store=store,
-            is_active=True
-        ).exists()
+        return store_context.has_access(user, store)
 
     def _get_user_accessible_stores(self, user):
         """Получает все магазины, к которым у пользователя есть доступ"""
@@ -294,7 +244,7 @@ class StoreViewSetMixin:
         queryset = super().get_queryset()
 
         # Проверяем, что модель поддерживает магазины
-        if not hasattr(queryset.model, 'store'):
+        if not store_scope(queryset.model)['store_field']:
             logger.debug(f"Model {queryset.model.__name__} doesn't have store field, skipping filter")
             return queryset
 
@@ -302,7 +252,10 @@ class StoreViewSetMixin:
         current_store = self.get_current_store()
 
         if current_store:
-            queryset = queryset.filter(store=current_store)
+            if isinstance(queryset, StoreFilteredQuerySet):
+                queryset = queryset.for_store(current_store)
+            else:
+                queryset = queryset.filter(store=current_store)
             logger.debug(f"✅ Filtered queryset by store: {current_store.name}")
         else:
             # ✅ ИСПРАВЛЕНО: Если магазин не найден, возвращаем пустой queryset
@@ -397,19 +350,7 @@ class StorePermissionMixin:
     """
     def has_store_permission(self, user, permission_name):
         """Проверяет, есть ли у пользователя разрешение в текущем магазине"""
-        if not hasattr(user, 'current_store') or not user.current_store:
-            return False
-
-        from .models import StoreEmployee
-        try:
-            membership = StoreEmployee.objects.get(
-                user=user,
-                store=user.current_store,
-                is_active=True
-            )
-            return getattr(membership, permission_name, False)
-        except StoreEmployee.DoesNotExist:
-            return False
+        return store_context.has_permission(user, permission_name)
 
     def check_store_permission(self, user, permission_name):
         """Проверяет разрешение и выбрасывает исключение если нет доступа"""
@@ -99,7 +99,7 @@ class Store(models.Model):
 
     def get_total_products(self):
         """Получить количество товаров в магазине"""
-        return self.products.count()
+        return self.product_set.count()
 
     def get_total_employees(self):
         """Получить количество сотрудников"""
@@ -107,19 +107,19 @@ class Store(models.Model):
 
     def get_total_customers(self):
         """Получить количество клиентов"""
-        return self.customers.count()
+        return self.customer_set.count()
 
     def get_today_revenue(self):
         """Получить выручку за сегодня"""
-        from django.utils import timezone
         from sales.models import Transaction
         from django.db.models import Sum
+        from stores.business_date import business_date
 
-        today = timezone.now().date()
-        revenue = Transaction.objects.filter(
+        # Магазин может не совпадать с магазином текущего запроса
+        revenue = Transaction.objects.across_stores().filter(
             store=self,
             status='completed',
-            created_at__date=today
+            business_date=business_date()
         ).aggregate(total=Sum('total_amount'))['total'] or 0
 
         return revenue
@@ -0,0 +1,183 @@
+# stores/pagination.py
+import base64
+import binascii
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
+from drf_yasg import openapi
+from rest_framework.exceptions import NotFound, ValidationError as RequestValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    📑 Keyset-пагинация по (ordering_field, id) с непрозрачным курсором.
+
+    Страница — одно условие «после последней строки предыдущей страницы» по
+    индексу (магазин, ordering_field, id) вместо OFFSET: глубина страницы не
+    влияет на стоимость. Размер страницы ограничен max_page_size.
+    Число записей — только по ?count=1 и приблизительно: точное до count_limit,
+    дальше — оценка планировщика PostgreSQL (или count_limit+ на других БД).
+    Прежний ?offset= отклоняется с 400: молча отдать первую страницу хуже.
+    """
+    ordering_field = 'created_at'
+    page_size = 50
+    max_page_size = 200
+    page_size_query_param = 'page_size'
+    limit_query_param = 'limit'  # прежний параметр offset/limit-пагинации — то же, что page_size
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    count_query_param = 'count'
+    offset_query_param = 'offset'
+    count_limit = 10000
+    invalid_cursor_message = 'Некорректный курсор'
+    offset_message = 'offset не поддерживается: следующая страница — по ссылке next (cursor)'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.offset_query_param in request.query_params:
+            raise RequestValidationError({self.offset_query_param: [self.offset_message]})
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.count = None
+        self.count_is_exact = None
+
+        # По умолчанию — новые сверху; ?ordering=<поле> — по возрастанию
+        ascending = request.query_params.get(self.ordering_query_param) in (self.ordering_field, 'id')
+        position, reverse = self.decode_cursor(request, queryset.model)
+        if self.wants_count(request):
+            self.count, self.count_is_exact = self.get_count(queryset)
+
+        # Страница «назад» читается в обратном порядке от первой строки текущей
+        queryset = self.after(queryset, position, descending=ascending == reverse)
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.has_next = position is not None if reverse else has_more
+        self.has_previous = has_more if reverse else position is not None
+        self.page = rows
+        return rows
+
+    def after(self, queryset, position=None, descending=True):
+        """Строки после позиции (значение поля, id) в порядке (ordering_field, id)"""
+        field = self.ordering_field
+        queryset = queryset.order_by(*((f'-{field}', '-pk') if descending else (field, 'pk')))
+        if position is None:
+            return queryset
+        value, pk = position
+        lookup = 'lt' if descending else 'gt'
+        # (поле, id) < (значение, id): нестрогое условие по полю — диапазон индекса,
+        # строгое по id — только для строк с тем же значением поля
+        return queryset.filter(**{f'{field}__{lookup}e': value}).filter(
+            Q(**{f'{field}__{lookup}': value}) | Q(**{f'pk__{lookup}': pk})
+        )
+
+    def get_paginated_response(self, data):
+        response = OrderedDict()
+        if self.count is not None:
+            response['count'] = self.count
+            response['count_is_exact'] = self.count_is_exact
+        response['page_size'] = self.page_size
+        response['next'] = self.get_next_link()
+        response['previous'] = self.get_previous_link()
+        response['has_more'] = response['next'] is not None
+        response['results'] = data
+        return Response(response)
+
+    def get_page_size(self, request):
+        for param in (self.page_size_query_param, self.limit_query_param):
+            try:
+                value = int(request.query_params[param])
+            except (KeyError, ValueError):
+                continue
+            if value > 0:
+                return min(value, self.max_page_size)
+        return self.page_size
+
+    def wants_count(self, request):
+        return request.query_params.get(self.count_query_param, '').lower() in ('1', 'true')
+
+    def get_count(self, queryset):
+        """
+        (число, точное ли): COUNT по не более чем count_limit+1 строкам,
+        для большего — оценка планировщика PostgreSQL
+        """
+        queryset = queryset.order_by()
+        count = queryset[:self.count_limit + 1].count()
+        if count <= self.count_limit:
+            return count, True
+
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql':
+            sql, params = queryset.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+                plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return max(int(plan[0]['Plan']['Plan Rows']), count), False
+        return count, False
+
+    # === КУРСОР ===
+
+    def decode_cursor(self, request, model):
+        """((значение поля, id) или None, назад ли)"""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            value, pk, reverse = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            value = model._meta.get_field(self.ordering_field).to_python(value)
+            pk = model._meta.pk.to_python(pk)
+        except (binascii.Error, UnicodeError, ValueError, TypeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        if value is None or pk is None:
+            raise NotFound(self.invalid_cursor_message)
+        return (value, pk), bool(reverse)
+
+    def encode_cursor(self, row, reverse):
+        value = getattr(row, self.ordering_field)
+        payload = json.dumps([value.isoformat() if hasattr(value, 'isoformat') else value, str(row.pk), int(reverse)])
+        cursor = base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            # Пустая страница после конца списка — назад к началу
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+
+# Параметры keyset-пагинации для swagger_auto_schema(manual_parameters=...)
+KEYSET_QUERY_PARAMETERS = [
+    openapi.Parameter(
+        'cursor', openapi.IN_QUERY,
+        description="Курсор страницы (из ссылок next/previous)",
+        type=openapi.TYPE_STRING
+    ),
+    openapi.Parameter(
+        'page_size', openapi.IN_QUERY,
+        description=f"Записей на странице (по умолчанию {KeysetPagination.page_size}, "
+                    f"не больше {KeysetPagination.max_page_size}); limit — то же самое",
+        type=openapi.TYPE_INTEGER
+    ),
+    openapi.Parameter(
+        'count', openapi.IN_QUERY,
+        description="1 — вернуть приблизительное число записей (count, count_is_exact)",
+        type=openapi.TYPE_STRING
+    ),
+]
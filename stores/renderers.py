@@ -0,0 +1,56 @@
+# stores/renderers.py
+from drf_yasg import openapi
+from rest_framework.renderers import BaseRenderer
+
+from stores.services.tabular_export import tabular_export
+
+
+class TabularExportRenderer(BaseRenderer):
+    """
+    📤 Рендерер выгрузок (?format=csv|xlsx или заголовок Accept).
+
+    Сам файл отдается потоком через tabular_export.response(); сюда попадают
+    только ошибки запроса — клиент получает их файлом того же формата
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            rows = [(field, str(message)) for field, message in data.items()]
+        else:
+            rows = [('', str(data))]
+        return b''.join(tabular_export.write(self.format, ('Поле', 'Сообщение'), rows))
+
+
+class CSVRenderer(TabularExportRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+
+class XLSXRenderer(TabularExportRenderer):
+    media_type = tabular_export.FORMATS['xlsx']
+    format = 'xlsx'
+    charset = None
+
+
+# renderer_classes действий выгрузки: без ?format= — CSV
+EXPORT_RENDERERS = [CSVRenderer, XLSXRenderer]
+
+# Параметры выгрузок для swagger_auto_schema(manual_parameters=...)
+EXPORT_QUERY_PARAMETERS = [
+    openapi.Parameter(
+        'format', openapi.IN_QUERY,
+        description="Формат файла: csv (по умолчанию) или xlsx",
+        type=openapi.TYPE_STRING, enum=['csv', 'xlsx']
+    ),
+    openapi.Parameter(
+        'date_from', openapi.IN_QUERY,
+        description="Начало периода YYYY-MM-DD (включительно)",
+        type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE
+    ),
+    openapi.Parameter(
+        'date_to', openapi.IN_QUERY,
+        description="Конец периода YYYY-MM-DD (включительно); без обеих дат — текущий месяц",
+        type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE
+    ),
+]
@@ -0,0 +1,202 @@
+# stores/services/membership_cache.py
+import copy
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.db.models import Exists, OuterRef
+
+logger = logging.getLogger(__name__)
+
+ALL_STORES = None  # ключ (user_id, ALL_STORES) — порядок магазинов пользователя
+
+PERMISSION_FIELDS = (
+    'can_manage_products',
+    'can_manage_sales',
+    'can_view_analytics',
+    'can_manage_employees',
+)
+
+
+def _clone(instance):
+    """Копия модели вместе с закэшированными связями (запись кэша не отдается наружу)"""
+    clone = copy.copy(instance)
+    clone._state = copy.copy(instance._state)
+    clone._state.fields_cache = {
+        name: _clone(value) if value is not None else None
+        for name, value in instance._state.fields_cache.items()
+    }
+    return clone
+
+
+def _store_key(store):
+    """Нормализованный id магазина (UUID строкой) или None для некорректного значения"""
+    store_id = getattr(store, 'pk', store)
+    try:
+        return str(uuid.UUID(str(store_id)))
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+class MembershipCache:
+    """
+    👥 Кэш членств в магазинах в памяти процесса:
+    (user_id, store_id) → активное членство StoreEmployee (с магазином) или None,
+    (user_id, None) → магазины пользователя по порядку выбора (домашний из Employee первым).
+
+    Размер ограничен (LRU, STORE_MEMBERSHIP_CACHE_MAX_ENTRIES), записи живут не дольше
+    STORE_MEMBERSHIP_CACHE_TTL секунд — это предел расхождения между процессами.
+    Внутри процесса записи сбрасываются сигналами StoreEmployee, Store и Employee
+    (сразу и после коммита).
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()   # ключ -> (expires_at, значение)
+        self._keys_by_user = {}         # user_id -> {ключ, ...}
+        self._keys_by_store = {}        # store_id -> {ключ, ...}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def max_entries(self):
+        return getattr(settings, 'STORE_MEMBERSHIP_CACHE_MAX_ENTRIES', 10000)
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'STORE_MEMBERSHIP_CACHE_TTL', 300)
+
+    def _queryset(self, user):
+        from stores.models import StoreEmployee
+        from users.models import Employee
+
+        return StoreEmployee.objects.filter(
+            user=user, is_active=True, store__isnull=False, store__is_active=True
+        ).select_related('store').annotate(
+            is_home=Exists(Employee.objects.filter(user=user, store=OuterRef('store')))
+        )
+
+    def _get(self, key):
+        """Значение из кэша или KeyError (вызывать под _lock)"""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            raise KeyError(key)
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def _put(self, key, value, store_ids=()):
+        """Кладет запись и вытесняет самые давние сверх лимита (вызывать под _lock)"""
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        self._keys_by_user.setdefault(key[0], set()).add(key)
+        for store_id in store_ids:
+            self._keys_by_store.setdefault(store_id, set()).add(key)
+
+        while len(self._entries) > self.max_entries:
+            evicted_key, (_, evicted) = self._entries.popitem(last=False)
+            self._unindex(evicted_key, evicted)
+
+    def _unindex(self, key, value):
+        user_id, store_id = key
+        store_ids = value if store_id is ALL_STORES else [store_id]
+        for index, index_key in [(self._keys_by_user, user_id)] + [(self._keys_by_store, sid) for sid in store_ids]:
+            keys = index.get(index_key)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del index[index_key]
+
+    def membership(self, user, store):
+        """Активное членство пользователя в активном магазине (копия) или None"""
+        store_id = _store_key(store)
+        if store_id is None:
+            return None
+
+        key = (user.pk, store_id)
+        with self._lock:
+            try:
+                membership = self._get(key)
+                self.hits += 1
+                return _clone(membership) if membership is not None else None
+            except KeyError:
+                self.misses += 1
+
+        membership = self._queryset(user).filter(store_id=store_id).first()
+        with self._lock:
+            self._put(key, membership, [store_id])
+        return _clone(membership) if membership is not None else None
+
+    def memberships(self, user):
+        """Все активные членства пользователя: домашний магазин первым, дальше по id магазина"""
+        with self._lock:
+            try:
+                store_ids = self._get((user.pk, ALL_STORES))
+                memberships = [self._get((user.pk, store_id)) for store_id in store_ids]
+                self.hits += 1
+                return [_clone(membership) for membership in memberships]
+            except KeyError:
+                self.misses += 1
+
+        memberships = list(self._queryset(user).order_by('-is_home', 'store_id'))
+        store_ids = [_store_key(membership.store_id) for membership in memberships]
+        with self._lock:
+            for store_id, membership in zip(store_ids, memberships):
+                self._put((user.pk, store_id), membership, [store_id])
+            self._put((user.pk, ALL_STORES), store_ids, store_ids)
+        return [_clone(membership) for membership in memberships]
+
+    def version(self, user):
+        """
+        Версия членств пользователя (хэш активных членств: магазин, роль, разрешения).
+        Пишется в JWT при выдаче — по ней видно, что роли в токене устарели
+        """
+        rows = sorted(
+            (str(membership.store_id), membership.role, *(getattr(membership, f) for f in PERMISSION_FIELDS))
+            for membership in self.memberships(user)
+        )
+        return hashlib.sha1(repr(rows).encode()).hexdigest()[:12]
+
+    def _drop(self, user_ids=(), store_ids=()):
+        with self._lock:
+            keys = set()
+            for user_id in user_ids:
+                keys |= self._keys_by_user.get(user_id, set())
+            for store_id in store_ids:
+                keys |= self._keys_by_store.get(store_id, set())
+            for key in keys:
+                entry = self._entries.pop(key, None)
+                if entry is not None:
+                    self._unindex(key, entry[1])
+            for user_id in user_ids:
+                self._keys_by_user.pop(user_id, None)
+            for store_id in store_ids:
+                self._keys_by_store.pop(store_id, None)
+
+    def invalidate(self, user_ids=(), store_ids=()):
+        """
+        Сбрасывает записи пользователей и магазинов.
+        Повторно — после коммита, чтобы не осталось членство, прочитанное до него
+        """
+        user_ids = list(user_ids)
+        store_ids = [_store_key(store_id) for store_id in store_ids]
+        self._drop(user_ids, store_ids)
+        db_transaction.on_commit(lambda: self._drop(user_ids, store_ids))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_user.clear()
+            self._keys_by_store.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+membership_cache = MembershipCache()
@@ -3,8 +3,8 @@ import logging
 from typing import Optional
 from django.contrib.auth import get_user_model
 from rest_framework.exceptions import ValidationError
-from rest_framework_simplejwt.tokens import AccessToken
 from stores.models import Store, StoreEmployee
+from stores.services.store_context import store_context
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
@@ -14,78 +14,22 @@ class StoreAccessService:
     🎭 Хранитель тайн магазинов — знает, куда пользователю путь открыт
     """
     
-    def __init__(self):
-        self._cache = {}  # Кэш для избежания повторных запросов
-    
     def get_current_store(self, user, request=None) -> Optional[Store]:
         """
-        🌟 Главный оракул: находит текущий магазин пользователя
-        Использует несколько путей поиска, как мудрый следопыт
+        🌟 Главный оракул: находит текущий магазин пользователя.
+        С запросом — из контекста магазина запроса (определяется один раз),
+        без запроса — магазин из Employee или первый доступный
         """
-        cache_key = f"{user.id}_current_store"
-        if cache_key in self._cache:
-            logger.debug(f"📦 Используем кэш для пользователя {user.username}")
-            return self._cache[cache_key]
-        
-        # Способ 1: Из атрибутов пользователя (установлено middleware)
-        if hasattr(user, 'current_store') and user.current_store:
-            if self._user_has_access_to_store(user, user.current_store):
-                logger.debug(f"✅ Магазин из атрибута пользователя: {user.current_store.name}")
-                self._cache[cache_key] = user.current_store
-                return user.current_store
-            else:
-                logger.warning(f"⚠️ У пользователя {user.username} нет доступа к {user.current_store.name}")
-
-        # Способ 2: Через Employee модель
-        if hasattr(user, 'employee') and user.employee and user.employee.store:
-            store = user.employee.store
-            if self._user_has_access_to_store(user, store):
-                logger.debug(f"✅ Магазин из Employee: {store.name}")
-                user.current_store = store
-                self._cache[cache_key] = store
-                return store
-
-        # Способ 3: Из JWT токена напрямую
-        if request:
-            try:
-                auth_header = request.META.get('HTTP_AUTHORIZATION', '')
-                if auth_header.startswith('Bearer '):
-                    token = auth_header.split(' ')[1]
-                    decoded_token = AccessToken(token)
-                    store_id = decoded_token.get('store_id')
-
-                    if store_id:
-                        store = Store.objects.get(id=store_id, is_active=True)
-                        if self._user_has_access_to_store(user, store):
-                            logger.debug(f"✅ Магазин из JWT: {store.name}")
-                            user.current_store = store
-                            self._cache[cache_key] = store
-                            return store
-                        else:
-                            logger.warning(f"⚠️ Нет доступа к магазину из JWT: {store.name}")
-            except Exception as e:
-                logger.debug(f"Не удалось получить магазин из JWT: {e}")
+        if request is not None:
+            return store_context.resolve(request, user)['store']
 
-        # Способ 4: Берем ПЕРВЫЙ ДОСТУПНЫЙ магазин пользователя
-        accessible_stores = self._get_user_accessible_stores(user)
-        if accessible_stores:
-            first_store = accessible_stores.first()
-            logger.debug(f"✅ Используем первый доступный магазин: {first_store.name}")
-            user.current_store = first_store
-            self._cache[cache_key] = first_store
-            return first_store
-
-        logger.warning(f"❌ Не найдено доступных магазинов для {user.username}")
-        self._cache[cache_key] = None
-        return None
+        store = store_context.resolve_for_user(user)['store']
+        user.current_store = store
+        return store
 
     def _user_has_access_to_store(self, user, store) -> bool:
         """🔑 Проверяет, есть ли у пользователя ключ к этому магазину"""
-        return StoreEmployee.objects.filter(
-            user=user,
-            store=store,
-            is_active=True
-        ).exists()
+        return store_context.has_access(user, store)
 
     def _get_user_accessible_stores(self, user):
         """🗺️ Карта доступных территорий пользователя"""
@@ -100,11 +44,11 @@ class StoreAccessService:
         )
 
     def clear_cache_for_user(self, user):
-        """🧹 Очищает кэш для пользователя (полезно после смены магазина)"""
-        cache_key = f"{user.id}_current_store"
-        if cache_key in self._cache:
-            del self._cache[cache_key]
-            logger.debug(f"🧹 Кэш очищен для пользователя {user.username}")
+        """🧹 Сбрасывает магазин пользователя в контексте текущего запроса (после смены магазина)"""
+        context = store_context.get()
+        if context is not None and context['user_id'] == user.pk:
+            context.update(store=None, store_id=None, role=None, membership=None, user_id=None)
+            logger.debug(f"🧹 Контекст магазина сброшен для пользователя {user.username}")
 
     def get_user_stores_info(self, user) -> dict:
         """📊 Информация о доступных магазинах пользователя"""
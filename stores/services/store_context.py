@@ -0,0 +1,157 @@
+# stores/services/store_context.py
+import logging
+from contextvars import ContextVar
+
+from stores.services.membership_cache import membership_cache, PERMISSION_FIELDS
+
+logger = logging.getLogger(__name__)
+
+STORE_CLAIMS = ('store_id', 'store_role', 'membership_version')
+
+_current = ContextVar('store_context', default=None)
+
+
+def _empty_context(user_id=None):
+    return {
+        'user_id': user_id,
+        'store': None,
+        'store_id': None,
+        'role': None,
+        'membership': None,
+        'permissions': dict.fromkeys(PERMISSION_FIELDS, False),
+        'source': None,
+        'token_stale': False,
+    }
+
+
+class StoreContextResolver:
+    """
+    🏪 Магазин запроса: определяется один раз и хранится в контексте запроса
+    (contextvar + атрибут HttpRequest), все миксины и сервисы читают его оттуда.
+
+    Порядок выбора магазина: store_id из JWT → магазин из Employee →
+    первый доступный. Членства берутся из кэша membership_cache —
+    обычно без запросов к БД.
+    """
+
+    def resolve(self, request, user=None):
+        """Контекст магазина запроса (словарь: store, role, membership, permissions, ...)"""
+        http_request = getattr(request, '_request', request)
+        user = user if user is not None else getattr(request, 'user', None)
+        user_id = getattr(user, 'pk', None) if getattr(user, 'is_authenticated', False) else None
+
+        context = getattr(http_request, '_store_context', None)
+        if context is None or context['user_id'] != user_id:
+            context = self._resolve(user, self.token_claims(request)) if user_id else _empty_context()
+            http_request._store_context = context
+            # В контекст запроса — только внутри activate() (middleware):
+            # по нему менеджеры моделей магазина фильтруют данные автоматически
+            if _current.get() is not None:
+                _current.set(context)
+
+        if user_id:
+            # Совместимость: сериализаторы и старый код читают атрибуты пользователя
+            user.current_store = context['store']
+            user.store_role = context['role']
+            user.store_id = str(context['store_id']) if context['store_id'] else None
+        return context
+
+    def resolve_for_user(self, user):
+        """Контекст без запроса (сервисы, команды): магазин из Employee или первый доступный"""
+        current = _current.get()
+        if current is not None and current['user_id'] == user.pk:
+            return current
+        return self._resolve(user, {})
+
+    def get(self):
+        """Контекст текущего запроса (None вне запроса; до resolve() — без магазина)"""
+        return _current.get()
+
+    def has_access(self, user, store):
+        """Активный сотрудник магазина? Из контекста запроса или кэша членств"""
+        context = _current.get()
+        store_id = getattr(store, 'pk', store)
+        if (context is not None and context['store_id'] is not None
+                and context['user_id'] == user.pk and str(context['store_id']) == str(store_id)):
+            return True
+        return membership_cache.membership(user, store_id) is not None
+
+    def has_permission(self, user, permission_name):
+        """Разрешение роли (can_*) пользователя в магазине контекста"""
+        context = self.resolve_for_user(user)
+        return bool(context['permissions'].get(permission_name, False))
+
+    def activate(self):
+        """Открывает контекст запроса (middleware). Возвращает токен для reset()"""
+        return _current.set(_empty_context())
+
+    def reset(self, token):
+        _current.reset(token)
+
+    def token_claims(self, request):
+        """
+        Магазинные claims токена запроса: store_id, store_role, membership_version.
+        Токен уже проверен StoreJWTAuthentication (request.auth) — повторно не декодируется.
+        Вне DRF (обычный HttpRequest) заголовок Authorization проверяется здесь
+        """
+        token = getattr(request, 'auth', None)
+        if token is None:
+            auth_header = request.META.get('HTTP_AUTHORIZATION', '')
+            if not auth_header.startswith('Bearer '):
+                return {}
+            try:
+                from rest_framework_simplejwt.tokens import AccessToken
+                token = AccessToken(auth_header.split(' ')[1])
+            except Exception as e:
+                logger.debug(f"Не удалось получить магазин из JWT: {e}")
+                return {}
+        return self.claims_of(token)
+
+    @staticmethod
+    def claims_of(token):
+        """store_id, store_role, membership_version проверенного токена (None, если claim нет)"""
+        if not hasattr(token, 'get'):
+            return {}
+        return {claim: token.get(claim) for claim in STORE_CLAIMS}
+
+    def _resolve(self, user, claims):
+        context = _empty_context(user.pk)
+        membership, source = None, None
+        token_store_id = claims.get('store_id')
+        # Все членства одним запросом (при холодном кэше): из них же и версия для claims токена
+        memberships = membership_cache.memberships(user)
+        if token_store_id:
+            membership = next((m for m in memberships if str(m.store_id) == str(token_store_id)), None)
+            source = 'token'
+            if membership is None:
+                logger.warning(f"⚠️ У пользователя {user.username} нет доступа к магазину из JWT: {token_store_id}")
+        if membership is None and memberships:
+            membership = memberships[0]
+            source = 'employee' if membership.is_home else 'first'
+
+        if membership is None:
+            logger.warning(f"❌ Не найдено доступных магазинов для {user.username}")
+            return context
+
+        context.update({
+            'store': membership.store,
+            'store_id': membership.store_id,
+            'role': membership.role,
+            'membership': membership,
+            'permissions': {field: getattr(membership, field) for field in PERMISSION_FIELDS},
+            'source': source,
+        })
+
+        # Роли в токене устарели (членства изменились после выдачи) — клиенту стоит обновить токен.
+        # Права всегда берутся из членства, а не из claims
+        if token_store_id:
+            version = claims.get('membership_version')
+            context['token_stale'] = (
+                source != 'token' or claims.get('store_role') != membership.role
+                or (version is not None and version != membership_cache.version(user))
+            )
+        logger.debug(f"✅ Магазин запроса: {membership.store.name} ({membership.role}, {source})")
+        return context
+
+
+store_context = StoreContextResolver()
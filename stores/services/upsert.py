@@ -0,0 +1,179 @@
+# stores/services/upsert.py
+"""
+Атомарный upsert для строк-сводок (счетчики по дню/магазину/товару).
+
+Вместо чтения строки, прибавления в Python и save() (несколько запросов и
+потерянные обновления при одновременных продажах) вся пачка строк пишется
+одним INSERT ... ON CONFLICT DO UPDATE: счетчики прибавляются на стороне БД.
+На СУБД без ON CONFLICT — UPDATE с F()-выражениями и INSERT при отсутствии строки.
+"""
+import logging
+from collections import OrderedDict
+
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+UPSERT_VENDORS = ('sqlite', 'postgresql')
+
+
+def upsert_increment(model, key_fields, rows, increment=(), replace=(), computed=None):
+    """
+    Вставляет строки или прибавляет к существующим по уникальному ключу.
+
+    key_fields — поля уникального ключа (unique_together модели)
+    rows       — [{поле: значение}], поля, которых нет в строке, берутся из default
+    increment  — счетчики: новое значение = текущее + значение строки
+    replace    — перезаписываются значением строки (например, последний кассир)
+    computed   — {поле: функция(new) -> SQL}, производные поля при обновлении;
+                 new(имя) — SQL-выражение нового значения поля (например, средний чек).
+                 При вставке значение берется из строки. Деление — через «* 1.0»:
+                 SQLite хранит целые суммы как INTEGER и делит их нацело
+    Остальные поля пишутся только при вставке.
+    Одинаковые ключи внутри rows сворачиваются заранее.
+    Возвращает число строк после свертки
+    """
+    rows = _collapse(model, key_fields, rows, increment)
+    if not rows:
+        return 0
+
+    using = router.db_for_write(model)
+    connection = connections[using]
+
+    if connection.vendor in UPSERT_VENDORS:
+        _insert_on_conflict(model, connection, key_fields, rows, increment, replace, computed or {})
+    else:
+        _update_or_insert(model, using, connection, key_fields, rows, increment, replace, computed or {})
+
+    return len(rows)
+
+
+def _field(model, name):
+    return model._meta.get_field(name)
+
+
+def _collapse(model, key_fields, rows, increment):
+    """Сворачивает строки с одинаковым ключом: счетчики суммируются, остальное — последнее"""
+    key_names = [_field(model, name).attname for name in key_fields]
+    counters = {_field(model, name).attname for name in increment}
+    collapsed = OrderedDict()
+    for row in rows:
+        row = {_field(model, name).attname: value for name, value in row.items()}
+        key = tuple(row[name] for name in key_names)
+        if key not in collapsed:
+            collapsed[key] = dict(row)
+            continue
+        current = collapsed[key]
+        for name, value in row.items():
+            if name in counters:
+                current[name] = current.get(name, 0) + value
+            else:
+                current[name] = value
+    return list(collapsed.values())
+
+
+def _concrete_fields(model):
+    """Поля для INSERT (кроме автоинкрементного первичного ключа)"""
+    return [
+        field for field in model._meta.concrete_fields
+        if not (field.primary_key and field.auto_created) and
+        not getattr(field, 'db_returning', False)
+    ]
+
+
+def _row_values(fields, row, now, connection):
+    values = []
+    for field in fields:
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+            value = row.get(field.attname, now)
+        elif field.attname in row:
+            value = row[field.attname]
+        else:
+            value = field.get_default()
+        values.append(field.get_db_prep_save(value, connection))
+    return values
+
+
+def _auto_now_fields(model):
+    return [field for field in _concrete_fields(model) if getattr(field, 'auto_now', False)]
+
+
+def _insert_on_conflict(model, connection, key_fields, rows, increment, replace, computed):
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    fields = _concrete_fields(model)
+    now = timezone.now()
+
+    def column(name):
+        return qn(_field(model, name).column)
+
+    def new(name):
+        """Значение поля после обновления"""
+        if name in increment:
+            return f"({table}.{column(name)} + excluded.{column(name)})"
+        if name in replace:
+            return f"excluded.{column(name)}"
+        return f"{table}.{column(name)}"
+
+    assignments = [f"{column(name)} = {new(name)}" for name in increment]
+    assignments += [f"{column(name)} = excluded.{column(name)}" for name in replace]
+    assignments += [f"{column(name)} = {sql(new)}" for name, sql in computed.items()]
+    assignments += [
+        f"{qn(field.column)} = excluded.{qn(field.column)}"
+        for field in _auto_now_fields(model) if field.name not in replace
+    ]
+
+    params = []
+    placeholders = []
+    for row in rows:
+        params.extend(_row_values(fields, row, now, connection))
+        placeholders.append(f"({', '.join(['%s'] * len(fields))})")
+
+    sql = (
+        f"INSERT INTO {table} ({', '.join(qn(field.column) for field in fields)}) "
+        f"VALUES {', '.join(placeholders)} "
+        f"ON CONFLICT ({', '.join(column(name) for name in key_fields)}) "
+        f"DO UPDATE SET {', '.join(assignments)}"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def _update_or_insert(model, using, connection, key_fields, rows, increment, replace, computed):
+    """Запасной путь: UPDATE с F(), при отсутствии строки — INSERT (с повтором при гонке)"""
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    manager = model._base_manager.using(using)
+    auto_now = {field.name: timezone.now() for field in _auto_now_fields(model)}
+
+    for row in rows:
+        keys = {_field(model, name).attname: row[_field(model, name).attname] for name in key_fields}
+        changes = {name: F(name) + row[_field(model, name).attname] for name in increment}
+        changes.update({name: row[_field(model, name).attname] for name in replace})
+        changes.update(auto_now)
+
+        with transaction.atomic(using=using, savepoint=False):
+            updated = manager.filter(**keys).update(**changes)
+            if not updated:
+                try:
+                    with transaction.atomic(using=using):
+                        manager.create(**row)
+                except IntegrityError:
+                    # Строку успели вставить параллельно — прибавляем к ней
+                    manager.filter(**keys).update(**changes)
+
+            if computed:
+                def new(name):
+                    return f"{table}.{qn(_field(model, name).column)}"
+                where = ' AND '.join(f"{qn(_field(model, name).column)} = %s" for name in key_fields)
+                assignments = ', '.join(
+                    f"{qn(_field(model, name).column)} = {sql(new)}" for name, sql in computed.items()
+                )
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f"UPDATE {table} SET {assignments} WHERE {where}",
+                        [_field(model, name).get_db_prep_save(row[_field(model, name).attname], connection)
+                         for name in key_fields]
+                    )
@@ -0,0 +1,29 @@
+# stores/signals.py
+import logging
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from stores.models import Store, StoreEmployee
+from stores.services.membership_cache import membership_cache
+from users.models import Employee
+
+logger = logging.getLogger(__name__)
+
+
+@receiver([post_save, post_delete], sender=StoreEmployee)
+def invalidate_memberships_on_employee_change(sender, instance, **kwargs):
+    """Членство изменилось (роль, активность, перевод в другой магазин) — сбрасываем кэш пользователя"""
+    membership_cache.invalidate(user_ids=[instance.user_id])
+
+
+@receiver([post_save, post_delete], sender=Store)
+def invalidate_memberships_on_store_change(sender, instance, **kwargs):
+    """Магазин изменился (в т.ч. is_active) — сбрасываем все членства в нем"""
+    membership_cache.invalidate(store_ids=[instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Employee)
+def invalidate_memberships_on_home_store_change(sender, instance, **kwargs):
+    """Домашний магазин сотрудника влияет на выбор магазина по умолчанию"""
+    membership_cache.invalidate(user_ids=[instance.user_id])
@@ -1,3 +1,378 @@
-from django.test import TestCase
+import json
+import os
+import re
+import subprocess
+import sys
+import uuid
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core.exceptions import PermissionDenied
+from django.db import connection
+from django.db.models import F, Sum
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from analytics.models import CashRegister, HourlySalesSummary
+from analytics.services.analytics_queue import analytics_queue
+from customers.models import Customer
+from inventory.models import Product, ProductBatch, Stock, StockHistory
+from inventory.pagination import StockHistoryPagination
+from inventory.services.batch_allocator import batch_allocator
+from sales.models import Transaction, TransactionHistory, TransactionItem
+from sales.services.outbox_dispatcher import outbox_dispatcher
+from stores.business_date import business_date, range_lookups
+from stores.management.bench import create_bench_store
+from stores.models import StoreEmployee
+from stores.services import membership_cache as membership_cache_module
+from stores.services import store_context as store_context_module
+from stores.services.membership_cache import membership_cache
+from stores.services.store_context import store_context
+from stores.pagination import KeysetPagination
+from stores.tokens import get_tokens_for_user_and_store
+
+
+class StoreOwnedManagerTests(TestCase):
+    """Фильтр по магазину запроса, явный выбор магазина и обратные связи"""
+
+    def setUp(self):
+        self.store, self.user, _ = create_bench_store(products=3, batches_per_product=1)
+        self.other_store, _, _ = create_bench_store(products=2, batches_per_product=1)
+        Customer.objects.create(store=self.other_store, full_name='Other customer')
+        Transaction.objects.create(
+            store=self.other_store, cashier=self.user, total_amount=Decimal('100'),
+            payment_method='cash', cash_amount=Decimal('100'), status='completed'
+        )
+
+        token = store_context.activate()
+        self.addCleanup(store_context.reset, token)
+        store_context.get().update({'store': self.store, 'store_id': self.store.pk})
+
+    def test_manager_scopes_to_request_store(self):
+        self.assertEqual(Product.objects.count(), 3)
+        self.assertEqual(Customer.objects.count(), 0)
+        self.assertEqual(Product.objects.across_stores().count(), 5)
+
+    def test_rescoping_queryset_to_other_store_is_denied(self):
+        with self.assertRaises(PermissionDenied):
+            Product.objects.filter(sale_price__gte=0).for_store(self.other_store)
+
+    def test_explicit_store_selection(self):
+        self.assertEqual(Product.objects.for_store(self.other_store).count(), 2)
+        self.assertEqual(Product.objects.across_stores().for_store(self.other_store).count(), 2)
+
+    def test_reverse_relations_follow_owner(self):
+        self.assertEqual(self.other_store.product_set.count(), 2)
+        product = self.other_store.product_set.first()
+        self.assertEqual(product.batches.count(), 1)
+
+    def test_store_helpers_report_own_store(self):
+        self.assertEqual(self.other_store.get_total_products(), 2)
+        self.assertEqual(self.other_store.get_total_customers(), 1)
+        self.assertEqual(self.other_store.get_today_revenue(), Decimal('100'))
+
+    def test_context_without_store_is_not_scoped(self):
+        store_context.get().update({'store': None, 'store_id': None})
+        self.assertEqual(Product.objects.count(), 5)
+
+
+# Холодный django.setup() в отдельном процессе: в процессе тестов все уже импортировано
+STARTUP_SCRIPT = (
+    "import json, sys, time; started = time.perf_counter(); import django; django.setup(); "
+    "print(json.dumps({'ms': (time.perf_counter() - started) * 1000, "
+    "'loaded': [name for name in %r if name in sys.modules]}))"
+)
+# Тяжелые библиотеки этикеток загружаются при первом использовании, а не при запуске
+LAZY_MODULES = ('reportlab', 'barcode', 'PIL')
+
+
+class StartupTests(SimpleTestCase):
+    """Холодный запуск Django: ленивые импорты и бюджет STARTUP_TIME_BUDGET_MS"""
+
+    RUNS = 3
+
+    def _cold_setup(self):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'sompos.settings'))
+        result = subprocess.run(
+            [sys.executable, '-c', STARTUP_SCRIPT % (LAZY_MODULES,)],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True
+        )
+        self.assertEqual(result.returncode, 0, result.stderr[-2000:])
+        return json.loads(result.stdout.splitlines()[-1])
+
+    def test_label_libraries_are_not_imported_at_startup(self):
+        self.assertEqual(self._cold_setup()['loaded'], [])
+
+    def test_startup_within_budget(self):
+        budget = settings.STARTUP_TIME_BUDGET_MS
+        best = min(self._cold_setup()['ms'] for _ in range(self.RUNS))
+        self.assertLessEqual(best, budget, f'Запуск {best:.0f} мс превышает бюджет {budget:.0f} мс')
+
+
+# Запросы, выполненные изнутри определения магазина (по стеку вызовов)
+RESOLVER_MODULES = {
+    os.path.abspath(store_context_module.__file__),
+    os.path.abspath(membership_cache_module.__file__),
+}
+
+
+def from_resolver():
+    frame = sys._getframe(2)
+    while frame is not None:
+        if frame.f_code.co_filename in RESOLVER_MODULES:
+            return True
+        frame = frame.f_back
+    return False
+
+
+class StoreContextQueryTests(TestCase):
+    """Магазин запроса определяется одним запросом при холодном кэше членств и без запросов дальше"""
+
+    ENDPOINTS = (
+        '/inventory/products/',
+        '/inventory/products/scan_barcode/?barcode=unknown',
+        '/inventory/categories/',
+        '/sales/transactions/',
+        '/users/users/',
+    )
+
+    def setUp(self):
+        self.store, self.user, _ = create_bench_store(products=5, batches_per_product=1)
+        StoreEmployee.objects.update_or_create(store=self.store, user=self.user, defaults={'role': 'owner'})
+        self.user.groups.add(Group.objects.get_or_create(name='owner')[0])
+        self.client = APIClient()
+        access = get_tokens_for_user_and_store(self.user, self.store.pk)['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+        membership_cache.clear()
+        self.addCleanup(membership_cache.clear)
+
+    def _store_queries(self, path):
+        """Число SQL-запросов на определение магазина за один запрос к API"""
+        queries = []
+
+        def record(execute, sql, params, many, context):
+            queries.append(from_resolver())
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            response = self.client.get(path)
+        self.assertLess(response.status_code, 400, path)
+        return sum(queries)
+
+    def test_store_resolved_once_per_cold_cache(self):
+        self.assertEqual(self._store_queries(self.ENDPOINTS[0]), 1)
+        for path in self.ENDPOINTS[1:]:
+            with self.subTest(path=path):
+                self.assertEqual(self._store_queries(path), 0)
+
+    def test_role_change_drops_cached_membership(self):
+        self._store_queries(self.ENDPOINTS[0])
+
+        membership = StoreEmployee.objects.get(store=self.store, user=self.user)
+        membership.role = 'admin'
+        membership.save()
+
+        self.assertEqual(self._store_queries(self.ENDPOINTS[0]), 1)
+        self.assertEqual(membership_cache.membership(self.user, self.store).role, 'admin')
+
+
+# Полный проход по таблице в плане: SQLite (EXPLAIN QUERY PLAN) и PostgreSQL (EXPLAIN)
+FULL_SCAN = {
+    'sqlite': re.compile(r'\bSCAN (\w+)'),
+    'postgresql': re.compile(r'\bSeq Scan on (\w+)'),
+}
+# Условия, по которым идет поиск в индексе
+INDEX_CONDITION = {
+    'sqlite': re.compile(r'USING (?:COVERING )?INDEX \w+ \(([^)]*)\)'),
+    'postgresql': re.compile(r'Index Cond: (.*)'),
+}
+TEMP_SORT = re.compile(r'TEMP B-TREE FOR .*ORDER BY|\bSort\b')
+
+
+def critical_queries(store_id, product_id, since):
+    """
+    Горячие запросы приложения в том виде, как их строит код:
+    index — имя индекса, который должен выбрать планировщик (если важно, какой именно),
+    index_columns — колонки, которые должны попасть в условие индекса,
+    no_sort — порядок должен давать индекс (без отдельной сортировки)
+    """
+    today = business_date()
+    return [
+        {
+            'name': 'продажи магазина по статусу',
+            'queryset': Transaction.objects.filter(
+                store_id=store_id, status='completed', created_at__gte=since
+            ).order_by('-created_at'),
+            'index_columns': ('store_id', 'status', 'created_at'),
+            'no_sort': True,
+        },
+        {
+            'name': 'продажи магазина за день',
+            'queryset': Transaction.objects.filter(store_id=store_id, business_date=today, status='completed'),
+            'index_columns': ('store_id', 'business_date', 'status'),
+            'no_sort': True,
+        },
+        {
+            'name': 'продажи магазина за период',
+            'queryset': Transaction.objects.filter(
+                store_id=store_id, business_date__gte=today - timedelta(days=7), status='completed'
+            ),
+            'index_columns': ('store_id', 'business_date'),
+        },
+        {
+            'name': 'лента продаж магазина',
+            'queryset': Transaction.objects.filter(store_id=store_id).order_by('-created_at')[:50],
+            'index_columns': ('store_id',),
+            'no_sort': True,
+        },
+        {
+            'name': 'продажи: keyset',
+            'queryset': KeysetPagination().after(
+                Transaction.objects.filter(store_id=store_id), (since, 1)
+            )[:51],
+            'index_columns': ('store_id', 'created_at'),
+            'no_sort': True,
+        },
+        {
+            'name': 'история продаж: keyset',
+            'queryset': KeysetPagination().after(
+                TransactionHistory.objects.filter(store_id=store_id), (since, 1)
+            )[:51],
+            'index_columns': ('store_id', 'created_at'),
+            'no_sort': True,
+        },
+        {
+            'name': 'история стока: keyset',
+            'queryset': StockHistoryPagination().after(
+                StockHistory.objects.filter(store_id=store_id), (since, uuid.uuid4())
+            )[:51],
+            'index_columns': ('store_id', 'timestamp'),
+            'no_sort': True,
+        },
+        {
+            'name': 'клиенты: keyset',
+            'queryset': KeysetPagination().after(
+                Customer.objects.filter(store_id=store_id), (since, 1)
+            )[:51],
+            'index_columns': ('store_id', 'created_at'),
+            'no_sort': True,
+        },
+        {
+            'name': 'выгрузка продаж с позициями',
+            'queryset': TransactionItem.objects.filter(
+                transaction__store_id=store_id, transaction__business_date__gte=today - timedelta(days=30)
+            ).order_by('transaction_id', 'id').values_list('transaction_id', 'quantity', 'price'),
+            'index_columns': ('store_id', 'business_date'),
+        },
+        {
+            'name': 'выгрузка истории стока',
+            'queryset': StockHistory.objects.filter(
+                store_id=store_id, **range_lookups('timestamp', today - timedelta(days=30), today)
+            ).order_by('timestamp', 'id').values_list('timestamp', 'quantity_change'),
+            'index_columns': ('store_id', 'timestamp'),
+            'no_sort': True,
+        },
+        {
+            'name': 'выгрузка закупок',
+            'queryset': ProductBatch.objects.filter(
+                store_id=store_id, **range_lookups('created_at', today - timedelta(days=30), today)
+            ).order_by('created_at', 'id').values_list('created_at', 'quantity'),
+            'index_columns': ('store_id', 'created_at'),
+            'no_sort': True,
+        },
+        {
+            'name': 'продажи товара',
+            'queryset': TransactionItem.objects.filter(
+                product_id=product_id, transaction__created_at__gte=since, transaction__status='completed'
+            ).values_list('quantity', 'price'),
+            'index_columns': ('product_id',),
+        },
+        {
+            'name': 'топ товаров магазина',
+            'queryset': TransactionItem.objects.filter(
+                transaction__store_id=store_id, transaction__status='completed'
+            ).values('product__name').annotate(
+                total_quantity=Sum('quantity'), total_revenue=Sum(F('quantity') * F('price'))
+            ),
+            'index_columns': ('store_id', 'status'),
+        },
+        {
+            'name': 'партии FIFO',
+            'queryset': ProductBatch.objects.filter(
+                product_id__in=[product_id, product_id + 1], quantity__gt=0
+            ).order_by('product_id', *batch_allocator.ORDERING),
+            'index_columns': ('product_id',),
+            'no_sort': True,
+        },
+        {
+            'name': 'заканчивающиеся товары',
+            'queryset': Stock.objects.filter(store_id=store_id, quantity__lte=10),
+            'index_columns': ('store_id', 'quantity'),
+        },
+        {
+            'name': 'открытая касса',
+            'queryset': CashRegister.objects.open_on(store_id, today),
+            'index': 'cashregister_open_idx',
+            'index_columns': ('store_id', 'date_opened'),
+        },
+        {
+            'name': 'продажи по часам',
+            'queryset': HourlySalesSummary.objects.pattern(store_id, today - timedelta(days=30)),
+            'index_columns': ('store_id', 'date'),
+        },
+        {
+            'name': 'должники магазина',
+            'queryset': Customer.objects.filter(store_id=store_id, debt__gt=0).order_by('-debt'),
+            'index_columns': ('store_id', 'debt'),
+            'no_sort': True,
+        },
+        {
+            'name': 'очередь outbox',
+            'queryset': outbox_dispatcher.pending(),
+            'index_columns': ('processed_at',),
+        },
+        {
+            'name': 'очередь аналитики',
+            'queryset': analytics_queue.pending(),
+            'index_columns': ('processed_at',),
+        },
+    ]
+
+
+def check_plan(plan, query, vendor):
+    """Проблемы плана запроса: [описание, ...] (пустой список — план в порядке)"""
+    problems = []
+    scans = FULL_SCAN[vendor].findall(plan)
+    if scans:
+        problems.append('полный проход: ' + ', '.join(scans))
+    conditions = ' '.join(INDEX_CONDITION[vendor].findall(plan))
+    missing = [column for column in query.get('index_columns', ()) if column not in conditions]
+    if missing:
+        problems.append('нет в условии индекса: ' + ', '.join(missing))
+    if query.get('index') and query['index'] not in plan:
+        problems.append(f"не используется индекс {query['index']}")
+    if query.get('no_sort') and TEMP_SORT.search(plan):
+        problems.append('отдельная сортировка')
+    return problems
+
+
+class QueryPlanTests(TestCase):
+    """Планы горячих запросов (EXPLAIN): без полного прохода таблиц и по нужным индексам"""
+
+    def setUp(self):
+        if connection.vendor not in FULL_SCAN:
+            self.skipTest(f'Разбор планов для {connection.vendor} не поддерживается')
+        if connection.vendor == 'postgresql':
+            # На маленьких таблицах PostgreSQL честно выбирает Seq Scan — запрещаем его,
+            # чтобы проверялось наличие подходящего индекса, а не размер таблицы
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def test_hot_queries_use_indexes(self):
+        for query in critical_queries(uuid.uuid4(), 1, timezone.now() - timedelta(days=30)):
+            with self.subTest(query=query['name']):
+                plan = query['queryset'].explain()
+                self.assertEqual(check_plan(plan, query, connection.vendor), [], plan)
@@ -3,6 +3,7 @@
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from rest_framework_simplejwt.tokens import RefreshToken
 from .models import StoreEmployee
+from .services.membership_cache import membership_cache
 
 class StoreTokenObtainPairSerializer(TokenObtainPairSerializer):
     """
@@ -23,6 +24,8 @@ class StoreTokenObtainPairSerializer(TokenObtainPairSerializer):
             token['store_id'] = str(store_membership.store.id)
             token['store_name'] = store_membership.store.name
             token['store_role'] = store_membership.role
+            # Версия членств: по ней видно, что роль в токене устарела
+            token['membership_version'] = membership_cache.version(user)
         
         # Добавляем дополнительную информацию о пользователе
         token['username'] = user.username
@@ -95,6 +98,10 @@ def get_tokens_for_user_and_store(user, store_id=None):
             access['store_name'] = store_membership.store.name
             access['store_role'] = store_membership.role
     
+    if refresh.get('store_id'):
+        # Версия членств: по ней видно, что роль в токене устарела (копируется в access)
+        refresh['membership_version'] = membership_cache.version(user)
+
     # Добавляем информацию о пользователе
     refresh['username'] = user.username
     refresh['email'] = user.email
@@ -5,6 +5,7 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from django.contrib.auth.models import User, Group
 from django.db import transaction
+from django.db.models import F
 from django.shortcuts import get_object_or_404
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
@@ -17,6 +18,7 @@ from .serializers import (
     StoreEmployeeSerializer, StoreSwitchSerializer
 )
 from .tokens import get_tokens_for_user_and_store
+from .services.store_context import store_context
 from users.serializers import UserSerializer
 
 from inventory.models import Product
@@ -74,9 +76,9 @@ class DebugStoreAccessView(APIView):
 
         # Проверяем доступ к данным
         debug_info['data_counts'] = {
-            'all_products': Product.objects.count(),
-            'all_customers': Customer.objects.count(),
-            'all_transactions': Transaction.objects.count(),
+            'all_products': Product.objects.across_stores().count(),
+            'all_customers': Customer.objects.across_stores().count(),
+            'all_transactions': Transaction.objects.across_stores().count(),
         }
 
         # Если есть текущий магазин
@@ -117,13 +119,10 @@ class DebugStoreAccessView(APIView):
             debug_info['other_stores_data'] = other_stores_data
 
         # JWT токен информация
-        auth_header = request.META.get('HTTP_AUTHORIZATION', '')
-        if auth_header.startswith('Bearer '):
+        # Токен уже проверен при аутентификации (request.auth)
+        decoded_token = request.auth
+        if decoded_token is not None:
             try:
-                from rest_framework_simplejwt.tokens import AccessToken
-                token = auth_header.split(' ')[1]
-                decoded_token = AccessToken(token)
-
                 debug_info['jwt_token_info'] = {
                     'store_id': decoded_token.get('store_id'),
                     'store_name': decoded_token.get('store_name'),
@@ -565,7 +564,7 @@ class StoreViewSet(viewsets.ModelViewSet):
                 'store_name': store.name,
                 'min_markup_percent': float(store.min_markup_percent),
                 'allow_sale_below_markup': store.allow_sale_below_markup,
-                'products_count': Product.objects.filter(store=store).count()
+                'products_count': Product.objects.across_stores().for_store(store).count()
             })
 
         elif request.method == 'POST':
@@ -612,45 +611,36 @@ class StoreViewSet(viewsets.ModelViewSet):
         """
         store = self.get_object()
         
-        products = Product.objects.filter(store=store).select_related('store')
-        
-        # Анализ товаров
-        pricing_analysis = []
-        below_markup_count = 0
-        no_purchase_price_count = 0
-        
-        for product in products:
-            avg_purchase = product.average_purchase_price
-            min_sale_price = product.min_sale_price
-            
-            if not avg_purchase:
-                no_purchase_price_count += 1
-                continue
-                
-            current_margin = ((product.sale_price - avg_purchase) / avg_purchase) * 100
-            
-            analysis = {
+        # Фильтрация, сортировка по марже и сводка — одним запросом в SQL:
+        # товары ниже наценки идут первыми, итоги приходят оконными агрегатами
+        products = list(
+            Product.objects.across_stores().for_store(store)
+            .select_related('custom_unit')
+            .with_price_stats()
+            .with_price_summary()
+            .order_by(F('margin_percent').asc(nulls_last=True), 'pk')[:20]
+        )
+        totals = products[0] if products else None
+        total_products = totals.summary_total if totals else 0
+        analyzed_count = totals.summary_analyzed if totals else 0
+        below_markup_count = totals.summary_below_markup if totals else 0
+        no_purchase_price_count = total_products - analyzed_count
+
+        products_below_markup = [
+            {
                 'product_id': product.id,
                 'product_name': product.name,
                 'sale_price': float(product.sale_price),
-                'min_sale_price': float(min_sale_price),
-                'avg_purchase_price': float(avg_purchase),
-                'current_margin': round(current_margin, 2),
-                'meets_min_markup': current_margin >= float(store.min_markup_percent),
+                'min_sale_price': round(product.min_allowed_price, 2),
+                'avg_purchase_price': float(product.purchase_price_avg),
+                'current_margin': round(product.margin_percent, 2),
+                'meets_min_markup': False,
                 'unit_display': product.unit_display
             }
-            
-            if not analysis['meets_min_markup']:
-                below_markup_count += 1
-                
-            pricing_analysis.append(analysis)
-        
-        # Сортируем по марже (от меньшей к большей)
-        pricing_analysis.sort(key=lambda x: x['current_margin'])
-        
-        # Статистика
-        margins = [p['current_margin'] for p in pricing_analysis]
-        
+            for product in products
+            if product.below_min_markup
+        ]
+
         summary = {
             'store_info': {
                 'id': str(store.id),
@@ -659,15 +649,15 @@ class StoreViewSet(viewsets.ModelViewSet):
                 'allow_sale_below_markup': store.allow_sale_below_markup
             },
             'statistics': {
-                'total_products': products.count(),
-                'analyzed_products': len(pricing_analysis),
+                'total_products': total_products,
+                'analyzed_products': analyzed_count,
                 'products_below_markup': below_markup_count,
                 'products_without_purchase_price': no_purchase_price_count,
-                'avg_margin': round(sum(margins) / len(margins), 2) if margins else 0,
-                'min_margin': min(margins) if margins else 0,
-                'max_margin': max(margins) if margins else 0
+                'avg_margin': round(totals.summary_avg_margin, 2) if analyzed_count else 0,
+                'min_margin': round(totals.summary_min_margin, 2) if analyzed_count else 0,
+                'max_margin': round(totals.summary_max_margin, 2) if analyzed_count else 0
             },
-            'products_below_markup': [p for p in pricing_analysis if not p['meets_min_markup']][:20],
+            'products_below_markup': products_below_markup,
             'recommendations': []
         }
         
@@ -696,49 +686,17 @@ class CreateUserForStoreView(APIView):
     def post(self, request):
         logger.info(f"CreateUser request from user: {request.user.username}")
 
-        # Получаем текущий магазин
-        current_store = None
-        store_role = None
-
-        # Способ 1: Из JWT токена
-        auth_header = request.META.get('HTTP_AUTHORIZATION', '')
-        if auth_header.startswith('Bearer '):
-            try:
-                from rest_framework_simplejwt.tokens import AccessToken
-                token = auth_header.split(' ')[1]
-                decoded_token = AccessToken(token)
-                store_id = decoded_token.get('store_id')
-
-                if store_id:
-                    from stores.models import Store
-                    current_store = Store.objects.get(id=store_id, is_active=True)
-                    store_role = decoded_token.get('store_role')
-                    logger.info(f"✅ Store from JWT: {current_store.name}")
-            except Exception as e:
-                logger.error(f"Failed to get store from JWT: {e}")
-
-        # Способ 2: Из атрибутов пользователя (middleware)
-        if not current_store and hasattr(request.user, 'current_store') and request.user.current_store:
-            current_store = request.user.current_store
-            store_role = getattr(request.user, 'store_role', 'unknown')
-            logger.info(f"✅ Store from middleware: {current_store.name}")
-
-        # Способ 3: Из StoreEmployee
+        # Магазин и роль из контекста запроса (store_id из уже проверенного JWT,
+        # роль — из актуального членства)
+        context = store_context.resolve(request)
+        current_store = context['store']
+        store_role = context['role']
         if not current_store:
-            store_membership = StoreEmployee.objects.filter(
-                user=request.user,
-                is_active=True
-            ).select_related('store').first()
-
-            if store_membership:
-                current_store = store_membership.store
-                store_role = store_membership.role
-                logger.info(f"✅ Store from StoreEmployee: {current_store.name}")
-            else:
-                return Response(
-                    {'error': 'Пользователь не привязан к магазину'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+            return Response(
+                {'error': 'Пользователь не привязан к магазину'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        logger.info(f"✅ Store from context ({context['source']}): {current_store.name}")
 
         # Проверяем права
         if store_role not in ['owner', 'admin']:
@@ -1029,12 +987,10 @@ class DebugTokenView(APIView):
             })
 
         # Информация из JWT токена
-        auth_header = request.META.get('HTTP_AUTHORIZATION', '')
-        if auth_header.startswith('Bearer '):
-            token = auth_header.split(' ')[1]
+        # Токен уже проверен при аутентификации (request.auth)
+        decoded_token = request.auth
+        if decoded_token is not None:
             try:
-                from rest_framework_simplejwt.tokens import AccessToken
-                decoded_token = AccessToken(token)
                 debug_info['jwt_info'] = {
                     'user_id': decoded_token.get('user_id'),
                     'store_id': decoded_token.get('store_id'),
@@ -445,70 +445,27 @@ class UserListView(APIView):
         tags=['Users']
     )
     def get(self, request):
-        from stores.models import StoreEmployee, Store
+        from stores.models import StoreEmployee
+        from stores.services.store_context import store_context
         from .serializers import StoreEmployeeUserSerializer
-        import jwt
-        from rest_framework_simplejwt.tokens import AccessToken
 
-        # Получаем текущий магазин из JWT токена
-        current_store = None
-        current_user_role = None
+        # Магазин и роль — из контекста запроса (JWT store_id + проверка членства)
+        context = store_context.resolve(request)
+        current_store = context['store']
+        current_user_role = context['role']
 
-        # Способ 1: Извлекаем из JWT токена
-        auth_header = request.META.get('HTTP_AUTHORIZATION', '')
-        if auth_header.startswith('Bearer '):
-            try:
-                token = auth_header.split(' ')[1]
-                # Декодируем токен
-                decoded_token = AccessToken(token)
-
-                store_id = decoded_token.get('store_id')
-                store_name = decoded_token.get('store_name')
-                store_role = decoded_token.get('store_role')
-
-                logger.info(f"JWT Token info - store_id: {store_id}, store_name: {store_name}, role: {store_role}")
-
-                if store_id:
-                    try:
-                        current_store = Store.objects.get(id=store_id)
-                        current_user_role = store_role
-                        logger.info(f"✅ Store from JWT: {current_store.name}")
-                    except Store.DoesNotExist:
-                        logger.error(f"Store {store_id} from JWT not found")
-
-            except Exception as e:
-                logger.error(f"Error decoding JWT: {e}")
-
-        # Способ 2: Если не удалось из JWT, пробуем из middleware
-        if not current_store and hasattr(request.user, 'current_store') and request.user.current_store:
-            current_store = request.user.current_store
-            current_user_role = getattr(request.user, 'store_role', None)
-            logger.info(f"✅ Store from middleware: {current_store.name}")
-
-        # Способ 3: Если все еще нет, берем из базы
         if not current_store:
-            store_membership = StoreEmployee.objects.filter(
-                user=request.user,
-                is_active=True
-            ).select_related('store').first()
-
-            if store_membership:
-                current_store = store_membership.store
-                current_user_role = store_membership.role
-                logger.info(f"✅ Store from DB: {current_store.name}")
-            else:
-                logger.error(f"No store found for user {request.user.username}")
-                return Response(
-                    {
-                        "error": "У вас нет доступа к магазину",
-                        "debug_info": {
-                            "user": request.user.username,
-                            "jwt_decoded": auth_header.startswith('Bearer '),
-                            "has_middleware_store": hasattr(request.user, 'current_store')
-                        }
-                    },
-                    status=status.HTTP_403_FORBIDDEN
-                )
+            logger.error(f"No store found for user {request.user.username}")
+            return Response(
+                {
+                    "error": "У вас нет доступа к магазину",
+                    "debug_info": {
+                        "user": request.user.username,
+                        "jwt_decoded": request.META.get('HTTP_AUTHORIZATION', '').startswith('Bearer '),
+                    }
+                },
+                status=status.HTTP_403_FORBIDDEN
+            )
 
         # Проверяем права доступа
         if current_user_role not in ['owner', 'admin', 'manager']:
@@ -593,19 +550,9 @@ class UserListView(APIView):
 
     def _get_current_store(self, request):
         """Вспомогательный метод для получения текущего магазина"""
-        from stores.models import StoreEmployee
+        from stores.services.store_context import store_context
 
-        # Пытаемся получить из атрибута пользователя
-        if hasattr(request.user, 'current_store') and request.user.current_store:
-            return request.user.current_store
-
-        # Если нет, получаем из базы
-        store_membership = StoreEmployee.objects.filter(
-            user=request.user,
-            is_active=True
-        ).select_related('store').first()
-
-        return store_membership.store if store_membership else None
+        return store_context.resolve(request)['store']
 
 class UserDetailView(APIView):
     permission_classes = [permissions.IsAuthenticated]
@@ -622,27 +569,9 @@ class UserDetailView(APIView):
     def get(self, request, pk):
         from stores.models import StoreEmployee, Store
         from .serializers import StoreEmployeeUserSerializer
-        from rest_framework_simplejwt.tokens import AccessToken
 
-        # Получаем текущий магазин из JWT
-        current_store = None
-        auth_header = request.META.get('HTTP_AUTHORIZATION', '')
-
-        if auth_header.startswith('Bearer '):
-            try:
-                token = auth_header.split(' ')[1]
-                decoded_token = AccessToken(token)
-                store_id = decoded_token.get('store_id')
-
-                if store_id:
-                    current_store = Store.objects.filter(id=store_id).first()
-
-            except Exception as e:
-                logger.error(f"Error decoding JWT: {e}")
-
-        # Fallback на другие методы
-        if not current_store:
-            current_store = self._get_current_store(request)
+        # Текущий магазин: store_id из проверенного JWT, иначе запасные варианты
+        current_store = self._get_current_store(request)
 
         if not current_store:
             return Response(
@@ -701,28 +630,12 @@ class UserDetailView(APIView):
     def patch(self, request, pk):
         from stores.models import StoreEmployee, Store
         from .models import Employee
-        from rest_framework_simplejwt.tokens import AccessToken
-
-        # Получаем текущий магазин из JWT
-        current_store = None
-        current_user_role = None
-        auth_header = request.META.get('HTTP_AUTHORIZATION', '')
-
-        if auth_header.startswith('Bearer '):
-            try:
-                token = auth_header.split(' ')[1]
-                decoded_token = AccessToken(token)
-                store_id = decoded_token.get('store_id')
-                current_user_role = decoded_token.get('store_role')
-
-                if store_id:
-                    current_store = Store.objects.filter(id=store_id).first()
-
-            except Exception as e:
-                logger.error(f"Error decoding JWT: {e}")
+        from stores.services.store_context import store_context
 
-        if not current_store:
-            current_store = self._get_current_store(request)
+        # Текущий магазин (store_id из проверенного JWT) и роль из актуального членства
+        context = store_context.resolve(request)
+        current_store = context['store']
+        current_user_role = context['role']
 
         if not current_store:
             return Response(
@@ -731,12 +644,6 @@ class UserDetailView(APIView):
             )
 
         # Проверяем права (только owner и admin могут редактировать)
-        if not current_user_role:
-            user_membership = StoreEmployee.objects.filter(
-                user=request.user,
-                store=current_store
-            ).first()
-            current_user_role = user_membership.role if user_membership else None
 
         if current_user_role not in ['owner', 'admin']:
             return Response(
@@ -855,25 +762,12 @@ class UserDetailView(APIView):
     )
     def delete(self, request, pk):
         from stores.models import StoreEmployee, Store
-        from rest_framework_simplejwt.tokens import AccessToken
-
-        # Получаем текущий магазин из JWT
-        current_store = None
-        current_user_role = None
-        auth_header = request.META.get('HTTP_AUTHORIZATION', '')
-
-        if auth_header.startswith('Bearer '):
-            try:
-                token = auth_header.split(' ')[1]
-                decoded_token = AccessToken(token)
-                store_id = decoded_token.get('store_id')
-                current_user_role = decoded_token.get('store_role')
-
-                if store_id:
-                    current_store = Store.objects.filter(id=store_id).first()
+        from stores.services.store_context import store_context
 
-            except Exception as e:
-                logger.error(f"Error decoding JWT: {e}")
+        # Магазин только из проверенного JWT, роль — из актуального членства
+        context = store_context.resolve(request)
+        current_store = context['store'] if context['source'] == 'token' else None
+        current_user_role = context['role']
 
         if not current_store:
             return Response(
@@ -917,17 +811,9 @@ class UserDetailView(APIView):
 
     def _get_current_store(self, request):
         """Вспомогательный метод для получения текущего магазина"""
-        from stores.models import StoreEmployee
-
-        if hasattr(request.user, 'current_store') and request.user.current_store:
-            return request.user.current_store
-
-        store_membership = StoreEmployee.objects.filter(
-            user=request.user,
-            is_active=True
-        ).select_related('store').first()
+        from stores.services.store_context import store_context
 
-        return store_membership.store if store_membership else None
+        return store_context.resolve(request)['store']
 
 # users/views.py - добавьте этот класс
 